@@ -1,16 +1,26 @@
 """
 WiFi手机投屏系统 - 统一入口
 支持多种投屏协议：RTSP、ADB
+
+导出的类在第一次访问时才导入所在模块（PEP 562），
+``import phone_mirroring`` 不会加载服务端、协议以及cv2、numpy、av等依赖。
 """
 
-from .server import MirroringServer
-from .client import MirroringClient
-from .config import Config, Presets
-from .protocols.rtsp import RTSPProtocol
-from .protocols.adb import ADBProtocol
-from .app_main import MirroringApp
+import importlib
 
 __version__ = "1.0.0"
+
+# 导出名称 -> 所在模块
+_LAZY_ATTRS = {
+    "MirroringServer": "phone_mirroring.server",
+    "MirroringClient": "phone_mirroring.client",
+    "Config": "phone_mirroring.config",
+    "Presets": "phone_mirroring.config",
+    "RTSPProtocol": "phone_mirroring.protocols.rtsp",
+    "ADBProtocol": "phone_mirroring.protocols.adb",
+    "MirroringApp": "phone_mirroring.app_main",
+}
+
 __all__ = [
     "MirroringServer",
     "MirroringClient",
@@ -20,3 +30,14 @@ __all__ = [
     "Config",
     "Presets"
 ]
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
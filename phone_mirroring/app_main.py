@@ -7,7 +7,7 @@
 import sys
 import asyncio
 import logging
-from typing import Optional, Dict, Any, Callable
+from typing import Optional, Dict, Any, Callable, List, TYPE_CHECKING
 from pathlib import Path
 
 # 添加项目根目录到路径
@@ -17,9 +17,14 @@ sys.path.insert(0, str(project_root))
 from phone_mirroring.server import MirroringServer
 from phone_mirroring.config import Config, Presets
 from phone_mirroring.streaming_manager import StreamingManager
-from phone_mirroring.protocols.adb import ADBProtocol
+from phone_mirroring.protocols.registry import get_protocol_class
 from phone_mirroring.error_handling import ErrorHandler
 
+# ADB协议和多设备池（numpy、编码器）在用到时才导入
+if TYPE_CHECKING:
+    from phone_mirroring.protocols.adb import ADBProtocol
+    from phone_mirroring.device_pool import DeviceStreamPool
+
 logger = logging.getLogger(__name__)
 
 class MirroringApp:
@@ -28,7 +33,8 @@ class MirroringApp:
     def __init__(self):
         self.server: Optional[MirroringServer] = None
         self.streaming_manager: Optional[StreamingManager] = None
-        self.adb_protocol: Optional[ADBProtocol] = None
+        self.adb_protocol: Optional['ADBProtocol'] = None
+        self.device_pool: Optional['DeviceStreamPool'] = None
         self.config: Config = Config()
         self.error_handler = ErrorHandler()
         
@@ -99,7 +105,10 @@ class MirroringApp:
                 'width': self.config.video.width,
                 'height': self.config.video.height,
                 'fps': self.config.video.fps,
-                'bitrate': self.config.video.bitrate
+                'bitrate': self.config.video.bitrate,
+                'recording': self.config.recording,
+                'timeshift': self.config.timeshift,
+                'mse': self.config.mse
             }
             
             self.streaming_manager = StreamingManager()
@@ -134,7 +143,7 @@ class MirroringApp:
                 'max_fps': self.config.video.fps
             }
             
-            self.adb_protocol = ADBProtocol(adb_config)
+            self.adb_protocol = get_protocol_class("ADB")(adb_config)
             
             if not await self.adb_protocol.start():
                 logger.error("❌ ADB连接失败")
@@ -144,7 +153,10 @@ class MirroringApp:
             
             # 启动RTSP流
             stream_config = {
-                'port': self.config.network.port
+                'port': self.config.network.port,
+                'recording': self.config.recording,
+                'timeshift': self.config.timeshift,
+                'mse': self.config.mse
             }
             
             self.streaming_manager = StreamingManager()
@@ -168,6 +180,43 @@ class MirroringApp:
                 self.on_error(e)
             return False
     
+    async def start_device_farm(self, devices: Optional[List[str]] = None, synthetic: int = 0,
+                                workers: Optional[int] = None) -> bool:
+        """启动多设备投屏（每台设备一个RTSP挂载点 rtsp://host:port/<设备>/）
+        
+        Args:
+            devices: ADB设备序列号列表，None表示所有已连接设备
+            synthetic: 额外添加的合成设备数量（无真机测试）
+            workers: 工作进程数，默认CPU核数
+        """
+        try:
+            logger.info("🚀 启动多设备投屏...")
+            from phone_mirroring.device_pool import DeviceLimits, start_device_farm
+            
+            limits = DeviceLimits(
+                max_width=self.config.video.width,
+                max_height=self.config.video.height,
+                max_fps=self.config.video.fps,
+                max_bitrate=self.config.video.bitrate
+            )
+            self.device_pool = await start_device_farm(devices, {
+                'port': self.config.network.port,
+                'workers': workers,
+                'limits': limits
+            }, synthetic=synthetic)
+            
+            stats = self.device_pool.get_stats()
+            logger.info(f"✅ 多设备投屏已启动: {stats['devices_streaming']}台设备")
+            for device in stats['devices'].values():
+                logger.info(f"📡 rtsp://localhost:{self.config.network.port}/{device['mount']}/")
+            return True
+            
+        except Exception as e:
+            logger.error(f"启动多设备投屏失败: {e}")
+            if self.on_error:
+                self.on_error(e)
+            return False
+    
     async def stop(self):
         """停止所有服务"""
         logger.info("🛑 正在停止所有服务...")
@@ -182,6 +231,10 @@ class MirroringApp:
             await self.adb_protocol.stop()
             self.adb_protocol = None
         
+        if self.device_pool:
+            await self.device_pool.stop()
+            self.device_pool = None
+        
         # 停止服务器
         if self.server:
             await self.server.stop()
@@ -208,6 +261,9 @@ class MirroringApp:
         if self.adb_protocol:
             stats['adb'] = self.adb_protocol.get_device_info()
         
+        if self.device_pool:
+            stats['devices'] = self.device_pool.get_stats()
+        
         return stats
     
     async def handle_control(self, control_data: Dict[str, Any]) -> bool:
@@ -220,6 +276,13 @@ class MirroringApp:
         
         return False
     
+    async def save_clip(self, path: str, seconds: float = 30.0) -> int:
+        """保存最近 seconds 秒画面为MP4（需启用时移缓冲，例如用于提交问题报告）"""
+        if not self.streaming_manager:
+            return 0
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.streaming_manager.save_clip, path, seconds)
+    
     def set_video_quality(self, quality: str):
         """设置视频质量"""
         if self.streaming_manager:
@@ -320,7 +383,7 @@ async def main():
     import argparse
     
     parser = argparse.ArgumentParser(description='WiFi手机投屏系统')
-    parser.add_argument('mode', choices=['screen', 'adb', 'server'], 
+    parser.add_argument('mode', choices=['screen', 'adb', 'server', 'farm'], 
                        help='运行模式')
     parser.add_argument('--port', type=int, default=8554,
                        help='RTSP服务器端口 (默认: 8554)')
@@ -328,6 +391,22 @@ async def main():
                        default='medium', help='视频质量')
     parser.add_argument('--device', type=str, default=None,
                        help='ADB设备ID (仅ADB模式)')
+    parser.add_argument('--devices', type=str, default=None,
+                       help='逗号分隔的ADB设备ID (仅farm模式，默认所有已连接设备)')
+    parser.add_argument('--synthetic', type=int, default=0,
+                       help='合成设备数量 (仅farm模式)')
+    parser.add_argument('--workers', type=int, default=None,
+                       help='工作进程数 (仅farm模式，默认CPU核数)')
+    parser.add_argument('--record', type=str, default=None, metavar='DIR',
+                       help='把视频流录制到目录 (screen/adb模式，不重新编码)')
+    parser.add_argument('--record-format', choices=['mp4', 'mkv'], default='mp4',
+                       help='录制文件格式 (默认: fragmented MP4)')
+    parser.add_argument('--timeshift', type=float, default=0, metavar='SECONDS',
+                       help='在内存中保留最近的画面用于回看和保存片段 (screen/adb模式)')
+    parser.add_argument('--timeshift-port', type=int, default=8091,
+                       help='时移回看HTTP端口 (默认: 8091)')
+    parser.add_argument('--web-port', type=int, default=0, metavar='PORT',
+                       help='浏览器低延迟播放端口，fMP4 over WebSocket/HTTP (screen/adb模式，0为关闭)')
     
     args = parser.parse_args()
     
@@ -338,17 +417,30 @@ async def main():
     )
     
     app = MirroringApp()
+    if args.record:
+        app.config.recording = {'enabled': True, 'output_dir': args.record, 'format': args.record_format}
+    if args.timeshift:
+        app.config.timeshift = {'enabled': True, 'duration': args.timeshift, 'http_port': args.timeshift_port}
+    if args.web_port:
+        app.config.mse = {'enabled': True, 'port': args.web_port}
     
     try:
         if args.mode == 'screen':
             await app.start_screen_mirroring({
                 'port': args.port,
-                'quality': args.quality
+                'quality': args.quality,
+                'recording': app.config.recording,
+                'timeshift': app.config.timeshift,
+                'mse': app.config.mse
             })
         elif args.mode == 'adb':
             await app.start_adb_mirroring(args.device)
         elif args.mode == 'server':
             await app.start_server_mode()
+        elif args.mode == 'farm':
+            app.config.network.port = args.port
+            await app.start_device_farm(args.devices.split(',') if args.devices else None,
+                                        synthetic=args.synthetic, workers=args.workers)
         
         # 保持运行
         logger.info("按 Ctrl+C 停止")
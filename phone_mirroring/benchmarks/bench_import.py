@@ -0,0 +1,117 @@
+"""
+导入耗时基准测试
+在全新的子进程中用 ``python -X importtime`` 导入各入口模块，解析每个模块的累计耗时，
+检查是否超出预算、是否在导入时加载了重依赖（cv2、numpy、av、aiortc）
+
+    python -m phone_mirroring.benchmarks.bench_import --runs 5
+    python -m phone_mirroring.benchmarks.bench_import --check        # 超出预算时返回1
+    python -m phone_mirroring.benchmarks.bench_import --check --scale 3   # 较慢的机器放宽时间预算
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# 导入时不应加载的重依赖（协议和采集/编码在启用时才导入）
+HEAVY_MODULES = ('cv2', 'numpy', 'av', 'aiortc', 'aiohttp')
+
+# 入口模块 -> (累计耗时预算ms, 导入时不应加载的模块)
+# asyncio 本身约占 50ms，服务端和应用入口的预算以此为基础
+IMPORT_BUDGETS: Dict[str, Tuple[float, Tuple[str, ...]]] = {
+    'phone_mirroring': (20.0, HEAVY_MODULES + ('phone_mirroring.server', 'phone_mirroring.protocols')),
+    'phone_mirroring.protocols': (40.0, HEAVY_MODULES + ('phone_mirroring.protocols.rtsp',
+                                                         'phone_mirroring.protocols.adb',
+                                                         'phone_mirroring.protocols.webrtc')),
+    'phone_mirroring.server': (150.0, HEAVY_MODULES + ('phone_mirroring.protocols.rtsp',
+                                                       'phone_mirroring.protocols.adb')),
+    'phone_mirroring.app_main': (200.0, HEAVY_MODULES + ('phone_mirroring.protocols.adb',
+                                                         'phone_mirroring.video_encoder',
+                                                         'phone_mirroring.device_pool')),
+}
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def parse_importtime(output: str) -> Dict[str, Tuple[int, int]]:
+    """解析 -X importtime 的输出
+
+    Returns:
+        模块名 -> (自身耗时us, 累计耗时us)
+    """
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # 表头
+        name = fields[2].strip()
+        modules.setdefault(name, (int(fields[0]), int(fields[1])))
+    return modules
+
+def import_once(module: str) -> Dict[str, Tuple[int, int]]:
+    """在新的解释器进程中导入模块一次"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [_PROJECT_ROOT, os.environ.get('PYTHONPATH')])))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, env=env, cwd=_PROJECT_ROOT, timeout=60)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed: {result.stderr.strip().splitlines()[-1:]}")
+    return parse_importtime(result.stderr)
+
+def measure_import(module: str, runs: int = 5) -> dict:
+    """多次导入取累计耗时的中位数，并记录导入时加载的被禁止模块和自身耗时最高的模块"""
+    # 第一次导入可能要编译 .pyc，不计入
+    modules = import_once(module)
+    times = []
+    for _ in range(runs):
+        modules = import_once(module)
+        times.append(modules[module][1] / 1000)
+
+    budget, forbidden = IMPORT_BUDGETS.get(module, (0.0, HEAVY_MODULES))
+    slowest = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)[:5]
+    return {
+        'module': module,
+        'cumulative_ms': statistics.median(times),
+        'budget_ms': budget,
+        'modules_loaded': len(modules),
+        'forbidden_loaded': [name for name in forbidden if name in modules],
+        'slowest': [(name, self_us / 1000) for name, (self_us, _) in slowest],
+    }
+
+def check_budgets(results: List[dict], scale: float = 1.0) -> List[str]:
+    """返回超出预算或加载了被禁止模块的问题描述，空列表表示通过"""
+    problems = []
+    for result in results:
+        if result['forbidden_loaded']:
+            problems.append(f"{result['module']} imports {', '.join(result['forbidden_loaded'])}")
+        if result['budget_ms'] and result['cumulative_ms'] > result['budget_ms'] * scale:
+            problems.append(f"{result['module']} takes {result['cumulative_ms']:.1f}ms "
+                            f"(budget {result['budget_ms'] * scale:.0f}ms)")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description='导入耗时基准测试（-X importtime）')
+    parser.add_argument('modules', nargs='*', default=list(IMPORT_BUDGETS))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--check', action='store_true', help='超出预算或加载了重依赖时返回1')
+    parser.add_argument('--scale', type=float, default=1.0, help='时间预算倍数（较慢的机器）')
+    args = parser.parse_args()
+
+    results = []
+    for module in args.modules:
+        result = measure_import(module, args.runs)
+        results.append(result)
+        print(f"  {module}: {result['cumulative_ms']:.1f}ms (budget {result['budget_ms']:.0f}ms), "
+              f"{result['modules_loaded']} modules")
+        print("    slowest: " + ", ".join(f"{name}={ms:.1f}ms" for name, ms in result['slowest']))
+
+    if args.check:
+        problems = check_budgets(results, args.scale)
+        for problem in problems:
+            print(f"  FAIL: {problem}")
+        sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
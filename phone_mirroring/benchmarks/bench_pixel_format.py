@@ -0,0 +1,112 @@
+"""
+像素格式基准测试
+对比 bgr24 与 yuv420p 管道格式在 1080p60 下每帧的 CPU 开销
+
+用法:
+    python -m phone_mirroring.benchmarks.bench_pixel_format --frames 300
+"""
+
+import argparse
+import shutil
+import time
+import logging
+
+import numpy as np
+
+from phone_mirroring.screen_capture import ScreenCapture, CaptureConfig, OutputFormat
+from phone_mirroring.video_encoder import FFmpegEncoder, EncodeConfig
+
+logger = logging.getLogger(__name__)
+
+def _child_cpu_time(pid: int) -> float:
+    """获取子进程CPU时间（需要psutil）"""
+    try:
+        import psutil
+        times = psutil.Process(pid).cpu_times()
+        return times.user + times.system
+    except Exception:
+        return 0.0
+
+def run_case(pixel_format: str, frames: np.ndarray, count: int, fps: int, encode: bool) -> dict:
+    """运行单个像素格式的测试"""
+    height, width = frames[0].shape[:2]
+    output_format = OutputFormat.I420 if pixel_format == 'yuv420p' else OutputFormat.BGR
+    capture = ScreenCapture(CaptureConfig(output_format=output_format))
+
+    encoder = None
+    if encode:
+        encoder = FFmpegEncoder(EncodeConfig(
+            width=width, height=height, fps=fps,
+            preset='ultrafast', pixel_format=pixel_format
+        ))
+        encoder.start(lambda data, metadata: None)
+
+    interval = 1.0 / fps if fps else 0
+    convert_time = 0.0
+    pipe_bytes = 0
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    child_start = _child_cpu_time(encoder.pid) if encoder else 0.0
+
+    for i in range(count):
+        deadline = wall_start + i * interval
+        delay = deadline - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+        t0 = time.perf_counter()
+        frame = capture._convert_output(frames[i % len(frames)], 'bgra')
+        convert_time += time.perf_counter() - t0
+        pipe_bytes += frame.nbytes
+
+        if encoder:
+            encoder.encode_frame(frame)
+
+    cpu_used = time.process_time() - cpu_start
+    child_used = _child_cpu_time(encoder.pid) - child_start if encoder else 0.0
+    wall = time.perf_counter() - wall_start
+
+    result = {
+        'pixel_format': pixel_format,
+        'convert_ms_per_frame': 1000 * convert_time / count,
+        'python_cpu_ms_per_frame': 1000 * cpu_used / count,
+        'ffmpeg_cpu_ms_per_frame': 1000 * child_used / count,
+        'pipe_mb_per_frame': pipe_bytes / count / 1e6,
+        'pipe_mb_per_second': pipe_bytes / wall / 1e6,
+    }
+
+    if encoder:
+        result['frames_dropped'] = encoder.frames_dropped
+        encoder.stop()
+
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='bgr24 vs yuv420p 管道格式基准测试')
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--fps', type=int, default=60)
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--no-encode', action='store_true', help='只测试颜色转换，不启动FFmpeg')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    encode = not args.no_encode and shutil.which('ffmpeg') is not None
+    if not args.no_encode and not encode:
+        print("ffmpeg not found, measuring conversion only")
+
+    # 合成BGRA帧（模拟mss采集输出）
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, (args.height, args.width, 4), dtype=np.uint8) for _ in range(4)]
+
+    print(f"{args.width}x{args.height}@{args.fps}, {args.frames} frames")
+    for pixel_format in ('bgr24', 'yuv420p'):
+        result = run_case(pixel_format, frames, args.frames, args.fps, encode)
+        print("  " + ", ".join(
+            f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in result.items()
+        ))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+X11 采集后端基准测试
+对比 MSS（XGetImage，像素经X套接字传输）与 XShm（共享内存）每帧的采集耗时和CPU开销
+
+需要X显示（可用Xvfb）:
+    xvfb-run -s "-screen 0 1920x1080x24" python -m phone_mirroring.benchmarks.bench_xshm --frames 300
+"""
+
+import argparse
+import time
+import logging
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def _grab_mss():
+    import mss
+    sct = mss.mss()
+    monitor = sct.monitors[1]
+
+    def grab():
+        screenshot = sct.grab(monitor)
+        return np.frombuffer(screenshot.raw, dtype=np.uint8).reshape(screenshot.height, screenshot.width, 4)
+    return grab, sct.close
+
+def _grab_xshm():
+    from phone_mirroring.xshm import XShmGrabber
+    grabber = XShmGrabber()
+    return grabber.grab, grabber.close
+
+def run_case(name: str, count: int, convert: bool) -> dict:
+    """运行单个后端的测试"""
+    grab, close = _grab_mss() if name == 'mss' else _grab_xshm()
+    try:
+        # 预热
+        frame = grab()
+        height, width = frame.shape[:2]
+        dst = np.empty((height // 2 * 3, width), dtype=np.uint8)
+
+        grab_time = convert_time = 0.0
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+
+        for _ in range(count):
+            t0 = time.perf_counter()
+            frame = grab()
+            t1 = time.perf_counter()
+            grab_time += t1 - t0
+
+            if convert:
+                cv2.cvtColor(frame[:height // 2 * 2], cv2.COLOR_BGRA2YUV_I420, dst=dst)
+                convert_time += time.perf_counter() - t1
+
+        cpu_used = time.process_time() - cpu_start
+        wall = time.perf_counter() - wall_start
+    finally:
+        close()
+
+    return {
+        'backend': name,
+        'resolution': f"{width}x{height}",
+        'grab_ms_per_frame': 1000 * grab_time / count,
+        'convert_ms_per_frame': 1000 * convert_time / count,
+        'cpu_ms_per_frame': 1000 * cpu_used / count,
+        'max_fps': count / wall,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='MSS vs XShm 采集后端基准测试')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--no-convert', action='store_true', help='只测试采集，不做BGRA->I420转换')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    for name in ('mss', 'xshm'):
+        try:
+            result = run_case(name, args.frames, not args.no_convert)
+        except Exception as e:
+            print(f"  {name}: unavailable ({e})")
+            continue
+        print("  " + ", ".join(
+            f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in result.items()
+        ))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+画面变化检测模块
+在颜色转换和编码之前判断采集到的原始帧是否与上一帧相同，以及哪些分块发生了变化
+"""
+
+from typing import Optional, Dict, Any, List, Tuple
+
+import numpy as np
+
+def _keep_reference(frame: np.ndarray, reference: Optional[np.ndarray], copy: bool) -> np.ndarray:
+    """保存新的参考帧：不复制时直接持有，复制时尽量写入已有的参考缓冲区"""
+    if not copy:
+        return frame
+    if reference is None or reference.shape != frame.shape or not reference.flags.writeable:
+        return frame.copy()
+    np.copyto(reference, frame)
+    return reference
+
+class ChangeDetector:
+    """原始帧变化检测器
+
+    每次只比较 1/row_step 的行（全分辨率、逐字节），比较的行每帧轮换，
+    静止画面下每帧只需读 1/row_step 的数据；细小变化（光标、单行文字）
+    最多延迟 row_step 帧被发现。检测到变化后才更新参考帧。
+
+    参考帧默认直接持有传入的数组（MSS等后端每次返回新数组），调用方不得原地修改；
+    后端复用同一块缓冲区（XShm）时设置 copy_reference，变化时把帧复制到参考缓冲区。
+    """
+
+    def __init__(self, row_step: int = 4):
+        self.row_step = max(1, row_step)
+        self.copy_reference = False
+        self._reference: Optional[np.ndarray] = None
+        self._phase = 0
+
+        self.stats = {
+            'checked': 0,
+            'changed': 0,
+            'unchanged': 0
+        }
+
+    def update(self, frame: np.ndarray) -> bool:
+        """比较新帧与参考帧，返回画面是否变化"""
+        self.stats['checked'] += 1
+        reference = self._reference
+
+        if reference is None or reference.shape != frame.shape:
+            changed = True
+        else:
+            rows = slice(self._phase, None, self.row_step)
+            self._phase = (self._phase + 1) % self.row_step
+            changed = not np.array_equal(frame[rows], reference[rows])
+
+        if changed:
+            self._reference = _keep_reference(frame, reference, self.copy_reference)
+            self.stats['changed'] += 1
+        else:
+            self.stats['unchanged'] += 1
+        return changed
+
+    def reset(self):
+        """丢弃参考帧，下一帧视为变化"""
+        self._reference = None
+        self._phase = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取检测统计"""
+        return dict(self.stats)
+
+class TileTracker:
+    """分块脏区域跟踪
+
+    逐字节比较新帧与上一帧，按 tile_size×tile_size 分块汇总出变化的块，
+    全部计算都是NumPy向量化操作，1080p BGRA约1ms。
+    接口与 ChangeDetector 相同（update返回是否变化），可直接替代。
+    """
+
+    def __init__(self, tile_size: int = 64):
+        self.tile_size = tile_size
+        self.copy_reference = False  # 同 ChangeDetector.copy_reference
+        self._reference: Optional[np.ndarray] = None
+
+        # 最近一次update的结果：(行块数, 列块数) 的布尔数组
+        self.dirty_tiles: Optional[np.ndarray] = None
+        self.dirty_ratio = 1.0
+        self.average_dirty_ratio = 0.0
+
+        self.stats = {
+            'checked': 0,
+            'changed': 0,
+            'unchanged': 0
+        }
+
+    def _compare(self, frame: np.ndarray, reference: np.ndarray) -> np.ndarray:
+        """逐块比较两帧，返回 (行块数, 列块数) 的脏块数组"""
+        height, width = frame.shape[:2]
+        size = self.tile_size
+        a = frame.reshape(height, -1)
+        b = reference.reshape(height, -1)
+
+        # 每行字节数是8的倍数时按uint64比较（BGRA一次比较2个像素）；
+        # 一个分块的字节宽度 size*通道数 总是8的倍数，比较单元不会跨块
+        if a.shape[1] % 8 == 0:
+            a, b = a.view(np.uint64), b.view(np.uint64)
+        units_per_tile = a.shape[1] * size // width
+        diff = a != b
+
+        # 先在块内按行归约，最后不足一块的行单独处理
+        full = height // size * size
+        row_tiles = diff[:full].reshape(height // size, size, -1).any(axis=1)
+        if full < height:
+            row_tiles = np.vstack([row_tiles, diff[full:].any(axis=0)])
+
+        # 再按列归约，右侧不足一块的部分补False
+        cols = -(-width // size)
+        padded = np.zeros((row_tiles.shape[0], cols * units_per_tile), dtype=bool)
+        padded[:, :row_tiles.shape[1]] = row_tiles
+        return padded.reshape(row_tiles.shape[0], cols, units_per_tile).any(axis=2)
+
+    def update(self, frame: np.ndarray) -> bool:
+        """比较新帧与上一帧，更新脏块，返回画面是否变化"""
+        self.stats['checked'] += 1
+        height, width = frame.shape[:2]
+
+        reference = self._reference
+        if reference is None or reference.shape != frame.shape:
+            self.dirty_tiles = np.ones((-(-height // self.tile_size), -(-width // self.tile_size)), dtype=bool)
+        else:
+            self.dirty_tiles = self._compare(frame, reference)
+
+        self.dirty_ratio = float(self.dirty_tiles.mean())
+        self.average_dirty_ratio = 0.9 * self.average_dirty_ratio + 0.1 * self.dirty_ratio
+
+        changed = self.dirty_ratio > 0
+        if changed:
+            self._reference = _keep_reference(frame, reference, self.copy_reference)
+            self.stats['changed'] += 1
+        else:
+            self.stats['unchanged'] += 1
+        return changed
+
+    def dirty_rects(self, scale_x: float = 1.0, scale_y: float = 1.0) -> List[Tuple[int, int, int, int]]:
+        """变化区域矩形 (x, y, w, h)，同一行相邻的脏块合并为一个矩形
+
+        Args:
+            scale_x, scale_y: 坐标缩放比例（脏块基于原始采集分辨率计算）
+        """
+        if self.dirty_tiles is None or self._reference is None:
+            return []
+
+        height, width = self._reference.shape[:2]
+        size = self.tile_size
+        rects = []
+        for row, line in enumerate(self.dirty_tiles):
+            # 找出每一段连续的脏块
+            padded = np.concatenate(([False], line, [False]))
+            edges = np.flatnonzero(padded[1:] != padded[:-1])
+            for start, end in zip(edges[::2], edges[1::2]):
+                x, y = start * size, row * size
+                w, h = min(end * size, width) - x, min(y + size, height) - y
+                rects.append((int(x * scale_x), int(y * scale_y),
+                              int(np.ceil(w * scale_x)), int(np.ceil(h * scale_y))))
+        return rects
+
+    def reset(self):
+        """丢弃参考帧，下一帧视为全部变化"""
+        self._reference = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取检测统计"""
+        return dict(self.stats,
+                    dirty_ratio=self.dirty_ratio,
+                    average_dirty_ratio=self.average_dirty_ratio,
+                    tile_size=self.tile_size)
@@ -59,6 +59,12 @@ class Config:
     # 录制配置
     recording: Dict = field(default_factory=dict)
     
+    # 时移缓冲配置（保存最近一段画面）
+    timeshift: Dict = field(default_factory=dict)
+    
+    # 浏览器输出配置（fMP4 over WebSocket/HTTP，MSE播放）
+    mse: Dict = field(default_factory=dict)
+    
     # 安全配置
     security: Dict = field(default_factory=lambda: {
         "require_password": False,
@@ -124,6 +130,8 @@ class Config:
             },
             "enabled_protocols": self.enabled_protocols,
             "recording": self.recording,
+            "timeshift": self.timeshift,
+            "mse": self.mse,
             "security": self.security,
             "debug": self.debug
         }
@@ -150,7 +158,7 @@ class Config:
                 if hasattr(self.control, k):
                     setattr(self.control, k, v)
         
-        for key in ["enabled_protocols", "recording", "security", "debug"]:
+        for key in ["enabled_protocols", "recording", "timeshift", "mse", "security", "debug"]:
             if key in data:
                 setattr(self, key, data[key])
 
@@ -0,0 +1,601 @@
+"""
+多设备投屏池模块
+每台设备一条采集流水线，分布在按CPU核数创建的工作进程中，共用一个RTSP服务（每台设备一个挂载点）
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, asdict
+from typing import Optional, Dict, Any, List, Union
+
+import numpy as np
+
+from phone_mirroring.protocols.rtsp import RTSPProtocol
+from phone_mirroring.protocols.adb import ADBProtocol
+from phone_mirroring.video_encoder import PyAVEncoder, EncodeConfig, HAS_AV
+from phone_mirroring.frame_clock import FrameClock
+from phone_mirroring.pipeline import Pipeline, Stage
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class DeviceLimits:
+    """单台设备的资源上限"""
+    max_width: int = 1280
+    max_height: int = 720
+    max_fps: int = 30
+    max_bitrate: int = 4000000   # 设备端编码码率；服务端按令牌桶（1秒突发）限制转发码率
+    queue_frames: int = 30       # 发送队列长度，满时丢弃最旧帧并等待下一个关键帧
+
+def discover_adb_devices() -> List[str]:
+    """列出 adb devices 中处于 device 状态的设备序列号（adb不可用时返回空列表）"""
+    try:
+        result = subprocess.run(['adb', 'devices'], capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"Cannot list ADB devices: {e}")
+        return []
+
+    serials = []
+    for line in result.stdout.strip().split('\n')[1:]:
+        parts = line.split()
+        if len(parts) >= 2 and parts[1] == 'device':
+            serials.append(parts[0])
+    return serials
+
+def mount_name(serial: str) -> str:
+    """设备序列号对应的RTSP挂载点名称（TCP设备的 host:port 等字符替换为下划线）"""
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', serial)
+
+class SyntheticDevice:
+    """合成设备，用于没有真机时测试设备池
+
+    接口与 ADBProtocol 的投屏部分一致（start/stop/set_video_frame_callback/request_keyframe），
+    按 max_fps 生成带移动色块的画面，用进程内PyAV编码为H.264。
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.device_id = config.get("device_id", "synthetic")
+        self.width = config.get("max_width", 320)
+        self.height = config.get("max_height", 240)
+        self.fps = config.get("max_fps", 30)
+        self.bitrate = config.get("bitrate", 1000000)
+        self.gop_size = config.get("gop_size", 2 * self.fps)
+
+        self.is_running = False
+        self.encoder: Optional[PyAVEncoder] = None
+        self.on_video_frame_callback = None
+        self._task: Optional[asyncio.Task] = None
+        self._frame_count = 0
+
+        # 不同设备画面颜色不同，便于肉眼区分
+        seed = sum(self.device_id.encode())
+        self._color = (seed * 37 % 256, seed * 91 % 256, seed * 53 % 256)
+
+    async def start(self) -> bool:
+        if not HAS_AV:
+            logger.error("PyAV is required for synthetic devices. Install with: pip install av")
+            return False
+
+        self.encoder = PyAVEncoder(EncodeConfig(
+            width=self.width, height=self.height, fps=self.fps, bitrate=self.bitrate,
+            gop_size=self.gop_size, preset='ultrafast', tune='zerolatency'))
+        if not self.encoder.start(self._on_encoded):
+            return False
+
+        self.is_running = True
+        self._task = asyncio.create_task(self._generate_loop())
+        logger.info(f"Synthetic device {self.device_id} started: {self.width}x{self.height}@{self.fps}fps")
+        return True
+
+    async def _generate_loop(self):
+        clock = FrameClock(self.fps)
+        bar = max(8, self.width // 10)
+        while self.is_running:
+            # 每帧新分配数组：编码线程异步读取已提交的帧
+            frame = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+            x = self._frame_count * 4 % max(1, self.width - bar)
+            frame[:, x:x + bar] = self._color
+            self.encoder.encode_frame(frame, time.monotonic())
+            self._frame_count += 1
+            await clock.wait_async()
+
+    def _on_encoded(self, data: bytes, metadata: Dict):
+        if self.on_video_frame_callback:
+            metadata['device_id'] = self.device_id
+            self.on_video_frame_callback(data, metadata)
+
+    def set_video_frame_callback(self, callback):
+        self.on_video_frame_callback = callback
+
+    def request_keyframe(self) -> bool:
+        return self.encoder.request_keyframe() if self.encoder else False
+
+    async def stop(self) -> bool:
+        self.is_running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.encoder:
+            self.encoder.stop()
+            self.encoder = None
+        return True
+
+    def get_device_info(self) -> Dict[str, Any]:
+        return {
+            'active_device': self.device_id,
+            'connection_state': 'streaming' if self.is_running else 'disconnected',
+            'capture_config': {'width': self.width, 'height': self.height, 'fps': self.fps, 'bitrate': self.bitrate}
+        }
+
+class _DeviceWorker:
+    """工作进程：在一个事件循环中运行分配给它的若干设备
+
+    命令（主进程 -> 工作进程）: ('start', serial, source, config) / ('stop', serial) /
+    ('keyframe', serial) / None（退出）。
+    输出（工作进程 -> 主进程）: ('frame', serial, data, metadata) / ('started' | 'failed' | 'stopped', serial, info) /
+    ('stats', index, stats)。输出队列满时该设备丢帧并等待下一个关键帧，不阻塞其他设备。
+    """
+
+    def __init__(self, index: int, commands, output):
+        self.index = index
+        self.commands = commands
+        self.output = output
+        self.devices: Dict[str, Any] = {}
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self._starting: Dict[str, asyncio.Task] = {}
+        self._waiting_keyframe = set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        stats_task = asyncio.create_task(self._stats_loop())
+        try:
+            while True:
+                command = await loop.run_in_executor(None, self.commands.get)
+                if command is None:
+                    break
+                try:
+                    await self._handle(command)
+                except Exception as e:
+                    logger.error(f"Worker {self.index} command {command[0]} failed: {e}")
+        finally:
+            stats_task.cancel()
+            for serial in list(self.devices):
+                await self._stop_device(serial)
+
+    async def _handle(self, command):
+        kind, serial = command[0], command[1]
+        if kind == 'start':
+            # 设备启动（adb连接、推送scrcpy）可能需要数秒，各设备并行启动
+            self._starting[serial] = asyncio.create_task(self._start_device(serial, command[2], command[3]))
+        elif kind == 'stop':
+            await self._stop_device(serial)
+            self.output.put(('stopped', serial, None))
+        elif kind == 'keyframe' and serial in self.devices:
+            self.devices[serial].request_keyframe()
+
+    async def _start_device(self, serial: str, source: str, config: Dict[str, Any]):
+        device = SyntheticDevice(config) if source == 'synthetic' else ADBProtocol(config)
+        self.counters[serial] = {'frames': 0, 'bytes': 0, 'dropped': 0}
+        device.set_video_frame_callback(lambda data, metadata: self._forward(serial, data, metadata))
+
+        try:
+            if await device.start():
+                self.devices[serial] = device
+                self.output.put(('started', serial, {'worker': self.index, 'pid': os.getpid()}))
+            else:
+                await device.stop()
+                self.output.put(('failed', serial, f"{source} device failed to start"))
+        except Exception as e:
+            self.output.put(('failed', serial, str(e)))
+        finally:
+            self._starting.pop(serial, None)
+
+    async def _stop_device(self, serial: str):
+        starting = self._starting.get(serial)
+        if starting:
+            await asyncio.gather(starting, return_exceptions=True)
+        device = self.devices.pop(serial, None)
+        if device:
+            device.set_video_frame_callback(None)
+            await device.stop()
+        self._waiting_keyframe.discard(serial)
+
+    def _forward(self, serial: str, data: bytes, metadata: Dict):
+        """设备帧送往主进程（设备读取协程或编码线程中调用）"""
+        counters = self.counters[serial]
+        is_keyframe = metadata.get('is_keyframe', False)
+        if serial in self._waiting_keyframe and not is_keyframe:
+            counters['dropped'] += 1
+            return
+        try:
+            self.output.put_nowait(('frame', serial, bytes(data), metadata))
+        except queue.Full:
+            counters['dropped'] += 1
+            self._waiting_keyframe.add(serial)
+            device = self.devices.get(serial)
+            if device:
+                device.request_keyframe()
+            return
+        self._waiting_keyframe.discard(serial)
+        counters['frames'] += 1
+        counters['bytes'] += len(data)
+
+    async def _stats_loop(self):
+        last_wall, last_cpu = time.monotonic(), time.process_time()
+        while True:
+            await asyncio.sleep(1)
+            wall, cpu = time.monotonic(), time.process_time()
+            try:
+                self.output.put_nowait(('stats', self.index, {
+                    'pid': os.getpid(),
+                    'cpu_percent': 100.0 * (cpu - last_cpu) / (wall - last_wall),
+                    'devices': {serial: dict(counters) for serial, counters in self.counters.items()
+                                if serial in self.devices}
+                }))
+            except queue.Full:
+                pass
+            last_wall, last_cpu = wall, cpu
+
+def _worker_main(index: int, commands, output, log_level: int):
+    """工作进程入口"""
+    logging.basicConfig(level=log_level, format=f'%(asctime)s - worker{index} - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(_DeviceWorker(index, commands, output).run())
+    except KeyboardInterrupt:
+        pass
+
+class _WorkerHandle:
+    """主进程中的工作进程句柄"""
+
+    def __init__(self, index: int, context, output_queue_size: int):
+        self.index = index
+        self.commands = context.Queue()
+        self.output = context.Queue(maxsize=output_queue_size)
+        self.process = context.Process(
+            target=_worker_main, args=(index, self.commands, self.output, logging.getLogger().level),
+            name=f"device-worker-{index}", daemon=True)
+        self.devices: List[str] = []
+        self.stats: Dict[str, Any] = {}
+        self.reader: Optional[threading.Thread] = None
+
+class DeviceStream:
+    """池中的一路设备：工作进程中的采集 -> 主进程中的发送阶段（事件循环）"""
+
+    def __init__(self, serial: str, source: str, limits: DeviceLimits, worker: _WorkerHandle, pool: 'DeviceStreamPool'):
+        self.serial = serial
+        self.source = source
+        self.mount = mount_name(serial)
+        self.limits = limits
+        self.worker = worker
+        self.state = 'starting'
+        self.error: Optional[str] = None
+        self.started = asyncio.get_running_loop().create_future()
+        self._pool = pool
+
+        # 令牌桶（字节），容量为1秒的码率上限
+        self._tokens = limits.max_bitrate / 8
+        self._last_refill = time.monotonic()
+        self._waiting_keyframe = False
+
+        self.pipeline = Pipeline(f"device-{self.mount}")
+        self.pipeline.add(Stage('ingest', kind='source'))
+        self.pipeline.add(Stage('send', self._send, kind='sink', executor='asyncio',
+                                queue_size=limits.queue_frames, overflow='drop_oldest',
+                                on_discard=self._on_dropped))
+
+        self.stats = {
+            'frames': 0,
+            'bytes': 0,
+            'keyframes': 0,
+            'dropped': 0,
+            'rate_limited': 0,
+            'start_time': 0.0
+        }
+
+    def ingest(self, data: bytes, metadata: Dict):
+        """收到工作进程转发的访问单元（读取线程中调用）"""
+        is_keyframe = metadata.get('is_keyframe', False)
+        if self._waiting_keyframe and not is_keyframe:
+            self.stats['dropped'] += 1
+            return
+
+        # 转发码率上限：令牌不足时丢帧并从下一个关键帧恢复
+        now = time.monotonic()
+        capacity = self.limits.max_bitrate / 8
+        self._tokens = min(capacity, self._tokens + (now - self._last_refill) * capacity)
+        self._last_refill = now
+        if self._tokens < len(data):
+            self.stats['rate_limited'] += 1
+            self._wait_for_keyframe()
+            return
+        self._tokens -= len(data)
+
+        self._waiting_keyframe = False
+        self.stats['frames'] += 1
+        self.stats['bytes'] += len(data)
+        if is_keyframe:
+            self.stats['keyframes'] += 1
+        metadata['mount'] = self.mount
+        self.pipeline.emit('ingest', (data, metadata))
+
+    def _on_dropped(self, item):
+        """发送队列溢出（或关闭）时丢弃的帧"""
+        if self.pipeline.is_running:
+            self.stats['dropped'] += 1
+            self._wait_for_keyframe()
+
+    def _wait_for_keyframe(self):
+        if not self._waiting_keyframe:
+            self._waiting_keyframe = True
+            self._pool.request_keyframe(self.serial)
+
+    async def _send(self, item):
+        rtsp_server = self._pool.rtsp_server
+        if rtsp_server:
+            await rtsp_server.send_frame(*item)
+
+    def get_stats(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.stats['start_time'] if self.stats['start_time'] else 0.0
+        return dict(self.stats,
+                    source=self.source,
+                    state=self.state,
+                    error=self.error,
+                    mount=self.mount,
+                    worker=self.worker.index,
+                    limits=asdict(self.limits),
+                    fps=self.stats['frames'] / elapsed if elapsed > 0 else 0.0,
+                    bitrate=8 * self.stats['bytes'] / elapsed if elapsed > 0 else 0.0,
+                    worker_stats=self.worker.stats.get('devices', {}).get(self.serial, {}),
+                    pipeline=self.pipeline.get_stats())
+
+class DeviceStreamPool:
+    """多设备投屏池
+
+    设备采集（scrcpy/screenrecord读取与H.264解析，或合成设备的编码）在工作进程中进行，
+    设备按最少负载分配到工作进程；访问单元经进程间队列回到主进程，
+    由每台设备自己的发送阶段发往共享RTSP服务的挂载点 rtsp://host:port/<设备>/。
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        config = config or {}
+        self.config = config
+        self.workers_count = config.get('workers') or os.cpu_count() or 1
+        self.output_queue_size = config.get('output_queue_size', 512)
+        self.scrcpy_port_start = config.get('scrcpy_port_start', 27183)
+
+        limits = config.get('limits', DeviceLimits())
+        self.default_limits = DeviceLimits(**limits) if isinstance(limits, dict) else limits
+
+        self.is_running = False
+        self.rtsp_server: Optional[RTSPProtocol] = None
+        self.devices: Dict[str, DeviceStream] = {}
+        self.workers: List[_WorkerHandle] = []
+        self._mounts: Dict[str, str] = {}    # 挂载点 -> 设备序列号
+        self._next_scrcpy_port = self.scrcpy_port_start
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stats = {'start_time': 0.0, 'devices_added': 0, 'devices_failed': 0}
+
+    async def start(self) -> bool:
+        """启动RTSP服务和工作进程"""
+        self._loop = asyncio.get_running_loop()
+        self.rtsp_server = RTSPProtocol({
+            'port': self.config.get('port', 8554),
+            'rtp_port_start': self.config.get('rtp_port_start', 5000),
+            'fps': self.default_limits.max_fps
+        })
+        if not await self.rtsp_server.start():
+            logger.error("Failed to start RTSP server")
+            return False
+        self.rtsp_server.register_callback("keyframe_requested", self._on_keyframe_requested)
+
+        # spawn：主进程已有事件循环和线程，fork出的子进程状态不可靠
+        context = multiprocessing.get_context('spawn')
+        for index in range(self.workers_count):
+            worker = _WorkerHandle(index, context, self.output_queue_size)
+            worker.process.start()
+            worker.reader = threading.Thread(target=self._read_worker, args=(worker,),
+                                             name=f"device-worker-reader-{index}", daemon=True)
+            self.workers.append(worker)
+
+        self.is_running = True
+        self.stats['start_time'] = time.monotonic()
+        for worker in self.workers:
+            worker.reader.start()
+
+        logger.info(f"Device pool started with {self.workers_count} worker processes, "
+                    f"RTSP port {self.rtsp_server.rtsp_port}")
+        return True
+
+    async def add_device(self, serial: str, source: str = 'adb',
+                         limits: Optional[Union[DeviceLimits, Dict]] = None, timeout: float = 30.0) -> bool:
+        """添加一台设备并等待其开始输出
+
+        Args:
+            serial: 设备序列号（合成设备为任意名称）
+            source: 'adb' 或 'synthetic'
+            limits: 该设备的资源上限，默认使用池的 limits
+        """
+        if not self.is_running or serial in self.devices:
+            return False
+        if isinstance(limits, dict):
+            limits = DeviceLimits(**limits)
+        limits = limits or self.default_limits
+
+        worker = min(self.workers, key=lambda w: len(w.devices))
+        device = DeviceStream(serial, source, limits, worker, self)
+        self.devices[serial] = device
+        self._mounts[device.mount] = serial
+        worker.devices.append(serial)
+        self.rtsp_server.add_mount(device.mount)
+        device.pipeline.start(self._loop)
+
+        config = {
+            'device_id': serial,
+            'scrcpy_port': self._next_scrcpy_port,
+            'max_width': limits.max_width,
+            'max_height': limits.max_height,
+            'max_fps': limits.max_fps,
+            'bitrate': limits.max_bitrate
+        }
+        self._next_scrcpy_port += 1
+        worker.commands.put(('start', serial, source, config))
+
+        try:
+            await asyncio.wait_for(asyncio.shield(device.started), timeout)
+        except asyncio.TimeoutError:
+            device.error = "start timed out"
+
+        if device.state != 'streaming':
+            logger.error(f"Device {serial} failed to start: {device.error}")
+            self.stats['devices_failed'] += 1
+            await self.remove_device(serial)
+            return False
+
+        self.stats['devices_added'] += 1
+        logger.info(f"Device {serial} streaming on worker {worker.index}: "
+                    f"rtsp://localhost:{self.rtsp_server.rtsp_port}/{device.mount}/")
+        return True
+
+    async def remove_device(self, serial: str) -> bool:
+        """停止并移除一台设备"""
+        device = self.devices.pop(serial, None)
+        if not device:
+            return False
+
+        device.worker.commands.put(('stop', serial))
+        device.worker.devices.remove(serial)
+        self._mounts.pop(device.mount, None)
+        await self._loop.run_in_executor(None, device.pipeline.stop)
+        if self.rtsp_server:
+            self.rtsp_server.remove_mount(device.mount)
+        return True
+
+    def request_keyframe(self, serial: Optional[str] = None):
+        """请求设备（None为所有设备）尽快输出IDR"""
+        for device in ([self.devices[serial]] if serial in self.devices else
+                       list(self.devices.values()) if serial is None else []):
+            device.worker.commands.put(('keyframe', device.serial))
+
+    def _on_keyframe_requested(self, client_id: Optional[str], reason: str):
+        mount = self.rtsp_server.client_mount(client_id) if self.rtsp_server else None
+        serial = self._mounts.get(mount)
+        if serial:
+            self.request_keyframe(serial)
+
+    def _read_worker(self, worker: _WorkerHandle):
+        """读取线程：把工作进程的输出分发给各设备，事件交回事件循环处理"""
+        while self.is_running:
+            try:
+                item = worker.output.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+
+            kind = item[0]
+            if kind == 'frame':
+                device = self.devices.get(item[1])
+                if device:
+                    device.ingest(item[2], item[3])
+            elif kind == 'stats':
+                worker.stats = item[2]
+            else:
+                self._loop.call_soon_threadsafe(self._on_worker_event, kind, item[1], item[2])
+
+    def _on_worker_event(self, kind: str, serial: str, info: Any):
+        device = self.devices.get(serial)
+        if not device:
+            return
+        if kind == 'started':
+            device.state = 'streaming'
+            device.stats['start_time'] = time.monotonic()
+        elif kind == 'failed':
+            device.state = 'failed'
+            device.error = info
+        if not device.started.done():
+            device.started.set_result(kind)
+
+    async def stop(self) -> bool:
+        """停止所有设备、工作进程和RTSP服务"""
+        for serial in list(self.devices):
+            await self.remove_device(serial)
+
+        for worker in self.workers:
+            worker.commands.put(None)
+        for worker in self.workers:
+            await self._loop.run_in_executor(None, worker.process.join, 5.0)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+        self.is_running = False
+        for worker in self.workers:
+            worker.reader.join(timeout=2.0)
+        self.workers = []
+
+        if self.rtsp_server:
+            await self.rtsp_server.stop()
+            self.rtsp_server = None
+
+        logger.info("Device pool stopped")
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取汇总统计和每台设备、每个工作进程的统计"""
+        devices = {serial: device.get_stats() for serial, device in self.devices.items()}
+        uptime = time.monotonic() - self.stats['start_time'] if self.stats['start_time'] else 0.0
+        return {
+            'is_running': self.is_running,
+            'uptime': uptime,
+            'devices_total': len(devices),
+            'devices_streaming': sum(d['state'] == 'streaming' for d in devices.values()),
+            'devices_added': self.stats['devices_added'],
+            'devices_failed': self.stats['devices_failed'],
+            'frames': sum(d['frames'] for d in devices.values()),
+            'bytes': sum(d['bytes'] for d in devices.values()),
+            'dropped': sum(d['dropped'] + d['worker_stats'].get('dropped', 0) for d in devices.values()),
+            'rate_limited': sum(d['rate_limited'] for d in devices.values()),
+            'bitrate': sum(d['bitrate'] for d in devices.values()),
+            'cpu_percent': sum(w.stats.get('cpu_percent', 0.0) for w in self.workers),
+            'workers': [
+                {'index': w.index, 'pid': w.process.pid, 'alive': w.process.is_alive(),
+                 'devices': list(w.devices), 'cpu_percent': w.stats.get('cpu_percent', 0.0)}
+                for w in self.workers
+            ],
+            'devices': devices,
+            'rtsp': self.rtsp_server.get_session_info() if self.rtsp_server else {}
+        }
+
+# 便捷函数
+async def start_device_farm(devices: Optional[List[str]] = None, config: Optional[Dict] = None,
+                            synthetic: int = 0) -> DeviceStreamPool:
+    """启动多设备投屏池
+
+    Args:
+        devices: ADB设备序列号列表，None表示 adb devices 列出的所有设备
+        config: 池配置（port, workers, limits...）
+        synthetic: 额外添加的合成设备数量
+
+    Returns:
+        DeviceStreamPool实例
+    """
+    pool = DeviceStreamPool(config)
+    if not await pool.start():
+        raise RuntimeError("Failed to start device pool")
+
+    serials = discover_adb_devices() if devices is None else devices
+    results = await asyncio.gather(
+        *(pool.add_device(serial) for serial in serials),
+        *(pool.add_device(f"synthetic-{i}", source='synthetic') for i in range(synthetic)))
+    logger.info(f"Device farm: {sum(results)}/{len(results)} devices streaming")
+    return pool
@@ -0,0 +1,382 @@
+"""
+编码器注册表模块
+探测可用的编码后端，用合成画面做短时编码基准测试，
+结果按FFmpeg版本和CPU缓存到磁盘，供 create_encoder('auto') 选择
+"""
+
+import json
+import logging
+import os
+import platform
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, asdict
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, Tuple
+
+import numpy as np
+
+from phone_mirroring.video_encoder import (
+    EncodeConfig, PyAVEncoder, VideoEncoder, build_ffmpeg_command, HAS_AV
+)
+
+logger = logging.getLogger(__name__)
+
+# 参与基准测试的libx264预设（从快到慢）
+X264_PRESETS = ('ultrafast', 'superfast', 'veryfast')
+
+# 软件编码器（libx264以外）
+SOFTWARE_ENCODERS = ('libopenh264',)
+
+# 硬件编码器（按优先级）
+HARDWARE_ENCODERS = ('h264_nvenc', 'h264_qsv', 'h264_amf', 'h264_videotoolbox')
+
+# 能输出码流、可用于推流的后端（OpenCV VideoWriter拿不到编码数据）
+STREAMING_BACKENDS = ('ffmpeg', 'pyav')
+
+# 默认缓存文件
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.phone_mirroring', 'encoder_benchmarks.json')
+
+@dataclass
+class EncoderCandidate:
+    """待测试的编码后端"""
+    backend: str              # ffmpeg, pyav, opencv
+    encoder_name: str         # libx264, libopenh264, h264_nvenc...
+    preset: Optional[str] = None
+
+    @property
+    def key(self) -> str:
+        return f"{self.backend}:{self.encoder_name}:{self.preset or '-'}"
+
+@dataclass
+class BenchmarkResult:
+    """单个后端的基准测试结果（基准分辨率下）"""
+    backend: str
+    encoder_name: str
+    preset: Optional[str] = None
+    ok: bool = False
+    fps: float = 0.0
+    latency_ms: float = 0.0
+    error: str = ''
+
+    @property
+    def key(self) -> str:
+        return f"{self.backend}:{self.encoder_name}:{self.preset or '-'}"
+
+@lru_cache(maxsize=None)
+def ffmpeg_version() -> str:
+    """FFmpeg版本（ffmpeg -version 第一行），不可用时返回空字符串"""
+    try:
+        result = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True, timeout=10)
+        return result.stdout.splitlines()[0].strip() if result.stdout else ''
+    except Exception:
+        return ''
+
+@lru_cache(maxsize=None)
+def ffmpeg_encoders() -> Tuple[str, ...]:
+    """FFmpeg支持的视频编码器名称"""
+    try:
+        result = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'],
+                                capture_output=True, text=True, timeout=10)
+    except Exception:
+        return ()
+
+    encoders = []
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        # 形如 " V....D libx264   libx264 H.264 ..."
+        if len(parts) >= 2 and len(parts[0]) == 6 and parts[0].startswith('V'):
+            encoders.append(parts[1])
+    return tuple(encoders)
+
+@lru_cache(maxsize=None)
+def cpu_signature() -> str:
+    """CPU标识（型号 + 逻辑核数）"""
+    model = platform.processor() or platform.machine()
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    model = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"{model} x{os.cpu_count()}"
+
+def list_candidates() -> List[EncoderCandidate]:
+    """列出本机可用的编码后端"""
+    candidates: List[EncoderCandidate] = []
+
+    available = ffmpeg_encoders()
+    if 'libx264' in available:
+        candidates += [EncoderCandidate('ffmpeg', 'libx264', preset) for preset in X264_PRESETS]
+    for name in SOFTWARE_ENCODERS + HARDWARE_ENCODERS:
+        if name in available:
+            candidates.append(EncoderCandidate('ffmpeg', name))
+
+    if HAS_AV:
+        import av
+        if 'libx264' in av.codecs_available:
+            candidates += [EncoderCandidate('pyav', 'libx264', preset) for preset in X264_PRESETS]
+        for name in SOFTWARE_ENCODERS + HARDWARE_ENCODERS:
+            if name in av.codecs_available:
+                candidates.append(EncoderCandidate('pyav', name))
+
+    candidates.append(EncoderCandidate('opencv', 'VideoWriter'))
+    return candidates
+
+def _synthetic_frames(width: int, height: int, count: int, pixel_format: str) -> List[np.ndarray]:
+    """生成带运动和纹理的合成画面，避免编码器对静止画面走捷径"""
+    import cv2
+
+    rng = np.random.default_rng(0)
+    texture = rng.integers(0, 256, (height, width + count * 8, 3), dtype=np.uint8)
+    texture = cv2.GaussianBlur(texture, (5, 5), 0)
+
+    frames = []
+    for i in range(count):
+        frame = np.ascontiguousarray(texture[:, i * 8:i * 8 + width])
+        if pixel_format == 'yuv420p':
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420)
+        frames.append(frame)
+    return frames
+
+def _benchmark_ffmpeg(config: EncodeConfig, frames: List[np.ndarray]) -> Tuple[float, float]:
+    """FFmpeg子进程吞吐测试
+
+    尽快写入所有帧，以第一段输出到EOF之间的时间计算吞吐（不含进程启动）。
+    zerolatency/无B帧时每帧延迟约等于单帧编码时间。
+    """
+    process = subprocess.Popen(build_ffmpeg_command(config), stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output_times: List[float] = []
+
+    def read_output():
+        fd = process.stdout.fileno()
+        while True:
+            chunk = os.read(fd, 1024 * 1024)
+            if not chunk:
+                break
+            output_times.append(time.perf_counter())
+
+    reader = threading.Thread(target=read_output, daemon=True)
+    reader.start()
+
+    try:
+        for frame in frames:
+            process.stdin.write(memoryview(frame).cast('B'))
+        process.stdin.close()
+        process.wait(timeout=60)
+    except Exception:
+        process.kill()
+        raise
+    reader.join(timeout=5)
+
+    if process.returncode != 0 or len(output_times) < 2:
+        error = process.stderr.read().decode('utf-8', errors='ignore').strip()
+        raise RuntimeError(error.splitlines()[-1] if error else f"ffmpeg exited with {process.returncode}")
+
+    elapsed = output_times[-1] - output_times[0]
+    fps = (len(frames) - 1) / elapsed if elapsed > 0 else 0.0
+    return fps, 1000.0 / fps if fps else float('inf')
+
+def _benchmark_pyav(config: EncodeConfig, frames: List[np.ndarray]) -> Tuple[float, float]:
+    """PyAV同步编码测试：逐帧计时，输出滞后的帧数计入延迟"""
+    encoder = PyAVEncoder(config)
+    if not encoder.start():
+        raise RuntimeError("failed to open codec")
+
+    try:
+        durations = []
+        delay_frames = None
+        for i, frame in enumerate(frames):
+            start = time.perf_counter()
+            packets = encoder.encode(frame, pts=i / config.fps)
+            durations.append(time.perf_counter() - start)
+            if packets and delay_frames is None:
+                delay_frames = i
+    finally:
+        encoder.stop()
+
+    if delay_frames is None:
+        raise RuntimeError("no packets produced")
+
+    fps = len(durations) / sum(durations)
+    latency_ms = float(np.median(durations)) * 1000 + delay_frames * 1000.0 / config.fps
+    return fps, latency_ms
+
+def _benchmark_opencv(config: EncodeConfig, frames: List[np.ndarray]) -> Tuple[float, float]:
+    """OpenCV VideoWriter编码测试"""
+    encoder = VideoEncoder(config)
+    if not encoder.initialize() or not encoder.encoder.isOpened():
+        raise RuntimeError("VideoWriter could not be opened")
+
+    try:
+        start = time.perf_counter()
+        for frame in frames:
+            encoder.encode_frame(frame)
+        elapsed = time.perf_counter() - start
+    finally:
+        encoder.release()
+
+    fps = len(frames) / elapsed if elapsed > 0 else 0.0
+    return fps, 1000.0 / fps if fps else float('inf')
+
+def benchmark_candidate(candidate: EncoderCandidate, width: int = 1280, height: int = 720,
+                        frame_count: int = 30) -> BenchmarkResult:
+    """对单个后端做短时合成编码测试"""
+    result = BenchmarkResult(candidate.backend, candidate.encoder_name, candidate.preset)
+    config = EncodeConfig(
+        width=width,
+        height=height,
+        fps=30,
+        preset=candidate.preset or 'fast',
+        encoder_name=candidate.encoder_name,
+        pixel_format='bgr24' if candidate.backend == 'opencv' else 'yuv420p'
+    )
+
+    try:
+        frames = _synthetic_frames(width, height, frame_count, config.pixel_format)
+        if candidate.backend == 'ffmpeg':
+            result.fps, result.latency_ms = _benchmark_ffmpeg(config, frames)
+        elif candidate.backend == 'pyav':
+            result.fps, result.latency_ms = _benchmark_pyav(config, frames)
+        else:
+            result.fps, result.latency_ms = _benchmark_opencv(config, frames)
+        result.ok = result.fps > 0
+    except Exception as e:
+        result.error = str(e)[:200]
+
+    logger.info(f"Encoder benchmark {candidate.key}: "
+                + (f"{result.fps:.0f}fps {result.latency_ms:.1f}ms" if result.ok else f"failed ({result.error})"))
+    return result
+
+class EncoderRegistry:
+    """编码器注册表
+
+    首次使用时对所有可用后端做基准测试，结果以 FFmpeg版本 + PyAV版本 + CPU
+    为键缓存到磁盘；环境不变时之后的进程直接读取缓存，不再重复探测。
+    """
+
+    # 基准测试分辨率，选择时按像素数换算到目标分辨率
+    BENCHMARK_SIZE = (1280, 720)
+
+    def __init__(self, cache_path: Optional[str] = None, frame_count: int = 30):
+        self.cache_path = cache_path or DEFAULT_CACHE_PATH
+        self.frame_count = frame_count
+        self._results: Optional[List[BenchmarkResult]] = None
+        self._lock = threading.Lock()
+
+    def cache_key(self) -> str:
+        """缓存键：FFmpeg版本、PyAV版本和CPU"""
+        av_version = ''
+        if HAS_AV:
+            import av
+            av_version = av.__version__
+        return f"{ffmpeg_version()}|pyav {av_version}|{cpu_signature()}"
+
+    def _load_cache(self) -> Dict[str, Any]:
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_cache(self, results: List[BenchmarkResult]):
+        cache = self._load_cache()
+        cache[self.cache_key()] = {
+            'created': time.time(),
+            'benchmark_size': list(self.BENCHMARK_SIZE),
+            'results': [asdict(r) for r in results]
+        }
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f, indent=2)
+        except OSError as e:
+            logger.warning(f"Failed to save encoder benchmark cache: {e}")
+
+    def cached_results(self) -> Optional[List[BenchmarkResult]]:
+        """读取缓存的测试结果，不触发基准测试"""
+        if self._results is not None:
+            return self._results
+
+        entry = self._load_cache().get(self.cache_key())
+        if not entry:
+            return None
+
+        try:
+            self._results = [BenchmarkResult(**r) for r in entry['results']]
+        except (KeyError, TypeError):
+            return None
+        return self._results
+
+    def get_results(self, refresh: bool = False) -> List[BenchmarkResult]:
+        """获取测试结果，没有缓存（或refresh）时运行基准测试"""
+        with self._lock:
+            if not refresh:
+                cached = self.cached_results()
+                if cached is not None:
+                    return cached
+
+            width, height = self.BENCHMARK_SIZE
+            logger.info("Benchmarking available encoders...")
+            results = [benchmark_candidate(c, width, height, self.frame_count) for c in list_candidates()]
+
+            self._results = results
+            self._save_cache(results)
+            return results
+
+    def select(self, config: EncodeConfig) -> Optional[BenchmarkResult]:
+        """选择满足帧率和延迟目标的最快后端
+
+        测试结果按像素数换算到目标分辨率；没有后端满足目标时返回最快的一个。
+        """
+        usable = [r for r in self.get_results() if r.ok and r.backend in STREAMING_BACKENDS]
+        if not usable:
+            return None
+
+        scale = (config.width * config.height) / (self.BENCHMARK_SIZE[0] * self.BENCHMARK_SIZE[1])
+        fastest = max(usable, key=lambda r: r.fps)
+
+        meeting = [r for r in usable
+                   if r.fps / scale >= config.fps and r.latency_ms * scale <= config.max_latency_ms]
+        if not meeting:
+            logger.warning(f"No encoder meets {config.fps}fps/{config.max_latency_ms}ms at "
+                           f"{config.width}x{config.height}, using fastest: {fastest.key}")
+            return fastest
+
+        return max(meeting, key=lambda r: r.fps)
+
+    def hardware_encoder(self) -> Optional[str]:
+        """可用的硬件编码器名称
+
+        有缓存时返回测试通过的第一个硬件编码器；否则按FFmpeg编码器列表判断
+        （列表每个进程只查询一次）。
+        """
+        results = self.cached_results()
+        if results is not None:
+            working = {r.encoder_name for r in results if r.ok and r.backend == 'ffmpeg'}
+            return next((name for name in HARDWARE_ENCODERS if name in working), None)
+
+        available = ffmpeg_encoders()
+        return next((name for name in HARDWARE_ENCODERS if name in available), None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取注册表状态"""
+        results = self.cached_results() or []
+        return {
+            'cache_path': self.cache_path,
+            'cache_key': self.cache_key(),
+            'results': [asdict(r) for r in results]
+        }
+
+_registry: Optional[EncoderRegistry] = None
+
+def get_registry() -> EncoderRegistry:
+    """获取进程内共享的编码器注册表"""
+    global _registry
+    if _registry is None:
+        _registry = EncoderRegistry()
+    return _registry
@@ -0,0 +1,275 @@
+"""
+文件视频源模块
+从 MP4/MKV 或裸 H.264（Annex-B）文件读取访问单元，按原始时间或尽快发布，不重新编码
+"""
+
+import logging
+import mmap
+import os
+import threading
+import time
+from typing import Optional, Dict, Any, Callable, Iterator, List, Tuple
+
+from phone_mirroring.nal_parser import AccessUnitParser, extract_parameter_sets
+
+logger = logging.getLogger(__name__)
+
+try:
+    import av
+    HAS_AV = True
+except ImportError:
+    HAS_AV = False
+
+# 按扩展名识别的裸H.264文件，其余格式交给PyAV解复用
+ANNEXB_EXTENSIONS = ('.h264', '.264', '.avc', '.annexb')
+
+_START_CODE = b'\x00\x00\x00\x01'
+
+def parse_avcc_extradata(extradata: bytes) -> Tuple[int, List[bytes]]:
+    """解析MP4/MKV中的avcC配置
+
+    Returns:
+        (NAL长度字段字节数, [SPS..., PPS...])
+    """
+    if len(extradata) < 7 or extradata[0] != 1:
+        raise ValueError("Not an avcC configuration record")
+
+    length_size = (extradata[4] & 0x03) + 1
+    parameter_sets = []
+    pos = 5
+    for count_mask in (0x1F, 0xFF):
+        count = extradata[pos] & count_mask
+        pos += 1
+        for _ in range(count):
+            size = int.from_bytes(extradata[pos:pos + 2], 'big')
+            parameter_sets.append(bytes(extradata[pos + 2:pos + 2 + size]))
+            pos += 2 + size
+    return length_size, parameter_sets
+
+def avcc_to_annexb(data: bytes, length_size: int, parameter_sets: Optional[List[bytes]] = None) -> bytes:
+    """把长度前缀的NAL序列转换为Annex-B，parameter_sets不为空时放在最前面"""
+    output = bytearray()
+    if parameter_sets:
+        for nal in parameter_sets:
+            output += _START_CODE + nal
+
+    pos = 0
+    while pos + length_size <= len(data):
+        size = int.from_bytes(data[pos:pos + length_size], 'big')
+        pos += length_size
+        output += _START_CODE
+        output += data[pos:pos + size]
+        pos += size
+    return bytes(output)
+
+def read_annexb(path: str, fps: float, chunk_size: int = 1 << 20) -> Iterator[Tuple[bytes, bool, float, float]]:
+    """按访问单元读取裸H.264文件（内存映射，分块送入解析器）
+
+    裸码流没有时间戳，按 fps 均匀分配。
+
+    Yields:
+        (访问单元, 是否关键帧, 解码时间, 显示时间)，时间单位为秒
+    """
+    parser = AccessUnitParser()
+    index = 0
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)
+        try:
+            for offset in range(0, len(mapped), chunk_size):
+                for au in parser.feed(view[offset:offset + chunk_size]):
+                    yield au.data, au.is_keyframe, index / fps, index / fps
+                    index += 1
+        finally:
+            view.release()
+
+    for au in parser.flush():
+        yield au.data, au.is_keyframe, index / fps, index / fps
+        index += 1
+
+def read_container(path: str) -> Iterator[Tuple[bytes, bool, float, float]]:
+    """用PyAV解复用MP4/MKV等容器中的H.264视频流（不解码）
+
+    avcC封装的包转换为Annex-B，关键帧前补上SPS/PPS。
+
+    Yields:
+        (访问单元, 是否关键帧, 解码时间, 显示时间)，时间单位为秒
+    """
+    if not HAS_AV:
+        raise RuntimeError("PyAV is required to read container files. Install with: pip install av")
+
+    with av.open(path) as container:
+        stream = container.streams.video[0]
+        if stream.codec_context.name != 'h264':
+            raise ValueError(f"Unsupported codec {stream.codec_context.name}, only H.264 can be passed through")
+
+        extradata = stream.codec_context.extradata
+        if extradata and extradata[0] == 1:
+            length_size, parameter_sets = parse_avcc_extradata(extradata)
+        else:
+            # 没有avcC（如MPEG-TS），包本身已是Annex-B
+            length_size, parameter_sets = 0, []
+
+        time_base = stream.time_base
+        for packet in container.demux(stream):
+            if packet.size == 0:
+                continue
+
+            data = bytes(packet)
+            if length_size:
+                data = avcc_to_annexb(data, length_size, parameter_sets if packet.is_keyframe else None)
+            elif packet.is_keyframe and parameter_sets and extract_parameter_sets(data)[0] is None:
+                data = avcc_to_annexb(b'', 0, parameter_sets) + data
+
+            dts = packet.dts if packet.dts is not None else packet.pts
+            pts = packet.pts if packet.pts is not None else dts
+            yield data, packet.is_keyframe, float(dts * time_base), float(pts * time_base)
+
+def probe_resolution(path: str) -> Optional[Tuple[int, int]]:
+    """读取容器文件的视频分辨率，裸码流返回None"""
+    if not HAS_AV or path.lower().endswith(ANNEXB_EXTENSIONS):
+        return None
+    with av.open(path) as container:
+        context = container.streams.video[0].codec_context
+        return context.width, context.height
+
+class FileSource:
+    """文件视频源
+
+    在独立线程中读取文件，每个访问单元通过 on_access_unit(data, metadata) 发布，
+    元数据格式与编码器输出一致（pts 为 time.monotonic() 时基的显示时间），另带解码时间 dts。
+
+    realtime=True 时按文件中的解码时间发布；False 为基准测试模式，尽快发布，
+    pts 仍按文件时间计算，RTP时间戳保持正确。loop=True 时到达文件末尾后从头循环。
+    """
+
+    def __init__(self, path: str, realtime: bool = True, loop: bool = False, fps: float = 30.0,
+                 on_access_unit: Optional[Callable[[bytes, Dict], None]] = None):
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self.fps = fps
+        self.on_access_unit = on_access_unit
+
+        self.is_running = False
+        self.finished = threading.Event()
+        self.resolution: Optional[Tuple[int, int]] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+        self.stats = {
+            'access_units': 0,
+            'keyframes': 0,
+            'bytes': 0,
+            'loops': 0,
+            'late': 0,          # 实时模式下晚于预定时间发布的访问单元
+            'start_time': 0.0,
+            'end_time': 0.0
+        }
+
+    def _open(self) -> Iterator[Tuple[bytes, bool, float, float]]:
+        if self.path.lower().endswith(ANNEXB_EXTENSIONS):
+            return read_annexb(self.path, self.fps)
+        return read_container(self.path)
+
+    def start(self, on_access_unit: Optional[Callable[[bytes, Dict], None]] = None) -> bool:
+        """开始读取并发布访问单元"""
+        if on_access_unit:
+            self.on_access_unit = on_access_unit
+
+        if not os.path.isfile(self.path):
+            logger.error(f"Video file not found: {self.path}")
+            return False
+
+        try:
+            self.resolution = probe_resolution(self.path)
+        except Exception as e:
+            logger.error(f"Failed to open video file {self.path}: {e}")
+            return False
+
+        self.is_running = True
+        self.finished.clear()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="file-source", daemon=True)
+        self._thread.start()
+
+        mode = "realtime" if self.realtime else "as fast as possible"
+        logger.info(f"File source started: {self.path} ({mode}{', looping' if self.loop else ''})")
+        return True
+
+    def _run(self):
+        """读取线程"""
+        start = time.monotonic()
+        self.stats['start_time'] = start
+        offset = 0.0        # 循环播放时累加的时间偏移
+        frame_number = 0
+
+        try:
+            while self.is_running:
+                first_dts = None
+                last_dts = 0.0
+                for data, is_keyframe, dts, pts in self._open():
+                    if not self.is_running:
+                        break
+                    if first_dts is None:
+                        first_dts = dts
+                    last_dts = dts - first_dts
+
+                    if self.realtime:
+                        delay = start + offset + last_dts - time.monotonic()
+                        if delay > 0:
+                            if self._stop_event.wait(delay):
+                                break
+                        elif delay < -0.05:
+                            self.stats['late'] += 1
+
+                    frame_number += 1
+                    self.stats['access_units'] += 1
+                    self.stats['bytes'] += len(data)
+                    if is_keyframe:
+                        self.stats['keyframes'] += 1
+
+                    if self.on_access_unit:
+                        self.on_access_unit(data, {
+                            'pts': start + offset + pts - first_dts,
+                            'dts': start + offset + last_dts,
+                            'is_keyframe': is_keyframe,
+                            'size': len(data),
+                            'frame_number': frame_number,
+                            'timestamp': time.time(),
+                            'media_time': pts
+                        })
+
+                if not self.loop or first_dts is None or not self.is_running:
+                    break
+                offset += last_dts + 1.0 / self.fps
+                self.stats['loops'] += 1
+
+        except Exception as e:
+            logger.error(f"File source error: {e}")
+        finally:
+            self.stats['end_time'] = time.monotonic()
+            self.is_running = False
+            self.finished.set()
+            logger.info(f"File source finished: {self.stats['access_units']} access units")
+
+    def request_keyframe(self) -> bool:
+        """文件源无法按需产生IDR（只能等待文件中的下一个关键帧）"""
+        return False
+
+    def stop(self):
+        """停止读取"""
+        self.is_running = False
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取读取统计"""
+        end = self.stats['end_time'] if not self.is_running else time.monotonic()
+        elapsed = end - self.stats['start_time'] if self.stats['start_time'] else 0.0
+        return dict(self.stats,
+                    path=self.path,
+                    realtime=self.realtime,
+                    elapsed=elapsed,
+                    access_units_per_second=self.stats['access_units'] / elapsed if elapsed > 0 else 0.0)
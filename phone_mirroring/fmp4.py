@@ -0,0 +1,159 @@
+"""
+Fragmented MP4 封装模块
+把 H.264 访问单元（Annex-B）直接封装为 fMP4：一个初始化段（ftyp+moov），
+随后每帧一个 moof+mdat 片段，供浏览器 Media Source Extensions 低延迟播放，不重新编码
+"""
+
+import logging
+import struct
+from typing import Optional, Dict, Tuple
+
+from phone_mirroring.nal_parser import (find_nal_units, extract_parameter_sets, parse_sps_resolution,
+                                        NAL_TYPE_SPS, NAL_TYPE_PPS, NAL_TYPE_AUD)
+
+logger = logging.getLogger(__name__)
+
+TIMESCALE = 90000
+TRACK_ID = 1
+
+# trun 样本标志：关键帧 / 依赖其他帧的非同步样本
+_SYNC_SAMPLE_FLAGS = 0x02000000
+_NON_SYNC_SAMPLE_FLAGS = 0x01010000
+
+_MATRIX = struct.pack('>9I', 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+
+def _box(box_type: bytes, *payloads: bytes) -> bytes:
+    payload = b''.join(payloads)
+    return struct.pack('>I', 8 + len(payload)) + box_type + payload
+
+def _full_box(box_type: bytes, version: int, flags: int, *payloads: bytes) -> bytes:
+    return _box(box_type, struct.pack('>I', (version << 24) | flags), *payloads)
+
+def codec_string(sps: bytes) -> str:
+    """MSE使用的codecs参数，如 avc1.42C01E"""
+    return 'avc1.' + sps[1:4].hex().upper()
+
+def annexb_to_avcc(data: bytes) -> bytes:
+    """Annex-B访问单元转为4字节长度前缀格式（去掉AUD和带外传输的SPS/PPS）"""
+    output = []
+    for begin, end in find_nal_units(data):
+        if end <= begin or (data[begin] & 0x1F) in (NAL_TYPE_SPS, NAL_TYPE_PPS, NAL_TYPE_AUD):
+            continue
+        output.append(struct.pack('>I', end - begin))
+        output.append(data[begin:end])
+    return b''.join(output)
+
+def build_init_segment(sps: bytes, pps: bytes, width: int, height: int) -> bytes:
+    """生成初始化段（ftyp + moov，单个视频轨，mvex声明后续为片段）"""
+    ftyp = _box(b'ftyp', b'iso5', struct.pack('>I', 512), b'iso5', b'iso6', b'avc1', b'mp41')
+
+    mvhd = _full_box(b'mvhd', 0, 0,
+                     struct.pack('>IIII', 0, 0, 1000, 0),
+                     struct.pack('>IH', 0x00010000, 0x0100), bytes(10), _MATRIX, bytes(24),
+                     struct.pack('>I', TRACK_ID + 1))
+    tkhd = _full_box(b'tkhd', 0, 3,
+                     struct.pack('>IIIII', 0, 0, TRACK_ID, 0, 0), bytes(8),
+                     struct.pack('>HHHH', 0, 0, 0, 0), _MATRIX,
+                     struct.pack('>II', width << 16, height << 16))
+
+    avcc = _box(b'avcC', bytes([1, sps[1], sps[2], sps[3], 0xFF, 0xE1]),
+                struct.pack('>H', len(sps)), sps, b'\x01', struct.pack('>H', len(pps)), pps)
+    avc1 = _box(b'avc1', bytes(6), struct.pack('>H', 1), bytes(16),
+                struct.pack('>HHIIIH', width, height, 0x00480000, 0x00480000, 0, 1),
+                bytes(32), struct.pack('>Hh', 0x0018, -1), avcc)
+    stbl = _box(b'stbl',
+                _full_box(b'stsd', 0, 0, struct.pack('>I', 1), avc1),
+                _full_box(b'stts', 0, 0, struct.pack('>I', 0)),
+                _full_box(b'stsc', 0, 0, struct.pack('>I', 0)),
+                _full_box(b'stsz', 0, 0, struct.pack('>II', 0, 0)),
+                _full_box(b'stco', 0, 0, struct.pack('>I', 0)))
+    minf = _box(b'minf',
+                _full_box(b'vmhd', 0, 1, bytes(8)),
+                _box(b'dinf', _full_box(b'dref', 0, 0, struct.pack('>I', 1), _full_box(b'url ', 0, 1))),
+                stbl)
+    mdia = _box(b'mdia',
+                _full_box(b'mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, TIMESCALE, 0, 0x55C4, 0)),
+                _full_box(b'hdlr', 0, 0, struct.pack('>I', 0), b'vide', bytes(12), b'VideoHandler\x00'),
+                minf)
+    mvex = _box(b'mvex', _full_box(b'trex', 0, 0, struct.pack('>IIIII', TRACK_ID, 1, 0, 0, 0)))
+
+    return ftyp + _box(b'moov', mvhd, _box(b'trak', tkhd, mdia), mvex)
+
+def build_fragment(sequence: int, decode_time: int, duration: int, composition_offset: int,
+                   sample: bytes, is_keyframe: bool) -> bytes:
+    """生成单帧片段（moof + mdat）"""
+    # trun: data-offset | duration | size | flags | composition-time-offset，版本1允许负偏移
+    trun_flags = 0x000001 | 0x000100 | 0x000200 | 0x000400 | 0x000800
+    sample_flags = _SYNC_SAMPLE_FLAGS if is_keyframe else _NON_SYNC_SAMPLE_FLAGS
+
+    def moof(data_offset: int) -> bytes:
+        traf = _box(b'traf',
+                    _full_box(b'tfhd', 0, 0x020000, struct.pack('>I', TRACK_ID)),   # default-base-is-moof
+                    _full_box(b'tfdt', 1, 0, struct.pack('>Q', decode_time)),
+                    _full_box(b'trun', 1, trun_flags,
+                              struct.pack('>IiIIIi', 1, data_offset, duration, len(sample),
+                                          sample_flags, composition_offset)))
+        return _box(b'moof', _full_box(b'mfhd', 0, 0, struct.pack('>I', sequence)), traf)
+
+    size = len(moof(0))
+    return moof(size + 8) + struct.pack('>I', 8 + len(sample)) + b'mdat' + sample
+
+class FMP4Packager:
+    """把访问单元序列封装为 fMP4 初始化段和逐帧片段
+
+    只需对每个访问单元调用一次 package()，得到的字节可原样发给任意数量的观众。
+    SPS变化（分辨率切换）时生成新的初始化段。
+    """
+
+    def __init__(self, default_fps: float = 30.0):
+        self.default_duration = round(TIMESCALE / default_fps)
+        self.init_segment: Optional[bytes] = None
+        self.codec: Optional[str] = None
+        self.resolution: Optional[Tuple[int, int]] = None
+
+        self._parameter_sets: Tuple[Optional[bytes], Optional[bytes]] = (None, None)
+        self._sequence = 0
+        self._origin: Optional[float] = None
+        self._last_dts = -1
+        self._last_duration = self.default_duration
+
+    def package(self, data: bytes, metadata: Dict) -> Tuple[Optional[bytes], Optional[bytes]]:
+        """封装一个访问单元
+
+        Returns:
+            (新的初始化段或None, 片段)；还没有收到带参数集的关键帧时片段为None
+        """
+        is_keyframe = metadata.get('is_keyframe', False)
+        new_init = None
+        if is_keyframe:
+            sps, pps = extract_parameter_sets(data)
+            if sps and pps and (sps, pps) != self._parameter_sets:
+                resolution = parse_sps_resolution(sps)
+                if resolution:
+                    self._parameter_sets = (sps, pps)
+                    self.resolution = resolution
+                    self.codec = codec_string(sps)
+                    self.init_segment = new_init = build_init_segment(sps, pps, *resolution)
+                    logger.info(f"fMP4 init segment: {self.codec} {resolution[0]}x{resolution[1]}")
+        if self.init_segment is None:
+            return None, None
+
+        pts = metadata.get('pts')
+        if pts is None:
+            pts = 0.0
+        dts = metadata.get('dts', pts)
+        if self._origin is None:
+            self._origin = dts
+
+        decode_time = round((dts - self._origin) * TIMESCALE)
+        if decode_time <= self._last_dts:
+            decode_time = self._last_dts + 1
+        if self._last_dts >= 0:
+            # 单帧片段发出时还不知道下一帧的时间，按上一帧间隔估计时长（tfdt保证时间轴准确）
+            self._last_duration = min(decode_time - self._last_dts, TIMESCALE)
+        self._last_dts = decode_time
+
+        self._sequence += 1
+        fragment = build_fragment(self._sequence, decode_time, self._last_duration,
+                                  round((pts - dts) * TIMESCALE), annexb_to_avcc(data), is_keyframe)
+        return new_init, fragment
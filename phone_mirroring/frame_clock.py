@@ -0,0 +1,160 @@
+"""
+帧时钟模块
+基于 time.monotonic_ns 的绝对截止时间调度，供采集、发送等按帧率运行的循环共用
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Optional, Dict, Any
+
+from phone_mirroring.performance import StageHistogram
+
+logger = logging.getLogger(__name__)
+
+try:
+    import win32api
+    HAS_WIN32 = True
+except ImportError:
+    HAS_WIN32 = False
+
+def display_refresh_rate() -> Optional[float]:
+    """主显示器刷新率（Hz），无法获取时返回None"""
+    if not HAS_WIN32:
+        return None
+    try:
+        settings = win32api.EnumDisplaySettings(None, -1)  # ENUM_CURRENT_SETTINGS
+        return float(settings.DisplayFrequency) or None
+    except Exception as e:
+        logger.debug(f"Failed to query display refresh rate: {e}")
+        return None
+
+class FrameClock:
+    """绝对截止时间帧时钟
+
+    第n帧的截止时间为 起点 + n*间隔，不会像 sleep(interval - elapsed) 那样累积漂移。
+    某一帧处理超时错过了后续截止时间时，跳过错过的帧位（计入 skipped），
+    从下一个未来的帧位继续，而不是连续补发。
+
+    refresh_rate 不为空时把帧间隔取整为刷新周期的整数倍（30fps@60Hz 为每2个刷新周期一帧），
+    给出 vsync_ns（某次垂直同步的 monotonic_ns 时间戳）时截止时间同时对齐到刷新相位。
+
+    抖动统计：lateness 为实际醒来时间相对截止时间的延迟直方图；
+    jitter_ms 为相邻两帧实际间隔与标称间隔之差的指数平均（RFC 3550 的到达间隔抖动算法）。
+    """
+
+    def __init__(self, fps: float, refresh_rate: Optional[float] = None, vsync_ns: Optional[int] = None):
+        self.refresh_rate = refresh_rate
+        self.vsync_ns = vsync_ns
+        self.interval_ns = self._interval_ns(fps)
+        self.fps = fps
+
+        self._next_ns: Optional[int] = None
+        self._last_tick_ns: Optional[int] = None
+        self._lock = threading.Lock()
+
+        self.lateness = StageHistogram()
+        self.jitter_ms = 0.0
+        self.stats = {
+            'ticks': 0,
+            'overruns': 0,   # 错过截止时间超过一个帧位的次数
+            'skipped': 0     # 因此跳过的帧位数
+        }
+
+    def _interval_ns(self, fps: float) -> int:
+        interval = 1e9 / fps
+        if self.refresh_rate:
+            period = 1e9 / self.refresh_rate
+            interval = max(1, round(interval / period)) * period
+        return int(interval)
+
+    def _align(self, deadline_ns: int) -> int:
+        """把截止时间对齐到不早于它的下一个刷新时刻"""
+        if not self.refresh_rate or self.vsync_ns is None:
+            return deadline_ns
+        period = 1e9 / self.refresh_rate
+        phase = (deadline_ns - self.vsync_ns) % period
+        return int(deadline_ns + (period - phase) % period)
+
+    def set_fps(self, fps: float):
+        """修改帧率，新间隔从下一个截止时间开始生效"""
+        if fps == self.fps:
+            return
+        with self._lock:
+            self.fps = fps
+            self.interval_ns = self._interval_ns(fps)
+
+    def reset(self):
+        """从当前时刻重新开始计时（长时间暂停后调用，不计为超时）"""
+        with self._lock:
+            self._next_ns = None
+            self._last_tick_ns = None
+
+    def delay(self) -> float:
+        """距离下一个截止时间的秒数（已过期时为0）"""
+        with self._lock:
+            if self._next_ns is None:
+                self._next_ns = self._align(time.monotonic_ns())
+            return max(0, self._next_ns - time.monotonic_ns()) / 1e9
+
+    def tick(self) -> int:
+        """到达截止时间后调用：记录抖动并推进到下一个截止时间
+
+        Returns:
+            本次跳过的帧位数
+        """
+        now = time.monotonic_ns()
+        with self._lock:
+            deadline = self._next_ns if self._next_ns is not None else now
+            late = now - deadline
+            if late >= 0:
+                self.lateness.record(late / 1e9)
+
+            if self._last_tick_ns is not None:
+                deviation = abs((now - self._last_tick_ns) - self.interval_ns) / 1e6
+                self.jitter_ms += (deviation - self.jitter_ms) / 16
+            self._last_tick_ns = now
+
+            # 错过的帧位直接跳过，下一个截止时间总在未来
+            skipped = max(0, late) // self.interval_ns
+            if skipped:
+                self.stats['overruns'] += 1
+                self.stats['skipped'] += skipped
+            self._next_ns = self._align(deadline + (skipped + 1) * self.interval_ns)
+            self.stats['ticks'] += 1
+            return skipped
+
+    def wait(self, stop_event: Optional[threading.Event] = None) -> int:
+        """阻塞到下一个截止时间（stop_event 被设置时提前返回）
+
+        Returns:
+            本次跳过的帧位数
+        """
+        delay = self.delay()
+        if delay > 0:
+            if stop_event is not None:
+                stop_event.wait(delay)
+            else:
+                time.sleep(delay)
+        return self.tick()
+
+    async def wait_async(self) -> int:
+        """异步等待到下一个截止时间"""
+        delay = self.delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self.tick()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取时钟统计"""
+        with self._lock:
+            lateness = self.lateness.get_stats()
+            return dict(self.stats,
+                        fps=self.fps,
+                        interval_ms=self.interval_ns / 1e6,
+                        refresh_rate=self.refresh_rate,
+                        jitter_ms=self.jitter_ms,
+                        lateness_mean_ms=lateness['mean_ms'],
+                        lateness_p95_ms=lateness['p95_ms'],
+                        lateness_max_ms=lateness['max_ms'])
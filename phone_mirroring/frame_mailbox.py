@@ -0,0 +1,105 @@
+"""
+帧邮箱模块
+单槽位、最新帧优先的线程间帧传递
+"""
+
+import threading
+import time
+from typing import Any, Optional, Dict, Callable
+
+class FrameMailbox:
+    """单槽位帧邮箱
+
+    生产者放入新帧时若上一帧尚未被取走，则直接覆盖（丢弃旧帧），
+    保证消费者总是拿到最新的一帧，生产者永远不会被阻塞。
+    被覆盖或关闭时仍未取走的帧交给 on_discard（用于归还池化缓冲区）。
+    """
+
+    def __init__(self, on_discard: Optional[Callable[[Any], None]] = None):
+        self._item: Any = None
+        self._has_item = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self.on_discard = on_discard
+
+        # 最近取出的帧在邮箱中等待的时间（秒）
+        self._put_time = 0.0
+        self.last_wait = 0.0
+
+        self.stats = {
+            'put': 0,
+            'taken': 0,
+            'dropped': 0
+        }
+
+    def put(self, item: Any) -> bool:
+        """放入一帧
+
+        Returns:
+            False 表示覆盖了尚未取走的旧帧
+        """
+        with self._cond:
+            if self._closed:
+                discarded, replaced = item, True
+            else:
+                replaced = self._has_item
+                discarded = self._item
+                self._item = item
+                self._has_item = True
+                self._put_time = time.monotonic()
+                self.stats['put'] += 1
+                if replaced:
+                    self.stats['dropped'] += 1
+                self._cond.notify()
+
+        if replaced and self.on_discard:
+            self.on_discard(discarded)
+        return not replaced
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """取出最新帧，超时或邮箱关闭时返回None"""
+        with self._cond:
+            if not self._has_item and not self._closed:
+                self._cond.wait(timeout)
+
+            if not self._has_item:
+                return None
+
+            item = self._item
+            self._item = None
+            self._has_item = False
+            self.last_wait = time.monotonic() - self._put_time
+            self.stats['taken'] += 1
+            return item
+
+    def take_nowait(self) -> Any:
+        """非阻塞取出当前帧，没有则返回None"""
+        return self.get(timeout=0)
+
+    def close(self):
+        """关闭邮箱并唤醒等待中的消费者"""
+        with self._cond:
+            self._closed = True
+            discarded = self._item if self._has_item else None
+            self._item = None
+            self._has_item = False
+            self._cond.notify_all()
+
+        if discarded is not None and self.on_discard:
+            self.on_discard(discarded)
+
+    def reopen(self):
+        """重新打开邮箱"""
+        with self._cond:
+            self._closed = False
+            self._item = None
+            self._has_item = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取邮箱统计"""
+        with self._cond:
+            return dict(self.stats, pending=self._has_item)
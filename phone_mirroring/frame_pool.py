@@ -0,0 +1,112 @@
+"""
+帧缓冲池模块
+预分配固定数量的帧数组，按引用计数在采集和编码线程之间复用
+"""
+
+import logging
+import threading
+from typing import Optional, Dict, Any, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 缓冲区id -> 所属缓冲池，供 retain_frame/release_frame 查找
+_owners: Dict[int, 'FramePool'] = {}
+_owners_lock = threading.Lock()
+
+class FramePool:
+    """固定形状的帧缓冲池
+
+    acquire() 取出的数组引用计数为1；每个额外的使用者（邮箱、编码线程）
+    调用 retain_frame() 加1，用完调用 release_frame() 减1，归零后回到池中。
+    池中没有空闲缓冲区时临时分配新数组（不阻塞采集），计入 exhausted。
+    """
+
+    def __init__(self, shape: Tuple[int, ...], dtype=np.uint8, count: int = 4):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self._buffers: List[np.ndarray] = [np.empty(self.shape, dtype=self.dtype) for _ in range(max(1, count))]
+        self._free: List[np.ndarray] = list(self._buffers)
+        self._refs: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self.stats = {
+            'acquired': 0,
+            'released': 0,
+            'exhausted': 0
+        }
+
+        with _owners_lock:
+            for buffer in self._buffers:
+                _owners[id(buffer)] = self
+
+    def acquire(self) -> np.ndarray:
+        """取出一个空闲缓冲区（引用计数为1），内容未初始化"""
+        with self._lock:
+            self.stats['acquired'] += 1
+            if self._free and not self._closed:
+                buffer = self._free.pop()
+                self._refs[id(buffer)] = 1
+                return buffer
+            self.stats['exhausted'] += 1
+
+        return np.empty(self.shape, dtype=self.dtype)
+
+    def retain(self, buffer: np.ndarray):
+        with self._lock:
+            key = id(buffer)
+            if key in self._refs:
+                self._refs[key] += 1
+
+    def release(self, buffer: np.ndarray):
+        with self._lock:
+            key = id(buffer)
+            count = self._refs.get(key)
+            if count is None:
+                return
+            if count > 1:
+                self._refs[key] = count - 1
+                return
+
+            del self._refs[key]
+            self.stats['released'] += 1
+            if not self._closed:
+                self._free.append(buffer)
+
+    def close(self):
+        """停用缓冲池（形状变化时），仍在使用中的缓冲区释放后不再回收"""
+        with self._lock:
+            self._closed = True
+            self._free.clear()
+        with _owners_lock:
+            for buffer in self._buffers:
+                if _owners.get(id(buffer)) is self:
+                    del _owners[id(buffer)]
+
+    @property
+    def in_use(self) -> int:
+        return len(self._refs)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓冲池统计"""
+        with self._lock:
+            return dict(self.stats, size=len(self._buffers), in_use=len(self._refs), free=len(self._free))
+
+def _owner(frame: Any) -> Optional[FramePool]:
+    if not isinstance(frame, np.ndarray):
+        return None
+    return _owners.get(id(frame))
+
+def retain_frame(frame: Any):
+    """增加池化帧的引用计数（非池化数组为空操作）"""
+    pool = _owner(frame)
+    if pool:
+        pool.retain(frame)
+
+def release_frame(frame: Any):
+    """减少池化帧的引用计数，归零后回到缓冲池（非池化数组为空操作）"""
+    pool = _owner(frame)
+    if pool:
+        pool.release(frame)
@@ -0,0 +1,67 @@
+"""
+关键帧请求限流模块
+合并新观众、PLI/FIR、丢包等来源的关键帧请求，避免请求风暴导致码率暴涨
+"""
+
+import threading
+import time
+from typing import Any, Dict, Optional
+
+class KeyframeLimiter:
+    """关键帧请求限流器
+
+    request() 只登记请求；take() 在距上次强制关键帧超过 min_interval 时
+    返回True并清除请求，间隔内的多个请求合并为一次。
+    编码器输出任何关键帧（包括GOP自然产生的）时调用 note_keyframe()，
+    已登记的请求视为已满足。
+    """
+
+    def __init__(self, min_interval: float = 0.5):
+        self.min_interval = min_interval
+        self._pending = False
+        self._last_forced = 0.0
+        self._lock = threading.Lock()
+
+        self.stats = {
+            'requested': 0,
+            'forced': 0,
+            'coalesced': 0
+        }
+
+    def request(self):
+        """登记一次关键帧请求"""
+        with self._lock:
+            self.stats['requested'] += 1
+            if self._pending:
+                self.stats['coalesced'] += 1
+            self._pending = True
+
+    def take(self, now: Optional[float] = None) -> bool:
+        """检查是否应立即强制关键帧（返回True时请求被消费）"""
+        if not self._pending:
+            return False
+
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if not self._pending or now - self._last_forced < self.min_interval:
+                return False
+
+            self._pending = False
+            self._last_forced = now
+            self.stats['forced'] += 1
+            return True
+
+    def note_keyframe(self):
+        """编码器输出了关键帧，满足已登记的请求"""
+        if self._pending:
+            with self._lock:
+                self._pending = False
+
+    @property
+    def pending(self) -> bool:
+        return self._pending
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取限流统计"""
+        with self._lock:
+            return dict(self.stats, pending=self._pending)
@@ -0,0 +1,239 @@
+"""
+端到端延迟时间戳（SEI）模块
+在 H.264 访问单元中插入 user_data_unregistered SEI，携带帧序号和各阶段的单调时钟时间戳，
+随码流经过编码器、打包器和各协议到达客户端，客户端解码后计算分段延迟和端到端延迟。
+"""
+
+import logging
+import struct
+import time
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, List, Tuple
+
+from phone_mirroring.nal_parser import find_nal_units, NAL_TYPE_SEI
+
+logger = logging.getLogger(__name__)
+
+# 本项目私有的 user_data_unregistered UUID（其他SEI一律忽略）
+LATENCY_SEI_UUID = bytes.fromhex('7a1c4e2b9d3f4a6c8e5b0f1d2c3a4b5e')
+
+SEI_PAYLOAD_USER_DATA_UNREGISTERED = 5
+LATENCY_SEI_VERSION = 1
+
+# 服务端阶段时间戳
+STAGE_CAPTURE = 1   # 采集完成
+STAGE_ENCODED = 2   # 编码输出
+STAGE_SENT = 3      # 离开发送缓冲，交给打包器
+
+STAGE_NAMES = {STAGE_CAPTURE: 'capture', STAGE_ENCODED: 'encoded', STAGE_SENT: 'sent'}
+
+# version(u8) seq(u32) wall_offset_ns(i64) count(u8)，随后 count 个 stage(u8) monotonic_ns(u64)
+_HEADER = struct.Struct('>BIqB')
+_STAMP = struct.Struct('>BQ')
+
+@dataclass
+class LatencyStamp:
+    """从SEI解析出的帧时间戳"""
+    seq: int
+    wall_offset_ns: int                                   # 发送端 time.time_ns() - time.monotonic_ns()
+    stamps: Dict[int, int] = field(default_factory=dict)  # 阶段 -> 发送端 monotonic_ns
+
+    def wall_ns(self, stage: int) -> Optional[int]:
+        """阶段时间戳换算为发送端墙上时间（跨主机比较时使用）"""
+        value = self.stamps.get(stage)
+        return None if value is None else value + self.wall_offset_ns
+
+def wall_offset_ns() -> int:
+    """本机墙上时钟与单调时钟的差值"""
+    return time.time_ns() - time.monotonic_ns()
+
+def _escape(rbsp: bytes) -> bytes:
+    """添加防竞争字节（00 00 0x -> 00 00 03 0x，x<=3）"""
+    out = bytearray()
+    zeros = 0
+    for byte in rbsp:
+        if zeros >= 2 and byte <= 3:
+            out.append(3)
+            zeros = 0
+        out.append(byte)
+        zeros = zeros + 1 if byte == 0 else 0
+    return bytes(out)
+
+def _unescape(ebsp) -> bytes:
+    """去除防竞争字节"""
+    out = bytearray()
+    zeros = 0
+    for byte in ebsp:
+        if zeros >= 2 and byte == 3:
+            zeros = 0
+            continue
+        out.append(byte)
+        zeros = zeros + 1 if byte == 0 else 0
+    return bytes(out)
+
+def build_latency_sei(seq: int, stamps: Dict[int, int], offset_ns: Optional[int] = None) -> bytes:
+    """构造携带时间戳的SEI NAL单元（含4字节起始码）
+
+    Args:
+        seq: 帧序号（按32位回绕）
+        stamps: 阶段 -> time.monotonic_ns()
+        offset_ns: 墙上时钟偏移，默认取本机当前值
+    """
+    if offset_ns is None:
+        offset_ns = wall_offset_ns()
+
+    items = sorted(stamps.items())
+    payload = bytearray(LATENCY_SEI_UUID)
+    payload += _HEADER.pack(LATENCY_SEI_VERSION, seq & 0xFFFFFFFF, offset_ns, len(items))
+    for stage, value in items:
+        payload += _STAMP.pack(stage, value)
+
+    rbsp = bytearray([SEI_PAYLOAD_USER_DATA_UNREGISTERED])
+    size = len(payload)
+    while size >= 255:
+        rbsp.append(255)
+        size -= 255
+    rbsp.append(size)
+    rbsp += payload
+    rbsp.append(0x80)  # rbsp_trailing_bits
+
+    return b'\x00\x00\x00\x01' + bytes([NAL_TYPE_SEI]) + _escape(rbsp)
+
+def insert_sei(access_unit: bytes, sei: bytes) -> bytes:
+    """把SEI插入访问单元第一个VCL NAL之前（AUD/SPS/PPS之后）"""
+    for begin, end in find_nal_units(access_unit):
+        if end > begin and 1 <= (access_unit[begin] & 0x1F) <= 5:
+            # 回退到起始码（3或4字节）
+            start = begin - 3
+            if start > 0 and access_unit[start - 1] == 0:
+                start -= 1
+            return access_unit[:start] + sei + access_unit[start:]
+    return access_unit + sei
+
+def _parse_sei_payloads(rbsp: bytes) -> List[Tuple[int, bytes]]:
+    """拆分SEI RBSP中的 (payload_type, payload) 列表"""
+    payloads = []
+    pos = 0
+    while pos < len(rbsp) and rbsp[pos] != 0x80:
+        payload_type = 0
+        while pos < len(rbsp) and rbsp[pos] == 255:
+            payload_type += 255
+            pos += 1
+        if pos >= len(rbsp):
+            break
+        payload_type += rbsp[pos]
+        pos += 1
+        size = 0
+        while pos < len(rbsp) and rbsp[pos] == 255:
+            size += 255
+            pos += 1
+        if pos >= len(rbsp):
+            break
+        size += rbsp[pos]
+        pos += 1
+        payloads.append((payload_type, rbsp[pos:pos + size]))
+        pos += size
+    return payloads
+
+def parse_latency_sei(access_unit) -> Optional[LatencyStamp]:
+    """从访问单元中解析本模块写入的时间戳SEI，不存在时返回None"""
+    for begin, end in find_nal_units(access_unit):
+        if end <= begin or (access_unit[begin] & 0x1F) != NAL_TYPE_SEI:
+            continue
+        rbsp = _unescape(access_unit[begin + 1:end])
+        for payload_type, payload in _parse_sei_payloads(rbsp):
+            if (payload_type != SEI_PAYLOAD_USER_DATA_UNREGISTERED or
+                    payload[:16] != LATENCY_SEI_UUID or len(payload) < 16 + _HEADER.size):
+                continue
+            version, seq, offset, count = _HEADER.unpack_from(payload, 16)
+            if version != LATENCY_SEI_VERSION:
+                continue
+            stamps = {}
+            pos = 16 + _HEADER.size
+            for _ in range(count):
+                if pos + _STAMP.size > len(payload):
+                    break
+                stage, value = _STAMP.unpack_from(payload, pos)
+                stamps[stage] = value
+                pos += _STAMP.size
+            return LatencyStamp(seq, offset, stamps)
+    return None
+
+class LatencyTracker:
+    """客户端延迟统计
+
+    所有时间先换算到墙上时间再相减：同一主机上两端的偏移相同，等价于直接比较单调时钟；
+    跨主机时依赖两端墙上时钟同步（NTP）。分段延迟写入 PerformanceMonitor 的
+    record_stage_latency()，端到端延迟（毫秒）写入 record_latency()。
+    """
+
+    def __init__(self, monitor=None):
+        from phone_mirroring.performance import StageTimings
+
+        self.monitor = monitor
+        self.timings = StageTimings()
+        self.frames = 0
+        self.lost = 0
+        self.last_seq: Optional[int] = None
+        self.last_latency_ms = 0.0
+        self._offset = wall_offset_ns()
+
+    def now_ns(self) -> int:
+        """本机当前时间（单调时钟换算的墙上时间，纳秒）"""
+        return time.monotonic_ns() + self._offset
+
+    def record(self, stamp: LatencyStamp, received_ns: int, decoded_ns: Optional[int] = None) -> Dict[str, float]:
+        """记录一帧的各段延迟
+
+        Args:
+            stamp: parse_latency_sei() 的结果
+            received_ns: 客户端收到访问单元的时间（now_ns()）
+            decoded_ns: 解码完成时间（now_ns()），None表示未解码
+
+        Returns:
+            阶段名 -> 延迟（秒）
+        """
+        capture = stamp.wall_ns(STAGE_CAPTURE)
+        encoded = stamp.wall_ns(STAGE_ENCODED)
+        sent = stamp.wall_ns(STAGE_SENT)
+
+        segments = {}
+        if capture is not None and encoded is not None:
+            segments['encode'] = encoded - capture
+        if encoded is not None and sent is not None:
+            segments['queue'] = sent - encoded
+        if sent is not None:
+            segments['transport'] = received_ns - sent
+        if decoded_ns is not None:
+            segments['decode'] = decoded_ns - received_ns
+        origin = capture if capture is not None else sent
+        if origin is not None:
+            segments['end_to_end'] = (decoded_ns if decoded_ns is not None else received_ns) - origin
+
+        # 序号跳变即丢帧（静止画面跳过的采集帧不分配序号）
+        if self.last_seq is not None:
+            gap = (stamp.seq - self.last_seq) & 0xFFFFFFFF
+            if 1 < gap < 0x80000000:
+                self.lost += gap - 1
+        self.last_seq = stamp.seq
+        self.frames += 1
+
+        result = {name: max(0, value) / 1e9 for name, value in segments.items()}
+        for name, seconds in result.items():
+            self.timings.record(name, seconds)
+            if self.monitor is not None:
+                self.monitor.record_stage_latency(name, seconds)
+
+        if 'end_to_end' in result:
+            self.last_latency_ms = result['end_to_end'] * 1000
+            if self.monitor is not None:
+                self.monitor.record_latency(self.last_latency_ms)
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'frames': self.frames,
+            'lost': self.lost,
+            'last_latency_ms': self.last_latency_ms,
+            'stages': self.timings.get_stats()
+        }
@@ -0,0 +1,208 @@
+"""
+媒体帧模块
+带引用计数的编码帧：负载放在缓冲池的 bytearray 中，以 memoryview 在设备、管理器和各协议之间共享，
+并附带 NAL 单元偏移索引，打包时直接切片，不再拼接拷贝或重新查找起始码
+"""
+
+import logging
+import threading
+from typing import Optional, Dict, Any, List, Tuple, Iterator, Iterable
+
+from phone_mirroring.nal_parser import find_nal_units, NAL_TYPE_SPS, NAL_TYPE_PPS
+
+logger = logging.getLogger(__name__)
+
+START_CODE_4 = b'\x00\x00\x00\x01'
+
+class MediaFrame:
+    """一个编码后的访问单元
+
+    负载为 Annex-B 格式，nal_units 为各 NAL 负载（不含起始码）的 (begin, end) 偏移。
+    创建时引用计数为1，由创建者持有；在回调返回后仍要使用帧的消费者调用 retain()，
+    用完调用 release()，归零后缓冲区回到缓冲池。释放后 data 的内容随时可能被覆盖，
+    需要长期保存时使用 tobytes()。
+    """
+
+    __slots__ = ('_view', '_pool', '_refs', 'size', 'nal_units', 'codec', 'pts', 'dts', 'is_keyframe')
+
+    def __init__(self, buffer, size: int, nal_units: List[Tuple[int, int]], pts: Optional[float] = None,
+                 is_keyframe: bool = False, codec: str = 'h264', dts: Optional[float] = None,
+                 pool: Optional['MediaFramePool'] = None):
+        self._view = memoryview(buffer)[:size]
+        self._pool = pool
+        self._refs = 1
+        self.size = size
+        self.nal_units = nal_units
+        self.codec = codec
+        self.pts = pts
+        self.dts = dts
+        self.is_keyframe = is_keyframe
+
+    @classmethod
+    def from_bytes(cls, data: bytes, pts: Optional[float] = None, is_keyframe: bool = False,
+                   codec: str = 'h264') -> 'MediaFrame':
+        """包装已有的 Annex-B 数据（不拷贝，不属于缓冲池）"""
+        return cls(data, len(data), find_nal_units(data), pts, is_keyframe, codec)
+
+    @property
+    def data(self) -> memoryview:
+        """负载视图（Annex-B）"""
+        return self._view
+
+    @property
+    def refcount(self) -> int:
+        return self._refs
+
+    def nal(self, index: int) -> memoryview:
+        """第 index 个 NAL 单元（不含起始码）"""
+        begin, end = self.nal_units[index]
+        return self._view[begin:end]
+
+    def iter_nals(self) -> Iterator[memoryview]:
+        """遍历 NAL 单元（不含起始码）"""
+        view = self._view
+        for begin, end in self.nal_units:
+            if end > begin:
+                yield view[begin:end]
+
+    def parameter_sets(self) -> Tuple[Optional[bytes], Optional[bytes]]:
+        """帧内的 SPS/PPS（拷贝为bytes，没有时为None）"""
+        sps = pps = None
+        view = self._view
+        for begin, end in self.nal_units:
+            if end <= begin:
+                continue
+            nal_type = view[begin] & 0x1F
+            if nal_type == NAL_TYPE_SPS and sps is None:
+                sps = view[begin:end].tobytes()
+            elif nal_type == NAL_TYPE_PPS and pps is None:
+                pps = view[begin:end].tobytes()
+        return sps, pps
+
+    def tobytes(self) -> bytes:
+        """拷贝出负载"""
+        return self._view.tobytes()
+
+    def __bytes__(self) -> bytes:
+        return self._view.tobytes()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def retain(self) -> 'MediaFrame':
+        """增加引用计数"""
+        pool = self._pool
+        if pool is None:
+            self._refs += 1
+        else:
+            with pool._lock:
+                self._refs += 1
+        return self
+
+    def release(self):
+        """减少引用计数，归零后缓冲区回到缓冲池"""
+        pool = self._pool
+        if pool is None:
+            self._refs = max(0, self._refs - 1)
+            return
+        with pool._lock:
+            if self._refs <= 0:
+                logger.warning("MediaFrame released more times than retained")
+                return
+            self._refs -= 1
+            if self._refs:
+                return
+        pool._recycle(self._view.obj)
+
+    def to_metadata(self) -> Dict[str, Any]:
+        """转换为回调使用的元数据字典（与 AccessUnit.to_metadata 一致）"""
+        metadata = {
+            'pts': self.pts,
+            'is_keyframe': self.is_keyframe,
+            'codec': self.codec,
+            'size': self.size
+        }
+        if self.dts is not None:
+            metadata['dts'] = self.dts
+        return metadata
+
+def frame_payload(frame_data):
+    """bytes 或 MediaFrame 的负载（MediaFrame 返回 memoryview，不拷贝）"""
+    return frame_data.data if isinstance(frame_data, MediaFrame) else frame_data
+
+class MediaFramePool:
+    """访问单元缓冲池
+
+    缓冲区按2的幂容量分级复用：码流稳定后每帧只是从池中取出一块已分配的缓冲区，
+    写入一次，最后一个使用者释放后放回。每级空闲缓冲区超过 max_free 时交给垃圾回收。
+    """
+
+    def __init__(self, max_free: int = 16, min_capacity: int = 4096):
+        self.max_free = max_free
+        self.min_capacity = min_capacity
+        self._free: Dict[int, List[bytearray]] = {}
+        self._lock = threading.Lock()
+
+        self.stats = {
+            'allocated': 0,     # 新分配的缓冲区
+            'reused': 0,        # 从池中取出的缓冲区
+            'recycled': 0,      # 释放后放回池中
+            'in_use': 0
+        }
+
+    def _capacity(self, size: int) -> int:
+        return max(self.min_capacity, 1 << (size - 1).bit_length())
+
+    def acquire(self, size: int) -> bytearray:
+        """取出容量不小于 size 的缓冲区（内容未初始化）"""
+        capacity = self._capacity(size)
+        with self._lock:
+            self.stats['in_use'] += 1
+            free = self._free.get(capacity)
+            if free:
+                self.stats['reused'] += 1
+                return free.pop()
+            self.stats['allocated'] += 1
+        return bytearray(capacity)
+
+    def _recycle(self, buffer: bytearray):
+        with self._lock:
+            self.stats['in_use'] -= 1
+            free = self._free.setdefault(len(buffer), [])
+            if len(free) < self.max_free:
+                free.append(buffer)
+                self.stats['recycled'] += 1
+
+    def frame_from_nals(self, nals: Iterable, pts: Optional[float] = None, is_keyframe: bool = False,
+                        codec: str = 'h264', dts: Optional[float] = None) -> MediaFrame:
+        """把若干 NAL 单元（不含起始码，bytes/memoryview）写入一块池化缓冲区组成一帧
+
+        每个 NAL 只拷贝一次，同时记录偏移索引。
+        """
+        nals = [nal for nal in nals if len(nal)]
+        size = sum(len(nal) for nal in nals) + 4 * len(nals)
+        buffer = self.acquire(size)
+        offsets = []
+        pos = 0
+        for nal in nals:
+            buffer[pos:pos + 4] = START_CODE_4
+            pos += 4
+            buffer[pos:pos + len(nal)] = nal
+            offsets.append((pos, pos + len(nal)))
+            pos += len(nal)
+        return MediaFrame(buffer, size, offsets, pts, is_keyframe, codec, dts, pool=self)
+
+    def frame_from_bytes(self, data, pts: Optional[float] = None, is_keyframe: bool = False,
+                         codec: str = 'h264', dts: Optional[float] = None) -> MediaFrame:
+        """把 Annex-B 数据拷贝进池化缓冲区组成一帧"""
+        size = len(data)
+        buffer = self.acquire(size)
+        buffer[:size] = data
+        return MediaFrame(buffer, size, find_nal_units(buffer, 0, size), pts, is_keyframe, codec, dts, pool=self)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓冲池统计"""
+        with self._lock:
+            return dict(self.stats,
+                        free=sum(len(free) for free in self._free.values()),
+                        free_bytes=sum(capacity * len(free) for capacity, free in self._free.items()))
@@ -0,0 +1,366 @@
+"""
+H.264 NAL/访问单元解析模块
+将 Annex-B 字节流增量切分为完整的访问单元（Access Unit）
+"""
+
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional, List, Tuple, Callable, Iterator, Deque
+
+logger = logging.getLogger(__name__)
+
+# NAL单元类型
+NAL_TYPE_SLICE = 1
+NAL_TYPE_IDR = 5
+NAL_TYPE_SEI = 6
+NAL_TYPE_SPS = 7
+NAL_TYPE_PPS = 8
+NAL_TYPE_AUD = 9
+NAL_TYPE_PREFIX = 14
+
+# 出现在VCL之后即表示新访问单元开始的NAL类型
+_AU_START_TYPES = (NAL_TYPE_AUD, NAL_TYPE_SEI, NAL_TYPE_SPS, NAL_TYPE_PPS, NAL_TYPE_PREFIX,
+                   15, 16, 17, 18)
+
+START_CODE = b'\x00\x00\x01'
+
+def find_nal_units(data, start: int = 0, end: Optional[int] = None) -> List[Tuple[int, int]]:
+    """查找 Annex-B 数据（bytes/bytearray）中的 NAL 单元
+
+    Returns:
+        (payload_offset, payload_end) 列表，payload 不含起始码
+    """
+    if end is None:
+        end = len(data)
+
+    units = []
+    pos = data.find(START_CODE, start, end)
+    while pos != -1:
+        payload = pos + 3
+        next_pos = data.find(START_CODE, payload, end)
+        if next_pos == -1:
+            units.append((payload, end))
+            break
+        # 4字节起始码的前导0属于下一个起始码
+        nal_end = next_pos - 1 if next_pos > payload and data[next_pos - 1] == 0 else next_pos
+        units.append((payload, nal_end))
+        pos = next_pos
+
+    return units
+
+def iter_nal_units(data: bytes) -> Iterator[bytes]:
+    """遍历 Annex-B 数据中的 NAL 单元（不含起始码）"""
+    for begin, end in find_nal_units(data):
+        if end > begin:
+            yield data[begin:end]
+
+def extract_parameter_sets(data) -> Tuple[Optional[bytes], Optional[bytes]]:
+    """提取访问单元中第一个VCL NAL之前的SPS和PPS
+
+    Returns:
+        (sps, pps)，不含起始码，未找到时为None
+    """
+    sps = pps = None
+    pos = data.find(START_CODE)
+    while pos != -1:
+        payload = pos + 3
+        if payload >= len(data):
+            break
+        nal_type = data[payload] & 0x1F
+        if 1 <= nal_type <= 5:
+            break
+
+        next_pos = data.find(START_CODE, payload)
+        nal_end = len(data) if next_pos == -1 else next_pos
+        if next_pos != -1 and data[next_pos - 1] == 0:
+            nal_end -= 1
+
+        if nal_type == NAL_TYPE_SPS:
+            sps = bytes(data[payload:nal_end])
+        elif nal_type == NAL_TYPE_PPS:
+            pps = bytes(data[payload:nal_end])
+        pos = next_pos
+
+    return sps, pps
+
+# 带 chroma_format_idc 等扩展字段的 High 系列 profile
+_HIGH_PROFILES = (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135)
+
+class _BitReader:
+    """RBSP比特读取（去除防竞争字节后）"""
+
+    def __init__(self, data: bytes):
+        rbsp = bytearray()
+        zeros = 0
+        for byte in data:
+            if zeros >= 2 and byte == 3:
+                zeros = 0
+                continue
+            rbsp.append(byte)
+            zeros = zeros + 1 if byte == 0 else 0
+        self.data = rbsp
+        self.pos = 0
+
+    def bit(self) -> int:
+        byte = self.data[self.pos >> 3]
+        value = (byte >> (7 - (self.pos & 7))) & 1
+        self.pos += 1
+        return value
+
+    def bits(self, count: int) -> int:
+        value = 0
+        for _ in range(count):
+            value = (value << 1) | self.bit()
+        return value
+
+    def ue(self) -> int:
+        zeros = 0
+        while self.bit() == 0:
+            zeros += 1
+        return (1 << zeros) - 1 + self.bits(zeros)
+
+    def se(self) -> int:
+        value = self.ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+def parse_sps_resolution(sps: bytes) -> Optional[Tuple[int, int]]:
+    """从SPS（含NAL头，不含起始码）解析裁剪后的图像宽高，格式错误时返回None"""
+    try:
+        reader = _BitReader(sps[1:])
+        profile_idc = reader.bits(8)
+        reader.bits(16)                     # constraint_set 标志、level_idc
+        reader.ue()                         # seq_parameter_set_id
+        chroma_format_idc = 1
+        if profile_idc in _HIGH_PROFILES:
+            chroma_format_idc = reader.ue()
+            if chroma_format_idc == 3:
+                reader.bit()                # separate_colour_plane_flag
+            reader.ue()                     # bit_depth_luma_minus8
+            reader.ue()                     # bit_depth_chroma_minus8
+            reader.bit()                    # qpprime_y_zero_transform_bypass_flag
+            if reader.bit():                # seq_scaling_matrix_present_flag
+                for i in range(8 if chroma_format_idc != 3 else 12):
+                    if reader.bit():
+                        last = next_scale = 8
+                        for _ in range(16 if i < 6 else 64):
+                            if next_scale:
+                                next_scale = (last + reader.se()) % 256
+                            last = next_scale or last
+        reader.ue()                         # log2_max_frame_num_minus4
+        poc_type = reader.ue()
+        if poc_type == 0:
+            reader.ue()                     # log2_max_pic_order_cnt_lsb_minus4
+        elif poc_type == 1:
+            reader.bit()
+            reader.se()
+            reader.se()
+            for _ in range(reader.ue()):
+                reader.se()
+        reader.ue()                         # max_num_ref_frames
+        reader.bit()                        # gaps_in_frame_num_value_allowed_flag
+        width_mbs = reader.ue() + 1
+        height_units = reader.ue() + 1
+        frame_mbs_only = reader.bit()
+        if not frame_mbs_only:
+            reader.bit()                    # mb_adaptive_frame_field_flag
+        reader.bit()                        # direct_8x8_inference_flag
+
+        width = width_mbs * 16
+        height = (2 - frame_mbs_only) * height_units * 16
+        if reader.bit():                    # frame_cropping_flag
+            left, right, top, bottom = reader.ue(), reader.ue(), reader.ue(), reader.ue()
+            crop_x = 2 if chroma_format_idc in (1, 2) else 1
+            crop_y = (2 if chroma_format_idc == 1 else 1) * (2 - frame_mbs_only)
+            width -= crop_x * (left + right)
+            height -= crop_y * (top + bottom)
+        return width, height
+    except IndexError:
+        return None
+
+def _is_first_slice(data, payload: int, payload_end: int) -> bool:
+    """判断切片是否为图像的第一个切片（first_mb_in_slice == 0）"""
+    # first_mb_in_slice 为 ue(v) 编码，值为0时第一个比特为1
+    return payload + 1 < payload_end and (data[payload + 1] & 0x80) != 0
+
+@dataclass
+class AccessUnit:
+    """完整的访问单元（一帧编码数据）"""
+    data: bytes
+    pts: Optional[float] = None
+    is_keyframe: bool = False
+    nal_types: List[int] = field(default_factory=list)
+
+    def to_metadata(self) -> dict:
+        """转换为回调使用的元数据字典"""
+        return {
+            'pts': self.pts,
+            'is_keyframe': self.is_keyframe,
+            'nal_types': self.nal_types,
+            'size': len(self.data)
+        }
+
+class AccessUnitParser:
+    """增量式 H.264 访问单元解析器
+
+    按任意大小喂入 Annex-B 字节流，输出按帧组装好的访问单元，
+    并按顺序为每个访问单元标记输入帧的采集时间戳（PTS）。
+    """
+
+    def __init__(self, on_access_unit: Optional[Callable[[AccessUnit], None]] = None):
+        self.on_access_unit = on_access_unit
+
+        self._buffer = bytearray()
+        self._scan_pos = 0      # 下次查找起始码的位置
+        self._nal_start = -1    # 当前未完成NAL的起始码位置
+        self._header_checked = False
+
+        # 当前正在组装的访问单元
+        self._au = bytearray()
+        self._au_types: List[int] = []
+        self._au_has_vcl = False
+        self._au_is_key = False
+
+        # 待分配的输入帧PTS（编码器按输入顺序输出）
+        self._pending_pts: Deque[float] = deque()
+
+        self.stats = {
+            'bytes_parsed': 0,
+            'nal_units': 0,
+            'access_units': 0,
+            'keyframes': 0
+        }
+
+    def push_pts(self, pts: float):
+        """登记一个已送入编码器的帧PTS"""
+        self._pending_pts.append(pts)
+
+    @property
+    def pending_frames(self) -> int:
+        """已送入编码器但尚未输出的帧数"""
+        return len(self._pending_pts)
+
+    def feed(self, data) -> List[AccessUnit]:
+        """喂入数据，返回本次解析出的完整访问单元"""
+        self._buffer += data
+        self.stats['bytes_parsed'] += len(data)
+
+        output: List[AccessUnit] = []
+        buf = self._buffer
+
+        while True:
+            # 下一个NAL头部一旦可读即可判断上一个访问单元是否结束，无需等待整个NAL
+            if self._nal_start != -1 and not self._header_checked:
+                if len(buf) < self._nal_start + 5:
+                    break
+                self._check_boundary(buf, self._nal_start + 3, output)
+                self._header_checked = True
+
+            pos = buf.find(START_CODE, self._scan_pos)
+            if pos == -1:
+                # 保留末尾2字节，避免起始码跨块被截断
+                self._scan_pos = max(self._scan_pos, len(buf) - 2)
+                break
+
+            if self._nal_start != -1:
+                nal_end = pos - 1 if pos > self._nal_start + 3 and buf[pos - 1] == 0 else pos
+                self._append_nal(buf, self._nal_start, nal_end)
+
+            self._nal_start = pos
+            self._header_checked = False
+            self._scan_pos = pos + 3
+
+        # 丢弃已处理的数据
+        consumed = self._nal_start if self._nal_start != -1 else self._scan_pos
+        if consumed > 0:
+            del buf[:consumed]
+            self._scan_pos -= consumed
+            if self._nal_start != -1:
+                self._nal_start = 0
+
+        return output
+
+    def flush(self) -> List[AccessUnit]:
+        """输出缓冲区中剩余的数据（流结束时调用）"""
+        output: List[AccessUnit] = []
+        buf = self._buffer
+        if self._nal_start != -1 and self._nal_start + 3 < len(buf):
+            if not self._header_checked:
+                self._check_boundary(buf, self._nal_start + 3, output)
+            self._append_nal(buf, self._nal_start, len(buf))
+        buf.clear()
+        self._scan_pos = 0
+        self._nal_start = -1
+        self._header_checked = False
+        self._emit_au(output)
+        return output
+
+    def reset(self):
+        """重置解析器状态"""
+        self._buffer.clear()
+        self._scan_pos = 0
+        self._nal_start = -1
+        self._header_checked = False
+        self._au = bytearray()
+        self._au_types = []
+        self._au_has_vcl = False
+        self._au_is_key = False
+        self._pending_pts.clear()
+
+    def _check_boundary(self, buf: bytearray, payload: int, output: List[AccessUnit]):
+        """根据新NAL的头部判断是否开始新的访问单元"""
+        if not self._au_has_vcl:
+            return
+
+        nal_type = buf[payload] & 0x1F
+        is_vcl = 1 <= nal_type <= 5
+        if nal_type in _AU_START_TYPES or (is_vcl and _is_first_slice(buf, payload, len(buf))):
+            self._emit_au(output)
+
+    def _append_nal(self, buf: bytearray, start: int, end: int):
+        """将一个完整的NAL单元（含起始码）加入当前访问单元"""
+        payload = start + 3
+        if payload >= end:
+            return
+
+        nal_type = buf[payload] & 0x1F
+
+        # 统一使用4字节起始码输出
+        self._au += b'\x00'
+        self._au += buf[start:end]
+        self._au_types.append(nal_type)
+        self.stats['nal_units'] += 1
+
+        if 1 <= nal_type <= 5:
+            self._au_has_vcl = True
+            if nal_type == NAL_TYPE_IDR:
+                self._au_is_key = True
+
+    def _emit_au(self, output: List[AccessUnit]):
+        """输出当前访问单元"""
+        if not self._au_has_vcl:
+            return
+
+        pts = self._pending_pts.popleft() if self._pending_pts else None
+        au = AccessUnit(
+            data=bytes(self._au),
+            pts=pts,
+            is_keyframe=self._au_is_key,
+            nal_types=self._au_types
+        )
+
+        self._au = bytearray()
+        self._au_types = []
+        self._au_has_vcl = False
+        self._au_is_key = False
+
+        self.stats['access_units'] += 1
+        if au.is_keyframe:
+            self.stats['keyframes'] += 1
+
+        output.append(au)
+        if self.on_access_unit:
+            try:
+                self.on_access_unit(au)
+            except Exception as e:
+                logger.error(f"Access unit callback error: {e}")
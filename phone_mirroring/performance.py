@@ -30,6 +30,7 @@ class PerformanceMetrics:
     memory_usage: float = 0
     frame_loss: float = 0
     quality_score: float = 100
+    frame_jitter: float = 0  # 已注册帧时钟中最大的调度抖动（ms）
     timestamp: float = field(default_factory=time.time)
 
 @dataclass
@@ -41,6 +42,76 @@ class BufferStats:
     overflow_count: int = 0
     underflow_count: int = 0
 
+class StageHistogram:
+    """单个处理阶段的耗时直方图
+    
+    按毫秒对数分桶计数，记录开销固定且不保存样本；分位数取所在桶的上界。
+    """
+    
+    BUCKETS_MS = (0.5, 1, 2, 4, 8, 16, 33, 66, 133, 266)
+    
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def record(self, seconds: float):
+        """记录一次耗时（秒）"""
+        ms = seconds * 1000
+        index = 0
+        while index < len(self.BUCKETS_MS) and ms > self.BUCKETS_MS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+    
+    def percentile(self, p: float) -> float:
+        """第p百分位耗时（毫秒，桶上界；超出最大桶时为实测最大值）"""
+        if not self.count:
+            return 0.0
+        
+        rank = self.count * p / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.BUCKETS_MS[index] if index < len(self.BUCKETS_MS) else self.max
+        return self.max
+    
+    def get_stats(self) -> Dict[str, Any]:
+        labels = [f"<={b}ms" for b in self.BUCKETS_MS] + [f">{self.BUCKETS_MS[-1]}ms"]
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count if self.count else 0.0,
+            'max_ms': self.max,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'buckets': {label: count for label, count in zip(labels, self.counts) if count}
+        }
+
+class StageTimings:
+    """流水线各阶段（采集、转换、排队、提交编码等）的耗时直方图集合"""
+    
+    def __init__(self):
+        self.stages: Dict[str, StageHistogram] = {}
+        self._lock = threading.Lock()
+    
+    def record(self, stage: str, seconds: float):
+        """记录某阶段的一次耗时（秒）"""
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = StageHistogram()
+            histogram.record(seconds)
+    
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {stage: histogram.get_stats() for stage, histogram in self.stages.items()}
+
 class PerformanceMonitor:
     """性能监控器"""
     
@@ -63,6 +134,12 @@ class PerformanceMonitor:
         self._latency_samples: List[float] = []
         self._bandwidth_samples: List[float] = []
         
+        # 帧时钟（FrameClock），名称 -> 时钟，提供调度抖动统计
+        self.clocks: Dict[str, Any] = {}
+        
+        # 端到端延迟分解（SEI时间戳回传：encode/transport/decode/end_to_end）
+        self.latency_stages = StageTimings()
+        
         self._lock = threading.Lock()
     
     def start(self):
@@ -135,6 +212,9 @@ class PerformanceMonitor:
         # 计算质量评分
         quality_score = self._calculate_quality_score(fps, latency, frame_loss)
         
+        # 帧调度抖动
+        frame_jitter = self._calculate_frame_jitter()
+        
         return PerformanceMetrics(
             fps=fps,
             latency=latency,
@@ -142,9 +222,32 @@ class PerformanceMonitor:
             cpu_usage=cpu_usage,
             memory_usage=memory_usage,
             frame_loss=frame_loss,
-            quality_score=quality_score
+            quality_score=quality_score,
+            frame_jitter=frame_jitter
         )
     
+    def register_clock(self, name: str, clock):
+        """注册帧时钟，其抖动计入 frame_jitter 并由 get_clock_stats() 报告"""
+        with self._lock:
+            self.clocks[name] = clock
+    
+    def unregister_clock(self, name: str):
+        """注销帧时钟"""
+        with self._lock:
+            self.clocks.pop(name, None)
+    
+    def get_clock_stats(self) -> Dict[str, Dict[str, Any]]:
+        """各帧时钟的抖动、超时和跳帧统计"""
+        with self._lock:
+            clocks = dict(self.clocks)
+        return {name: clock.get_stats() for name, clock in clocks.items()}
+    
+    def _calculate_frame_jitter(self) -> float:
+        """已注册帧时钟中最大的调度抖动（ms）"""
+        with self._lock:
+            clocks = list(self.clocks.values())
+        return max((clock.jitter_ms for clock in clocks), default=0)
+    
     def record_frame(self, frame_time: float):
         """记录帧时间"""
         with self._lock:
@@ -159,6 +262,14 @@ class PerformanceMonitor:
             if len(self._latency_samples) > 100:
                 self._latency_samples.pop(0)
     
+    def record_stage_latency(self, stage: str, seconds: float):
+        """记录端到端链路中某一段的延迟（秒），由客户端解析SEI时间戳后回报"""
+        self.latency_stages.record(stage, seconds)
+    
+    def get_latency_stats(self) -> Dict[str, Dict[str, Any]]:
+        """各段延迟直方图（毫秒分位数）"""
+        return self.latency_stages.get_stats()
+    
     def record_bandwidth(self, bytes_per_second: float):
         """记录带宽"""
         with self._lock:
@@ -254,7 +365,8 @@ class PerformanceMonitor:
                 cpu_usage=statistics.mean(m.cpu_usage for m in recent_metrics),
                 memory_usage=statistics.mean(m.memory_usage for m in recent_metrics),
                 frame_loss=statistics.mean(m.frame_loss for m in recent_metrics),
-                quality_score=statistics.mean(m.quality_score for m in recent_metrics)
+                quality_score=statistics.mean(m.quality_score for m in recent_metrics),
+                frame_jitter=statistics.mean(m.frame_jitter for m in recent_metrics)
             )
 
 class PerformanceOptimizer:
@@ -434,7 +546,9 @@ class PerformanceOptimizer:
             "current": current.__dict__ if current else None,
             "average": average.__dict__ if average else None,
             "optimization": self.get_optimization_settings(),
-            "thresholds": self.thresholds
+            "thresholds": self.thresholds,
+            "clocks": self.monitor.get_clock_stats(),
+            "latency": self.monitor.get_latency_stats()
         }
 
 # 便捷函数
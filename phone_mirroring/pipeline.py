@@ -0,0 +1,403 @@
+"""
+流水线模块
+把采集、转换、编码、分包、发送组织为显式的阶段图，阶段之间为有界队列，
+每个阶段可选择线程、asyncio或进程执行，并统计处理耗时、排队耗时和队列深度
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Dict, Any, Callable, List, Deque, Tuple
+
+from phone_mirroring.performance import StageHistogram
+
+logger = logging.getLogger(__name__)
+
+# 阶段类型（只用于展示和统计分组，行为由是否有输入/输出决定）
+STAGE_KINDS = ('source', 'transform', 'encoder', 'packetizer', 'sink')
+EXECUTORS = ('thread', 'asyncio', 'process')
+
+class StageQueue:
+    """阶段之间的有界队列
+
+    overflow='block' 时队列满则阻塞生产者（背压），最多阻塞 block_timeout 秒，
+    超时后丢弃新项并计入 stats['timeouts']（消费者停止后生产者不会永远阻塞，流水线能够停止）；
+    'drop_oldest' 时丢弃最旧的项目，生产者从不阻塞（容量为1时即最新帧邮箱）。
+    被丢弃或关闭时未取走的项目交给 on_discard。
+    接口与 FrameMailbox 兼容，另提供 get_async() 供asyncio阶段使用。
+    """
+
+    def __init__(self, capacity: int = 1, overflow: str = 'drop_oldest',
+                 on_discard: Optional[Callable[[Any], None]] = None, block_timeout: float = 1.0):
+        if overflow not in ('block', 'drop_oldest'):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.capacity = max(1, capacity)
+        self.overflow = overflow
+        self.on_discard = on_discard
+        self.block_timeout = block_timeout
+
+        self._items: Deque[Tuple[float, Any]] = deque()
+        self._closed = False
+        self._cond = threading.Condition()
+        self._async_waiter: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = None
+
+        # 最近取出项目的排队耗时（秒）
+        self.last_wait = 0.0
+        self.stats = {
+            'put': 0,
+            'taken': 0,
+            'dropped': 0,
+            'timeouts': 0,
+            'max_depth': 0,
+            'blocked_time': 0.0
+        }
+
+    def put(self, item: Any, timeout: Optional[float] = None) -> bool:
+        """放入一项
+
+        Args:
+            item: 项目
+            timeout: overflow='block' 时的最长阻塞时间（秒），None 为 block_timeout
+
+        Returns:
+            False 表示该项或被挤掉的旧项被丢弃（队列关闭、阻塞超时或 drop_oldest 溢出）
+        """
+        discarded = []
+        with self._cond:
+            if self.overflow == 'block' and len(self._items) >= self.capacity and not self._closed:
+                start = time.monotonic()
+                if not self._cond.wait_for(lambda: len(self._items) < self.capacity or self._closed,
+                                           self.block_timeout if timeout is None else timeout):
+                    self.stats['timeouts'] += 1
+                self.stats['blocked_time'] += time.monotonic() - start
+
+            if self._closed or len(self._items) >= self.capacity and self.overflow == 'block':
+                discarded.append(item)
+            else:
+                while len(self._items) >= self.capacity:
+                    discarded.append(self._items.popleft()[1])
+                self._items.append((time.monotonic(), item))
+                self.stats['put'] += 1
+                self.stats['max_depth'] = max(self.stats['max_depth'], len(self._items))
+                self._cond.notify_all()
+                self._wake_async()
+            self.stats['dropped'] += len(discarded)
+
+        if self.on_discard:
+            for old in discarded:
+                self.on_discard(old)
+        return not discarded
+
+    def _wake_async(self):
+        if self._async_waiter:
+            loop, event = self._async_waiter
+            self._async_waiter = None
+            loop.call_soon_threadsafe(event.set)
+
+    def _take(self) -> Any:
+        enqueued, item = self._items.popleft()
+        self.last_wait = time.monotonic() - enqueued
+        self.stats['taken'] += 1
+        self._cond.notify_all()
+        return item
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """取出最早的一项，超时或队列关闭时返回None"""
+        with self._cond:
+            if not self._items and not self._closed:
+                self._cond.wait_for(lambda: self._items or self._closed, timeout)
+            if not self._items:
+                return None
+            return self._take()
+
+    async def get_async(self) -> Any:
+        """在事件循环中等待并取出一项，队列关闭时返回None"""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self._items:
+                    return self._take()
+                if self._closed:
+                    return None
+                event = asyncio.Event()
+                self._async_waiter = (loop, event)
+            await event.wait()
+
+    def close(self):
+        """关闭队列，唤醒等待中的生产者和消费者，丢弃未取走的项目"""
+        with self._cond:
+            self._closed = True
+            discarded = [item for _, item in self._items]
+            self._items.clear()
+            self._cond.notify_all()
+            self._wake_async()
+
+        if self.on_discard:
+            for item in discarded:
+                self.on_discard(item)
+
+    def reopen(self):
+        """重新打开队列"""
+        with self._cond:
+            self._closed = False
+            self._items.clear()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def depth(self) -> int:
+        return len(self._items)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取队列统计"""
+        with self._cond:
+            return dict(self.stats, depth=len(self._items), capacity=self.capacity, overflow=self.overflow)
+
+class Stage:
+    """流水线中的一个阶段
+
+    func(item) 处理输入并返回输出（None表示没有输出）；没有输入的源阶段 func() 每次产生一项。
+    输出也可以由外部组件异步产生（编码器回调、设备回调）并调用 emit() 送往下一阶段。
+    func 为空的源阶段表示外部生产者，start/stop 用于启停该生产者。
+
+    executor:
+        'thread'  专用线程
+        'asyncio' 流水线事件循环中的协程（func可以是协程函数）
+        'process' 在单独的进程中执行func（func及输入输出必须可pickle），由一个线程转发
+    """
+
+    def __init__(self, name: str, func: Optional[Callable] = None, kind: str = 'transform',
+                 executor: str = 'thread', queue: Optional[Any] = None,
+                 queue_size: int = 1, overflow: str = 'drop_oldest',
+                 on_discard: Optional[Callable[[Any], None]] = None,
+                 start: Optional[Callable[[], Any]] = None, stop: Optional[Callable[[], Any]] = None):
+        if kind not in STAGE_KINDS:
+            raise ValueError(f"Unknown stage kind: {kind}")
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor: {executor}")
+
+        self.name = name
+        self.func = func
+        self.kind = kind
+        self.executor = executor
+        self.on_start = start
+        self.on_stop = stop
+
+        # 输入队列（源阶段没有）；可传入已有的队列（如采集器的帧邮箱）
+        if kind == 'source':
+            self.input = None
+        else:
+            self.input = queue if queue is not None else StageQueue(queue_size, overflow, on_discard)
+
+        self.next: Optional['Stage'] = None
+        self.is_running = False
+        self._worker = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+
+        self.latency = StageHistogram()
+        self.wait = StageHistogram()
+        self.busy_time = 0.0
+        self.started_at = 0.0
+        self.stats = {
+            'processed': 0,
+            'emitted': 0,
+            'errors': 0
+        }
+
+    def emit(self, item: Any) -> bool:
+        """把一项送往下一阶段的输入队列"""
+        if self.next is None or item is None:
+            return False
+        self.stats['emitted'] += 1
+        return self.next.input.put(item)
+
+    def _record(self, started: float):
+        elapsed = time.perf_counter() - started
+        self.latency.record(elapsed)
+        self.busy_time += elapsed
+        self.stats['processed'] += 1
+        if self.input is not None and hasattr(self.input, 'last_wait'):
+            self.wait.record(self.input.last_wait)
+
+    def _run_thread(self):
+        """线程执行：取输入、处理、输出"""
+        while self.is_running:
+            try:
+                if self.input is not None:
+                    item = self.input.get(timeout=0.5)
+                    if item is None:
+                        continue
+                    started = time.perf_counter()
+                    if self._process_pool:
+                        output = self._process_pool.submit(self.func, item).result()
+                    else:
+                        output = self.func(item)
+                else:
+                    started = time.perf_counter()
+                    output = self.func()
+                    if output is None:
+                        continue
+                self._record(started)
+                self.emit(output)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Pipeline stage {self.name} error: {e}")
+
+    async def _run_async(self):
+        """asyncio执行"""
+        while self.is_running:
+            try:
+                if self.input is not None:
+                    item = await self.input.get_async()
+                    if item is None:
+                        if self.input.closed:
+                            break
+                        continue
+                    started = time.perf_counter()
+                    output = self.func(item)
+                else:
+                    started = time.perf_counter()
+                    output = self.func()
+                if asyncio.iscoroutine(output):
+                    output = await output
+                if output is None and self.input is None:
+                    await asyncio.sleep(0)
+                    continue
+                self._record(started)
+                self.emit(output)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Pipeline stage {self.name} error: {e}")
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """启动阶段（外部生产者阶段调用 start 回调）"""
+        if self.input is not None and hasattr(self.input, 'reopen'):
+            self.input.reopen()
+        self.is_running = True
+        self.started_at = time.monotonic()
+
+        if self.func is None:
+            if self.on_start:
+                self.on_start()
+            return
+
+        if self.executor == 'asyncio':
+            if loop is None:
+                raise RuntimeError(f"Stage {self.name} needs an event loop")
+            self._worker = asyncio.run_coroutine_threadsafe(self._run_async(), loop) \
+                if not _in_loop(loop) else loop.create_task(self._run_async())
+        else:
+            if self.executor == 'process':
+                self._process_pool = ProcessPoolExecutor(max_workers=1)
+            self._worker = threading.Thread(target=self._run_thread, name=f"stage-{self.name}", daemon=True)
+            self._worker.start()
+        if self.on_start:
+            self.on_start()
+
+    def stop(self):
+        """停止阶段：关闭输入队列唤醒工作者并等待其退出"""
+        self.is_running = False
+        if self.on_stop:
+            self.on_stop()
+        if self.input is not None:
+            self.input.close()
+
+        if isinstance(self._worker, threading.Thread):
+            self._worker.join(timeout=2.0)
+        elif isinstance(self._worker, asyncio.Task):
+            # 可能在执行器线程中调用，取消操作交回事件循环
+            self._worker.get_loop().call_soon_threadsafe(self._worker.cancel)
+        elif self._worker is not None:
+            self._worker.cancel()
+        self._worker = None
+
+        if self._process_pool:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取阶段统计（utilization 为处理耗时占运行时间的比例，接近1即为瓶颈）"""
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        stats = dict(self.stats,
+                     kind=self.kind,
+                     executor=self.executor,
+                     latency=self.latency.get_stats(),
+                     utilization=self.busy_time / elapsed if elapsed > 0 else 0.0)
+        if self.input is not None:
+            stats['queue'] = self.input.get_stats()
+            stats['wait'] = self.wait.get_stats()
+        return stats
+
+def _in_loop(loop: asyncio.AbstractEventLoop) -> bool:
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+class Pipeline:
+    """线性阶段图
+
+    按添加顺序连接各阶段，启动时从下游到上游依次启动（保证生产者开始输出时消费者已就绪），
+    停止时从上游到下游依次停止。
+    """
+
+    def __init__(self, name: str = 'pipeline'):
+        self.name = name
+        self.stages: List[Stage] = []
+        self.is_running = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def add(self, stage: Stage) -> Stage:
+        """在末尾添加一个阶段"""
+        if self.stages:
+            if stage.input is None:
+                raise ValueError(f"Source stage {stage.name} must be the first stage")
+            self.stages[-1].next = stage
+        elif stage.kind != 'source':
+            raise ValueError("The first stage of a pipeline must be a source")
+        self.stages.append(stage)
+        return stage
+
+    def stage(self, name: str) -> Stage:
+        return next(stage for stage in self.stages if stage.name == name)
+
+    def emit(self, name: str, item: Any) -> bool:
+        """由外部组件（回调）代表指定阶段输出一项"""
+        return self.stage(name).emit(item)
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """启动流水线（含asyncio阶段时需提供事件循环）"""
+        self._loop = loop
+        self.is_running = True
+        for stage in reversed(self.stages):
+            stage.start(loop)
+        logger.info(f"Pipeline {self.name} started: " + " -> ".join(
+            f"{stage.name}[{stage.executor}]" for stage in self.stages))
+
+    def stop(self):
+        """停止流水线"""
+        self.is_running = False
+        for stage in self.stages:
+            stage.stop()
+        logger.info(f"Pipeline {self.name} stopped")
+
+    def bottleneck(self) -> Optional[str]:
+        """利用率最高的阶段"""
+        running = [stage for stage in self.stages if stage.func is not None and stage.started_at]
+        if not running:
+            return None
+        return max(running, key=lambda stage: stage.get_stats()['utilization']).name
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取各阶段统计"""
+        return {
+            'stages': {stage.name: stage.get_stats() for stage in self.stages},
+            'bottleneck': self.bottleneck()
+        }
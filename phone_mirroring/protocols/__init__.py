@@ -1,13 +1,35 @@
 """
 协议模块
+各协议的实现在第一次访问时才导入（PEP 562），导入本包不会加载协议依赖
 """
 
 from .base import BaseProtocol
-from .rtsp import RTSPProtocol
-from .adb import ADBProtocol
+from .registry import register_protocol, get_protocol_class, available_protocols, is_protocol_loaded
+
+_LAZY_PROTOCOLS = {
+    "RTSPProtocol": "RTSP",
+    "ADBProtocol": "ADB",
+    "MSEProtocol": "MSE",
+    "WebRTCProtocol": "WebRTC",
+}
 
 __all__ = [
     "BaseProtocol",
     "RTSPProtocol",
-    "ADBProtocol"
+    "ADBProtocol",
+    "MSEProtocol",
+    "register_protocol",
+    "get_protocol_class",
+    "available_protocols",
+    "is_protocol_loaded"
 ]
+
+def __getattr__(name):
+    if name in _LAZY_PROTOCOLS:
+        cls = get_protocol_class(_LAZY_PROTOCOLS[name])
+        globals()[name] = cls
+        return cls
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
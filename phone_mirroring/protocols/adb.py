@@ -10,11 +10,11 @@ import subprocess
 import time
 import struct
 import threading
-import numpy as np
 from typing import Dict, Any, Optional, List, Tuple, Callable
 from dataclasses import dataclass
 from enum import Enum
 from .base import BaseProtocol
+from ..media_frame import MediaFrame, MediaFramePool
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +34,7 @@ class VideoFrameInfo:
     orientation: int = 0
     format: str = "H264"
     timestamp: float = 0.0
+    is_keyframe: bool = False
 
 class H264Parser:
     """H.264视频流解析器"""
@@ -61,7 +62,9 @@ class H264Parser:
         self.frame_buffer = []
         self.sps_data: Optional[bytes] = None
         self.pps_data: Optional[bytes] = None
-        self.frame_callback: Optional[Callable[[bytes, VideoFrameInfo], None]] = None
+        # 回调返回后帧即被释放，需要继续持有的使用者调用 frame.retain()
+        self.frame_callback: Optional[Callable[[MediaFrame], None]] = None
+        self.pool = MediaFramePool()
     
     def feed_data(self, data: bytes):
         """喂入原始数据"""
@@ -119,7 +122,7 @@ class H264Parser:
             return
         
         # 获取NAL类型
-        nal_type = nal_unit[4] & 0x1F if nal_unit.startswith(self.START_CODE_4) else nal_unit[3] & 0x1F
+        nal_type = self._nal_type(nal_unit)
         
         # 保存SPS和PPS
         if nal_type == self.NAL_TYPE_SPS:
@@ -141,33 +144,36 @@ class H264Parser:
             if self.frame_buffer:
                 self._emit_frame()
     
+    def _nal_type(self, nal_unit: bytes) -> int:
+        """获取NAL单元类型（含起始码）"""
+        return nal_unit[4] & 0x1F if nal_unit.startswith(self.START_CODE_4) else nal_unit[3] & 0x1F
+    
+    def _nal_payload(self, nal_unit: bytes) -> memoryview:
+        """去掉起始码的NAL单元（不拷贝）"""
+        return memoryview(nal_unit)[4 if nal_unit.startswith(self.START_CODE_4) else 3:]
+    
     def _emit_frame(self):
         """发送完整帧"""
         if not self.frame_buffer:
             return
         
-        # 组合帧数据（包含SPS/PPS）
-        frame_data = b''
-        if self.sps_data:
-            frame_data += self.sps_data
-        if self.pps_data:
-            frame_data += self.pps_data
-        
-        for nal in self.frame_buffer:
-            frame_data += nal
-        
-        # 创建帧信息
-        info = VideoFrameInfo(
-            timestamp=time.time(),
-            format="H264"
+        # 参数集和切片各拷贝一次，直接写入池化缓冲区（包含SPS/PPS）
+        nals = [nal for nal in (self.sps_data, self.pps_data) if nal] + self.frame_buffer
+        frame = self.pool.frame_from_nals(
+            (self._nal_payload(nal) for nal in nals),
+            pts=time.monotonic(),
+            is_keyframe=any(self._nal_type(nal) == self.NAL_TYPE_IDR for nal in self.frame_buffer)
         )
         
-        # 触发回调
-        if self.frame_callback:
-            self.frame_callback(frame_data, info)
-        
         # 清空帧缓冲区（保留SPS/PPS）
         self.frame_buffer = []
+        
+        # 触发回调，之后释放解析器持有的引用
+        try:
+            if self.frame_callback:
+                self.frame_callback(frame)
+        finally:
+            frame.release()
     
     def reset(self):
         """重置解析器状态"""
@@ -179,6 +185,8 @@ class H264Parser:
 class ADBProtocol(BaseProtocol):
     """ADB协议实现，用于Android设备投屏"""
     
+    ingest_only = True
+    
     def __init__(self, config: Dict[str, Any]):
         super().__init__(config)
         self.adb_port = config.get("adb_port", 5555)
@@ -213,6 +221,7 @@ class ADBProtocol(BaseProtocol):
         
         # 帧回调
         self.on_video_frame_callback: Optional[Callable[[bytes, Dict], None]] = None
+        self._keyframe_warning_logged = False
         
         logger.info(f"ADB Protocol initialized for device: {self.device_id or 'auto-detect'}")
     
@@ -567,21 +576,27 @@ class ADBProtocol(BaseProtocol):
             logger.error(f"Error reading screenrecord stream: {e}")
             self.stats["errors"] += 1
     
-    def _on_video_frame(self, frame_data: bytes, info: VideoFrameInfo):
-        """视频帧回调"""
+    def _on_video_frame(self, frame: MediaFrame):
+        """视频帧回调
+        
+        帧以 MediaFrame 交给各使用者（len()/bytes() 与bytes兼容），回调返回后即被释放，
+        需要在回调之后继续使用的一方调用 frame.retain()，用完调用 frame.release()。
+        """
         metadata = {
-            'timestamp': info.timestamp,
-            'size': len(frame_data),
+            'timestamp': time.time(),
+            'pts': frame.pts,
+            'size': frame.size,
             'device_id': self.active_device,
-            'format': info.format
+            'format': "H264",
+            'is_keyframe': frame.is_keyframe
         }
         
         # 触发帧接收事件
-        self.emit("frame_received", frame_data, metadata)
+        self.emit("frame_received", frame, metadata)
         
         # 如果有外部回调，也调用它
         if self.on_video_frame_callback:
-            self.on_video_frame_callback(frame_data, metadata)
+            self.on_video_frame_callback(frame, metadata)
     
     async def _heartbeat_loop(self):
         """心跳检测循环"""
@@ -666,6 +681,18 @@ class ADBProtocol(BaseProtocol):
             self.stats["errors"] += 1
             return False
     
+    def request_keyframe(self) -> bool:
+        """请求设备尽快输出IDR（不支持，始终返回False）
+        
+        scrcpy 以 --no-control 运行、不建立控制连接，无法发送 RESET_VIDEO；
+        screenrecord 也没有强制关键帧的接口。观众只能等待设备的下一个关键帧。
+        """
+        if not self._keyframe_warning_logged:
+            logger.warning("ADB source cannot force keyframes (scrcpy runs without a control connection), "
+                           "viewers wait for the next device keyframe")
+            self._keyframe_warning_logged = True
+        return False
+    
     async def _execute_shell_command(self, command: str) -> bool:
         """执行ADB shell命令"""
         try:
@@ -699,9 +726,10 @@ class ADBProtocol(BaseProtocol):
                 'height': self.max_height,
                 'fps': self.max_fps,
                 'bitrate': self.bitrate
-            }
+            },
+            'frame_pool': self.h264_parser.pool.get_stats()
         }
     
-    def set_video_frame_callback(self, callback: Callable[[bytes, Dict], None]):
+    def set_video_frame_callback(self, callback: Callable[[MediaFrame, Dict], None]):
         """设置视频帧回调"""
         self.on_video_frame_callback = callback
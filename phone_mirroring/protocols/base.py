@@ -13,6 +13,9 @@ logger = logging.getLogger(__name__)
 class BaseProtocol(ABC):
     """协议基类"""
     
+    # 只接收媒体的协议（视频源），服务端不向其分发帧
+    ingest_only = False
+    
     def __init__(self, config: Dict[str, Any]):
         self.config = config
         self.is_running = False
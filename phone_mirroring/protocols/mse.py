@@ -0,0 +1,427 @@
+"""
+浏览器低延迟输出协议（MSE）
+把访问单元封装为逐帧 fMP4 片段，通过 WebSocket 或 HTTP chunked 推送给浏览器的
+Media Source Extensions 播放，不需要 aiortc/ICE，也不需要 VLC
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import struct
+import time
+from collections import deque
+from typing import Dict, Any, Optional, List, Set, Tuple, Deque
+from urllib.parse import urlparse
+
+from .base import BaseProtocol
+from phone_mirroring.fmp4 import FMP4Packager
+
+logger = logging.getLogger(__name__)
+
+_WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# WebSocket 操作码
+_OP_TEXT = 0x1
+_OP_BINARY = 0x2
+_OP_CLOSE = 0x8
+_OP_PING = 0x9
+_OP_PONG = 0xA
+
+PLAYER_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Phone Mirroring</title>
+<style>html,body{margin:0;height:100%;background:#000}video{width:100%;height:100%;object-fit:contain}</style>
+</head><body><video id="video" autoplay muted playsinline></video><script>
+const video = document.getElementById('video');
+const source = new MediaSource();
+let buffer = null, pending = [];
+video.src = URL.createObjectURL(source);
+function feed() {
+  if (!buffer || buffer.updating) return;
+  const ranges = video.buffered;
+  if (ranges.length) {
+    const end = ranges.end(ranges.length - 1);
+    if (end - video.currentTime > 0.5) video.currentTime = end - 0.05;   // 追到直播边缘
+    if (video.currentTime - ranges.start(0) > 30) { buffer.remove(0, video.currentTime - 10); return; }
+  }
+  const item = pending.shift();
+  if (item === undefined) return;
+  if (typeof item === 'string') {               // 分辨率/档次变化
+    if (buffer.changeType) buffer.changeType(item);
+    feed();
+  } else {
+    buffer.appendBuffer(item);
+  }
+}
+source.addEventListener('sourceopen', () => {
+  const ws = new WebSocket((location.protocol === 'https:' ? 'wss://' : 'ws://') + location.host + '/ws');
+  ws.binaryType = 'arraybuffer';
+  ws.onmessage = (event) => {
+    if (typeof event.data === 'string') {          // 初始化段之前的编码信息
+      const type = 'video/mp4; codecs="' + JSON.parse(event.data).codec + '"';
+      if (!buffer) {
+        buffer = source.addSourceBuffer(type);
+        buffer.addEventListener('updateend', feed);
+      } else {
+        pending.push(type);
+      }
+      return;
+    }
+    pending.push(event.data);
+    feed();
+  };
+  ws.onclose = () => setTimeout(() => location.reload(), 1000);
+});
+</script></body></html>
+"""
+
+class MSEViewer:
+    """一个浏览器观众（WebSocket 或 HTTP chunked 连接）"""
+
+    def __init__(self, viewer_id: str, writer: asyncio.StreamWriter, websocket: bool):
+        self.viewer_id = viewer_id
+        self.writer = writer
+        self.websocket = websocket
+        self.queue: Deque[Tuple[int, bytes]] = deque()
+        self.event = asyncio.Event()
+        self.closed = False
+        self.waiting_keyframe = False
+        self.fragments_sent = 0
+        self.fragments_dropped = 0
+        self.bytes_sent = 0
+        self.connected_at = time.time()
+
+    def enqueue(self, opcode: int, payload: bytes):
+        self.queue.append((opcode, payload))
+        self.event.set()
+
+    def write(self, opcode: int, payload: bytes):
+        """按连接类型加帧头写入（不等待发送完成）"""
+        if self.websocket:
+            length = len(payload)
+            if length < 126:
+                header = struct.pack('>BB', 0x80 | opcode, length)
+            elif length < 65536:
+                header = struct.pack('>BBH', 0x80 | opcode, 126, length)
+            else:
+                header = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+            self.writer.write(header + payload)
+        elif opcode == _OP_BINARY:
+            self.writer.write(b'%X\r\n' % len(payload) + payload + b'\r\n')
+        else:
+            return
+        self.bytes_sent += len(payload)
+
+    def close(self):
+        self.closed = True
+        self.event.set()
+
+class MSEProtocol(BaseProtocol):
+    """fMP4 over WebSocket / HTTP chunked 输出
+
+    每个访问单元只封装一次，得到的片段原样发给所有观众；缓存当前GOP，
+    新观众连接后立即收到初始化段和GOP缓存，不需要等待下一个关键帧。
+    观众发送跟不上时清空其队列，从下一个关键帧继续（其他观众不受影响）。
+
+    HTTP接口：
+        GET /            内置播放页（WebSocket + MSE）
+        GET /ws          WebSocket：文本消息为编码信息（JSON），二进制消息为初始化段/片段
+        GET /live.mp4    HTTP chunked 连续 fMP4 流
+        GET /info.json   当前编码（MSE codecs 字符串）和分辨率
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        super().__init__(config)
+        self.host = config.get("host", "0.0.0.0")
+        self.port = config.get("port", 8092)
+        self.max_queue_frames = config.get("max_queue_frames", 60)
+        self.max_gop_frames = config.get("max_gop_frames", 600)
+        self.rendition: Optional[str] = config.get("rendition")
+
+        self.packager = FMP4Packager(config.get("fps", 30))
+        self.gop_cache: List[bytes] = []
+        self.viewers: Dict[str, MSEViewer] = {}
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._next_viewer = 0
+        self.stats["fragments"] = 0
+        self.stats["fragments_dropped"] = 0
+
+    async def start(self) -> bool:
+        """启动HTTP/WebSocket服务"""
+        try:
+            self.loop = asyncio.get_running_loop()
+            self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+            self.is_running = True
+            self.stats["start_time"] = time.time()
+            logger.info(f"MSE output started: http://localhost:{self.port}/")
+            return True
+        except OSError as e:
+            logger.error(f"Failed to start MSE output on port {self.port}: {e}")
+            return False
+
+    async def stop(self) -> bool:
+        """停止服务并断开所有观众"""
+        self.is_running = False
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        for viewer in list(self.viewers.values()):
+            viewer.close()
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.gop_cache.clear()
+        logger.info("MSE output stopped")
+        return True
+
+    def push(self, frame_data: bytes, metadata: Dict[str, Any]):
+        """提交一个访问单元（可在编码器/设备回调线程中调用，同一路码流只能有一个生产者）"""
+        if not self.is_running or not self.loop:
+            return
+        rendition = metadata.get('rendition')
+        if rendition != self.rendition:
+            if self.rendition is not None or self.packager.init_segment is not None:
+                return
+            self.rendition = rendition
+
+        init, fragment = self.packager.package(frame_data, metadata)
+        if fragment is None:
+            return
+        self.stats["fragments"] += 1
+        try:
+            self.loop.call_soon_threadsafe(self._publish, init, fragment, metadata.get('is_keyframe', False))
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    async def send_frame(self, frame_data: bytes, metadata: Dict[str, Any]) -> bool:
+        """发送视频帧（供外部调用）"""
+        self.push(frame_data, metadata)
+        return True
+
+    async def send_audio(self, audio_data: bytes, metadata: Dict[str, Any]) -> bool:
+        """暂不支持音频"""
+        return False
+
+    async def handle_control(self, control_data: Dict[str, Any]) -> bool:
+        """浏览器输出只负责播放，不处理控制指令"""
+        return False
+
+    def _codec_message(self) -> bytes:
+        width, height = self.packager.resolution
+        return json.dumps({'codec': self.packager.codec, 'width': width, 'height': height}).encode()
+
+    def _publish(self, init: Optional[bytes], fragment: bytes, is_keyframe: bool):
+        """事件循环中：更新GOP缓存并把同一份片段分发给所有观众"""
+        if is_keyframe:
+            self.gop_cache = [fragment]
+        elif self.gop_cache and len(self.gop_cache) < self.max_gop_frames:
+            self.gop_cache.append(fragment)
+        else:
+            # GOP过长，不再缓存，新观众等待下一个关键帧
+            self.gop_cache = []
+
+        for viewer in list(self.viewers.values()):
+            if init:
+                viewer.enqueue(_OP_TEXT, self._codec_message())
+                viewer.enqueue(_OP_BINARY, init)
+            if viewer.waiting_keyframe:
+                if not is_keyframe:
+                    viewer.fragments_dropped += 1
+                    continue
+                # 丢弃的队列中可能含有初始化段，恢复时重新发送
+                viewer.waiting_keyframe = False
+                if not init:
+                    viewer.enqueue(_OP_TEXT, self._codec_message())
+                    viewer.enqueue(_OP_BINARY, self.packager.init_segment)
+            elif len(viewer.queue) >= self.max_queue_frames:
+                dropped = sum(1 for opcode, _ in viewer.queue if opcode == _OP_BINARY)
+                viewer.queue.clear()
+                viewer.fragments_dropped += dropped + 1
+                self.stats["fragments_dropped"] += dropped + 1
+                if not is_keyframe:
+                    viewer.waiting_keyframe = True
+                    continue
+                viewer.enqueue(_OP_TEXT, self._codec_message())
+                viewer.enqueue(_OP_BINARY, self.packager.init_segment)
+            viewer.enqueue(_OP_BINARY, fragment)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """处理一个HTTP连接"""
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=10)
+            lines = request.decode('latin-1').split('\r\n')
+            parts = lines[0].split(' ')
+            headers = {}
+            for line in lines[1:]:
+                if ':' in line:
+                    key, value = line.split(':', 1)
+                    headers[key.strip().lower()] = value.strip()
+            if len(parts) < 2 or parts[0] != 'GET':
+                await self._respond(writer, 405, 'Method Not Allowed')
+                return
+
+            path = urlparse(parts[1]).path
+            if path == '/ws' and headers.get('upgrade', '').lower() == 'websocket':
+                await self._serve_websocket(reader, writer, headers)
+            elif path == '/live.mp4':
+                await self._serve_chunked(reader, writer)
+            elif path == '/info.json':
+                body = self._codec_message() if self.packager.init_segment else b'{}'
+                await self._respond(writer, 200, 'OK', body, 'application/json')
+            elif path in ('/', '/index.html'):
+                await self._respond(writer, 200, 'OK', PLAYER_PAGE.encode('utf-8'), 'text/html; charset=utf-8')
+            else:
+                await self._respond(writer, 404, 'Not Found')
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.LimitOverrunError,
+                ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logger.error(f"MSE connection error: {e}")
+            self.stats["errors"] += 1
+        finally:
+            self._tasks.discard(task)
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, code: int, message: str,
+                       body: bytes = b'', content_type: str = 'text/plain'):
+        writer.write((f"HTTP/1.1 {code} {message}\r\n"
+                      f"Content-Type: {content_type}\r\n"
+                      f"Content-Length: {len(body)}\r\n"
+                      f"Access-Control-Allow-Origin: *\r\n"
+                      f"Connection: close\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+
+    async def _serve_websocket(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                               headers: Dict[str, str]):
+        key = headers.get('sec-websocket-key', '').encode('latin-1')
+        accept = base64.b64encode(hashlib.sha1(key + _WEBSOCKET_GUID).digest()).decode('ascii')
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\n"
+                      "Upgrade: websocket\r\n"
+                      "Connection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode('latin-1'))
+        await writer.drain()
+
+        viewer = self._add_viewer(writer, websocket=True)
+        reader_task = asyncio.create_task(self._read_websocket(reader, viewer))
+        try:
+            await self._send_loop(viewer)
+        finally:
+            reader_task.cancel()
+            self._remove_viewer(viewer)
+
+    async def _read_websocket(self, reader: asyncio.StreamReader, viewer: MSEViewer):
+        """读取客户端帧：响应ping，收到close或连接断开时结束观众"""
+        try:
+            while not viewer.closed:
+                head = await reader.readexactly(2)
+                opcode, length = head[0] & 0x0F, head[1] & 0x7F
+                if length == 126:
+                    length = struct.unpack('>H', await reader.readexactly(2))[0]
+                elif length == 127:
+                    length = struct.unpack('>Q', await reader.readexactly(8))[0]
+                mask = await reader.readexactly(4) if head[1] & 0x80 else None
+                payload = await reader.readexactly(length)
+                if mask:
+                    payload = bytes(b ^ mask[i & 3] for i, b in enumerate(payload))
+                # 控制帧直接写出（write不等待，不会与发送循环中的消息交错）
+                if opcode == _OP_CLOSE:
+                    viewer.write(_OP_CLOSE, payload[:2])
+                    break
+                if opcode == _OP_PING:
+                    viewer.write(_OP_PONG, payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            viewer.close()
+
+    async def _serve_chunked(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        writer.write(("HTTP/1.1 200 OK\r\n"
+                      "Content-Type: video/mp4\r\n"
+                      "Transfer-Encoding: chunked\r\n"
+                      "Cache-Control: no-store\r\n"
+                      "Access-Control-Allow-Origin: *\r\n"
+                      "Connection: close\r\n\r\n").encode('latin-1'))
+        viewer = self._add_viewer(writer, websocket=False)
+        reader_task = asyncio.create_task(self._wait_disconnect(reader, viewer))
+        try:
+            await self._send_loop(viewer)
+            writer.write(b'0\r\n\r\n')
+        finally:
+            reader_task.cancel()
+            self._remove_viewer(viewer)
+
+    async def _wait_disconnect(self, reader: asyncio.StreamReader, viewer: MSEViewer):
+        """客户端关闭连接时立即结束观众（不必等到下一次写入失败）"""
+        try:
+            while await reader.read(4096):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            viewer.close()
+
+    def _add_viewer(self, writer: asyncio.StreamWriter, websocket: bool) -> MSEViewer:
+        """登记观众，先放入初始化段和当前GOP缓存（即时起播）"""
+        self._next_viewer += 1
+        viewer = MSEViewer(f"mse-{self._next_viewer}", writer, websocket)
+        if self.packager.init_segment and self.gop_cache:
+            viewer.enqueue(_OP_TEXT, self._codec_message())
+            viewer.enqueue(_OP_BINARY, self.packager.init_segment)
+            for fragment in self.gop_cache:
+                viewer.enqueue(_OP_BINARY, fragment)
+        else:
+            viewer.waiting_keyframe = True
+        self.viewers[viewer.viewer_id] = viewer
+        self.stats["connected_clients"] += 1
+        logger.info(f"MSE viewer connected: {viewer.viewer_id} ({'websocket' if websocket else 'chunked'})")
+        self.emit("client_connected", viewer.viewer_id)
+        return viewer
+
+    def _remove_viewer(self, viewer: MSEViewer):
+        viewer.close()
+        if self.viewers.pop(viewer.viewer_id, None):
+            self.stats["connected_clients"] -= 1
+            logger.info(f"MSE viewer disconnected: {viewer.viewer_id}")
+            self.emit("client_disconnected", viewer.viewer_id)
+
+    async def _send_loop(self, viewer: MSEViewer):
+        """把观众队列中的片段写入连接；drain() 只阻塞这一个观众"""
+        while self.is_running and not viewer.closed:
+            await viewer.event.wait()
+            viewer.event.clear()
+            while viewer.queue and not viewer.closed:
+                opcode, payload = viewer.queue.popleft()
+                viewer.write(opcode, payload)
+                await viewer.writer.drain()
+                if opcode == _OP_BINARY:
+                    viewer.fragments_sent += 1
+                    self.stats["frames_sent"] += 1
+                    self.stats["bytes_sent"] += len(payload)
+
+    def get_session_info(self) -> Dict[str, Any]:
+        """获取观众信息"""
+        return {
+            'viewers': len(self.viewers),
+            'codec': self.packager.codec,
+            'resolution': self.packager.resolution,
+            'gop_cache_frames': len(self.gop_cache),
+            'sessions': [
+                {
+                    'id': v.viewer_id,
+                    'transport': 'websocket' if v.websocket else 'chunked',
+                    'queued': len(v.queue),
+                    'fragments_sent': v.fragments_sent,
+                    'fragments_dropped': v.fragments_dropped,
+                    'bytes_sent': v.bytes_sent
+                }
+                for v in self.viewers.values()
+            ]
+        }
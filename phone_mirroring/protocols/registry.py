@@ -0,0 +1,70 @@
+"""
+协议注册表
+协议名称映射到实现所在的模块和类名，只在第一次取用时导入，
+未启用的协议（及其依赖的aiortc、av、numpy等）不会被加载
+"""
+
+import importlib
+import logging
+import threading
+from typing import Dict, List, Tuple, Type
+
+from .base import BaseProtocol
+
+logger = logging.getLogger(__name__)
+
+# 内置协议：名称 -> (模块, 类名)，名称与 Config.enabled_protocols 一致
+_REGISTRY: Dict[str, Tuple[str, str]] = {
+    "RTSP": ("phone_mirroring.protocols.rtsp", "RTSPProtocol"),
+    "ADB": ("phone_mirroring.protocols.adb", "ADBProtocol"),
+    "MSE": ("phone_mirroring.protocols.mse", "MSEProtocol"),
+    "WebRTC": ("phone_mirroring.protocols.webrtc", "WebRTCProtocol"),
+}
+
+_loaded: Dict[str, Type[BaseProtocol]] = {}
+_lock = threading.Lock()
+
+def _key(name: str) -> str:
+    """协议名称不区分大小写（"webrtc" 与 "WebRTC" 相同）"""
+    for registered in _REGISTRY:
+        if registered.lower() == name.lower():
+            return registered
+    raise KeyError(f"Unknown protocol: {name}")
+
+def register_protocol(name: str, module: str, class_name: str):
+    """注册协议实现（模块在第一次 get_protocol_class 时才导入）"""
+    with _lock:
+        try:
+            name = _key(name)
+        except KeyError:
+            pass
+        _REGISTRY[name] = (module, class_name)
+        _loaded.pop(name, None)
+
+def get_protocol_class(name: str) -> Type[BaseProtocol]:
+    """取协议实现类，按需导入其模块
+
+    Raises:
+        KeyError: 未注册的协议
+        ImportError: 协议模块或其依赖无法导入
+    """
+    key = _key(name)
+    cls = _loaded.get(key)
+    if cls is not None:
+        return cls
+
+    with _lock:
+        module_name, class_name = _REGISTRY[key]
+        module = importlib.import_module(module_name)
+        cls = getattr(module, class_name)
+        _loaded[key] = cls
+        logger.debug(f"Loaded protocol {key} from {module_name}")
+        return cls
+
+def available_protocols() -> List[str]:
+    """已注册的协议名称"""
+    return list(_REGISTRY)
+
+def is_protocol_loaded(name: str) -> bool:
+    """协议模块是否已经导入"""
+    return _key(name) in _loaded
@@ -4,15 +4,21 @@ RTSP协议实现
 """
 
 import asyncio
+import base64
 import logging
 import socket
 import struct
 import time
 import random
 import threading
-from typing import Dict, Any, Optional, List, Callable, Tuple
+from typing import Dict, Any, Optional, List, Callable, Tuple, Iterable
 from enum import Enum
+from urllib.parse import urlparse
 from .base import BaseProtocol
+from ..nal_parser import find_nal_units, extract_parameter_sets
+from ..media_frame import MediaFrame
+from ..renditions import Rendition, ClientRendition
+from ..frame_clock import FrameClock
 
 logger = logging.getLogger(__name__)
 
@@ -140,6 +146,39 @@ class H264Packetizer:
         
         return packets
     
+    def packetize_access_unit(self, au_data: bytes, timestamp: int = None) -> List[RTPPacket]:
+        """将完整的访问单元（可含多个NAL单元）分包为RTP包
+        
+        每个NAL单元独立封装，只有访问单元的最后一个RTP包设置marker位。
+        """
+        return self.packetize_nals((au_data[begin:end] for begin, end in find_nal_units(au_data)), timestamp)
+    
+    def packetize_nals(self, nals: Iterable, timestamp: int = None) -> List[RTPPacket]:
+        """将一个访问单元的NAL单元序列（不含起始码，bytes或memoryview）分包为RTP包
+        
+        单一NAL包直接引用传入的NAL数据，不拷贝。
+        """
+        if timestamp is None:
+            timestamp = self.last_timestamp + self.timestamp_increment
+        self.last_timestamp = timestamp
+        
+        packets = []
+        for nal_data in nals:
+            if not len(nal_data):
+                continue
+            if len(nal_data) <= self.mtu:
+                nal_packets = [self._create_single_nal_packet(nal_data, timestamp)]
+            else:
+                nal_packets = self._create_fragmented_packets(nal_data, timestamp)
+            for packet in nal_packets:
+                packet.marker = 0
+            packets.extend(nal_packets)
+        
+        if packets:
+            packets[-1].marker = 1
+        
+        return packets
+    
     def _remove_start_code(self, data: bytes) -> bytes:
         """移除H.264起始码"""
         # 检查4字节起始码
@@ -222,6 +261,128 @@ class H264Packetizer:
         self.sequence_number = (self.sequence_number + 1) & 0xFFFF
         return self.sequence_number
 
+class RTCPReceiver(asyncio.DatagramProtocol):
+    """RTCP接收端，解析客户端发回的反馈报文"""
+    
+    # RTCP包类型
+    PT_SR = 200
+    PT_RR = 201
+    PT_RTPFB = 205
+    PT_PSFB = 206
+    
+    # 反馈消息格式
+    RTPFB_NACK = 1
+    PSFB_PLI = 1
+    PSFB_FIR = 4
+    PSFB_AFB = 15  # 应用层反馈（REMB）
+    
+    def __init__(self, on_keyframe_request: Callable[[Tuple[str, int], str], None],
+                 loss_threshold: float = 0.05,
+                 on_receiver_report: Optional[Callable[[Tuple[str, int], Optional[float], Optional[int]], None]] = None,
+                 loss_reports: int = 3):
+        self.on_keyframe_request = on_keyframe_request
+        self.on_receiver_report = on_receiver_report
+        self.loss_threshold = loss_threshold
+        # 连续多少个接收报告丢包率超过阈值才请求关键帧（偶发丢包不触发）
+        self.loss_reports = loss_reports
+        self._loss_streak: Dict[Optional[Tuple[str, int]], int] = {}
+        self.transport = None
+        self.packets_received = 0
+    
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]):
+        self.packets_received += 1
+        reason = self.parse_keyframe_request(data, addr)
+        if reason:
+            self.on_keyframe_request(addr, reason)
+        
+        if self.on_receiver_report:
+            fraction_lost, remb = self.parse_receiver_report(data)
+            if fraction_lost is not None or remb is not None:
+                self.on_receiver_report(addr, fraction_lost, remb)
+    
+    def parse_keyframe_request(self, data: bytes, addr: Optional[Tuple[str, int]] = None) -> Optional[str]:
+        """解析复合RTCP包，返回需要关键帧的原因（pli/fir/loss），否则返回None
+        
+        NACK 只表示个别包丢失，不请求关键帧（客户端解码失败时会发PLI）；
+        丢包率超过阈值的接收报告按客户端计数，连续 loss_reports 个才返回 loss。
+        """
+        lossy = None
+        offset = 0
+        while offset + 4 <= len(data):
+            first, packet_type, length = struct.unpack_from('!BBH', data, offset)
+            if first >> 6 != 2:
+                break
+            
+            fmt = first & 0x1F
+            end = offset + (length + 1) * 4
+            
+            if packet_type == self.PT_PSFB and fmt == self.PSFB_PLI:
+                return 'pli'
+            if packet_type == self.PT_PSFB and fmt == self.PSFB_FIR:
+                return 'fir'
+            if packet_type in (self.PT_SR, self.PT_RR):
+                # 接收报告块：SR头部28字节，RR头部8字节，每块24字节
+                block = offset + (28 if packet_type == self.PT_SR else 8)
+                for _ in range(fmt):
+                    if block + 24 > min(end, len(data)):
+                        break
+                    lossy = bool(lossy) or data[block + 4] / 256 >= self.loss_threshold
+                    block += 24
+            
+            offset = end
+        
+        if lossy is None:
+            return None
+        if not lossy:
+            self._loss_streak.pop(addr, None)
+            return None
+        streak = self._loss_streak.get(addr, 0) + 1
+        if streak < self.loss_reports:
+            self._loss_streak[addr] = streak
+            return None
+        self._loss_streak.pop(addr, None)
+        return 'loss'
+    
+    def parse_receiver_report(self, data: bytes) -> Tuple[Optional[float], Optional[int]]:
+        """解析复合RTCP包中的带宽信息
+        
+        Returns:
+            (接收报告中最大的丢包率, REMB估计带宽bps)，没有对应报文时为None
+        """
+        fraction_lost = None
+        remb = None
+        offset = 0
+        while offset + 4 <= len(data):
+            first, packet_type, length = struct.unpack_from('!BBH', data, offset)
+            if first >> 6 != 2:
+                break
+            
+            fmt = first & 0x1F
+            end = min(offset + (length + 1) * 4, len(data))
+            
+            if packet_type in (self.PT_SR, self.PT_RR):
+                block = offset + (28 if packet_type == self.PT_SR else 8)
+                for _ in range(fmt):
+                    if block + 24 > end:
+                        break
+                    fraction_lost = max(fraction_lost or 0.0, data[block + 4] / 256)
+                    block += 24
+            elif packet_type == self.PT_PSFB and fmt == self.PSFB_AFB:
+                # 通用头4字节 + 发送端SSRC + 媒体SSRC，之后为 'REMB' 标识
+                fci = offset + 12
+                if fci + 8 <= end and data[fci:fci + 4] == b'REMB':
+                    exponent = data[fci + 5] >> 2
+                    mantissa = ((data[fci + 5] & 0x03) << 16) | (data[fci + 6] << 8) | data[fci + 7]
+                    remb = mantissa << exponent
+            
+            offset = offset + (length + 1) * 4
+        
+        return fraction_lost, remb
+
+
 class RTSPClientSession:
     """RTSP客户端会话"""
     
@@ -245,6 +406,16 @@ class RTSPClientSession:
         # RTP socket
         self.rtp_socket: Optional[socket.socket] = None
         
+        # Simulcast档位分配；不同档位的序列号各自独立，
+        # 发送时加上偏移量保证客户端看到的序列号连续
+        self.rendition: Optional[ClientRendition] = None
+        self.sequence_offset = 0
+        self.last_sequence: Optional[int] = None
+        self.initial_sequence = 0
+        
+        # 请求的挂载点（多路设备共用服务时），None为默认码流
+        self.mount: Optional[str] = None
+        
         # 统计信息
         self.frames_sent = 0
         self.bytes_sent = 0
@@ -270,6 +441,11 @@ class RTSPClientSession:
         
         try:
             data = packet.pack()
+            sequence = (packet.sequence_number + self.sequence_offset) & 0xFFFF
+            if self.sequence_offset:
+                data = bytearray(data)
+                struct.pack_into('!H', data, 2, sequence)
+            self.last_sequence = sequence
             self.rtp_socket.sendto(data, (self.address[0], self.rtp_port))
             self.frames_sent += 1
             self.bytes_sent += len(data)
@@ -307,21 +483,49 @@ class RTSPProtocol(BaseProtocol):
         self.rtp_port_start = config.get("rtp_port_start", 5000)
         self.next_rtp_port = self.rtp_port_start
         
+        # 当前码流的参数集（SPS, PPS），编码器重新配置后会变化
+        self.parameter_sets: Optional[Tuple[bytes, bytes]] = None
+        
         # SDP信息
         self.sdp_info = self._generate_sdp()
         
         # H.264分包器
         self.packetizer = H264Packetizer(mtu=1400)
         
-        # 视频流任务
+        # Simulcast档位（按码率从高到低），每个档位独立分包、独立跟踪参数集
+        self.renditions: List[Rendition] = []
+        self.rendition_packetizers: Dict[str, H264Packetizer] = {}
+        self.rendition_parameter_sets: Dict[str, Tuple[bytes, bytes]] = {}
+        
+        # 挂载点（rtsp://host:port/<名称>/），多路码流共用一个服务：
+        # 每路独立分包、独立跟踪参数集，只发送给请求该路径的客户端
+        self.mount_packetizers: Dict[str, H264Packetizer] = {}
+        self.mount_parameter_sets: Dict[str, Tuple[bytes, bytes]] = {}
+        
+        # 视频流任务（按帧率的绝对截止时间轮询数据源）
         self.video_stream_task: Optional[asyncio.Task] = None
         self.is_streaming = False
+        self.stream_clock = FrameClock(config.get("fps", 30))
         
         # 视频数据源回调
-        self.video_source_callback: Optional[Callable[[], bytes]] = None
+        self.video_source_callback: Optional[Callable[[], Any]] = None
+        
+        # RTCP反馈接收（服务端RTCP端口）
+        self.rtcp_transport = None
+        self.keyframe_loss_threshold = config.get("keyframe_loss_threshold", 0.05)
+        self.stats["keyframe_requests"] = 0
     
-    def _generate_sdp(self) -> str:
-        """生成SDP信息"""
+    def _generate_sdp(self, mount: Optional[str] = None) -> str:
+        """生成SDP信息（mount不为空时使用该挂载点的参数集）"""
+        parameter_sets = self.mount_parameter_sets.get(mount) if mount else self.parameter_sets
+        if parameter_sets:
+            sps, pps = parameter_sets
+            profile_level_id = sps[1:4].hex().upper()
+            sprop = ','.join(base64.b64encode(p).decode('ascii') for p in (sps, pps))
+        else:
+            profile_level_id = '42001E'
+            sprop = 'Z0LAHtkAo8or0EQAAAADAEAAAAwgbgIAAV7AAH8eMGUA==,aM48gA=='
+        
         return f"""v=0
 o=- {int(time.time())} {int(time.time())} IN IP4 0.0.0.0
 s=Phone Mirroring Session
@@ -332,7 +536,7 @@ a=tool:PhoneMirroring/1.0
 a=type:broadcast
 m=video {self.rtp_port_start} RTP/AVP 96
 a=rtpmap:96 H264/90000
-a=fmtp:96 packetization-mode=1;profile-level-id=42001E;sprop-parameter-sets=Z0LAHtkAo8or0EQAAAADAEAAAAwgbgIAAV7AAH8eMGUA==,aM48gA==
+a=fmtp:96 packetization-mode=1;profile-level-id={profile_level_id};sprop-parameter-sets={sprop}
 a=control:trackID=1
 a=framerate:30.0
 m=audio {self.rtp_port_start + 2} RTP/AVP 97
@@ -356,6 +560,16 @@ a=control:trackID=2"""
             loop = asyncio.get_event_loop()
             self.accept_task = loop.create_task(self._accept_connections())
             
+            # 监听客户端RTCP反馈（SETUP中声明的server_port）
+            try:
+                self.rtcp_transport, _ = await loop.create_datagram_endpoint(
+                    lambda: RTCPReceiver(self._on_rtcp_keyframe_request, self.keyframe_loss_threshold,
+                                         self._on_rtcp_receiver_report),
+                    local_addr=('0.0.0.0', self.rtp_port_start + 1)
+                )
+            except OSError as e:
+                logger.warning(f"RTCP feedback disabled, cannot bind port {self.rtp_port_start + 1}: {e}")
+            
             logger.info(f"RTSP Server started on port {self.rtsp_port}")
             self.emit("started")
             return True
@@ -391,6 +605,10 @@ a=control:trackID=2"""
             if self.server_socket:
                 self.server_socket.close()
             
+            if self.rtcp_transport:
+                self.rtcp_transport.close()
+                self.rtcp_transport = None
+            
             self.clients.clear()
             self.client_tasks.clear()
             
@@ -435,7 +653,7 @@ a=control:trackID=2"""
         loop = asyncio.get_event_loop()
         
         try:
-            while self.is_running and session.state != RTSPState.INIT:
+            while self.is_running:
                 try:
                     # 接收RTSP请求
                     data = await loop.sock_recv(session.socket, 4096)
@@ -451,6 +669,10 @@ a=control:trackID=2"""
                     
                     self.stats["bytes_received"] += len(data)
                     
+                    # TEARDOWN后结束会话（新会话初始状态也是INIT，不能只靠状态判断）
+                    if request.startswith('TEARDOWN'):
+                        break
+                    
                 except Exception as e:
                     logger.error(f"Error handling client {session.client_id}: {e}")
                     break
@@ -495,13 +717,23 @@ a=control:trackID=2"""
             })
         
         elif method == 'DESCRIBE':
+            mount = self._url_mount(url)
+            if mount is not None and self.mount_packetizers and mount not in self.mount_packetizers:
+                return self._create_response(404, "Not Found", cseq)
+            session.mount = mount if mount in self.mount_packetizers else None
+            
+            sdp = self._generate_sdp(session.mount) if session.mount else self.sdp_info
+            base = f'rtsp://{session.address[0]}:{self.rtsp_port}/' + (f'{session.mount}/' if session.mount else '')
             return self._create_response(200, "OK", cseq, {
                 'Content-Type': 'application/sdp',
-                'Content-Length': str(len(self.sdp_info)),
-                'Content-Base': f'rtsp://{session.address[0]}:{self.rtsp_port}/'
-            }, self.sdp_info)
+                'Content-Length': str(len(sdp)),
+                'Content-Base': base
+            }, sdp)
         
         elif method == 'SETUP':
+            mount = self._url_mount(url)
+            if mount in self.mount_packetizers:
+                session.mount = mount
             return await self._handle_setup(session, headers, cseq)
         
         elif method == 'PLAY':
@@ -538,6 +770,10 @@ a=control:trackID=2"""
             session.setup_transport(self.next_rtp_port, self.next_rtp_port + 1)
             self.next_rtp_port += 2
         
+        if self.renditions:
+            session.rendition = ClientRendition(self.renditions, self._parse_bandwidth(headers))
+            logger.info(f"Client {session.client_id} assigned rendition {session.rendition.target}")
+        
         session.state = RTSPState.READY
         
         transport_response = f"RTP/AVP;unicast;client_port={session.rtp_port}-{session.rtcp_port};server_port={self.rtp_port_start}-{self.rtp_port_start + 1}"
@@ -555,17 +791,24 @@ a=control:trackID=2"""
         
         session.state = RTSPState.PLAYING
         session.start_time = time.time()
+        packetizer = self.mount_packetizers.get(session.mount, self.packetizer)
+        session.initial_sequence = packetizer.sequence_number
+        session.last_sequence = None
         
         # 启动视频流传输
         if not self.is_streaming:
             self.is_streaming = True
+            self.stream_clock.reset()
             self.video_stream_task = asyncio.create_task(self._video_stream_loop())
         
         logger.info(f"Client {session.client_id} started playing")
         
+        # 新观众需要尽快拿到IDR，不必等待下一个GOP
+        self.request_keyframe(session.client_id, "play")
+        
         return self._create_response(200, "OK", cseq, {
             'Session': session.session_id,
-            'RTP-Info': f'url=rtsp://{session.address[0]}:{self.rtsp_port}/trackID=1;seq={self.packetizer.sequence_number}'
+            'RTP-Info': f'url=rtsp://{session.address[0]}:{self.rtsp_port}/trackID=1;seq={packetizer.sequence_number}'
         })
     
     async def _handle_pause(self, session: RTSPClientSession, headers: Dict, cseq: int) -> str:
@@ -591,6 +834,20 @@ a=control:trackID=2"""
             'Session': session.session_id
         })
     
+    def _url_mount(self, url: str) -> Optional[str]:
+        """请求URL路径的第一段（trackID等控制路径除外），没有时返回None"""
+        segment = urlparse(url).path.strip('/').split('/')[0]
+        if not segment or segment.startswith('trackID'):
+            return None
+        return segment
+    
+    def _parse_bandwidth(self, headers: Dict) -> Optional[int]:
+        """解析客户端声明的带宽（RFC 2326 Bandwidth头，单位bps）"""
+        try:
+            return int(headers['Bandwidth']) if 'Bandwidth' in headers else None
+        except ValueError:
+            return None
+    
     def _parse_client_ports(self, transport: str) -> Optional[Tuple[int, int]]:
         """解析客户端端口"""
         try:
@@ -644,37 +901,158 @@ a=control:trackID=2"""
         """视频流发送循环"""
         while self.is_running and self.is_streaming:
             try:
-                # 获取视频数据
-                frame_data = None
-                if self.video_source_callback:
-                    frame_data = self.video_source_callback()
-                
-                if frame_data:
-                    await self._send_video_frame(frame_data)
+                # 取出数据源中所有已就绪的访问单元
+                while self.video_source_callback:
+                    frame = self.video_source_callback()
+                    if not frame:
+                        break
+                    
+                    if isinstance(frame, tuple):
+                        frame_data, metadata = frame
+                    else:
+                        frame_data, metadata = frame, {}
+                    await self._send_video_frame(frame_data, metadata.get('pts'),
+                                                 metadata.get('is_keyframe'),
+                                                 metadata.get('rendition'),
+                                                 metadata.get('mount'))
                 
-                # 控制帧率 (30fps = 33ms)
-                await asyncio.sleep(1/30)
+                # 控制帧率
+                await self.stream_clock.wait_async()
                 
             except Exception as e:
                 logger.error(f"Error in video stream loop: {e}")
                 await asyncio.sleep(0.1)
     
-    async def _send_video_frame(self, frame_data: bytes):
-        """发送视频帧到所有播放中的客户端"""
-        # 分包
-        timestamp = int(time.time() * 90000)  # 90kHz时钟
-        packets = self.packetizer.packetize(frame_data, timestamp)
+    def _update_parameter_sets(self, frame_data: bytes, is_keyframe: Optional[bool],
+                               rendition: Optional[str] = None, mount: Optional[str] = None) -> bytes:
+        """跟踪访问单元中的SPS/PPS
+        
+        参数集变化（编码器重新配置）时重新生成SDP并通知；
+        已知的关键帧缺少参数集时在前面补上，保证播放中的客户端能在带内拿到。
+        Simulcast时每个档位单独跟踪，SDP使用最高档位的参数集；挂载点各自单独跟踪。
+        """
+        sps, pps = extract_parameter_sets(frame_data)
+        missing = self._track_parameter_sets(sps, pps, is_keyframe, rendition, mount)
+        if missing:
+            frame_data = b'\x00\x00\x00\x01' + missing[0] + b'\x00\x00\x00\x01' + missing[1] + frame_data
+        return frame_data
+    
+    def _track_parameter_sets(self, sps: Optional[bytes], pps: Optional[bytes], is_keyframe: Optional[bool],
+                              rendition: Optional[str] = None,
+                              mount: Optional[str] = None) -> Optional[Tuple[bytes, bytes]]:
+        """记录访问单元中的SPS/PPS
+        
+        Returns:
+            需要补在关键帧前面的 (SPS, PPS)，不需要时为None
+        """
+        tracked = None
+        if mount is not None:
+            tracked = self.mount_parameter_sets
+            key = mount
+        elif rendition is not None and rendition != self.renditions[0].name:
+            tracked = self.rendition_parameter_sets
+            key = rendition
+        
+        if tracked is not None:
+            if sps and pps:
+                tracked[key] = (sps, pps)
+            elif is_keyframe and key in tracked:
+                return tracked[key]
+            return None
+        
+        if sps and pps:
+            if (sps, pps) != self.parameter_sets:
+                changed = self.parameter_sets is not None
+                self.parameter_sets = (sps, pps)
+                self.sdp_info = self._generate_sdp()
+                if changed:
+                    logger.info("H.264 parameter sets changed, SDP re-announced")
+                    self.emit("parameter_sets_changed", sps, pps)
+        elif is_keyframe and self.parameter_sets and not sps and not pps:
+            return self.parameter_sets
+        
+        return None
+    
+    def _frame_nals(self, frame: MediaFrame, is_keyframe: Optional[bool], rendition: Optional[str],
+                    mount: Optional[str], sei: Optional[bytes]) -> List:
+        """MediaFrame 的NAL单元视图（不拷贝），按需在前面补参数集、在第一个切片前插入SEI"""
+        nals = []
+        if is_keyframe is not False:
+            sps, pps = frame.parameter_sets()
+            missing = self._track_parameter_sets(sps, pps, is_keyframe, rendition, mount)
+            if missing:
+                nals.extend(missing)
+        for nal in frame.iter_nals():
+            if sei is not None and 1 <= (nal[0] & 0x1F) <= 5:
+                nals.append(sei)
+                sei = None
+            nals.append(nal)
+        return nals
+    
+    async def _send_video_frame(self, frame_data, pts: Optional[float] = None,
+                                is_keyframe: Optional[bool] = None, rendition: Optional[str] = None,
+                                mount: Optional[str] = None, sei: Optional[bytes] = None):
+        """发送视频帧到所有播放中的客户端
+        
+        Args:
+            frame_data: 完整的H.264访问单元（Annex-B格式的bytes或MediaFrame）
+            pts: 采集时间戳（秒），为None时使用当前时间
+            is_keyframe: 是否为关键帧，None表示未知（非关键帧不检查参数集）
+            rendition: Simulcast档位名称，只发送给分配到该档位的客户端
+            mount: 挂载点名称，只发送给请求该路径的客户端
+            sei: 插入第一个切片之前的SEI NAL单元（不含起始码），仅用于MediaFrame
+        """
+        if mount is not None and mount not in self.mount_packetizers:
+            return
+        if rendition is not None and rendition not in self.rendition_packetizers:
+            rendition = None
+        
+        # 分包（90kHz时钟）
+        timestamp = int((pts if pts is not None else time.time()) * 90000) & 0xFFFFFFFF
+        if mount is not None:
+            packetizer = self.mount_packetizers[mount]
+        else:
+            packetizer = self.rendition_packetizers[rendition] if rendition else self.packetizer
+        
+        if isinstance(frame_data, MediaFrame):
+            # 直接按NAL索引切片分包，帧负载不拷贝
+            packets = packetizer.packetize_nals(self._frame_nals(frame_data, is_keyframe, rendition, mount, sei),
+                                                timestamp)
+        else:
+            if is_keyframe is not False:
+                frame_data = self._update_parameter_sets(frame_data, is_keyframe, rendition, mount)
+            packets = packetizer.packetize_access_unit(frame_data, timestamp)
+        if not packets:
+            return
         
         # 发送到每个播放中的客户端
         for session in list(self.clients.values()):
-            if session.state == RTSPState.PLAYING:
-                for packet in packets:
-                    session.send_rtp_packet(packet)
+            if session.state != RTSPState.PLAYING or session.mount != mount:
+                continue
+            
+            if rendition and session.rendition:
+                previous = session.rendition.current
+                if not session.rendition.accept(rendition, bool(is_keyframe)):
+                    continue
+                if session.rendition.current != previous or session.last_sequence is None:
+                    # 切换档位：接上客户端已收到的序列号
+                    expected = session.initial_sequence if session.last_sequence is None else session.last_sequence + 1
+                    session.sequence_offset = (expected - packets[0].sequence_number) & 0xFFFF
+            
+            for packet in packets:
+                session.send_rtp_packet(packet)
     
-    async def send_frame(self, frame_data: bytes, metadata: Dict[str, Any]) -> bool:
-        """发送视频帧（供外部调用）"""
+    async def send_frame(self, frame_data, metadata: Dict[str, Any]) -> bool:
+        """发送视频帧（供外部调用）
+        
+        frame_data 可以是bytes或MediaFrame（调用期间有效，返回后不再引用）；
+        metadata 中的 sei 为插入MediaFrame第一个切片之前的SEI NAL单元。
+        """
         try:
-            await self._send_video_frame(frame_data)
+            metadata = metadata or {}
+            await self._send_video_frame(frame_data, metadata.get('pts'),
+                                         metadata.get('is_keyframe'), metadata.get('rendition'),
+                                         metadata.get('mount'), metadata.get('sei'))
             self.stats["bytes_sent"] += len(frame_data)
             self.stats["frames_sent"] += 1
             return True
@@ -699,8 +1077,82 @@ a=control:trackID=2"""
             self.stats["errors"] += 1
             return False
     
-    def set_video_source(self, callback: Callable[[], bytes]):
-        """设置视频数据源回调"""
+    def request_keyframe(self, client_id: Optional[str], reason: str):
+        """向视频源请求关键帧（通过keyframe_requested事件）"""
+        self.stats["keyframe_requests"] += 1
+        logger.debug(f"Keyframe requested by {client_id}: {reason}")
+        self.emit("keyframe_requested", client_id, reason)
+    
+    def _on_rtcp_keyframe_request(self, addr: Tuple[str, int], reason: str):
+        """RTCP反馈触发的关键帧请求"""
+        client_id = None
+        for session in self.clients.values():
+            if session.address[0] == addr[0] and session.rtcp_port == addr[1]:
+                client_id = session.client_id
+                break
+        self.request_keyframe(client_id, reason)
+    
+    def _on_rtcp_receiver_report(self, addr: Tuple[str, int], fraction_lost: Optional[float],
+                                 remb: Optional[int]):
+        """RTCP接收报告/REMB更新客户端带宽估计，目标档位变化时请求该档位的IDR"""
+        for session in self.clients.values():
+            if session.address[0] != addr[0] or session.rtcp_port != addr[1] or not session.rendition:
+                continue
+            
+            changed = False
+            if remb is not None:
+                changed = session.rendition.on_bandwidth_hint(remb) or changed
+            if fraction_lost is not None:
+                changed = session.rendition.on_loss_report(fraction_lost) or changed
+            
+            if changed and session.rendition.switching:
+                logger.info(f"Client {session.client_id} switching to rendition {session.rendition.target} "
+                            f"(estimated {session.rendition.estimator.estimate / 1000:.0f}kbps)")
+                self.request_keyframe(session.client_id, "rendition")
+            break
+    
+    def set_renditions(self, renditions: List[Rendition]):
+        """启用Simulcast：视频源输出的元数据需带 'rendition' 字段
+        
+        各档位分包器共用同一个SSRC，客户端切换档位时看到的是同一路流。
+        """
+        self.renditions = list(renditions)
+        self.rendition_packetizers = {}
+        for rendition in self.renditions:
+            packetizer = H264Packetizer(mtu=self.packetizer.mtu)
+            packetizer.ssrc = self.packetizer.ssrc
+            self.rendition_packetizers[rendition.name] = packetizer
+    
+    def client_rendition(self, client_id: Optional[str]) -> Optional[str]:
+        """客户端的目标档位（关键帧请求应发往该档位），未启用Simulcast时返回None"""
+        session = self.clients.get(client_id) if client_id else None
+        if session and session.rendition:
+            return session.rendition.target
+        return None
+    
+    def add_mount(self, name: str):
+        """添加挂载点 rtsp://host:port/<name>/，视频源元数据中 'mount' 为该名称的帧只发往这里"""
+        if name in self.mount_packetizers:
+            return
+        self.mount_packetizers[name] = H264Packetizer(mtu=self.packetizer.mtu)
+        logger.info(f"RTSP mount added: /{name}/")
+    
+    def remove_mount(self, name: str):
+        """移除挂载点（已连接的客户端不再收到数据）"""
+        self.mount_packetizers.pop(name, None)
+        self.mount_parameter_sets.pop(name, None)
+        logger.info(f"RTSP mount removed: /{name}/")
+    
+    def client_mount(self, client_id: Optional[str]) -> Optional[str]:
+        """客户端请求的挂载点，None表示默认码流或未知客户端"""
+        session = self.clients.get(client_id) if client_id else None
+        return session.mount if session else None
+    
+    def set_video_source(self, callback: Callable[[], Any]):
+        """设置视频数据源回调
+        
+        回调返回 bytes 或 (访问单元数据, 元数据) 元组，无数据时返回None
+        """
         self.video_source_callback = callback
     
     def get_session_info(self) -> Dict[str, Any]:
@@ -708,12 +1160,16 @@ a=control:trackID=2"""
         return {
             'clients': len(self.clients),
             'streaming': self.is_streaming,
+            'stream_clock': self.stream_clock.get_stats(),
+            'mounts': list(self.mount_packetizers),
             'sessions': [
                 {
                     'id': s.client_id,
                     'state': s.state.value,
                     'address': s.address,
-                    'frames_sent': s.frames_sent
+                    'mount': s.mount,
+                    'frames_sent': s.frames_sent,
+                    **(s.rendition.get_stats() if s.rendition else {})
                 }
                 for s in self.clients.values()
             ]
@@ -6,21 +6,27 @@ import asyncio
 import json
 import logging
 import time
-from typing import Dict, Any, Optional, List, Set
+from collections import deque
+from fractions import Fraction
+from typing import Dict, Any, Optional, List, Set, Deque, Callable
 from .base import BaseProtocol
+from ..nal_parser import iter_nal_units, extract_parameter_sets, NAL_TYPE_IDR
 
 logger = logging.getLogger(__name__)
 
 try:
     import aiohttp
     import websockets
-    from aiortc import RTCPeerConnection, RTCSessionDescription, RTCConfiguration, RTCIceServer
+    from aiortc import RTCPeerConnection, RTCSessionDescription, RTCConfiguration, RTCIceServer, RTCRtpSender
     from aiortc.contrib.media import MediaStreamTrack, MediaPlayer, MediaRecorder
-    from av import VideoFrame, AudioFrame
+    from aiortc.mediastreams import MediaStreamError
+    from av import VideoFrame, AudioFrame, Packet
     WEBRTC_AVAILABLE = True
 except ImportError:
     logger.warning("WebRTC dependencies not installed. Please install: pip install aiohttp websockets aiortc av")
     WEBRTC_AVAILABLE = False
+    # 让模块仍可导入，start() 时报告依赖缺失
+    MediaStreamTrack = object
 
 class WebRTCTrack(MediaStreamTrack):
     """WebRTC媒体轨道"""
@@ -64,6 +70,83 @@ class WebRTCTrack(MediaStreamTrack):
         self._ended = True
         self._queue.put_nowait(None)
 
+# RTP视频时钟（90kHz）
+VIDEO_TIME_BASE = Fraction(1, 90000)
+
+class H264PassthroughTrack(MediaStreamTrack):
+    """H.264直通视频轨道
+    
+    recv() 返回已编码的访问单元（av.Packet），aiortc 对 Packet 不解码也不重新编码，
+    直接交给H.264 RTP打包器（H264Encoder.pack），每个观众只有打包的开销。
+    每个观众一条轨道（aiortc的每个发送器都会调用 recv()）：
+    新轨道从关键帧开始，观众跟不上时丢弃积压的帧并等待下一个关键帧。
+    """
+    
+    kind = "video"
+    
+    def __init__(self, max_frames: int = 30):
+        super().__init__()
+        self.max_frames = max_frames
+        self.on_keyframe_needed: Optional[Callable[[], None]] = None
+        self._queue: Deque[Packet] = deque()
+        self._event = asyncio.Event()
+        self._waiting_keyframe = True
+        self.stats = {"frames": 0, "dropped": 0, "bytes": 0}
+    
+    def put_access_unit(self, data: bytes, pts: float, is_keyframe: bool) -> bool:
+        """放入一个Annex-B访问单元
+        
+        Args:
+            data: 完整的访问单元（关键帧应带SPS/PPS）
+            pts: 显示时间戳（秒）
+            is_keyframe: 是否为IDR帧
+        
+        Returns:
+            是否入队（等待关键帧时丢弃的帧返回False）
+        """
+        if self.readyState != "live":
+            return False
+        
+        if len(self._queue) >= self.max_frames:
+            # 观众跟不上：丢弃积压的帧，之后的帧依赖被丢弃的帧，从下一个关键帧继续
+            self.stats["dropped"] += len(self._queue)
+            self._queue.clear()
+            if not self._waiting_keyframe and self.on_keyframe_needed:
+                self.on_keyframe_needed()
+            self._waiting_keyframe = True
+        
+        if is_keyframe:
+            self._waiting_keyframe = False
+        elif self._waiting_keyframe:
+            self.stats["dropped"] += 1
+            return False
+        
+        packet = Packet(data)
+        packet.pts = int(pts * 90000)
+        packet.time_base = VIDEO_TIME_BASE
+        self._queue.append(packet)
+        self._event.set()
+        return True
+    
+    async def recv(self):
+        """取下一个已编码的访问单元（aiortc的发送器调用）"""
+        while not self._queue:
+            if self.readyState != "live":
+                raise MediaStreamError
+            self._event.clear()
+            await self._event.wait()
+        
+        packet = self._queue.popleft()
+        self.stats["frames"] += 1
+        self.stats["bytes"] += packet.size
+        return packet
+    
+    def stop(self):
+        """停止轨道，唤醒等待中的 recv()"""
+        super().stop()
+        self._queue.clear()
+        self._event.set()
+
 class WebRTCProtocol(BaseProtocol):
     """WebRTC协议实现"""
     
@@ -73,14 +156,17 @@ class WebRTCProtocol(BaseProtocol):
         self.websockets: Dict[str, websockets.WebSocketServerProtocol] = {}
         self.http_session: Optional[aiohttp.ClientSession] = None
         self.server: Optional[websockets.WebSocketServer] = None
-        self.video_track: Optional[WebRTCTrack] = None
+        # 每个观众一条H.264直通轨道
+        self.video_tracks: Dict[str, H264PassthroughTrack] = {}
         self.audio_track: Optional[WebRTCTrack] = None
+        self.parameter_sets: Optional[tuple] = None
         
         # WebRTC配置
         self.signaling_port = config.get("signaling_port", 8081)
+        self.max_queue_frames = config.get("max_queue_frames", 30)
         self.ice_servers = [
-            RTCIceServer("stun:stun.l.google.com:19302")
-        ] + config.get("ice_servers", [])
+            RTCIceServer(url) for url in config.get("stun_servers", ["stun:stun.l.google.com:19302"])
+        ] + config.get("ice_servers", []) if WEBRTC_AVAILABLE else []
         
         if not WEBRTC_AVAILABLE:
             logger.error("WebRTC dependencies not available")
@@ -98,8 +184,7 @@ class WebRTCProtocol(BaseProtocol):
             # 创建HTTP会话
             self.http_session = aiohttp.ClientSession()
             
-            # 创建媒体轨道
-            self.video_track = WebRTCTrack("video")
+            # 创建音频轨道（视频轨道在观众连接时创建）
             self.audio_track = WebRTCTrack("audio")
             
             # 启动WebSocket信令服务器
@@ -128,8 +213,9 @@ class WebRTCProtocol(BaseProtocol):
                 await connection.close()
             
             # 停止媒体轨道
-            if self.video_track:
-                self.video_track.stop()
+            for track in self.video_tracks.values():
+                track.stop()
+            self.video_tracks.clear()
             if self.audio_track:
                 self.audio_track.stop()
             
@@ -150,7 +236,7 @@ class WebRTCProtocol(BaseProtocol):
             logger.error(f"Error stopping WebRTC server: {e}")
             return False
     
-    async def _handle_websocket(self, websocket, path):
+    async def _handle_websocket(self, websocket, path=None):
         """处理WebSocket信令"""
         client_id = f"{websocket.remote_address[0]}:{websocket.remote_address[1]}_{int(time.time())}"
         self.websockets[client_id] = websocket
@@ -172,6 +258,7 @@ class WebRTCProtocol(BaseProtocol):
             self.stats["errors"] += 1
         finally:
             # 清理连接
+            self._close_video_track(client_id)
             if client_id in self.connections:
                 await self.connections[client_id].close()
                 del self.connections[client_id]
@@ -206,17 +293,27 @@ class WebRTCProtocol(BaseProtocol):
             pc = RTCPeerConnection(configuration)
             self.connections[client_id] = pc
             
-            # 添加媒体轨道
-            if self.video_track:
-                pc.addTrack(self.video_track)
-            if self.audio_track:
+            # 添加媒体轨道：视频为该观众的H.264直通轨道，只协商H.264
+            track = H264PassthroughTrack(self.max_queue_frames)
+            track.on_keyframe_needed = lambda: self.request_keyframe(client_id, "overflow")
+            self._close_video_track(client_id)
+            self.video_tracks[client_id] = track
+            video_sender = pc.addTrack(track)
+            self._prefer_h264(pc, video_sender)
+            self._forward_keyframe_requests(client_id, video_sender)
+            # 只在Offer带音频时添加音频轨道（没有对应m行的收发器会导致Answer失败）
+            if self.audio_track and "m=audio" in data["sdp"]:
                 pc.addTrack(self.audio_track)
             
             # 设置连接事件处理器
             @pc.on("iceconnectionstatechange")
             async def on_iceconnectionstatechange():
                 logger.info(f"ICE connection state for {client_id}: {pc.iceConnectionState}")
+                if pc.iceConnectionState == "completed":
+                    # 新观众需要尽快拿到IDR
+                    self.request_keyframe(client_id, "connected")
                 if pc.iceConnectionState == "failed":
+                    self._close_video_track(client_id)
                     await pc.close()
                     if client_id in self.connections:
                         del self.connections[client_id]
@@ -246,6 +343,43 @@ class WebRTCProtocol(BaseProtocol):
             logger.error(f"Error handling offer for {client_id}: {e}")
             self.stats["errors"] += 1
     
+    @staticmethod
+    def _prefer_h264(pc, sender):
+        """视频只协商H.264：直通的码流只能交给H.264打包器"""
+        codecs = [codec for codec in RTCRtpSender.getCapabilities("video").codecs
+                  if codec.mimeType.lower() == "video/h264"]
+        for transceiver in pc.getTransceivers():
+            if transceiver.sender is sender:
+                transceiver.setCodecPreferences(codecs)
+    
+    def _close_video_track(self, client_id: str):
+        """停止观众的视频轨道"""
+        track = self.video_tracks.pop(client_id, None)
+        if track:
+            track.stop()
+    
+    def _forward_keyframe_requests(self, client_id: str, sender):
+        """将接收端的PLI/FIR转发给视频源
+        
+        aiortc收到PLI/FIR时调用 RTCRtpSender._send_keyframe()，
+        在其基础上额外触发keyframe_requested事件。
+        """
+        send_keyframe = getattr(sender, "_send_keyframe", None)
+        if send_keyframe is None:
+            return
+        
+        def _send_keyframe():
+            send_keyframe()
+            self.request_keyframe(client_id, "pli")
+        
+        sender._send_keyframe = _send_keyframe
+    
+    def request_keyframe(self, client_id: Optional[str], reason: str):
+        """向视频源请求关键帧（通过keyframe_requested事件）"""
+        self.stats["keyframe_requests"] = self.stats.get("keyframe_requests", 0) + 1
+        logger.debug(f"Keyframe requested by {client_id}: {reason}")
+        self.emit("keyframe_requested", client_id, reason)
+    
     async def _handle_answer(self, client_id: str, data: Dict[str, Any]):
         """处理Answer信令"""
         # 通常服务器端不需要处理answer，因为我们是主动发送方
@@ -283,29 +417,35 @@ class WebRTCProtocol(BaseProtocol):
             except Exception as e:
                 logger.error(f"Error sending signaling to {client_id}: {e}")
     
-    async def send_frame(self, frame_data: bytes, metadata: Dict[str, Any]) -> bool:
-        """发送视频帧"""
-        if not WEBRTC_AVAILABLE or not self.video_track:
+    async def send_frame(self, frame_data, metadata: Dict[str, Any]) -> bool:
+        """发送视频帧
+        
+        frame_data 为H.264访问单元（Annex-B格式的bytes或MediaFrame），不解码、不重新编码，
+        原样交给每个观众的直通轨道，由aiortc分包发送。
+        metadata 中的 pts（秒）作为RTP时间戳，is_keyframe 缺省时按NAL类型判断。
+        """
+        if not WEBRTC_AVAILABLE:
             return False
+        if not self.video_tracks:
+            return True
         
         try:
-            # 转换为VideoFrame
-            import cv2
-            import numpy as np
-            
-            # 假设frame_data是H.264编码数据，需要解码
-            # 这里简化处理，实际需要根据编码格式处理
-            nparr = np.frombuffer(frame_data, np.uint8)
-            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            # 轨道队列在本次调用之后仍引用数据，MediaFrame 需要拷贝出来（所有观众共用一份）
+            data = bytes(frame_data)
+            is_keyframe = metadata.get("is_keyframe")
+            if is_keyframe is None:
+                is_keyframe = any(nal[0] & 0x1F == NAL_TYPE_IDR for nal in iter_nal_units(data))
+            if is_keyframe:
+                data = self._with_parameter_sets(data)
             
-            if frame is not None:
-                video_frame = VideoFrame.from_ndarray(frame, format="bgr24")
-                video_frame.pts = int(time.time() * 90000)  # 90kHz时钟
-                video_frame.time_base = None
-                
-                self.video_track.put_frame(video_frame)
-                self.stats["frames_sent"] += 1
+            pts = metadata.get("pts")
+            if pts is None:
+                pts = time.time()
             
+            for track in list(self.video_tracks.values()):
+                if track.put_access_unit(data, pts, is_keyframe):
+                    self.stats["bytes_sent"] += len(data)
+            self.stats["frames_sent"] += 1
             return True
             
         except Exception as e:
@@ -313,6 +453,16 @@ class WebRTCProtocol(BaseProtocol):
             self.stats["errors"] += 1
             return False
     
+    def _with_parameter_sets(self, data: bytes) -> bytes:
+        """记录关键帧的SPS/PPS，缺少时补在前面（浏览器解码IDR前需要参数集）"""
+        sps, pps = extract_parameter_sets(data)
+        if sps and pps:
+            self.parameter_sets = (sps, pps)
+        elif self.parameter_sets:
+            sps, pps = self.parameter_sets
+            data = b'\x00\x00\x00\x01' + sps + b'\x00\x00\x00\x01' + pps + data
+        return data
+    
     async def send_audio(self, audio_data: bytes, metadata: Dict[str, Any]) -> bool:
         """发送音频数据"""
         if not WEBRTC_AVAILABLE or not self.audio_track:
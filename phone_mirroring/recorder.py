@@ -0,0 +1,342 @@
+"""
+录制模块
+把编码器或ADB设备输出的访问单元直接封装（不重新编码）为分段的 fragmented MP4 / MKV 文件
+"""
+
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from fractions import Fraction
+from typing import Optional, Dict, Any, List, Tuple, Iterable, Union, BinaryIO
+
+from phone_mirroring.nal_parser import extract_parameter_sets
+from phone_mirroring.pipeline import StageQueue
+
+logger = logging.getLogger(__name__)
+
+try:
+    import av
+    HAS_AV = True
+except ImportError:
+    HAS_AV = False
+
+# 封装格式 -> (PyAV格式名, 扩展名, 复用器选项)
+CONTAINER_FORMATS = {
+    'mp4': ('mp4', 'mp4', {'movflags': 'frag_keyframe+empty_moov+default_base_moof'}),
+    'mkv': ('matroska', 'mkv', {}),
+}
+
+# 写入文件使用的时间基（与RTP视频时钟一致）
+TIME_BASE = Fraction(1, 90000)
+
+@dataclass
+class RecordingConfig:
+    """录制配置"""
+    output_dir: str = "recordings"
+    format: str = "mp4"                 # mp4（fragmented，崩溃后已写入的片段仍可播放）或 mkv
+    segment_duration: float = 300.0     # 秒，到点后在下一个关键帧切换文件，0表示不按时长切分
+    segment_size: int = 0               # 字节，超过后在下一个关键帧切换文件，0表示不按大小切分
+    buffer_size: int = 4 << 20          # 文件写缓冲，复用器的小块写入合并为大块写入
+    queue_frames: int = 300             # 写入队列长度，满时丢弃最旧帧并等待下一个关键帧
+    filename_prefix: str = "mirror"
+    rendition: Optional[str] = None     # Simulcast时录制的档位，None表示第一个收到的档位
+
+def probe_dimensions(access_unit: bytes) -> Optional[Tuple[int, int]]:
+    """用H.264码流解析器从SPS读出分辨率（不解码）"""
+    context = av.CodecContext.create('h264', 'r')
+    context.parse(access_unit)
+    context.parse(b'')
+    if context.width and context.height:
+        return context.width, context.height
+    return None
+
+class SegmentMuxer:
+    """把以关键帧开始的一段访问单元封装为MP4/MKV（不重新编码）
+
+    可连续打开多个分段，参数集和分辨率在分段之间缓存，只有SPS变化时才重新探测。
+    """
+
+    def __init__(self, format: str = 'mp4'):
+        if format not in CONTAINER_FORMATS:
+            raise ValueError(f"Unsupported container format: {format}")
+        self.format = format
+        self.extension = CONTAINER_FORMATS[format][1]
+        self.frames = 0
+
+        self._file: Optional[BinaryIO] = None
+        self._owns_file = False
+        self._container = None
+        self._stream = None
+        self._start = 0.0
+        self._last_dts = -1
+        self._parameter_sets: Tuple[Optional[bytes], Optional[bytes]] = (None, None)
+        self._dimensions: Optional[Tuple[int, int]] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._container is not None
+
+    @property
+    def start_pts(self) -> float:
+        """当前分段第一帧的pts"""
+        return self._start
+
+    def open(self, output: Union[str, BinaryIO], data: bytes, pts: float, buffer_size: int = 1 << 20) -> bool:
+        """以关键帧 data 开始新分段
+
+        Args:
+            output: 文件路径（按 buffer_size 缓冲写入）或可写的文件对象
+            data: 第一个访问单元（关键帧），从中取SPS/PPS
+            pts: 第一帧的pts（秒），分段内时间戳从0开始
+
+        Returns:
+            False 表示还没有参数集，无法开始分段
+        """
+        sps, pps = extract_parameter_sets(data)
+        if sps and pps:
+            if (sps, pps) != self._parameter_sets:
+                self._parameter_sets = (sps, pps)
+                self._dimensions = probe_dimensions(data)
+        elif self._parameter_sets[0]:
+            sps, pps = self._parameter_sets
+        else:
+            return False
+        if not self._dimensions:
+            return False
+
+        format_name, _, options = CONTAINER_FORMATS[self.format]
+        if isinstance(output, str):
+            self._file = open(output, 'wb', buffering=buffer_size)
+            self._owns_file = True
+        else:
+            self._file = output
+            self._owns_file = False
+        self._container = av.open(self._file, 'w', format=format_name, options=options)
+        self._stream = self._container.add_stream('h264')
+        self._stream.width, self._stream.height = self._dimensions
+        self._stream.time_base = TIME_BASE
+        # Annex-B参数集，复用器自行转换为avcC
+        self._stream.codec_context.extradata = b'\x00\x00\x00\x01' + sps + b'\x00\x00\x00\x01' + pps
+
+        self._start = pts
+        self._last_dts = -1
+        self.frames = 0
+        return True
+
+    def mux(self, data: bytes, metadata: Dict):
+        """写入一个访问单元（metadata 含 pts、is_keyframe，可选 dts）"""
+        pts = metadata.get('pts')
+        if pts is None:
+            pts = time.monotonic()
+
+        # 没有B帧的实时流 dts=pts；文件源提供真实dts
+        dts = round((metadata.get('dts', pts) - self._start) * 90000)
+        if dts <= self._last_dts:
+            dts = self._last_dts + 1
+        self._last_dts = dts
+
+        packet = av.Packet(data)
+        packet.stream = self._stream
+        packet.time_base = TIME_BASE
+        packet.pts = max(dts, round((pts - self._start) * 90000))
+        packet.dts = dts
+        packet.is_keyframe = metadata.get('is_keyframe', False)
+        self._container.mux(packet)
+        self.frames += 1
+
+    def tell(self) -> int:
+        """当前分段已写入的字节数"""
+        return self._file.tell() if self._file else 0
+
+    def close(self) -> int:
+        """结束当前分段
+
+        Returns:
+            分段字节数
+        """
+        if self._container is None:
+            return 0
+        try:
+            self._container.close()
+        except Exception as e:
+            logger.error(f"Failed to finalize {self.format} segment: {e}")
+        finally:
+            size = self._file.tell()
+            if self._owns_file:
+                self._file.close()
+            self._container = None
+            self._stream = None
+            self._file = None
+        return size
+
+def remux_access_units(units: Iterable[Tuple[bytes, Dict]], output: Union[str, BinaryIO],
+                       format: str = 'mp4') -> int:
+    """把第一个为关键帧的访问单元序列封装为一个文件
+
+    Returns:
+        写入的帧数（0表示没有可用的关键帧）
+    """
+    muxer = SegmentMuxer(format)
+    try:
+        for data, metadata in units:
+            if not muxer.is_open:
+                if not metadata.get('is_keyframe') or not muxer.open(output, data, metadata.get('pts', 0.0)):
+                    continue
+            muxer.mux(data, metadata)
+    finally:
+        muxer.close()
+    return muxer.frames
+
+class Recorder:
+    """录制器
+
+    write() 只把访问单元放入有界队列，由后台写入线程封装，不阻塞实时链路；
+    每个分段从关键帧开始，独立可播放。
+    """
+
+    def __init__(self, config: Optional[RecordingConfig] = None):
+        self.config = config or RecordingConfig()
+        if self.config.format not in CONTAINER_FORMATS:
+            raise ValueError(f"Unsupported recording format: {self.config.format}")
+
+        self.is_recording = False
+        self.segments: List[str] = []
+        self.queue = StageQueue(self.config.queue_frames, overflow='drop_oldest', on_discard=self._on_dropped)
+        self._thread: Optional[threading.Thread] = None
+        self._rendition = self.config.rendition
+        self._resync = False
+
+        # 当前分段（仅写入线程访问）
+        self._muxer = SegmentMuxer(self.config.format)
+
+        self.stats = {
+            'frames_written': 0,
+            'frames_dropped': 0,    # 写入跟不上被丢弃的帧
+            'frames_skipped': 0,    # 等待关键帧期间跳过的帧
+            'bytes_written': 0,
+            'segments': 0,
+            'errors': 0
+        }
+
+    def start(self) -> bool:
+        """开始录制"""
+        if not HAS_AV:
+            logger.error("PyAV is required for recording. Install with: pip install av")
+            return False
+        if self.is_recording:
+            return True
+
+        try:
+            os.makedirs(self.config.output_dir, exist_ok=True)
+        except OSError as e:
+            logger.error(f"Cannot create recording directory {self.config.output_dir}: {e}")
+            return False
+
+        self.is_recording = True
+        self.queue.reopen()
+        self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._thread.start()
+        logger.info(f"Recording started: {self.config.output_dir} ({self.config.format})")
+        return True
+
+    def write(self, data: bytes, metadata: Dict):
+        """提交一个访问单元（在编码器/设备回调线程中调用，立即返回）"""
+        if not self.is_recording:
+            return
+
+        rendition = metadata.get('rendition')
+        if rendition != self._rendition:
+            if self._rendition is not None or self.stats['frames_written'] or self.queue.depth:
+                return
+            self._rendition = rendition
+        self.queue.put((data, metadata))
+
+    def _on_dropped(self, item):
+        """队列溢出丢弃了旧帧，后续帧依赖它，写入线程需要等待下一个关键帧"""
+        if self.is_recording:
+            self.stats['frames_dropped'] += 1
+            self._resync = True
+
+    def _run(self):
+        """写入线程"""
+        try:
+            while self.is_recording or self.queue.depth:
+                item = self.queue.get(timeout=0.2)
+                if item is None:
+                    continue
+                try:
+                    self._write(*item)
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    logger.error(f"Recording write error: {e}")
+                    self._close_segment()
+        finally:
+            self._close_segment()
+
+    def _write(self, data: bytes, metadata: Dict):
+        is_keyframe = metadata.get('is_keyframe', False)
+        pts = metadata.get('pts')
+        if pts is None:
+            pts = time.monotonic()
+
+        muxer = self._muxer
+        if self._resync or not muxer.is_open or (is_keyframe and self._should_rotate(pts)):
+            if not is_keyframe:
+                self.stats['frames_skipped'] += 1
+                return
+            self._resync = False
+            if not muxer.is_open or self._should_rotate(pts):
+                self._close_segment()
+                if not self._open_segment(data, pts):
+                    self.stats['frames_skipped'] += 1
+                    return
+
+        muxer.mux(data, dict(metadata, pts=pts))
+        self.stats['frames_written'] += 1
+
+    def _should_rotate(self, pts: float) -> bool:
+        duration, size = self.config.segment_duration, self.config.segment_size
+        return ((duration > 0 and pts - self._muxer.start_pts >= duration) or
+                (size > 0 and self._muxer.tell() >= size))
+
+    def _open_segment(self, data: bytes, pts: float) -> bool:
+        """以关键帧开始一个新分段"""
+        stamp = time.strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(self.config.output_dir,
+                            f"{self.config.filename_prefix}_{stamp}_{self.stats['segments'] + 1:04d}.{self._muxer.extension}")
+        if not self._muxer.open(path, data, pts, self.config.buffer_size):
+            return False
+
+        self.segments.append(path)
+        self.stats['segments'] += 1
+        logger.info(f"Recording segment opened: {path}")
+        return True
+
+    def _close_segment(self):
+        self.stats['bytes_written'] += self._muxer.close()
+
+    def stop(self, timeout: float = 5.0):
+        """停止录制，写完队列中剩余的访问单元并关闭当前分段"""
+        if not self.is_recording:
+            return
+        self.is_recording = False
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        self.queue.close()
+        logger.info(f"Recording stopped: {self.stats['segments']} segments, "
+                    f"{self.stats['frames_written']} frames")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取录制统计"""
+        return dict(self.stats,
+                    recording=self.is_recording,
+                    format=self.config.format,
+                    current_segment=self.segments[-1] if self._muxer.is_open else None,
+                    queue=self.queue.get_stats())
+
+def create_recorder(output_dir: str = "recordings", format: str = "mp4", **kwargs) -> Recorder:
+    """创建录制器"""
+    return Recorder(RecordingConfig(output_dir=output_dir, format=format, **kwargs))
@@ -0,0 +1,173 @@
+"""
+多码率档位模块
+定义simulcast档位，按客户端实测带宽分配档位，并只在IDR处切换
+"""
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Any, Union, Tuple
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Rendition:
+    """一个编码档位"""
+    name: str
+    width: int
+    height: int
+    bitrate: int
+
+# 常用档位
+RENDITION_PRESETS: Dict[str, Rendition] = {
+    '1080p': Rendition('1080p', 1920, 1080, 4000000),
+    '720p': Rendition('720p', 1280, 720, 2000000),
+    '480p': Rendition('480p', 854, 480, 800000),
+    '360p': Rendition('360p', 640, 360, 500000),
+}
+
+DEFAULT_RENDITIONS = ('1080p', '720p', '480p')
+
+def parse_renditions(spec: Optional[List[Union[str, Dict[str, Any]]]] = None,
+                     max_size: Optional[Tuple[int, int]] = None) -> List[Rendition]:
+    """解析档位配置
+
+    Args:
+        spec: 档位名称（见RENDITION_PRESETS）或 {name, width, height, bitrate} 字典的列表
+        max_size: 采集分辨率，超过它的档位被忽略（不做放大）
+
+    Returns:
+        按码率从高到低排序的档位列表
+    """
+    renditions = []
+    for item in spec or DEFAULT_RENDITIONS:
+        if isinstance(item, str):
+            if item not in RENDITION_PRESETS:
+                raise ValueError(f"Unknown rendition: {item}")
+            rendition = RENDITION_PRESETS[item]
+        else:
+            rendition = Rendition(**item)
+
+        # I420要求宽高为偶数
+        rendition = Rendition(rendition.name, rendition.width & ~1, rendition.height & ~1, rendition.bitrate)
+        if max_size and (rendition.width > max_size[0] or rendition.height > max_size[1]):
+            logger.debug(f"Skipping rendition {rendition.name}: larger than {max_size[0]}x{max_size[1]}")
+            continue
+        renditions.append(rendition)
+
+    if not renditions and max_size:
+        renditions.append(Rendition(f'{max_size[1]}p', max_size[0] & ~1, max_size[1] & ~1,
+                                    RENDITION_PRESETS['720p'].bitrate))
+
+    return sorted(renditions, key=lambda r: r.bitrate, reverse=True)
+
+def select_rendition(renditions: List[Rendition], bandwidth_bps: Optional[float],
+                     headroom: float = 1.25) -> Rendition:
+    """选择带宽能容纳的最高档位（码率乘以余量系数），带宽未知时选最高档"""
+    if bandwidth_bps is None:
+        return renditions[0]
+    for rendition in renditions:
+        if rendition.bitrate * headroom <= bandwidth_bps:
+            return rendition
+    return renditions[-1]
+
+class BandwidthEstimator:
+    """基于丢包的带宽估计
+
+    有显式带宽（RTSP Bandwidth头、RTCP REMB）时直接采用；
+    接收报告丢包率超过10%时按丢包率降低估计，低于2%时缓慢上探。
+    """
+
+    LOSS_DECREASE = 0.10
+    LOSS_INCREASE = 0.02
+    INCREASE_FACTOR = 1.05
+
+    def __init__(self, initial_bps: Optional[float] = None):
+        self.estimate: Optional[float] = initial_bps
+
+    def on_bandwidth_hint(self, bps: float):
+        """接收端给出的带宽（REMB或Bandwidth头）"""
+        if bps > 0:
+            self.estimate = float(bps)
+
+    def on_loss_report(self, fraction_lost: float, sending_bitrate: float):
+        """接收报告中的丢包率（sending_bitrate为该客户端当前档位的码率）"""
+        base = self.estimate if self.estimate is not None else sending_bitrate
+        if fraction_lost > self.LOSS_DECREASE:
+            self.estimate = sending_bitrate * (1 - 0.5 * fraction_lost)
+        elif fraction_lost < self.LOSS_INCREASE:
+            self.estimate = max(base, sending_bitrate) * self.INCREASE_FACTOR
+        else:
+            self.estimate = base
+
+class ClientRendition:
+    """单个客户端的档位分配
+
+    target为带宽对应的目标档位，current为实际正在接收的档位；
+    目标变化后继续发送当前档位，直到目标档位出现IDR时才切换，保证解码不花屏。
+    降档立即生效，升档需要带宽在 upgrade_hold 秒内持续满足，避免来回抖动。
+    """
+
+    def __init__(self, renditions: List[Rendition], initial_bps: Optional[float] = None,
+                 upgrade_hold: float = 2.0):
+        self.renditions = renditions
+        self.estimator = BandwidthEstimator(initial_bps)
+        self.upgrade_hold = upgrade_hold
+
+        self.target = select_rendition(renditions, initial_bps).name
+        self.current: Optional[str] = None
+        self._upgrade_since: Optional[float] = None
+        self.switches = 0
+
+    def _rendition(self, name: str) -> Rendition:
+        return next(r for r in self.renditions if r.name == name)
+
+    @property
+    def switching(self) -> bool:
+        """是否在等待目标档位的IDR"""
+        return self.current != self.target
+
+    def on_bandwidth_hint(self, bps: float, now: Optional[float] = None) -> bool:
+        self.estimator.on_bandwidth_hint(bps)
+        return self._update_target(now)
+
+    def on_loss_report(self, fraction_lost: float, now: Optional[float] = None) -> bool:
+        sending = self._rendition(self.current or self.target).bitrate
+        self.estimator.on_loss_report(fraction_lost, sending)
+        return self._update_target(now)
+
+    def _update_target(self, now: Optional[float] = None) -> bool:
+        """根据最新估计更新目标档位，返回目标是否变化"""
+        now = time.monotonic() if now is None else now
+        best = select_rendition(self.renditions, self.estimator.estimate)
+        if best.name == self.target:
+            self._upgrade_since = None
+            return False
+
+        if best.bitrate > self._rendition(self.target).bitrate:
+            if self._upgrade_since is None:
+                self._upgrade_since = now
+            if now - self._upgrade_since < self.upgrade_hold:
+                return False
+
+        self._upgrade_since = None
+        self.target = best.name
+        return True
+
+    def accept(self, rendition: str, is_keyframe: bool) -> bool:
+        """该档位的访问单元是否应发送给此客户端（在目标档位的IDR处完成切换）"""
+        if rendition == self.target and self.current != self.target and is_keyframe:
+            if self.current is not None:
+                self.switches += 1
+                logger.info(f"Client switched rendition {self.current} -> {self.target}")
+            self.current = self.target
+            return True
+        return rendition == self.current
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'rendition': self.current,
+            'target': self.target,
+            'estimated_bandwidth': self.estimator.estimate,
+            'switches': self.switches
+        }
@@ -9,10 +9,17 @@ import logging
 import asyncio
 import threading
 import time
-from typing import Optional, Dict, Any, Callable, Tuple
+from typing import Optional, Dict, Any, Callable, Tuple, List
 from dataclasses import dataclass
 from enum import Enum
 
+from phone_mirroring.change_detector import ChangeDetector, TileTracker
+from phone_mirroring.frame_pool import FramePool, retain_frame, release_frame
+from phone_mirroring.frame_mailbox import FrameMailbox
+from phone_mirroring.performance import StageTimings
+from phone_mirroring.frame_clock import FrameClock, display_refresh_rate
+from phone_mirroring.xshm import XShmGrabber
+
 logger = logging.getLogger(__name__)
 
 class CaptureMethod(Enum):
@@ -20,8 +27,22 @@ class CaptureMethod(Enum):
     PIL = "pil"           # Pillow库
     MSS = "mss"           # MSS库（推荐，性能更好）
     D3D = "d3d"           # Direct3D（Windows专属，高性能）
+    XSHM = "xshm"         # X11 MIT-SHM共享内存（Linux，不经X套接字复制像素）
     OPENCV = "opencv"     # OpenCV
 
+class OutputFormat(Enum):
+    """输出帧像素格式"""
+    BGR = "bgr"     # BGR24 (H, W, 3)
+    I420 = "i420"   # YUV420 平面格式 (H*3/2, W)，可直接送入编码器 yuv420p 管道
+
+# 采集原生格式 -> 输出格式 的颜色转换
+_COLOR_CONVERSIONS = {
+    ('bgra', OutputFormat.BGR): cv2.COLOR_BGRA2BGR,
+    ('rgb', OutputFormat.BGR): cv2.COLOR_RGB2BGR,
+    ('bgra', OutputFormat.I420): cv2.COLOR_BGRA2YUV_I420,
+    ('rgb', OutputFormat.I420): cv2.COLOR_RGB2YUV_I420,
+}
+
 @dataclass
 class CaptureConfig:
     """屏幕捕获配置"""
@@ -30,6 +51,19 @@ class CaptureConfig:
     region: Optional[Tuple[int, int, int, int]] = None  # (left, top, width, height)
     scale: float = 1.0  # 缩放比例
     quality: int = 95   # 图像质量（JPEG压缩）
+    output_size: Optional[Tuple[int, int]] = None  # (width, height)，设置后优先于scale
+    output_format: OutputFormat = OutputFormat.BGR
+    buffer_count: int = 4  # 输出帧缓冲池大小（last_frame/调用方/编码邮箱/编码写入各占一个）
+    detect_changes: bool = False  # 画面未变化时跳过缩放和颜色转换，直接返回上一帧
+    change_row_step: int = 4  # 变化检测每帧比较 1/N 的行
+    track_dirty_tiles: bool = False  # 逐帧计算 tile_size×tile_size 脏块（同时用作变化检测）
+    tile_size: int = 64
+    idle_fps: int = 0  # 连续捕获时画面静止超过 idle_after 秒后降到的帧率（0为不降）
+    idle_after: float = 0.5
+    retry_interval: float = 0.05  # 捕获失败后的首次重试间隔，连续失败时指数退避
+    max_retry_interval: float = 2.0
+    reinit_after: int = 5  # 连续失败次数达到该值时重新初始化捕获后端
+    align_to_refresh: bool = False  # 帧间隔取整为显示器刷新周期的整数倍
 
 class ScreenCapture:
     """屏幕捕获器"""
@@ -41,6 +75,16 @@ class ScreenCapture:
         self.last_frame: Optional[np.ndarray] = None
         self.frame_count = 0
         
+        # 画面变化检测（frame_changed 为最近一次capture_frame的结果）
+        if self.config.track_dirty_tiles:
+            self._change_detector = TileTracker(self.config.tile_size)
+        elif self.config.detect_changes:
+            self._change_detector = ChangeDetector(self.config.change_row_step)
+        else:
+            self._change_detector = None
+        self.frame_changed = True
+        self._raw_size: Optional[Tuple[int, int]] = None
+        
         # 回调函数
         self.on_frame_captured: Optional[Callable[[np.ndarray, Dict], None]] = None
         self.on_error: Optional[Callable[[Exception], None]] = None
@@ -50,9 +94,26 @@ class ScreenCapture:
         self._frame_buffer = []
         self._buffer_lock = threading.Lock()
         
+        # 输出帧缓冲池（按引用计数复用）和缩放中间缓冲区
+        self._output_pool: Optional[FramePool] = None
+        self._resize_buffer: Optional[np.ndarray] = None
+        
+        # 连续捕获：捕获线程把 (帧, 信息) 放入单槽位邮箱，消费者总是取到最新一帧
+        self.frames = FrameMailbox(on_discard=self._discard_published)
+        self._wake_until = 0.0
+        self._stop_event = threading.Event()
+        self.clock: Optional[FrameClock] = None
+        
+        # 捕获线程内首次初始化的结果（见 wait_initialized）
+        self._init_done = threading.Event()
+        self._init_ok = False
+        
         # 性能统计
         self._last_capture_time = 0
         self._capture_times = []
+        self.timings = StageTimings()
+        self.capture_failures = 0
+        self.reinitializations = 0
         
         logger.info(f"ScreenCapture initialized with method: {self.config.method.value}")
     
@@ -65,6 +126,8 @@ class ScreenCapture:
                 return self._init_pil()
             elif self.config.method == CaptureMethod.D3D:
                 return self._init_d3d()
+            elif self.config.method == CaptureMethod.XSHM:
+                return self._init_xshm()
             elif self.config.method == CaptureMethod.OPENCV:
                 return self._init_opencv()
             else:
@@ -122,6 +185,26 @@ class ScreenCapture:
             logger.error(f"Failed to initialize D3D capture: {e}")
             return self._init_mss()
     
+    def _init_xshm(self) -> bool:
+        """初始化X11 MIT-SHM捕获器（Linux）"""
+        if self._capture_impl is not None and hasattr(self._capture_impl, 'close'):
+            self._capture_impl.close()
+        
+        try:
+            self._capture_impl = XShmGrabber()
+            
+            # 每次捕获都覆盖同一块共享内存，变化检测需要复制参考帧
+            if self._change_detector:
+                self._change_detector.copy_reference = True
+            
+            width, height = self._capture_impl.screen_size
+            logger.info(f"XShm initialized. Screen size: {width}x{height}")
+            return True
+            
+        except (OSError, RuntimeError) as e:
+            logger.warning(f"XShm capture unavailable ({e}), falling back to MSS")
+            return self._init_mss()
+    
     def _init_opencv(self) -> bool:
         """初始化OpenCV捕获器"""
         # OpenCV不支持直接屏幕捕获，使用MSS作为后端
@@ -131,29 +214,51 @@ class ScreenCapture:
     def capture_frame(self) -> Optional[np.ndarray]:
         """捕获单帧
         
+        返回的数组来自缓冲池，调用方用完后应调用 release_frame() 归还；
+        交给编码器的帧由编码器自行持有引用，提交后即可归还。
+        
         Returns:
-            BGR格式的numpy数组，捕获失败返回None
+            按 config.output_format 输出的numpy数组（默认BGR），捕获失败返回None
         """
         try:
             start_time = time.time()
+            grab_start = time.perf_counter()
             
+            # 各后端返回原生格式的帧，颜色转换只在最后做一次
             if self.config.method == CaptureMethod.MSS:
-                frame = self._capture_mss()
+                frame, native_format = self._capture_mss(), 'bgra'
             elif self.config.method == CaptureMethod.PIL:
-                frame = self._capture_pil()
+                frame, native_format = self._capture_pil(), 'rgb'
             elif self.config.method == CaptureMethod.D3D:
-                frame = self._capture_d3d()
+                frame, native_format = self._capture_d3d(), 'rgb'
+            elif self.config.method == CaptureMethod.XSHM:
+                frame, native_format = self._capture_xshm(), 'bgra'
             else:
-                frame = self._capture_mss()
+                frame, native_format = self._capture_mss(), 'bgra'
             
             if frame is None:
                 return None
+            convert_start = time.perf_counter()
+            self.timings.record('grab', convert_start - grab_start)
+            
+            # 画面未变化：跳过缩放和颜色转换，返回上一次的输出
+            if self._change_detector:
+                self.frame_changed = self._change_detector.update(frame)
+                self._raw_size = (frame.shape[1], frame.shape[0])
+                if self.config.detect_changes and not self.frame_changed and self.last_frame is not None:
+                    retain_frame(self.last_frame)
+                    return self.last_frame
+            
+            # 应用缩放（在颜色转换之前进行，写入复用的中间缓冲区）
+            if self.config.output_size:
+                size = tuple(self.config.output_size)
+            else:
+                size = (int(frame.shape[1] * self.config.scale), int(frame.shape[0] * self.config.scale))
+            if size != (frame.shape[1], frame.shape[0]):
+                frame = self._resize(frame, size)
             
-            # 应用缩放
-            if self.config.scale != 1.0:
-                new_width = int(frame.shape[1] * self.config.scale)
-                new_height = int(frame.shape[0] * self.config.scale)
-                frame = cv2.resize(frame, (new_width, new_height))
+            frame = self._convert_output(frame, native_format)
+            self.timings.record('convert', time.perf_counter() - convert_start)
             
             # 更新统计
             self.frame_count += 1
@@ -162,7 +267,11 @@ class ScreenCapture:
             if len(self._capture_times) > 100:
                 self._capture_times.pop(0)
             
+            # 采集器自身持有last_frame的一个引用，另一个引用交给调用方
+            if self.last_frame is not None:
+                release_frame(self.last_frame)
             self.last_frame = frame
+            retain_frame(frame)
             
             # 触发回调
             if self.on_frame_captured:
@@ -172,6 +281,9 @@ class ScreenCapture:
                     'timestamp': time.time(),
                     'resolution': f"{frame.shape[1]}x{frame.shape[0]}"
                 }
+                if isinstance(self._change_detector, TileTracker):
+                    metadata['dirty_ratio'] = self._change_detector.dirty_ratio
+                    metadata['dirty_rects'] = self.get_dirty_rects()
                 self.on_frame_captured(frame, metadata)
             
             return frame
@@ -182,6 +294,62 @@ class ScreenCapture:
                 self.on_error(e)
             return None
     
+    @property
+    def dirty_tiles(self) -> Optional[np.ndarray]:
+        """最近一帧变化的分块，(行块数, 列块数) 的布尔数组，基于原始采集分辨率
+        
+        需要 track_dirty_tiles=True，否则为None
+        """
+        if isinstance(self._change_detector, TileTracker):
+            return self._change_detector.dirty_tiles
+        return None
+    
+    def get_dirty_rects(self) -> List[Tuple[int, int, int, int]]:
+        """最近一帧的变化区域 (x, y, w, h)，坐标已换算到输出帧（缩放后）"""
+        if not isinstance(self._change_detector, TileTracker) or not self._raw_size:
+            return []
+        
+        raw_w, raw_h = self._raw_size
+        if self.config.output_size:
+            out_w, out_h = self.config.output_size
+        else:
+            out_w, out_h = int(raw_w * self.config.scale), int(raw_h * self.config.scale)
+        return self._change_detector.dirty_rects(out_w / raw_w, out_h / raw_h)
+    
+    def _resize(self, frame: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+        """缩放到复用的中间缓冲区（随后立即被颜色转换读取，单个即可）"""
+        shape = (size[1], size[0]) + frame.shape[2:]
+        if self._resize_buffer is None or self._resize_buffer.shape != shape:
+            self._resize_buffer = np.empty(shape, dtype=frame.dtype)
+        return cv2.resize(frame, size, dst=self._resize_buffer)
+    
+    def _convert_output(self, frame: np.ndarray, native_format: str) -> np.ndarray:
+        """将原生格式的帧一次性转换为输出格式，结果写入缓冲池中的数组"""
+        output_format = self.config.output_format
+        code = _COLOR_CONVERSIONS[(native_format, output_format)]
+        
+        if output_format == OutputFormat.I420:
+            # I420要求宽高为偶数
+            height, width = frame.shape[0] & ~1, frame.shape[1] & ~1
+            if (height, width) != frame.shape[:2]:
+                frame = frame[:height, :width]
+            shape = (height * 3 // 2, width)
+        else:
+            shape = (frame.shape[0], frame.shape[1], 3)
+        
+        pool = self._output_pool
+        if pool is None or pool.shape != shape:
+            if pool:
+                pool.close()
+            pool = self._output_pool = FramePool(shape, count=self.config.buffer_count)
+        
+        return cv2.cvtColor(frame, code, dst=pool.acquire())
+    
+    def release_frame(self, frame: Optional[np.ndarray]):
+        """归还 capture_frame() 返回的帧"""
+        if frame is not None:
+            release_frame(frame)
+    
     def _capture_mss(self) -> Optional[np.ndarray]:
         """使用MSS捕获屏幕"""
         try:
@@ -199,11 +367,9 @@ class ScreenCapture:
             # 捕获屏幕
             screenshot = self._capture_impl.grab(monitor)
             
-            # 转换为numpy数组 (BGR格式)
-            frame = np.array(screenshot)
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
-            
-            return frame
+            # 直接包装MSS的BGRA缓冲区（每次grab都是新的bytearray），不复制
+            return np.frombuffer(screenshot.raw, dtype=np.uint8).reshape(
+                screenshot.height, screenshot.width, 4)
             
         except Exception as e:
             logger.error(f"MSS capture error: {e}")
@@ -217,11 +383,8 @@ class ScreenCapture:
             else:
                 screenshot = self._capture_impl.grab()
             
-            # 转换为numpy数组
-            frame = np.array(screenshot)
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-            
-            return frame
+            # 转换为numpy数组 (RGB格式)
+            return np.array(screenshot)
             
         except Exception as e:
             logger.error(f"PIL capture error: {e}")
@@ -230,71 +393,134 @@ class ScreenCapture:
     def _capture_d3d(self) -> Optional[np.ndarray]:
         """使用Direct3D捕获屏幕"""
         try:
-            frame = self._capture_impl.screenshot()
-            if frame is not None:
-                # D3DShot默认返回RGB格式
-                frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-            return frame
+            # D3DShot默认返回RGB格式
+            return self._capture_impl.screenshot()
             
         except Exception as e:
             logger.error(f"D3D capture error: {e}")
             return None
     
+    def _capture_xshm(self) -> Optional[np.ndarray]:
+        """使用X11共享内存捕获屏幕（返回共享内存的视图，下次捕获时被覆盖）"""
+        if not isinstance(self._capture_impl, XShmGrabber):
+            return self._capture_mss()
+        
+        try:
+            if self.config.region:
+                return self._capture_impl.grab(*self.config.region)
+            return self._capture_impl.grab()
+            
+        except Exception as e:
+            logger.error(f"XShm capture error: {e}")
+            return None
+    
     async def capture_frame_async(self) -> Optional[np.ndarray]:
         """异步捕获单帧"""
         loop = asyncio.get_event_loop()
         return await loop.run_in_executor(None, self.capture_frame)
     
     def start_capture(self, callback: Callable[[np.ndarray, Dict], None] = None):
-        """开始连续捕获"""
+        """开始连续捕获
+        
+        捕获在独立线程中进行，每帧以 (frame, info) 放入 self.frames 邮箱，
+        info 含 'pts'（time.monotonic()）和 'changed'。消费者取出后负责 release_frame(frame)；
+        未被取走就被新帧覆盖的帧由邮箱自动归还。
+        """
         if self.is_capturing:
             logger.warning("Capture already running")
             return
         
-        if not self.initialize():
-            logger.error("Failed to initialize capture")
-            return
-        
         if callback:
             self.on_frame_captured = callback
         
+        self.frames.reopen()
+        self._stop_event.clear()
+        self._init_done.clear()
+        refresh_rate = display_refresh_rate() if self.config.align_to_refresh else None
+        self.clock = FrameClock(self.config.fps, refresh_rate=refresh_rate)
         self.is_capturing = True
-        self.capture_thread = threading.Thread(target=self._capture_loop)
+        self.capture_thread = threading.Thread(target=self._capture_loop, name="screen-capture")
         self.capture_thread.daemon = True
         self.capture_thread.start()
         
         logger.info(f"Screen capture started at {self.config.fps} FPS")
     
+    def wait_initialized(self, timeout: Optional[float] = 5.0) -> bool:
+        """等待捕获线程初始化后端，返回是否成功（超时返回False）"""
+        return self._init_done.wait(timeout) and self._init_ok
+    
+    def _close_impl(self):
+        """释放捕获后端实例"""
+        if self._capture_impl:
+            if hasattr(self._capture_impl, 'close'):
+                self._capture_impl.close()
+            self._capture_impl = None
+    
+    def _discard_published(self, item: Tuple[np.ndarray, Dict]):
+        release_frame(item[0])
+    
+    def wake(self, duration: float = 1.0):
+        """在 duration 秒内暂停静止降帧（如需要尽快产出关键帧时）"""
+        self._wake_until = time.monotonic() + duration
+    
     def _capture_loop(self):
-        """捕获循环"""
-        frame_interval = 1.0 / self.config.fps
+        """捕获循环
+        
+        捕获失败时按 retry_interval 指数退避重试（上限 max_retry_interval），
+        连续失败 reinit_after 次后重新初始化后端（显示器变化、会话切换等）。
+        """
+        # 捕获后端在本线程内初始化（MSS/D3D实例、X连接不能跨线程使用），结果通过 wait_initialized 获取
+        initialized = self._init_ok = self.initialize()
+        self._init_done.set()
+        failures = 0
+        last_change = time.monotonic()
+        clock = self.clock
         
         while self.is_capturing:
-            loop_start = time.time()
-            
-            frame = self.capture_frame()
+            frame = self.capture_frame() if initialized else None
             if frame is None:
+                failures += 1
+                self.capture_failures += 1
+                if failures == 1:
+                    logger.warning("Screen capture failed, retrying with backoff")
+                if failures % self.config.reinit_after == 0:
+                    logger.warning(f"Screen capture failed {failures} times, reinitializing backend")
+                    self.reinitializations += 1
+                    self._close_impl()
+                    initialized = self.initialize()
+                
+                delay = min(self.config.retry_interval * 2 ** (failures - 1), self.config.max_retry_interval)
+                self._stop_event.wait(delay)
                 continue
             
-            # 控制帧率
-            elapsed = time.time() - loop_start
-            sleep_time = frame_interval - elapsed
-            if sleep_time > 0:
-                time.sleep(sleep_time)
+            if failures:
+                logger.info(f"Screen capture recovered after {failures} failures")
+                failures = 0
+                clock.reset()
+            
+            pts = time.monotonic()
+            if self.frame_changed:
+                last_change = pts
+            self.frames.put((frame, {'pts': pts, 'changed': self.frame_changed}))
+            
+            # 按绝对截止时间控制帧率（静止时降到 idle_fps）
+            idle = (self.config.idle_fps and pts - last_change > self.config.idle_after
+                    and pts >= self._wake_until)
+            clock.set_fps(self.config.idle_fps if idle else self.config.fps)
+            clock.wait(self._stop_event)
     
     def stop_capture(self):
         """停止捕获"""
         self.is_capturing = False
+        self._stop_event.set()
         
         if self.capture_thread:
             self.capture_thread.join(timeout=2.0)
             self.capture_thread = None
+        self.frames.close()
         
         # 释放资源
-        if self._capture_impl:
-            if hasattr(self._capture_impl, 'close'):
-                self._capture_impl.close()
-            self._capture_impl = None
+        self._close_impl()
         
         logger.info("Screen capture stopped")
     
@@ -307,7 +533,16 @@ class ScreenCapture:
             'is_capturing': self.is_capturing,
             'average_capture_time': avg_time,
             'effective_fps': 1.0 / avg_time if avg_time > 0 else 0,
-            'method': self.config.method.value
+            'method': self.config.method.value,
+            'change_detection': self._change_detector.get_stats() if self._change_detector else None,
+            'buffer_pool': self._output_pool.get_stats() if self._output_pool else None,
+            'mailbox': self.frames.get_stats(),
+            'capture_failures': self.capture_failures,
+            'reinitializations': self.reinitializations,
+            'stage_timings': self.timings.get_stats(),
+            'frame_clock': self.clock.get_stats() if self.clock else None,
+            'dirty_ratio': self._change_detector.average_dirty_ratio
+                if isinstance(self._change_detector, TileTracker) else None
         }
     
     def set_region(self, left: int, top: int, width: int, height: int):
@@ -423,8 +658,8 @@ def create_capture(method: str = 'mss', **kwargs) -> ScreenCapture:
     """创建屏幕捕获器
     
     Args:
-        method: 捕获方法 ('mss', 'pil', 'd3d', 'opencv')
-        **kwargs: 其他配置参数
+        method: 捕获方法 ('mss', 'pil', 'd3d', 'xshm', 'opencv')
+        **kwargs: 其他配置参数（output_format 可为 'bgr' 或 'i420'）
         
     Returns:
         ScreenCapture实例
@@ -434,10 +669,13 @@ def create_capture(method: str = 'mss', **kwargs) -> ScreenCapture:
         'pil': CaptureMethod.PIL,
         'd3d': CaptureMethod.D3D,
         'd3dshot': CaptureMethod.D3D,
+        'xshm': CaptureMethod.XSHM,
         'opencv': CaptureMethod.OPENCV
     }
     
     capture_method = method_map.get(method.lower(), CaptureMethod.MSS)
+    if isinstance(kwargs.get('output_format'), str):
+        kwargs['output_format'] = OutputFormat(kwargs['output_format'].lower())
     config = CaptureConfig(method=capture_method, **kwargs)
     
     return ScreenCapture(config)
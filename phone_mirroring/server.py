@@ -6,47 +6,182 @@
 import asyncio
 import logging
 import time
-from typing import Dict, List, Optional, Any, Callable
+from collections import deque
+from typing import Dict, List, Optional, Any, Callable, Deque, Tuple
 from phone_mirroring.config import Config
+from phone_mirroring.performance import StageHistogram
+from phone_mirroring.media_frame import MediaFrame
 from phone_mirroring.protocols.base import BaseProtocol
-from phone_mirroring.protocols.adb import ADBProtocol
+from phone_mirroring.protocols.registry import get_protocol_class
 
-# 尝试导入 RTSP 协议，如果不存在则创建空实现
-try:
-    from phone_mirroring.protocols.rtsp import RTSPProtocol
-except ImportError:
-    # 为缺失的 RTSP 协议创建占位符
-    class RTSPProtocol(BaseProtocol):
-        """RTSP协议占位符（尚未实现）"""
+# RTSP 协议模块无法导入时使用的空实现
+class RTSPPlaceholder(BaseProtocol):
+    """RTSP协议占位符（尚未实现）"""
+    
+    def __init__(self, config: Dict[str, Any]):
+        super().__init__(config)
+        self.port = config.get("port", 8554)
         
-        def __init__(self, config: Dict[str, Any]):
-            super().__init__(config)
-            self.port = config.get("port", 8554)
-            
-        async def start(self) -> bool:
-            logging.warning("RTSP protocol not implemented yet")
-            return False
+    async def start(self) -> bool:
+        logging.warning("RTSP protocol not implemented yet")
+        return False
+    
+    async def stop(self) -> bool:
+        return True
+    
+    async def send_frame(self, frame_data: bytes, metadata: Dict[str, Any]) -> bool:
+        return True
+    
+    async def send_audio(self, audio_data: bytes, metadata: Dict[str, Any]) -> bool:
+        return True
+    
+    async def handle_control(self, control_data: Dict[str, Any]) -> bool:
+        return True
+
+logger = logging.getLogger(__name__)
+
+class ProtocolLane:
+    """单个协议的视频帧发送通道
+    
+    每个协议一个有界队列和一个发送任务，broadcast_frame 只入队不等待。
+    队列溢出或 send_frame 超时时只丢弃该协议的帧，之后的帧依赖被丢弃的帧，
+    因此该协议等待下一个关键帧再继续，其他协议不受影响。
+    MediaFrame 在队列中时持有一个引用，发送完成或丢弃后释放。
+    """
+    
+    def __init__(self, name: str, protocol: BaseProtocol, max_frames: int = 30, timeout: float = 0.5):
+        self.name = name
+        self.protocol = protocol
+        self.max_frames = max_frames
+        self.timeout = timeout
+        self.queue: Deque[Tuple[bytes, Dict[str, Any]]] = deque()
+        self.event = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.latency = StageHistogram()
+        self._waiting_keyframe = False
         
-        async def stop(self) -> bool:
-            return True
+        self.stats = {
+            "sent": 0,
+            "failed": 0,        # send_frame 返回False
+            "dropped": 0,       # 队列溢出、超时或等待关键帧期间丢弃
+            "timeouts": 0,
+            "errors": 0,
+            "bytes_sent": 0
+        }
+    
+    def start(self):
+        """启动发送任务（需在事件循环中调用）"""
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """停止发送任务并丢弃队列中的帧"""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        self._drop_queued()
+    
+    def put(self, frame_data: bytes, metadata: Dict[str, Any]) -> bool:
+        """放入一帧（metadata 复制一份，协议修改它不影响调用方和其他协议）
         
-        async def send_frame(self, frame_data: bytes, metadata: Dict[str, Any]) -> bool:
-            return True
+        Returns:
+            False 表示该帧对此协议被丢弃
+        """
+        # 没有 is_keyframe 标记的帧视为可独立解码
+        is_keyframe = metadata.get("is_keyframe", True)
+        if self._waiting_keyframe:
+            if not is_keyframe:
+                self.stats["dropped"] += 1
+                return False
+            self._waiting_keyframe = False
         
-        async def send_audio(self, audio_data: bytes, metadata: Dict[str, Any]) -> bool:
-            return True
+        if len(self.queue) >= self.max_frames:
+            self._drop_queued()
+            if not is_keyframe:
+                self._waiting_keyframe = True
+                self.stats["dropped"] += 1
+                return False
         
-        async def handle_control(self, control_data: Dict[str, Any]) -> bool:
-            return True
-
-logger = logging.getLogger(__name__)
+        if isinstance(frame_data, MediaFrame):
+            frame_data.retain()
+        self.queue.append((frame_data, dict(metadata)))
+        self.event.set()
+        return True
+    
+    def _drop_queued(self):
+        self.stats["dropped"] += len(self.queue)
+        while self.queue:
+            self._release(self.queue.popleft()[0])
+    
+    @staticmethod
+    def _release(frame_data):
+        if isinstance(frame_data, MediaFrame):
+            frame_data.release()
+    
+    async def _run(self):
+        """发送任务：按顺序调用 send_frame，每次最多等待 timeout 秒"""
+        while True:
+            await self.event.wait()
+            self.event.clear()
+            while self.queue:
+                frame_data, metadata = self.queue.popleft()
+                if not self.protocol.is_running:
+                    self.stats["dropped"] += 1
+                    self._release(frame_data)
+                    continue
+                
+                start = time.perf_counter()
+                try:
+                    success = await asyncio.wait_for(self.protocol.send_frame(frame_data, metadata), self.timeout)
+                except asyncio.TimeoutError:
+                    self.stats["timeouts"] += 1
+                    self.stats["dropped"] += 1
+                    self._drop_queued()
+                    self._waiting_keyframe = True
+                    logger.warning(f"{self.name} send_frame timed out after {self.timeout * 1000:.0f} ms, "
+                                   f"dropping frames until next keyframe")
+                    continue
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    logger.error(f"Error broadcasting frame via {self.name}: {e}")
+                    continue
+                finally:
+                    self.latency.record(time.perf_counter() - start)
+                    self._release(frame_data)
+                
+                if success:
+                    self.stats["sent"] += 1
+                    self.stats["bytes_sent"] += len(frame_data)
+                else:
+                    self.stats["failed"] += 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """发送统计（send_latency 为 send_frame 耗时直方图）"""
+        return dict(self.stats,
+                    queued=len(self.queue),
+                    waiting_keyframe=self._waiting_keyframe,
+                    send_latency=self.latency.get_stats())
 
 class MirroringServer:
     """手机投屏服务器"""
     
-    def __init__(self, config: Optional[Config] = None):
+    def __init__(self, config: Optional[Config] = None, fanout_queue_frames: int = 30,
+                 send_timeout: float = 0.5):
+        """
+        Args:
+            config: 服务配置
+            fanout_queue_frames: 每个协议的待发送帧队列长度
+            send_timeout: 单次 send_frame 的超时时间（秒）
+        """
         self.config = config if config is not None else Config()
         self.protocols: Dict[str, BaseProtocol] = {}
+        self.lanes: Dict[str, ProtocolLane] = {}
+        self.fanout_queue_frames = fanout_queue_frames
+        self.send_timeout = send_timeout
         self.is_running = False
         self.callbacks: Dict[str, List[Callable]] = {}
         
@@ -64,10 +199,10 @@ class MirroringServer:
         self._init_protocols()
     
     def _init_protocols(self):
-        """初始化所有支持的协议"""
+        """初始化启用的协议（只导入启用协议的模块）"""
         # RTSP协议
         if "RTSP" in self.config.enabled_protocols:
-            self.protocols["RTSP"] = RTSPProtocol({
+            self.protocols["RTSP"] = self._protocol_class("RTSP")({
                 "port": self.config.network.port,
                 "rtp_port_start": 5000
             })
@@ -83,7 +218,24 @@ class MirroringServer:
                 "bitrate": self.config.video.bitrate,
                 "max_fps": self.config.video.fps
             }
-            self.protocols["ADB"] = ADBProtocol(adb_config)
+            self.protocols["ADB"] = self._protocol_class("ADB")(adb_config)
+        
+        # WebRTC协议（H.264直通）
+        if "WebRTC" in self.config.enabled_protocols:
+            self.protocols["WebRTC"] = self._protocol_class("WebRTC")({
+                "signaling_port": self.config.network.port + 1
+            })
+    
+    @staticmethod
+    def _protocol_class(name: str):
+        """从协议注册表取实现类，RTSP模块无法导入时退回占位实现"""
+        try:
+            return get_protocol_class(name)
+        except ImportError as e:
+            if name != "RTSP":
+                raise
+            logger.warning(f"RTSP protocol unavailable: {e}")
+            return RTSPPlaceholder
     
     async def start(self) -> bool:
         """启动服务"""
@@ -105,6 +257,12 @@ class MirroringServer:
                     protocol.register_callback("client_connected", self._on_client_connected)
                     protocol.register_callback("client_disconnected", self._on_client_disconnected)
                     protocol.register_callback("frame_received", self._on_frame_received)
+                    protocol.register_callback("keyframe_requested", self._on_keyframe_requested)
+                    # 只接收媒体的协议（ADB）不需要发送通道
+                    if not protocol.ingest_only:
+                        lane = ProtocolLane(protocol_name, protocol, self.fanout_queue_frames, self.send_timeout)
+                        lane.start()
+                        self.lanes[protocol_name] = lane
                     logger.info(f"{protocol_name} protocol started successfully")
                 else:
                     logger.error(f"Failed to start {protocol_name} protocol")
@@ -126,6 +284,11 @@ class MirroringServer:
         try:
             self.is_running = False
             
+            # 先停止发送任务，再停止协议
+            for lane in self.lanes.values():
+                await lane.stop()
+            self.lanes.clear()
+            
             # 停止所有协议
             for protocol_name, protocol in self.protocols.items():
                 logger.info(f"Stopping {protocol_name} protocol...")
@@ -139,31 +302,32 @@ class MirroringServer:
             logger.error(f"Error stopping server: {e}")
             return False
     
-    async def broadcast_frame(self, frame_data: bytes, metadata: Optional[Dict[str, Any]] = None) -> bool:
-        """广播视频帧到所有协议"""
+    async def broadcast_frame(self, frame_data, metadata: Optional[Dict[str, Any]] = None) -> bool:
+        """广播视频帧到所有协议
+        
+        帧放入各协议的发送队列后立即返回，各协议并发发送，慢协议只丢弃自己的帧。
+        调用方的 metadata 不会被修改。frame_data 为bytes或MediaFrame，
+        MediaFrame 由各发送队列自行持有引用，调用方返回后即可释放。
+        
+        Returns:
+            至少一个协议接收了该帧
+        """
+        return self._fan_out(frame_data, metadata)
+    
+    def _fan_out(self, frame_data, metadata: Optional[Dict[str, Any]]) -> bool:
+        """把一帧放入各协议的发送队列（不等待）"""
         if not self.is_running:
             return False
         
-        metadata = metadata or {}
-        metadata.update({
-            "timestamp": time.time(),
-            "size": len(frame_data)
-        })
+        metadata = dict(metadata or {}, timestamp=time.time(), size=len(frame_data))
         
-        success_count = 0
-        for protocol_name, protocol in self.protocols.items():
-            try:
-                if protocol.is_running:
-                    success = await protocol.send_frame(frame_data, metadata)
-                    if success:
-                        success_count += 1
-            except Exception as e:
-                logger.error(f"Error broadcasting frame via {protocol_name}: {e}")
+        queued = 0
+        for lane in self.lanes.values():
+            if lane.protocol.is_running and lane.put(frame_data, metadata):
+                queued += 1
         
         self.stats["total_frames"] += 1
-        self.stats["total_bytes_sent"] += len(frame_data) * success_count
-        
-        return success_count > 0
+        return queued > 0
     
     async def broadcast_audio(self, audio_data: bytes, metadata: Optional[Dict[str, Any]] = None) -> bool:
         """广播音频数据到所有协议"""
@@ -219,6 +383,10 @@ class MirroringServer:
                 protocol_stats[protocol_name] = protocol.get_stats()
         
         stats["protocols"] = protocol_stats
+        
+        # 各协议发送通道：发送耗时、丢帧、超时
+        stats["fanout"] = {name: lane.get_stats() for name, lane in self.lanes.items()}
+        stats["total_bytes_sent"] += sum(lane.stats["bytes_sent"] for lane in self.lanes.values())
         return stats
     
     def get_active_protocols(self) -> List[str]:
@@ -269,11 +437,22 @@ class MirroringServer:
         logger.info(f"Client disconnected: {client_id}")
         self.emit("client_disconnected", client_id)
     
-    def _on_frame_received(self, frame_data: bytes, metadata: Dict[str, Any]):
-        """接收到帧事件"""
+    def _on_keyframe_requested(self, client_id: Optional[str], reason: str):
+        """观众请求关键帧：转发给视频源并通知上层
+        
+        ADB设备目前无法强制关键帧（见 ADBProtocol.request_keyframe），
+        上层（如推送编码数据的应用）可通过 keyframe_requested 事件处理。
+        """
+        adb = self.protocols.get("ADB")
+        if adb and adb.is_running:
+            adb.request_keyframe()
+        self.emit("keyframe_requested", client_id, reason)
+    
+    def _on_frame_received(self, frame_data, metadata: Dict[str, Any]):
+        """接收到帧事件（MediaFrame 在回调返回后释放，发送队列各自持有引用）"""
         self.stats["total_bytes_received"] += len(frame_data)
-        # 转发给其他协议
-        asyncio.create_task(self.broadcast_frame(frame_data, metadata))
+        # 转发给其他协议：入队不等待，直接在回调中完成
+        self._fan_out(frame_data, metadata)
 
 # 便捷函数
 async def create_server(config: Optional[Config] = None) -> MirroringServer:
@@ -0,0 +1,191 @@
+"""
+Simulcast编码模块
+一次采集，按档位各缩放一次，分别送入独立的编码器并行编码
+"""
+
+import logging
+from dataclasses import replace
+from typing import Optional, Dict, Any, List, Callable
+
+import cv2
+import numpy as np
+
+from phone_mirroring.frame_pool import FramePool, release_frame
+from phone_mirroring.renditions import Rendition
+from phone_mirroring.video_encoder import EncodeConfig, create_encoder
+
+logger = logging.getLogger(__name__)
+
+def scale_frame(frame: np.ndarray, width: int, height: int, pixel_format: str,
+                dst: Optional[np.ndarray] = None) -> np.ndarray:
+    """缩放一帧到指定分辨率
+
+    I420按Y/U/V平面分别缩放，不经过BGR往返转换。
+    """
+    if pixel_format != 'yuv420p':
+        return cv2.resize(frame, (width, height), dst=dst, interpolation=cv2.INTER_AREA)
+
+    src_h = frame.shape[0] * 2 // 3
+    src_w = frame.shape[1]
+    if (src_w, src_h) == (width, height):
+        return frame
+
+    if dst is None:
+        dst = np.empty((height * 3 // 2, width), dtype=np.uint8)
+
+    # Y平面
+    cv2.resize(frame[:src_h], (width, height), dst=dst[:height], interpolation=cv2.INTER_AREA)
+
+    # U、V平面各为 (h/2, w/2)，在数组中按行连续存放
+    src_quarter = src_h * src_w // 4
+    dst_quarter = height * width // 4
+    src_chroma = frame[src_h:].reshape(-1)
+    dst_chroma = dst[height:].reshape(-1)
+    for i in range(2):
+        src_plane = src_chroma[i * src_quarter:(i + 1) * src_quarter].reshape(src_h // 2, src_w // 2)
+        dst_plane = dst_chroma[i * dst_quarter:(i + 1) * dst_quarter].reshape(height // 2, width // 2)
+        cv2.resize(src_plane, (width // 2, height // 2), dst=dst_plane, interpolation=cv2.INTER_AREA)
+
+    return dst
+
+class SimulcastEncoder:
+    """多档位编码器
+
+    对外接口与单个编码器一致（start/encode_frame/request_keyframe/reconfigure/stop），
+    输出的元数据带有 'rendition' 字段。每个档位是独立的编码器实例
+    （FFmpeg为独立进程，PyAV为独立编码线程），encode_frame只负责缩放和投递，不会阻塞。
+    """
+
+    def __init__(self, config: EncodeConfig, renditions: List[Rendition],
+                 encoder_type: str = 'ffmpeg', buffer_count: int = 4):
+        self.config = config
+        self.renditions = renditions
+        self.encoder_type = encoder_type
+        self.buffer_count = buffer_count
+
+        self.encoders: Dict[str, Any] = {}
+        self.is_running = False
+        self.on_encoded_data: Optional[Callable[[bytes, Dict], None]] = None
+
+        # 每个档位的缩放缓冲池：编码器持有引用（邮箱/写入中）的缓冲区不会被复用
+        self._pools: Dict[str, FramePool] = {}
+
+    def _rendition_config(self, rendition: Rendition) -> EncodeConfig:
+        return replace(self.config, width=rendition.width, height=rendition.height,
+                       bitrate=rendition.bitrate)
+
+    def start(self, output_callback: Callable[[bytes, Dict], None] = None) -> bool:
+        """启动所有档位的编码器"""
+        if output_callback:
+            self.on_encoded_data = output_callback
+
+        for rendition in self.renditions:
+            encoder = create_encoder(self.encoder_type, self._rendition_config(rendition))
+            encoder.on_encoded_data = self._make_output(rendition.name)
+            if not encoder.start():
+                logger.error(f"Failed to start encoder for rendition {rendition.name}")
+                self.stop()
+                return False
+
+            self.encoders[rendition.name] = encoder
+
+        self.is_running = True
+        logger.info("Simulcast encoder started: " + ", ".join(
+            f"{r.name} {r.width}x{r.height}@{r.bitrate // 1000}kbps" for r in self.renditions))
+        return True
+
+    def _make_output(self, name: str) -> Callable[[bytes, Dict], None]:
+        def output(data: bytes, metadata: Dict):
+            metadata['rendition'] = name
+            if self.on_encoded_data:
+                self.on_encoded_data(data, metadata)
+        return output
+
+    def _scale(self, frame: np.ndarray, rendition: Rendition) -> np.ndarray:
+        """缩放到档位分辨率，写入从该档位缓冲池取出的缓冲区
+
+        返回池中的缓冲区时调用方持有一个引用，提交给编码器后需 release_frame。
+        """
+        pixel_format = self.config.pixel_format
+        if pixel_format == 'yuv420p':
+            shape = (rendition.height * 3 // 2, rendition.width)
+            if frame.shape == shape:
+                return frame
+        else:
+            shape = (rendition.height, rendition.width, 3)
+            if frame.shape == shape:
+                return frame
+
+        pool = self._pools.get(rendition.name)
+        if pool is None or pool.shape != shape:
+            if pool is not None:
+                pool.close()
+            pool = self._pools[rendition.name] = FramePool(shape, count=max(1, self.buffer_count))
+
+        return scale_frame(frame, rendition.width, rendition.height, pixel_format, dst=pool.acquire())
+
+    def encode_frame(self, frame: np.ndarray, pts: Optional[float] = None) -> bool:
+        """将采集帧缩放到每个档位并提交给对应编码器"""
+        if not self.is_running:
+            return False
+
+        success = True
+        for rendition in self.renditions:
+            encoder = self.encoders.get(rendition.name)
+            if encoder:
+                scaled = self._scale(frame, rendition)
+                success = encoder.encode_frame(scaled, pts) and success
+                if scaled is not frame:
+                    # 编码器已 retain，归还本方的引用
+                    release_frame(scaled)
+        return success
+
+    async def encode_frame_async(self, frame: np.ndarray, pts: Optional[float] = None) -> bool:
+        """异步编码帧（提交本身不阻塞）"""
+        return self.encode_frame(frame, pts)
+
+    def request_keyframe(self, rendition: Optional[str] = None) -> bool:
+        """请求指定档位（None为全部档位）尽快输出IDR"""
+        if rendition is not None:
+            encoder = self.encoders.get(rendition)
+            return encoder.request_keyframe() if encoder else False
+
+        results = [encoder.request_keyframe() for encoder in self.encoders.values()]
+        return any(results)
+
+    def reconfigure(self, **kwargs) -> bool:
+        """修改所有档位的编码参数
+
+        分辨率由档位决定不可修改；码率按各档位与最高档的比例换算。
+        """
+        kwargs = {k: v for k, v in kwargs.items() if k not in ('width', 'height')}
+        top_bitrate = self.renditions[0].bitrate
+
+        success = True
+        for rendition in self.renditions:
+            changes = dict(kwargs)
+            if 'bitrate' in changes:
+                changes['bitrate'] = int(changes['bitrate'] * rendition.bitrate / top_bitrate)
+            encoder = self.encoders.get(rendition.name)
+            if encoder:
+                success = encoder.reconfigure(**changes) and success
+
+        self.config = replace(self.config, **{k: v for k, v in kwargs.items() if hasattr(self.config, k)})
+        return success
+
+    def stop(self):
+        """停止所有档位的编码器"""
+        self.is_running = False
+        for encoder in self.encoders.values():
+            encoder.stop()
+        self.encoders.clear()
+        for pool in self._pools.values():
+            pool.close()
+        self._pools.clear()
+        logger.info("Simulcast encoder stopped")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取各档位的编码统计"""
+        return {
+            'renditions': {name: encoder.get_stats() for name, encoder in self.encoders.items()}
+        }
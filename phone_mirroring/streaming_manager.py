@@ -6,12 +6,25 @@
 import asyncio
 import logging
 import time
-from typing import Optional, Dict, Any, Callable
+from collections import deque
+from typing import Optional, Dict, Any, Callable, Deque, Tuple, Set, Union, TYPE_CHECKING
 from enum import Enum
 
-from phone_mirroring.video_encoder import FFmpegEncoder, EncodeConfig, create_encoder
-from phone_mirroring.screen_capture import ScreenCapture, CaptureConfig, create_capture
 from phone_mirroring.protocols.rtsp import RTSPProtocol
+from phone_mirroring.protocols.mse import MSEProtocol
+from phone_mirroring.renditions import parse_renditions
+from phone_mirroring.pipeline import Pipeline, Stage
+from phone_mirroring.media_frame import MediaFrame
+from phone_mirroring.latency_sei import (build_latency_sei, insert_sei, STAGE_CAPTURE,
+                                         STAGE_ENCODED, STAGE_SENT)
+
+# 屏幕采集和编码（cv2、numpy、av）、文件源、录制和时移（av）在启用时才导入
+if TYPE_CHECKING:
+    from phone_mirroring.video_encoder import FFmpegEncoder
+    from phone_mirroring.screen_capture import ScreenCapture
+    from phone_mirroring.file_source import FileSource
+    from phone_mirroring.recorder import Recorder, RecordingConfig
+    from phone_mirroring.timeshift import TimeShiftBuffer, TimeShiftConfig, TimeShiftServer
 
 logger = logging.getLogger(__name__)
 
@@ -30,13 +43,22 @@ class StreamingManager:
         self.source_type: StreamSource = StreamSource.SCREEN
         
         # 组件
-        self.screen_capture: Optional[ScreenCapture] = None
-        self.video_encoder: Optional[FFmpegEncoder] = None
+        self.screen_capture: Optional['ScreenCapture'] = None
+        self.video_encoder: Optional['FFmpegEncoder'] = None
         self.rtsp_server: Optional[RTSPProtocol] = None
+        self.adb_protocol = None
+        self.file_source: Optional['FileSource'] = None
+        self.recorder: Optional['Recorder'] = None
+        self.timeshift: Optional['TimeShiftBuffer'] = None
+        self.timeshift_server: Optional['TimeShiftServer'] = None
+        self.mse: Optional[MSEProtocol] = None
         
-        # 视频缓冲区
-        self.video_buffer = []
+        # 视频缓冲区（完整访问单元及其元数据），Simulcast时每个档位一个，单路时键为None
+        self.video_buffers: Dict[Optional[str], Deque[Tuple[bytes, Dict]]] = {}
+        self.max_buffer_frames = 30
         self.buffer_lock = asyncio.Lock()
+        self._waiting_keyframe: Set[Optional[str]] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
         
         # 回调
         self.on_frame_ready: Optional[Callable[[bytes, Dict], None]] = None
@@ -49,59 +71,125 @@ class StreamingManager:
             'frames_dropped': 0,
             'bytes_sent': 0,
             'start_time': 0,
-            'fps': 0
+            'fps': 0,
+            'frames_static': 0,      # 画面未变化、未送入编码器的帧
+            'frames_repeated': 0,    # 静止期间的保活重复帧
+            'cpu_percent': 0.0
         }
         
-        # 任务
-        self.capture_task: Optional[asyncio.Task] = None
+        # 静止画面：超过 idle_after 秒无变化后采集线程降到 idle_fps 轮询，
+        # 每 keepalive_interval 秒重复送一帧保持码流；关键帧请求会临时唤醒
+        self.idle_after = 0.5
+        self.idle_fps = 5
+        self.keepalive_interval = 1.0
+        self._wake_until = 0.0
+        self._last_submit = 0.0
+        
+        # 流水线：源 -> 编码 -> 缓冲/发送，各阶段之间为有界队列（见 _build_*_pipeline）
+        self.pipeline: Optional[Pipeline] = None
+        self._output_stage = 'encode'     # 访问单元由哪个阶段输出（编码器或文件源）
+        self.buffer_queue_size = 60
         self.stream_task: Optional[asyncio.Task] = None
+        
+        # 端到端延迟追踪：发送前在访问单元中插入携带采集/编码/发送时间戳的SEI
+        self.latency_sei = True
+        self._latency_seq = 0
     
     async def start_screen_streaming(self, config: Optional[Dict] = None) -> bool:
         """启动桌面屏幕投屏
         
         Args:
-            config: 配置字典，包含resolution, fps, bitrate等
+            config: 配置字典，包含width, height, fps, bitrate,
+                pixel_format ('bgr24' 默认 / 'yuv420p'，后者管道数据量减半) 等；
+                simulcast 为档位列表（如 ['1080p', '720p', '480p']）或True（默认档位）时
+                同一采集帧按档位分别编码，客户端按实测带宽分配档位；
+                skip_static（默认True）在画面不变时跳过转换和编码，idle_fps、keepalive_interval
+                控制静止时的轮询和保活频率；track_dirty_tiles 开启64×64分块脏区域统计；
+                align_to_refresh 把采集帧间隔对齐到显示器刷新周期；
+                latency_sei（默认True）在码流中插入延迟时间戳SEI；
+                recording 为录制配置（enabled为True时开始录制，见 start_recording）；
+                timeshift 为时移缓冲配置（enabled为True时启用，见 start_timeshift）；
+                mse 为浏览器fMP4输出配置（enabled为True时启用，见 start_mse）
         """
         try:
+            from phone_mirroring.video_encoder import EncodeConfig, create_encoder
+            from phone_mirroring.screen_capture import create_capture
+            from phone_mirroring.simulcast import SimulcastEncoder
+            
             config = config or {}
+            self._loop = asyncio.get_running_loop()
+            self.latency_sei = config.get('latency_sei', True)
+            if config.get('recording', {}).get('enabled'):
+                self.start_recording(config['recording'])
+            if config.get('timeshift', {}).get('enabled'):
+                await self.start_timeshift(config['timeshift'])
+            if config.get('mse', {}).get('enabled'):
+                await self.start_mse(config['mse'])
             
             # 1. 启动RTSP服务器
             logger.info("Starting RTSP server...")
             rtsp_config = {
                 'port': config.get('port', 8554),
-                'rtp_port_start': config.get('rtp_port_start', 5000)
+                'rtp_port_start': config.get('rtp_port_start', 5000),
+                'fps': config.get('fps', 30)
             }
             self.rtsp_server = RTSPProtocol(rtsp_config)
             
             if not await self.rtsp_server.start():
                 logger.error("Failed to start RTSP server")
                 return False
+            self.rtsp_server.register_callback("keyframe_requested", self._on_keyframe_requested)
             
             # 2. 初始化屏幕捕获
             logger.info("Initializing screen capture...")
             capture_method = config.get('capture_method', 'mss')
+            width = config.get('width', 1920)
+            height = config.get('height', 1080)
+            
+            # yuv420p: 采集端一次性BGRA->I420，管道数据量为bgr24的一半
+            pixel_format = config.get('pixel_format', 'bgr24')
             self.screen_capture = create_capture(
                 method=capture_method,
-                fps=config.get('fps', 30)
+                fps=config.get('fps', 30),
+                output_size=(width, height),
+                output_format='i420' if pixel_format == 'yuv420p' else 'bgr',
+                detect_changes=config.get('skip_static', True),
+                track_dirty_tiles=config.get('track_dirty_tiles', False),
+                idle_fps=config.get('idle_fps', self.idle_fps) if config.get('skip_static', True) else 0,
+                idle_after=self.idle_after,
+                align_to_refresh=config.get('align_to_refresh', False)
             )
-            
-            if not self.screen_capture.initialize():
-                logger.error("Failed to initialize screen capture")
-                await self.rtsp_server.stop()
-                return False
+            self.idle_fps = config.get('idle_fps', self.idle_fps)
+            self.keepalive_interval = config.get('keepalive_interval', self.keepalive_interval)
             
             # 3. 初始化视频编码器
             logger.info("Initializing video encoder...")
             encode_config = EncodeConfig(
-                width=config.get('width', 1920),
-                height=config.get('height', 1080),
+                width=width,
+                height=height,
                 fps=config.get('fps', 30),
                 bitrate=config.get('bitrate', 2000000),
                 preset='fast',
-                tune='zerolatency'
+                tune='zerolatency',
+                pixel_format=pixel_format
             )
             
-            self.video_encoder = FFmpegEncoder(encode_config)
+            encoder_type = config.get('encoder', 'ffmpeg')
+            if encoder_type == 'auto':
+                # 没有缓存时基准测试需要数秒，在线程池中运行，不阻塞事件循环
+                from phone_mirroring.encoder_registry import get_registry
+                await self._loop.run_in_executor(None, get_registry().get_results)
+            
+            simulcast = config.get('simulcast')
+            if simulcast:
+                renditions = parse_renditions(simulcast if isinstance(simulcast, list) else None,
+                                              max_size=(width, height))
+                self.video_encoder = SimulcastEncoder(encode_config, renditions,
+                                                      encoder_type=encoder_type)
+                self.rtsp_server.set_renditions(renditions)
+            else:
+                # encoder='auto' 时按基准测试结果选择最快的后端
+                self.video_encoder = create_encoder(encoder_type, encode_config)
             
             # 设置编码器输出回调
             self.video_encoder.on_encoded_data = self._on_encoded_data
@@ -114,12 +202,20 @@ class StreamingManager:
             # 4. 设置RTSP视频源
             self.rtsp_server.set_video_source(self._get_video_frame)
             
-            # 5. 启动捕获循环
+            # 5. 启动流水线：采集线程 -> 邮箱 -> 编码提交线程 -> 编码器 -> 缓冲（事件循环）
             self.is_running = True
             self.source_type = StreamSource.SCREEN
             self.stats['start_time'] = time.time()
             
-            self.capture_task = asyncio.create_task(self._capture_loop())
+            self.pipeline = self._build_screen_pipeline(config)
+            self.pipeline.start(self._loop)
+            
+            # 捕获后端只在采集线程内初始化一次，等待其结果
+            if not await self._loop.run_in_executor(None, self.screen_capture.wait_initialized, 5.0):
+                logger.error("Failed to initialize screen capture")
+                await self.stop()
+                return False
+            
             self.stream_task = asyncio.create_task(self._streaming_loop())
             
             logger.info("Screen streaming started successfully")
@@ -137,10 +233,20 @@ class StreamingManager:
         
         Args:
             adb_protocol: ADBProtocol实例
-            config: 配置字典
+            config: 配置字典，latency_sei（默认True）在码流中插入延迟时间戳SEI
+                （设备端编码，采集时间取主机收到访问单元的时间），recording 为录制配置，
+                timeshift 为时移缓冲配置；mse 为浏览器fMP4输出配置
         """
         try:
             config = config or {}
+            self._loop = asyncio.get_running_loop()
+            self.latency_sei = config.get('latency_sei', True)
+            if config.get('recording', {}).get('enabled'):
+                self.start_recording(config['recording'])
+            if config.get('timeshift', {}).get('enabled'):
+                await self.start_timeshift(config['timeshift'])
+            if config.get('mse', {}).get('enabled'):
+                await self.start_mse(config['mse'])
             
             # 1. 启动RTSP服务器
             logger.info("Starting RTSP server for ADB...")
@@ -153,17 +259,21 @@ class StreamingManager:
             if not await self.rtsp_server.start():
                 logger.error("Failed to start RTSP server")
                 return False
+            self.rtsp_server.register_callback("keyframe_requested", self._on_keyframe_requested)
             
-            # 2. 设置ADB视频帧回调
-            adb_protocol.set_video_frame_callback(self._on_adb_frame)
-            
-            # 3. 设置RTSP视频源
+            # 2. 设置RTSP视频源
             self.rtsp_server.set_video_source(self._get_video_frame)
             
             self.is_running = True
             self.source_type = StreamSource.ADB
             self.stats['start_time'] = time.time()
             
+            # 3. 启动流水线：ADB读取 -> 发送（事件循环），设备帧回调送入发送队列
+            self.adb_protocol = adb_protocol
+            self.pipeline = self._build_adb_pipeline(config)
+            self.pipeline.start(self._loop)
+            adb_protocol.set_video_frame_callback(self._on_adb_frame)
+            
             self.stream_task = asyncio.create_task(self._streaming_loop())
             
             logger.info("ADB streaming started successfully")
@@ -176,37 +286,120 @@ class StreamingManager:
             await self.stop()
             return False
     
+    async def start_file_streaming(self, path: str, config: Optional[Dict] = None) -> bool:
+        """启动文件投屏（MP4/MKV/裸H.264，直接转发访问单元，不重新编码）
+        
+        Args:
+            path: 视频文件路径
+            config: 配置字典，realtime（默认True）为False时尽快发布（基准测试），
+                loop（默认True）循环播放，fps 为裸H.264文件的帧率，
+                latency_sei（默认True）在码流中插入发送时间戳SEI，recording 为录制配置，
+                timeshift 为时移缓冲配置；mse 为浏览器fMP4输出配置
+        """
+        try:
+            from phone_mirroring.file_source import FileSource
+            
+            config = config or {}
+            self._loop = asyncio.get_running_loop()
+            self.latency_sei = config.get('latency_sei', True)
+            if config.get('recording', {}).get('enabled'):
+                self.start_recording(config['recording'])
+            if config.get('timeshift', {}).get('enabled'):
+                await self.start_timeshift(config['timeshift'])
+            if config.get('mse', {}).get('enabled'):
+                await self.start_mse(config['mse'])
+            
+            # 1. 启动RTSP服务器
+            logger.info("Starting RTSP server for file...")
+            rtsp_config = {
+                'port': config.get('port', 8554),
+                'rtp_port_start': config.get('rtp_port_start', 5000),
+                'fps': config.get('fps', 30)
+            }
+            self.rtsp_server = RTSPProtocol(rtsp_config)
+            
+            if not await self.rtsp_server.start():
+                logger.error("Failed to start RTSP server")
+                return False
+            self.rtsp_server.register_callback("keyframe_requested", self._on_keyframe_requested)
+            
+            # 2. 设置RTSP视频源
+            self.rtsp_server.set_video_source(self._get_video_frame)
+            
+            self.is_running = True
+            self.source_type = StreamSource.FILE
+            self.stats['start_time'] = time.time()
+            
+            # 3. 启动流水线：文件读取线程 -> 缓冲（访问单元与编码器输出走同一条缓冲路径）
+            self.file_source = FileSource(
+                path,
+                realtime=config.get('realtime', True),
+                loop=config.get('loop', True),
+                fps=config.get('fps', 30)
+            )
+            self.pipeline = self._build_file_pipeline(config)
+            self.pipeline.start(self._loop)
+            if not self.file_source.is_running:
+                await self.stop()
+                return False
+            
+            self.stream_task = asyncio.create_task(self._streaming_loop())
+            
+            logger.info("File streaming started successfully")
+            logger.info(f"RTSP URL: rtsp://localhost:{rtsp_config['port']}/")
+            
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to start file streaming: {e}")
+            await self.stop()
+            return False
+    
     async def stop(self) -> bool:
         """停止流媒体"""
         try:
             self.is_running = False
             
             # 停止任务
-            for task in [self.capture_task, self.stream_task]:
-                if task:
-                    task.cancel()
-                    try:
-                        await task
-                    except asyncio.CancelledError:
-                        pass
-            
-            # 停止编码器
+            if self.stream_task:
+                self.stream_task.cancel()
+                try:
+                    await self.stream_task
+                except asyncio.CancelledError:
+                    pass
+            
+            # 先按从源到汇的顺序停止流水线（关闭各阶段队列唤醒工作线程），再停止编码器
+            if self.pipeline:
+                await asyncio.get_running_loop().run_in_executor(None, self.pipeline.stop)
+                self.pipeline = None
+            elif self.screen_capture:
+                self.screen_capture.stop_capture()
+            self.screen_capture = None
+            
             if self.video_encoder:
                 self.video_encoder.stop()
                 self.video_encoder = None
             
-            # 停止屏幕捕获
-            if self.screen_capture:
-                self.screen_capture.stop_capture()
-                self.screen_capture = None
+            # 源已停止，写完录制队列并关闭当前分段
+            if self.recorder:
+                await asyncio.get_running_loop().run_in_executor(None, self.stop_recording)
+            await self.stop_timeshift()
+            await self.stop_mse()
             
             # 停止RTSP服务器
             if self.rtsp_server:
                 await self.rtsp_server.stop()
                 self.rtsp_server = None
             
+            if self.adb_protocol:
+                self.adb_protocol.set_video_frame_callback(None)
+                self.adb_protocol = None
+            
+            self.file_source = None
+            
             # 清空缓冲区
-            self.video_buffer.clear()
+            self.video_buffers.clear()
+            self._waiting_keyframe.clear()
             
             logger.info("Streaming stopped")
             return True
@@ -215,39 +408,130 @@ class StreamingManager:
             logger.error(f"Error stopping streaming: {e}")
             return False
     
-    async def _capture_loop(self):
-        """屏幕捕获循环"""
+    def _build_screen_pipeline(self, config: Dict) -> Pipeline:
+        """屏幕投屏流水线
+        
+        capture（采集线程，输出到其最新帧邮箱）-> encode（线程，静止判断后提交编码器，
+        编码输出由编码器回调送出）-> buffer（事件循环，按档位缓冲供RTSP拉取）。
+        编码跟不上时邮箱只保留最新帧；缓冲阶段跟不上时阻塞编码器读取线程（背压），
+        阻塞超时丢弃的访问单元由 _discard_access_unit 处理。
+        """
+        capture = self.screen_capture
+        self._last_submit = time.monotonic()
+        self._output_stage = 'encode'
+        
+        pipeline = Pipeline('screen')
+        pipeline.add(Stage('capture', kind='source', start=capture.start_capture, stop=capture.stop_capture))
+        pipeline.add(Stage('encode', self._submit_frame, kind='encoder', queue=capture.frames))
+        pipeline.add(Stage('buffer', self._buffer_item, kind='sink', executor='asyncio',
+                           queue_size=config.get('buffer_queue_size', self.buffer_queue_size), overflow='block',
+                           on_discard=self._discard_access_unit))
+        return pipeline
+    
+    def _build_adb_pipeline(self, config: Dict) -> Pipeline:
+        """ADB投屏流水线：adb（设备读取协程）-> send（事件循环，按到达顺序发送）
+        
+        设备回调在事件循环中调用，不能阻塞，发送队列满时丢弃最旧的帧。
+        队列中的 MediaFrame 各持有一个引用，发送或丢弃后释放。
+        """
+        pipeline = Pipeline('adb')
+        pipeline.add(Stage('adb', kind='source'))
+        pipeline.add(Stage('send', self._send_item, kind='sink', executor='asyncio',
+                           queue_size=config.get('buffer_queue_size', self.buffer_queue_size),
+                           on_discard=self._discard_item))
+        return pipeline
+    
+    def _build_file_pipeline(self, config: Dict) -> Pipeline:
+        """文件投屏流水线：file（文件读取线程）-> buffer（事件循环）"""
+        source = self.file_source
+        self._output_stage = 'file'
+        pipeline = Pipeline('file')
+        pipeline.add(Stage('file', kind='source', start=lambda: source.start(self._on_encoded_data),
+                           stop=source.stop))
+        pipeline.add(Stage('buffer', self._buffer_item, kind='sink', executor='asyncio',
+                           queue_size=config.get('buffer_queue_size', self.buffer_queue_size), overflow='block',
+                           on_discard=self._discard_access_unit))
+        return pipeline
+    
+    def _submit_frame(self, item: Tuple[Any, Dict]) -> None:
+        """编码阶段：把采集帧提交编码器
+        
+        画面未变化的帧不送入编码器，只按 keepalive_interval 重复送入上一帧。
+        """
+        frame, info = item
+        pts = info['pts']
         try:
-            frame_interval = 1.0 / self.screen_capture.config.fps
-            
-            while self.is_running:
-                loop_start = time.time()
-                
-                # 捕获屏幕
-                frame = self.screen_capture.capture_frame()
-                
-                if frame is not None and self.video_encoder:
-                    # 编码帧
-                    success = await self.video_encoder.encode_frame_async(frame)
-                    if success:
-                        self.stats['frames_captured'] += 1
-                
-                # 控制帧率
-                elapsed = time.time() - loop_start
-                sleep_time = frame_interval - elapsed
-                if sleep_time > 0:
-                    await asyncio.sleep(sleep_time)
-                    
-        except asyncio.CancelledError:
-            logger.info("Capture loop cancelled")
-        except Exception as e:
-            logger.error(f"Capture loop error: {e}")
-            if self.on_error:
-                self.on_error(e)
+            if not info['changed']:
+                if pts < self._wake_until or pts - self._last_submit >= self.keepalive_interval:
+                    self.stats['frames_repeated'] += 1
+                else:
+                    self.stats['frames_static'] += 1
+                    return None
+            
+            # 编码器自行持有帧引用
+            if self.video_encoder and self.video_encoder.encode_frame(frame, pts):
+                self.stats['frames_captured'] += 1
+                self._last_submit = pts
+        finally:
+            # 归还缓冲池
+            self.screen_capture.release_frame(frame)
+        return None
+    
+    def _buffer_item(self, item: Tuple[bytes, Dict]) -> None:
+        """缓冲阶段"""
+        self._buffer_access_unit(*item)
+    
+    async def _send_item(self, item: Tuple[Any, Dict]) -> None:
+        """发送阶段（ADB）"""
+        try:
+            if self.rtsp_server:
+                await self.rtsp_server.send_frame(*self._stamp_latency(*item))
+        finally:
+            self._discard_item(item)
+    
+    def _discard_access_unit(self, item: Tuple[bytes, Dict]):
+        """缓冲阶段队列阻塞超时（或停止时）丢弃的访问单元
+        
+        之后的帧可能参考被丢弃的帧，该档位丢弃到下一个关键帧为止并请求关键帧。
+        在编码输出线程中调用，集合的添加是原子操作。
+        """
+        self.stats['frames_dropped'] += 1
+        if not self.is_running:
+            return
+        rendition = item[1].get('rendition')
+        self._waiting_keyframe.add(rendition)
+        self.request_keyframe(rendition)
+    
+    def _discard_item(self, item: Tuple[Any, Dict]):
+        """释放发送队列中的 MediaFrame 引用（发送完成或被丢弃）"""
+        if isinstance(item[0], MediaFrame):
+            item[0].release()
+    
+    def _stamp_latency(self, data, metadata: Dict) -> Tuple[Any, Dict]:
+        """访问单元离开缓冲区时插入延迟时间戳SEI（采集、编码、发送三个时间点）
+        
+        MediaFrame 不拼接拷贝，SEI 放在 metadata['sei'] 中由RTSP打包时插入。
+        """
+        if not self.latency_sei:
+            return data, metadata
+        
+        self._latency_seq += 1
+        stamps = {STAGE_SENT: time.monotonic_ns()}
+        if 'capture_time' in metadata:
+            stamps[STAGE_CAPTURE] = metadata['capture_time']
+        if 'encoded_time' in metadata:
+            stamps[STAGE_ENCODED] = metadata['encoded_time']
+        metadata['latency_seq'] = self._latency_seq
+        sei = build_latency_sei(self._latency_seq, stamps)
+        if isinstance(data, MediaFrame):
+            metadata['sei'] = sei[4:]
+            return data, metadata
+        return insert_sei(data, sei), metadata
     
     async def _streaming_loop(self):
         """流媒体发送循环"""
         try:
+            last_wall, last_cpu = time.monotonic(), time.process_time()
             while self.is_running:
                 await asyncio.sleep(1)
                 
@@ -255,41 +539,232 @@ class StreamingManager:
                 uptime = time.time() - self.stats['start_time']
                 if uptime > 0:
                     self.stats['fps'] = self.stats['frames_captured'] / uptime
+                
+                # 本进程CPU占用（不含FFmpeg子进程）
+                wall, cpu = time.monotonic(), time.process_time()
+                self.stats['cpu_percent'] = 100.0 * (cpu - last_cpu) / (wall - last_wall)
+                last_wall, last_cpu = wall, cpu
                     
         except asyncio.CancelledError:
             logger.info("Streaming loop cancelled")
         except Exception as e:
             logger.error(f"Streaming loop error: {e}")
     
-    def _on_encoded_data(self, data: bytes):
-        """编码数据回调"""
-        if data:
-            # 添加到缓冲区
-            self.video_buffer.append(data)
-            
-            # 限制缓冲区大小
-            if len(self.video_buffer) > 30:
-                self.video_buffer.pop(0)
+    def _on_encoded_data(self, data: bytes, metadata: Dict):
+        """编码数据回调（每次一个完整访问单元）"""
+        if not data or not self.is_running:
+            return
+        
+        self.stats['frames_encoded'] += 1
+        
+        # 录制/时移旁路：只入队或拷贝进缓冲，不阻塞编码输出线程
+        self._tee(data, metadata)
+        
+        # 屏幕源的pts即采集时的 time.monotonic()
+        if self.latency_sei:
+            metadata['encoded_time'] = time.monotonic_ns()
+            if self.source_type == StreamSource.SCREEN and metadata.get('pts') is not None:
+                metadata['capture_time'] = int(metadata['pts'] * 1e9)
+        
+        # 编码输出来自读取线程，经有界队列交给事件循环中的缓冲阶段
+        pipeline = self.pipeline
+        if pipeline:
+            pipeline.emit(self._output_stage, (data, metadata))
+        else:
+            self._buffer_access_unit(data, metadata)
+    
+    def _buffer_access_unit(self, data: bytes, metadata: Dict):
+        """将访问单元加入所属档位的缓冲区，溢出时按GOP丢弃"""
+        is_keyframe = metadata.get('is_keyframe', False)
+        rendition = metadata.get('rendition')
+        
+        # 丢帧后需等待下一个关键帧，避免发送无法解码的参考帧
+        if rendition in self._waiting_keyframe:
+            if not is_keyframe:
                 self.stats['frames_dropped'] += 1
-            
-            self.stats['frames_encoded'] += 1
+                return
+            self._waiting_keyframe.discard(rendition)
+        
+        buffer = self.video_buffers.setdefault(rendition, deque())
+        buffer.append((data, metadata))
+        
+        # 限制缓冲区大小：丢弃最旧的帧直到下一个关键帧
+        if len(buffer) > self.max_buffer_frames:
+            buffer.popleft()
+            self.stats['frames_dropped'] += 1
+            while buffer and not buffer[0][1].get('is_keyframe', False):
+                buffer.popleft()
+                self.stats['frames_dropped'] += 1
+            if not buffer:
+                self._waiting_keyframe.add(rendition)
+                self.request_keyframe(rendition)
+    
+    def request_keyframe(self, rendition: Optional[str] = None) -> bool:
+        """请求当前视频源尽快输出IDR（编码器，请求经过限流；ADB设备和文件源不支持，返回False）
+        
+        Args:
+            rendition: Simulcast档位，None表示所有档位
+        """
+        if self.source_type == StreamSource.ADB and self.adb_protocol:
+            return self.adb_protocol.request_keyframe()
+        if self.source_type == StreamSource.FILE:
+            return False
+        
+        # 静止画面下编码器收不到新帧，临时恢复正常帧率让IDR尽快产生
+        self._wake_until = time.monotonic() + 1.0
+        if self.screen_capture:
+            self.screen_capture.wake(1.0)
+        
+        if not self.video_encoder:
+            return False
+        from phone_mirroring.simulcast import SimulcastEncoder
+        if isinstance(self.video_encoder, SimulcastEncoder):
+            return self.video_encoder.request_keyframe(rendition)
+        return self.video_encoder.request_keyframe()
+    
+    def _on_keyframe_requested(self, client_id: Optional[str], reason: str):
+        """协议层的关键帧请求（新观众PLAY、RTCP PLI/FIR、丢包、切换档位）"""
+        if self.is_running:
+            rendition = self.rtsp_server.client_rendition(client_id) if self.rtsp_server else None
+            self.request_keyframe(rendition)
     
-    def _on_adb_frame(self, frame_data: bytes, metadata: Dict):
-        """ADB视频帧回调"""
-        self.video_buffer.append(frame_data)
+    def _on_adb_frame(self, frame_data, metadata: Dict):
+        """ADB视频帧回调
+        
+        frame_data 为设备协议的 MediaFrame（或bytes），metadata 是设备协议为这一帧创建的字典，
+        直接在其上补充字段，不再复制。
+        """
         self.stats['frames_captured'] += 1
         
-        # 通知RTSP服务器有新帧
-        if self.rtsp_server:
-            asyncio.create_task(
-                self.rtsp_server.send_frame(frame_data, metadata)
-            )
+        # 设备帧没有主机时基的时间戳，以收到的时间为准（RTP时间戳、录制和延迟SEI共用）
+        arrival = time.monotonic_ns()
+        metadata['pts'] = arrival / 1e9
+        if isinstance(frame_data, MediaFrame):
+            frame_data.pts = metadata['pts']
+        if self.latency_sei:
+            metadata['capture_time'] = arrival
+        
+        self._tee(frame_data, metadata)
+        
+        # 送入发送阶段队列，按到达顺序发送；队列持有帧的一个引用
+        pipeline = self.pipeline
+        if pipeline:
+            if isinstance(frame_data, MediaFrame):
+                frame_data.retain()
+            pipeline.emit('adb', (frame_data, metadata))
     
-    def _get_video_frame(self) -> Optional[bytes]:
-        """获取视频帧（供RTSP服务器调用）"""
-        if self.video_buffer:
-            return self.video_buffer.pop(0)
-        return None
+    def start_recording(self, config: Optional[Union['RecordingConfig', Dict]] = None) -> bool:
+        """开始录制当前视频源（直接封装编码输出，不重新编码）
+        
+        Args:
+            config: RecordingConfig 或配置字典（Config.recording，'enabled'键被忽略）
+        """
+        if self.recorder:
+            return True
+        from phone_mirroring.recorder import Recorder, RecordingConfig
+        if isinstance(config, dict):
+            config = RecordingConfig(**{k: v for k, v in config.items() if k != 'enabled'})
+        
+        recorder = Recorder(config)
+        if not recorder.start():
+            logger.warning("Recording could not be started, streaming continues without it")
+            return False
+        self.recorder = recorder
+        return True
+    
+    def stop_recording(self):
+        """停止录制（等待写入线程写完队列）"""
+        recorder, self.recorder = self.recorder, None
+        if recorder:
+            recorder.stop()
+    
+    async def start_timeshift(self, config: Optional[Union['TimeShiftConfig', Dict]] = None) -> bool:
+        """启用时移缓冲（保留最近 duration 秒的访问单元，可导出片段或通过HTTP回看）
+        
+        Args:
+            config: TimeShiftConfig 或配置字典（'enabled'键被忽略），http_port 非0时启动回看服务
+        """
+        if self.timeshift:
+            return True
+        from phone_mirroring.timeshift import TimeShiftBuffer, TimeShiftConfig, TimeShiftServer
+        if isinstance(config, dict):
+            config = TimeShiftConfig(**{k: v for k, v in config.items() if k != 'enabled'})
+        
+        self.timeshift = TimeShiftBuffer(config)
+        logger.info(f"Time-shift buffer enabled: {self.timeshift.config.duration:.0f}s, "
+                    f"{self.timeshift.capacity >> 20} MiB")
+        if self.timeshift.config.http_port:
+            server = TimeShiftServer(self.timeshift, self.timeshift.config.http_port)
+            if await server.start():
+                self.timeshift_server = server
+        return True
+    
+    async def stop_timeshift(self):
+        """关闭时移缓冲和回看服务"""
+        if self.timeshift_server:
+            await self.timeshift_server.stop()
+            self.timeshift_server = None
+        self.timeshift = None
+    
+    async def start_mse(self, config: Optional[Dict] = None) -> bool:
+        """启用浏览器输出：访问单元封装为逐帧fMP4，经WebSocket/HTTP chunked推送给MSE播放
+        
+        Args:
+            config: 配置字典（port 默认8092，rendition、max_queue_frames 等，'enabled'键被忽略）
+        """
+        if self.mse:
+            return True
+        mse = MSEProtocol({k: v for k, v in (config or {}).items() if k != 'enabled'})
+        if not await mse.start():
+            logger.warning("Browser output could not be started, streaming continues without it")
+            return False
+        self.mse = mse
+        return True
+    
+    async def stop_mse(self):
+        """关闭浏览器输出"""
+        mse, self.mse = self.mse, None
+        if mse:
+            await mse.stop()
+    
+    def save_clip(self, path: str, seconds: float = 30.0, format: str = 'mp4') -> int:
+        """把最近 seconds 秒保存为文件（仅重新封装，耗时与片段大小成正比，可在线程池中调用）
+        
+        Returns:
+            保存的帧数，未启用时移缓冲或缓冲为空时为0
+        """
+        timeshift = self.timeshift
+        if not timeshift:
+            logger.warning("Time-shift buffer is not enabled")
+            return 0
+        frames = timeshift.export_last(path, seconds, format)
+        logger.info(f"Saved clip {path}: {frames} frames")
+        return frames
+    
+    def _tee(self, data, metadata: Dict):
+        """把访问单元交给录制器、时移缓冲和浏览器输出（都不阻塞调用线程）"""
+        recorder, timeshift, mse = self.recorder, self.timeshift, self.mse
+        if isinstance(data, MediaFrame):
+            # 时移缓冲直接从帧缓冲区拷贝；录制器和浏览器输出在帧释放后仍使用数据，共用一份拷贝
+            if timeshift:
+                timeshift.write(data.data, metadata)
+                timeshift = None
+            data = data.tobytes() if recorder or mse else None
+        if recorder:
+            recorder.write(data, metadata)
+        if timeshift:
+            timeshift.write(data, metadata)
+        if mse:
+            mse.push(data, metadata)
+    
+    def _get_video_frame(self) -> Optional[Tuple[bytes, Dict]]:
+        """获取视频帧（供RTSP服务器调用），多个档位时取最早编码的一帧"""
+        oldest = None
+        for buffer in self.video_buffers.values():
+            if buffer and (oldest is None or
+                           (buffer[0][1].get('pts') or 0) < (oldest[0][1].get('pts') or 0)):
+                oldest = buffer
+        return self._stamp_latency(*oldest.popleft()) if oldest else None
     
     def get_stats(self) -> Dict[str, Any]:
         """获取统计信息"""
@@ -302,9 +777,38 @@ class StreamingManager:
             'fps': self.stats['fps'],
             'frames_captured': self.stats['frames_captured'],
             'frames_encoded': self.stats['frames_encoded'],
-            'frames_dropped': self.stats['frames_dropped']
+            'frames_dropped': self.stats['frames_dropped'],
+            'frames_static': self.stats['frames_static'],
+            'frames_repeated': self.stats['frames_repeated'],
+            'cpu_percent': self.stats['cpu_percent']
         }
         
+        # 各阶段耗时直方图：grab/convert（采集线程）及流水线各阶段的处理耗时
+        stage_timings = {}
+        if self.screen_capture:
+            stats['capture'] = self.screen_capture.get_stats()
+            stage_timings.update(stats['capture']['stage_timings'])
+        if self.pipeline:
+            stats['pipeline'] = self.pipeline.get_stats()
+            for name, stage in stats['pipeline']['stages'].items():
+                if stage['processed']:
+                    stage_timings[name] = stage['latency']
+        stats['stage_timings'] = stage_timings
+        
+        if self.recorder:
+            stats['recording'] = self.recorder.get_stats()
+        if self.timeshift:
+            stats['timeshift'] = self.timeshift.get_stats()
+        if self.mse:
+            stats['mse'] = self.mse.get_session_info()
+        
+        if self.file_source:
+            stats['file'] = self.file_source.get_stats()
+        
+        # 添加编码器状态
+        if self.video_encoder:
+            stats['encoder'] = self.video_encoder.get_stats()
+        
         # 添加RTSP服务器状态
         if self.rtsp_server:
             stats['rtsp'] = self.rtsp_server.get_session_info()
@@ -370,3 +874,21 @@ async def start_adb_mirror(adb_protocol, config: Optional[Dict] = None) -> Strea
         raise RuntimeError("Failed to start ADB mirroring")
     
     return manager
+
+async def start_file_mirror(path: str, config: Optional[Dict] = None) -> StreamingManager:
+    """快速启动文件投屏
+    
+    Args:
+        path: 视频文件路径
+        config: 配置字典
+        
+    Returns:
+        StreamingManager实例
+    """
+    manager = StreamingManager()
+    success = await manager.start_file_streaming(path, config)
+    
+    if not success:
+        raise RuntimeError("Failed to start file mirroring")
+    
+    return manager
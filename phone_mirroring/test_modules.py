@@ -145,13 +145,16 @@ def test_rtsp_packet():
 def test_h264_parser():
     """测试H264解析器"""
     try:
-        from phone_mirroring.protocols.adb import H264Parser, VideoFrameInfo
+        from phone_mirroring.protocols.adb import H264Parser
         
         parser = H264Parser()
+        aud = b'\x00\x00\x00\x01\x09\xf0'  # 访问单元分隔符
         
-        # 测试NAL单元检测
+        # 测试NAL单元检测（NAL单元在下一个起始码出现时才完整）
         test_data = b'\x00\x00\x00\x01\x67' + b'A' * 100  # SPS NAL单元
         parser.feed_data(test_data)
+        assert parser.sps_data is None, "NAL单元未结束前不应解析"
+        parser.feed_data(aud)
         
         assert parser.sps_data is not None, "应检测到SPS数据"
         
@@ -163,12 +166,13 @@ def test_h264_parser():
         )
         
         frames_received = []
-        def frame_callback(data, info):
-            frames_received.append((data, info))
+        def frame_callback(frame):
+            frames_received.append((frame.tobytes(), frame.is_keyframe))
         
         parser.frame_callback = frame_callback
-        parser.feed_data(test_frame)
-        parser._emit_frame()  # 手动触发帧发送
+        parser.feed_data(test_frame + aud)
+        
+        assert frames_received == [(test_frame, True)], "IDR帧应带最新的SPS/PPS输出"
         
         logger.info(f"✅ H264解析器测试通过，收到 {len(frames_received)} 帧")
         return True
@@ -177,6 +181,1377 @@ def test_h264_parser():
         logger.error(f"❌ H264解析器测试失败: {e}")
         return False
 
+def test_access_unit_parser():
+    """测试访问单元解析器"""
+    try:
+        from phone_mirroring.nal_parser import AccessUnitParser
+        from phone_mirroring.protocols.rtsp import H264Packetizer
+        from phone_mirroring.video_encoder import EncodeConfig, build_ffmpeg_command
+        
+        parser = AccessUnitParser()
+        parser.push_pts(1.0)
+        parser.push_pts(2.0)
+        
+        # IDR访问单元（SPS+PPS+IDR）后接一个P帧，first_mb_in_slice=0
+        stream = (
+            b'\x00\x00\x00\x01\x67' + b'S' * 20 +
+            b'\x00\x00\x00\x01\x68' + b'P' * 10 +
+            b'\x00\x00\x00\x01\x65\x88' + b'I' * 3000 +
+            b'\x00\x00\x00\x01\x41\x9a' + b'B' * 500
+        )
+        
+        # 按任意大小分块喂入
+        access_units = []
+        for i in range(0, len(stream), 333):
+            access_units.extend(parser.feed(stream[i:i + 333]))
+        assert len(access_units) == 1, "P帧开始时应输出完整的IDR访问单元"
+        access_units.extend(parser.flush())
+        
+        assert len(access_units) == 2
+        assert access_units[0].is_keyframe and access_units[0].pts == 1.0
+        assert access_units[0].nal_types == [7, 8, 5]
+        assert not access_units[1].is_keyframe and access_units[1].pts == 2.0
+        assert b''.join(au.data for au in access_units) == stream
+        
+        # PTS按输出顺序分配，所有编码器（包括libx264的任意tune）都必须关闭B帧
+        for encoder_name in ('libx264', 'h264_nvenc'):
+            command = build_ffmpeg_command(EncodeConfig(encoder_name=encoder_name, tune='film'))
+            assert command[command.index('-bf') + 1] == '0', f"{encoder_name} 未关闭B帧"
+        
+        # 只有访问单元的最后一个RTP包设置marker位
+        packets = H264Packetizer(mtu=1400).packetize_access_unit(access_units[0].data, 90000)
+        assert [p.marker for p in packets].count(1) == 1 and packets[-1].marker == 1
+        
+        logger.info("✅ 访问单元解析器测试通过")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 访问单元解析器测试失败: {e}")
+        return False
+
+def test_frame_mailbox():
+    """测试单槽位帧邮箱"""
+    try:
+        from phone_mirroring.frame_mailbox import FrameMailbox
+        
+        mailbox = FrameMailbox()
+        assert mailbox.put("frame1")
+        assert not mailbox.put("frame2"), "未取走的旧帧应被覆盖"
+        assert mailbox.get(timeout=0.1) == "frame2"
+        assert mailbox.get(timeout=0.01) is None
+        
+        mailbox.close()
+        assert not mailbox.put("frame3")
+        assert mailbox.stats['dropped'] == 1
+        
+        logger.info("✅ 帧邮箱测试通过")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 帧邮箱测试失败: {e}")
+        return False
+
+def test_i420_conversion():
+    """测试I420输出格式转换"""
+    try:
+        import numpy as np
+        from phone_mirroring.screen_capture import ScreenCapture, CaptureConfig, OutputFormat
+        from phone_mirroring.video_encoder import EncodeConfig, expected_frame_shape
+        
+        capture = ScreenCapture(CaptureConfig(output_format=OutputFormat.I420, buffer_count=2))
+        bgra = np.zeros((121, 200, 4), dtype=np.uint8)
+        
+        first = capture._convert_output(bgra, 'bgra')
+        second = capture._convert_output(bgra, 'bgra')
+        capture.release_frame(first)
+        third = capture._convert_output(bgra, 'bgra')
+        
+        assert first.shape == (180, 200), "奇数高度应裁剪为偶数"
+        assert first is not second and first is third, "归还的输出缓冲区应被复用"
+        
+        config = EncodeConfig(width=200, height=120, pixel_format='yuv420p')
+        assert expected_frame_shape(config) == first.shape
+        
+        logger.info("✅ I420转换测试通过")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ I420转换测试失败: {e}")
+        return False
+
+def test_pyav_encoder():
+    """测试PyAV进程内编码器"""
+    try:
+        import numpy as np
+        from phone_mirroring.video_encoder import PyAVEncoder, EncodeConfig, HAS_AV
+        
+        if not HAS_AV:
+            logger.info("⚠️ PyAV未安装，跳过PyAV编码器测试")
+            return True
+        
+        encoder = PyAVEncoder(EncodeConfig(width=160, height=120, preset='ultrafast'))
+        assert encoder.start(), "编码器应能启动"
+        
+        packets = encoder.encode(np.zeros((120, 160, 3), dtype=np.uint8), pts=1.0)
+        packets += encoder.encode(np.zeros((180, 160), dtype=np.uint8), pts=1.04)
+        
+        assert packets and packets[0].is_keyframe, "第一帧应为关键帧"
+        assert packets[0].pts == 90000, "PTS应为90kHz时间基"
+        
+        # 在线修改分辨率，切换后的第一帧应为IDR
+        assert encoder.reconfigure(width=320, height=240)
+        switched = encoder.encode(np.zeros((120, 160, 3), dtype=np.uint8), pts=1.08)
+        encoder.stop()
+        
+        assert switched and switched[-1].is_keyframe, "切换后应输出IDR"
+        assert encoder.config.width == 320
+        
+        logger.info("✅ PyAV编码器测试通过")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ PyAV编码器测试失败: {e}")
+        return False
+
+def test_parameter_set_update():
+    """测试RTSP参数集跟踪与SDP更新"""
+    try:
+        import base64
+        from phone_mirroring.protocols.rtsp import RTSPProtocol
+        
+        rtsp = RTSPProtocol({})
+        sps = bytes([0x67, 0x64, 0x00, 0x1F, 0xAC])
+        pps = bytes([0x68, 0xEE, 0x3C, 0x80])
+        idr = b'\x00\x00\x00\x01\x65\x88\x84'
+        
+        keyframe = b'\x00\x00\x00\x01' + sps + b'\x00\x00\x00\x01' + pps + idr
+        assert rtsp._update_parameter_sets(keyframe, True) == keyframe
+        assert rtsp.parameter_sets == (sps, pps)
+        assert 'profile-level-id=64001F' in rtsp.sdp_info
+        assert base64.b64encode(sps).decode() in rtsp.sdp_info
+        
+        # 缺少参数集的关键帧应补上SPS/PPS
+        assert rtsp._update_parameter_sets(idr, True) == keyframe
+        assert rtsp._update_parameter_sets(idr, None) == idr
+        
+        logger.info("✅ 参数集更新测试通过")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 参数集更新测试失败: {e}")
+        return False
+
+def test_keyframe_requests():
+    """测试关键帧请求限流与RTCP反馈解析"""
+    try:
+        import struct
+        import threading
+        import time
+        from phone_mirroring.keyframe_limiter import KeyframeLimiter
+        from phone_mirroring.protocols.rtsp import RTCPReceiver
+        
+        limiter = KeyframeLimiter(min_interval=0.5)
+        assert not limiter.take(now=10.0), "无请求时不应触发"
+        
+        for _ in range(5):
+            limiter.request()
+        assert limiter.take(now=10.0), "首个请求应立即触发"
+        
+        limiter.request()
+        assert not limiter.take(now=10.2), "间隔内的请求应等待"
+        assert limiter.take(now=10.6), "间隔结束后应触发一次"
+        
+        limiter.request()
+        limiter.note_keyframe()
+        assert not limiter.take(now=20.0), "自然关键帧应满足请求"
+        assert limiter.stats['coalesced'] == 4
+        
+        receiver = RTCPReceiver(lambda addr, reason: None, loss_threshold=0.05, loss_reports=3)
+        pli = struct.pack('!BBHII', 0x81, 206, 2, 1, 2)
+        nack = struct.pack('!BBHIIHH', 0x81, 205, 3, 1, 2, 100, 0)
+        rr_ok = struct.pack('!BBHI', 0x81, 201, 7, 1) + struct.pack('!IB3sIIII', 2, 0, b'\x00' * 3, 0, 0, 0, 0)
+        rr_loss = struct.pack('!BBHI', 0x81, 201, 7, 1) + struct.pack('!IB3sIIII', 2, 64, b'\x00' * 3, 0, 0, 0, 0)
+        
+        assert receiver.parse_keyframe_request(pli) == 'pli'
+        assert receiver.parse_keyframe_request(rr_ok) is None
+        assert receiver.parse_keyframe_request(rr_ok + pli) == 'pli', "应解析复合RTCP包"
+        assert receiver.parse_keyframe_request(nack) is None, "NACK不应请求关键帧"
+        
+        # 丢包需在同一客户端连续多个报告中出现才请求关键帧
+        client, other = ('10.0.0.1', 5001), ('10.0.0.2', 5001)
+        assert receiver.parse_keyframe_request(rr_loss, client) is None
+        assert receiver.parse_keyframe_request(rr_loss, other) is None
+        assert receiver.parse_keyframe_request(rr_ok, client) is None
+        reasons = [receiver.parse_keyframe_request(rr_loss, client) for _ in range(3)]
+        assert reasons == [None, None, 'loss'], f"连续丢包判断错误: {reasons}"
+        assert receiver.parse_keyframe_request(rr_loss, client) is None, "触发后应重新计数"
+        
+        # 强制关键帧的替换进程启动期间发生重新配置时，不能覆盖重新配置的进程
+        from phone_mirroring.video_encoder import FFmpegEncoder, EncodeConfig
+        
+        class IdleProcess:
+            def __init__(self, config, warmup_frames=0):
+                self.config = config
+                self.warmup_frames = warmup_frames
+                self.started_at = time.monotonic()
+                self.output_started = False
+                self.output_delay = None
+                self.has_exited = False
+                self.submitted = []
+                self.stopped = threading.Event()
+            
+            def start(self):
+                pass
+            
+            def submit(self, frame, pts):
+                self.submitted.append(pts)
+                return True
+            
+            def exited(self):
+                return self.has_exited
+            
+            def stop(self):
+                self.stopped.set()
+        
+        encoder = FFmpegEncoder(EncodeConfig(bitrate=2000000))
+        assert encoder.process is None and encoder.pid is None, "未启动时没有FFmpeg进程"
+        encoder._create_process = lambda config, warmup_frames=0: IdleProcess(config, warmup_frames)
+        reconfigured = IdleProcess(EncodeConfig(bitrate=1000000))
+        encoder._pending = reconfigured
+        assert not encoder._start_replacement(encoder.config, keyframe_only=True)
+        assert encoder._pending is reconfigured, "重新配置的替换进程被覆盖"
+        encoder._pending = None
+        encoder.config = reconfigured.config
+        assert not encoder._start_replacement(EncodeConfig(bitrate=2000000), keyframe_only=True), "旧配置不应生效"
+        assert encoder._start_replacement(encoder.config, keyframe_only=True)
+        
+        # 替换进程退出（或超过预热期限）时放弃替换，关键帧请求恢复处理
+        pending = encoder._pending
+        pending.has_exited = True
+        encoder._feed_pending(None, 1.0)
+        assert encoder._pending is None and pending.stopped.wait(1.0), "退出的替换进程未被放弃"
+        
+        # 预热帧送完仍无输出时继续送帧，测得输出延迟后按该帧数重新启动
+        encoder.WARMUP_STALL = 0.0
+        assert encoder._start_replacement(encoder.config, warmup_frames=2)
+        pending = encoder._pending
+        for pts in range(4):
+            encoder._feed_pending(None, float(pts))
+        assert pending.submitted == [0.0, 1.0, 2.0, 3.0], "滞留帧的替换进程应继续送帧"
+        pending.output_started, pending.output_delay = True, 30
+        encoder._feed_pending(None, 4.0)
+        deadline = time.monotonic() + 2.0
+        while encoder._pending is pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert encoder._pending.warmup_frames == 31 and pending.stopped.is_set(), "应按测得的延迟重新预热"
+        
+        # 输出回调阻塞时不持有_swap_lock；其他读取线程的访问单元排队，按顺序输出
+        from phone_mirroring.nal_parser import AccessUnit
+        
+        active = encoder._active = IdleProcess(encoder.config)
+        encoder._pending = encoder._switch_pts = None
+        release = threading.Event()
+        emitted = []
+        def slow_output(data, metadata):
+            emitted.append(metadata['pts'])
+            release.wait(2.0)
+        encoder.on_encoded_data = slow_output
+        
+        units = [AccessUnit(data=b'\x00\x00\x00\x01\x41', pts=float(i), is_keyframe=False) for i in range(3)]
+        reader = threading.Thread(target=encoder._on_access_unit, args=(active, units[0]))
+        reader.start()
+        while not emitted:
+            time.sleep(0.01)
+        assert encoder._swap_lock.acquire(timeout=0.5), "输出回调期间不应持有_swap_lock"
+        encoder._swap_lock.release()
+        encoder._on_access_unit(active, units[1])
+        encoder._on_access_unit(active, units[2])
+        assert emitted == [0.0], "排队的访问单元应由正在输出的线程输出"
+        release.set()
+        reader.join(2.0)
+        assert emitted == [0.0, 1.0, 2.0], f"输出顺序错误: {emitted}"
+        
+        logger.info("✅ 关键帧请求测试通过")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 关键帧请求测试失败: {e}")
+        return False
+
+def test_encoder_registry():
+    """测试编码器注册表的选择与缓存"""
+    try:
+        import os
+        import tempfile
+        from phone_mirroring.encoder_registry import EncoderRegistry, BenchmarkResult
+        from phone_mirroring.video_encoder import EncodeConfig
+        
+        cache_path = os.path.join(tempfile.mkdtemp(), 'benchmarks.json')
+        registry = EncoderRegistry(cache_path=cache_path)
+        results = [
+            BenchmarkResult('ffmpeg', 'libx264', 'veryfast', ok=True, fps=70, latency_ms=14),
+            BenchmarkResult('ffmpeg', 'libx264', 'ultrafast', ok=True, fps=150, latency_ms=7),
+            BenchmarkResult('ffmpeg', 'h264_nvenc', ok=False, error='no device'),
+            BenchmarkResult('opencv', 'VideoWriter', ok=True, fps=400, latency_ms=2),
+        ]
+        registry._save_cache(results)
+        
+        # 新实例应从磁盘缓存读取，而不是重新测试
+        registry = EncoderRegistry(cache_path=cache_path)
+        assert len(registry.get_results()) == 4
+        assert registry.hardware_encoder() is None, "测试失败的硬件编码器不应被选用"
+        
+        choice = registry.select(EncodeConfig(width=1280, height=720, fps=30))
+        assert choice.key == 'ffmpeg:libx264:ultrafast', f"选择错误: {choice.key}"
+        
+        # 4K下换算帧率不足时退回最快的后端
+        choice = registry.select(EncodeConfig(width=3840, height=2160, fps=60))
+        assert choice.preset == 'ultrafast'
+        
+        # 'auto' 只修改配置副本，调用方的配置保持不变
+        from phone_mirroring import encoder_registry
+        from phone_mirroring.video_encoder import create_encoder
+        shared, encoder_registry._registry = encoder_registry._registry, registry
+        try:
+            config = EncodeConfig(width=1280, height=720, fps=30, preset='medium')
+            encoder = create_encoder('auto', config)
+        finally:
+            encoder_registry._registry = shared
+        assert config.encoder_name == 'libx264' and config.preset == 'medium', "调用方的配置不应被修改"
+        assert encoder.config.preset == 'ultrafast' and encoder.config is not config
+        
+        logger.info("✅ 编码器注册表测试通过")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 编码器注册表测试失败: {e}")
+        return False
+
+def test_simulcast_renditions():
+    """测试Simulcast档位缩放、分配与IDR切换"""
+    try:
+        import struct
+        import numpy as np
+        from phone_mirroring.renditions import parse_renditions, ClientRendition
+        from phone_mirroring.simulcast import scale_frame, SimulcastEncoder
+        from phone_mirroring.frame_pool import retain_frame, release_frame
+        from phone_mirroring.video_encoder import EncodeConfig
+        from phone_mirroring.protocols.rtsp import RTCPReceiver
+        
+        renditions = parse_renditions(['1080p', '720p', '480p'], max_size=(1280, 720))
+        assert [r.name for r in renditions] == ['720p', '480p'], "超过采集分辨率的档位应被忽略"
+        
+        # I420按平面缩放
+        frame = np.zeros((720 * 3 // 2, 1280), dtype=np.uint8)
+        assert scale_frame(frame, 854, 480, 'yuv420p').shape == (720, 854)
+        
+        # 编码器仍持有（retain）的缩放缓冲区不会被下一帧复用
+        class HoldingEncoder:
+            def __init__(self):
+                self.held = []
+            def encode_frame(self, frame, pts=None):
+                retain_frame(frame)
+                self.held.append(frame)
+                return True
+            def stop(self):
+                pass
+        
+        simulcast = SimulcastEncoder(EncodeConfig(width=1280, height=720, pixel_format='yuv420p'),
+                                     renditions[1:], buffer_count=2)
+        holder = simulcast.encoders['480p'] = HoldingEncoder()
+        simulcast.is_running = True
+        for _ in range(4):
+            assert simulcast.encode_frame(frame)
+        assert len({id(buffer) for buffer in holder.held}) == 4, "持有中的缓冲区被复用"
+        for buffer in holder.held:
+            release_frame(buffer)
+        assert simulcast._pools['480p'].get_stats()['free'] == 2
+        simulcast.stop()
+        
+        # 带宽不足时降档，在目标档位的IDR处才切换
+        client = ClientRendition(renditions, initial_bps=5000000)
+        assert client.target == '720p'
+        assert client.accept('720p', True) and not client.accept('480p', True)
+        
+        client.on_bandwidth_hint(1500000, now=0.0)
+        assert client.target == '480p'
+        assert client.accept('720p', False), "切换前继续发送当前档位"
+        assert not client.accept('480p', False), "非IDR不能切换"
+        assert client.accept('480p', True) and client.current == '480p'
+        
+        # 升档需要带宽持续满足
+        assert not client.on_bandwidth_hint(5000000, now=1.0)
+        assert client.on_bandwidth_hint(5000000, now=3.5) and client.target == '720p'
+        
+        # REMB: 1500 * 2^10 bps
+        receiver = RTCPReceiver(lambda addr, reason: None)
+        remb = struct.pack('!BBHII', 0x8F, 206, 5, 1, 0) + b'REMB' + struct.pack('!BBH', 1, (10 << 2), 1500) + struct.pack('!I', 2)
+        assert receiver.parse_receiver_report(remb) == (None, 1500 << 10)
+        
+        logger.info("✅ Simulcast档位测试通过")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Simulcast档位测试失败: {e}")
+        return False
+
+def test_change_detector():
+    """测试静止画面检测"""
+    try:
+        import numpy as np
+        from phone_mirroring.change_detector import ChangeDetector
+        
+        detector = ChangeDetector(row_step=4)
+        frame = np.zeros((1080, 1920, 4), dtype=np.uint8)
+        assert detector.update(frame), "第一帧应视为变化"
+        assert not any(detector.update(frame.copy()) for _ in range(8)), "相同画面不应判为变化"
+        
+        # 单像素变化（如光标）应在 row_step 帧内被发现
+        changed = frame.copy()
+        changed[501, 700] = 255
+        results = [detector.update(changed) for _ in range(4)]
+        assert results.count(True) == 1, f"单像素变化检测错误: {results}"
+        assert not detector.update(changed.copy())
+        
+        # 分块脏区域：边缘不足64像素的块也要覆盖
+        from phone_mirroring.change_detector import TileTracker
+        tracker = TileTracker(tile_size=64)
+        tracker.update(frame)
+        changed = frame.copy()
+        changed[1079, 1919] = 1
+        changed[100, 70] = 1
+        assert tracker.update(changed)
+        assert tracker.dirty_tiles.shape == (17, 30)
+        assert sorted(map(tuple, np.argwhere(tracker.dirty_tiles))) == [(1, 1), (16, 29)]
+        assert tracker.dirty_rects() == [(64, 64, 64, 64), (1856, 1024, 64, 56)]
+        assert not tracker.update(changed.copy()) and tracker.dirty_ratio == 0
+        
+        # 后端复用同一缓冲区（XShm）时参考帧必须复制，否则原地更新的画面永远判为未变化
+        shared = np.zeros((64, 64, 4), dtype=np.uint8)
+        detector = ChangeDetector(row_step=1)
+        detector.copy_reference = True
+        assert detector.update(shared)
+        shared[10, 10] = 255
+        assert detector.update(shared), "原地更新的缓冲区应检测到变化"
+        assert not detector.update(shared)
+        
+        logger.info("✅ 静止画面检测测试通过")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 静止画面检测测试失败: {e}")
+        return False
+
+def test_frame_pool():
+    """测试帧缓冲池引用计数"""
+    try:
+        import numpy as np
+        from phone_mirroring.frame_pool import FramePool, retain_frame, release_frame
+        from phone_mirroring.frame_mailbox import FrameMailbox
+        
+        pool = FramePool((4, 4), count=2)
+        a = pool.acquire()
+        b = pool.acquire()
+        extra = pool.acquire()
+        assert pool.get_stats()['exhausted'] == 1, "池耗尽时应临时分配"
+        release_frame(extra)
+        
+        # 邮箱丢弃被覆盖的帧时归还
+        retain_frame(a)
+        mailbox = FrameMailbox(on_discard=release_frame)
+        mailbox.put(a)
+        mailbox.put(b)
+        release_frame(a)
+        assert pool.in_use == 1, "被覆盖的帧应归还缓冲池"
+        
+        assert pool.acquire() is a, "归还的缓冲区应被复用"
+        release_frame(np.zeros(4))
+        
+        logger.info("✅ 帧缓冲池测试通过")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 帧缓冲池测试失败: {e}")
+        return False
+
+def test_capture_thread():
+    """测试采集线程、失败退避和阶段耗时统计"""
+    try:
+        import numpy as np
+        from phone_mirroring.screen_capture import ScreenCapture, CaptureConfig
+        from phone_mirroring.performance import StageHistogram
+        
+        histogram = StageHistogram()
+        for ms in (0.3, 0.4, 3, 50):
+            histogram.record(ms / 1000)
+        assert histogram.percentile(50) == 0.5 and histogram.percentile(100) == 66
+        
+        # 前3次捕获失败，之后恢复
+        raw = np.zeros((64, 64, 4), dtype=np.uint8)
+        attempts = []
+        capture = ScreenCapture(CaptureConfig(fps=100, retry_interval=0.01))
+        capture.initialize = lambda: True
+        capture._capture_mss = lambda: attempts.append(1) or (raw if len(attempts) > 3 else None)
+        
+        capture.start_capture()
+        assert capture.wait_initialized(2.0), "捕获线程应报告初始化成功"
+        item = capture.frames.get(timeout=2.0)
+        capture.stop_capture()
+        
+        assert item is not None, "恢复后应发布帧"
+        frame, info = item
+        assert frame.shape == (64, 64, 3) and 'pts' in info and info['changed']
+        capture.release_frame(frame)
+        
+        stats = capture.get_stats()
+        assert stats['capture_failures'] == 3
+        assert stats['stage_timings']['grab']['count'] >= 1
+        
+        logger.info("✅ 采集线程测试通过")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 采集线程测试失败: {e}")
+        return False
+
+def test_xshm_capture():
+    """测试X11 MIT-SHM捕获与MSS结果一致、关闭后释放共享内存段"""
+    try:
+        import os
+        import numpy as np
+        from phone_mirroring.xshm import XShmGrabber
+        from phone_mirroring.screen_capture import ScreenCapture, CaptureConfig, CaptureMethod
+        
+        if not os.environ.get('DISPLAY'):
+            logger.info("⚠️ 没有X显示，跳过XShm捕获测试")
+            return True
+        try:
+            grabber = XShmGrabber()
+        except (OSError, RuntimeError) as e:
+            logger.info(f"⚠️ XShm不可用（{e}），跳过XShm捕获测试")
+            return True
+        
+        import mss
+        with mss.mss() as sct:
+            shot = sct.grab(sct.monitors[1])
+        expected = np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+        
+        try:
+            frame = grabber.grab()
+            assert frame is not None, "XShmGetImage应成功"
+            assert frame.shape == expected.shape and frame.dtype == expected.dtype, \
+                f"XShm帧 {frame.shape}/{frame.dtype} 应与MSS {expected.shape}/{expected.dtype} 一致"
+            shmid = grabber._shminfo.shmid
+        finally:
+            grabber.close()
+        
+        # 关闭后本进程和X服务器都已分离，标记删除的共享内存段应被回收
+        assert grabber._shminfo.shmaddr is None and grabber._image is None
+        with open('/proc/sysvipc/shm') as f:
+            segments = {int(line.split()[1]) for line in f.readlines()[1:]}
+        assert shmid not in segments, "close()后共享内存段应被释放"
+        grabber.close()
+        
+        # 通过ScreenCapture使用XSHM方法
+        capture = ScreenCapture(CaptureConfig(method=CaptureMethod.XSHM))
+        assert capture.initialize(), "XSHM捕获初始化失败"
+        try:
+            assert isinstance(capture._capture_impl, XShmGrabber), "XSHM不应回退到MSS"
+            frame = capture.capture_frame()
+            assert frame is not None and frame.shape == (shot.height, shot.width, 3)
+            capture.release_frame(frame)
+        finally:
+            capture.stop_capture()
+        
+        logger.info("✅ XShm捕获测试通过")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ XShm捕获测试失败: {e}")
+        return False
+
+def test_frame_clock():
+    """测试帧时钟的绝对截止时间和超时跳帧"""
+    try:
+        import time
+        from phone_mirroring.frame_clock import FrameClock
+        from phone_mirroring.performance import create_monitor
+        
+        clock = FrameClock(100)
+        start = time.monotonic()
+        for _ in range(20):
+            time.sleep(0.002)  # 处理耗时不应累积到帧间隔上
+            clock.wait()
+        elapsed = time.monotonic() - start
+        assert 0.18 <= elapsed < 0.25, f"20帧@100fps耗时异常: {elapsed:.3f}s"
+        
+        # 超时35ms：跳过错过的帧位而不是连续补发
+        time.sleep(0.035)
+        assert clock.wait() >= 2
+        assert clock.delay() > 0.001, "跳帧后下一个截止时间应在未来"
+        assert clock.get_stats()['skipped'] >= 2
+        
+        # 刷新率对齐：30fps@60Hz 为每两个刷新周期一帧，24fps@60Hz 取整为2个周期
+        assert FrameClock(30, refresh_rate=60).interval_ns == int(2e9 / 60)
+        assert FrameClock(24, refresh_rate=60).interval_ns == int(2e9 / 60)
+        
+        monitor = create_monitor()
+        monitor.register_clock('capture', clock)
+        assert monitor._collect_metrics().frame_jitter == clock.jitter_ms
+        
+        logger.info("✅ 帧时钟测试通过")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 帧时钟测试失败: {e}")
+        return False
+
+def test_file_source():
+    """测试文件视频源"""
+    try:
+        import os
+        import tempfile
+        import numpy as np
+        from phone_mirroring.file_source import FileSource, avcc_to_annexb, parse_avcc_extradata
+        from phone_mirroring.video_encoder import PyAVEncoder, EncodeConfig, HAS_AV
+        
+        # avcC -> Annex-B
+        extradata = bytes([1, 0x42, 0xC0, 0x1E, 0xFF, 0xE1, 0, 2, 0x67, 0x42, 1, 0, 2, 0x68, 0xCE])
+        length_size, parameter_sets = parse_avcc_extradata(extradata)
+        assert length_size == 4 and parameter_sets == [b'\x67\x42', b'\x68\xce']
+        converted = avcc_to_annexb(b'\x00\x00\x00\x02\x65\x88', length_size, parameter_sets)
+        assert converted == b'\x00\x00\x00\x01\x67\x42\x00\x00\x00\x01\x68\xce\x00\x00\x00\x01\x65\x88'
+        
+        if not HAS_AV:
+            logger.info("⚠️ PyAV未安装，跳过文件读取测试")
+            return True
+        
+        # 编码10帧写成裸H.264文件，再按基准测试模式读回
+        encoder = PyAVEncoder(EncodeConfig(width=160, height=120, preset='ultrafast', gop_size=5))
+        assert encoder.start()
+        packets = []
+        for i in range(10):
+            packets += encoder.encode(np.full((120, 160, 3), i * 20, dtype=np.uint8), pts=i / 30)
+        encoder.stop()
+        
+        path = os.path.join(tempfile.mkdtemp(), 'test.h264')
+        with open(path, 'wb') as f:
+            f.write(b''.join(bytes(packet) for packet in packets))
+        
+        units = []
+        source = FileSource(path, realtime=False, on_access_unit=lambda data, metadata: units.append(metadata))
+        assert source.start()
+        assert source.finished.wait(5.0)
+        os.remove(path)
+        
+        assert len(units) == len(packets), f"访问单元数量不符: {len(units)} != {len(packets)}"
+        assert units[0]['is_keyframe'] and sum(u['is_keyframe'] for u in units) == sum(p.is_keyframe for p in packets)
+        assert abs(units[3]['pts'] - units[0]['pts'] - 0.1) < 1e-6, "裸码流按fps分配时间戳"
+        
+        logger.info("✅ 文件视频源测试通过")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 文件视频源测试失败: {e}")
+        return False
+
+def test_pipeline():
+    """测试流水线"""
+    try:
+        import asyncio
+        from phone_mirroring.pipeline import Pipeline, Stage, StageQueue
+        
+        # drop_oldest 队列溢出时丢弃最旧项并交给 on_discard
+        discarded = []
+        queue = StageQueue(2, 'drop_oldest', on_discard=discarded.append)
+        assert queue.put(1) and queue.put(2)
+        assert not queue.put(3) and discarded == [1]
+        assert queue.get() == 2 and queue.depth == 1
+        
+        # block 队列满时阻塞生产者，超时后丢弃新项
+        queue = StageQueue(1, 'block')
+        assert queue.put('a')
+        assert not queue.put('b', timeout=0.05)
+        assert queue.get_stats()['blocked_time'] >= 0.04
+        
+        # 未指定超时时最多阻塞 block_timeout，消费者停止后生产者不会永远阻塞
+        queue = StageQueue(1, 'block', block_timeout=0.05)
+        assert queue.put('a') and not queue.put('b')
+        assert queue.get_stats()['timeouts'] == 1 and queue.get_stats()['dropped'] == 1
+        
+        # 源（线程）-> 取绝对值（进程）-> 收集（asyncio）
+        async def run():
+            numbers = iter(range(-1, -21, -1))
+            results = []
+            done = asyncio.Event()
+            
+            def collect(item):
+                results.append(item)
+                if len(results) == 20:
+                    done.set()
+            
+            pipeline = Pipeline('test')
+            pipeline.add(Stage('source', lambda: next(numbers, None), kind='source'))
+            pipeline.add(Stage('abs', abs, executor='process', queue_size=4, overflow='block'))
+            pipeline.add(Stage('collect', collect, kind='sink', executor='asyncio', queue_size=4, overflow='block'))
+            pipeline.start(asyncio.get_running_loop())
+            try:
+                await asyncio.wait_for(done.wait(), 10.0)
+            finally:
+                await asyncio.get_running_loop().run_in_executor(None, pipeline.stop)
+            return results, pipeline.get_stats()
+        
+        results, stats = asyncio.run(run())
+        assert results == list(range(1, 21)), f"输出顺序或内容错误: {results}"
+        abs_stats = stats['stages']['abs']
+        assert abs_stats['processed'] == 20 and abs_stats['queue']['dropped'] == 0
+        assert abs_stats['latency']['count'] == 20 and abs_stats['queue']['max_depth'] <= 4
+        assert stats['bottleneck'] in ('source', 'abs', 'collect')
+        
+        # 缓冲阶段阻塞超时丢弃访问单元后，该档位等待关键帧并请求关键帧
+        from phone_mirroring.streaming_manager import StreamingManager
+        
+        class RecordingEncoder:
+            def __init__(self):
+                self.requests = 0
+            def request_keyframe(self):
+                self.requests += 1
+                return True
+        
+        manager = StreamingManager()
+        manager.is_running = True
+        manager.video_encoder = RecordingEncoder()
+        manager.screen_capture = type('Capture', (), {'start_capture': None, 'stop_capture': None,
+                                                      'frames': StageQueue(), 'wake': lambda self, d: None})()
+        pipeline = manager._build_screen_pipeline({'buffer_queue_size': 1})
+        buffer = pipeline.stage('buffer').input
+        buffer.block_timeout = 0.05
+        assert pipeline.emit('encode', (b'\x00\x00\x00\x01\x65', {'is_keyframe': True}))
+        assert not pipeline.emit('encode', (b'\x00\x00\x00\x01\x41', {'is_keyframe': False}))
+        assert buffer.get_stats()['timeouts'] == 1 and manager.video_encoder.requests == 1
+        assert None in manager._waiting_keyframe, "丢弃后应等待关键帧"
+        manager._buffer_access_unit(b'\x00\x00\x00\x01\x41', {'is_keyframe': False})
+        assert not manager.video_buffers.get(None), "关键帧之前的P帧不应进入缓冲区"
+        manager._buffer_access_unit(b'\x00\x00\x00\x01\x65', {'is_keyframe': True})
+        assert len(manager.video_buffers[None]) == 1 and None not in manager._waiting_keyframe
+        
+        logger.info("✅ 流水线测试通过")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 流水线测试失败: {e}")
+        return False
+
+def test_device_pool():
+    """测试多设备投屏池"""
+    try:
+        import asyncio
+        import os
+        from phone_mirroring.device_pool import DeviceStreamPool, mount_name
+        from phone_mirroring.video_encoder import HAS_AV
+        
+        assert mount_name('192.168.1.5:5555') == '192.168.1.5_5555'
+        
+        if not HAS_AV:
+            logger.info("⚠️ PyAV未安装，跳过合成设备测试")
+            return True
+        
+        async def run():
+            pool = DeviceStreamPool({
+                'port': 18554, 'rtp_port_start': 15000, 'workers': 1,
+                'limits': {'max_width': 160, 'max_height': 120, 'max_fps': 15, 'max_bitrate': 500000}
+            })
+            assert await pool.start()
+            try:
+                results = await asyncio.gather(pool.add_device('synthetic-a', 'synthetic'),
+                                               pool.add_device('synthetic-b', 'synthetic'))
+                assert all(results), "合成设备启动失败"
+                await asyncio.sleep(1.5)
+                return pool.get_stats()
+            finally:
+                await pool.stop()
+        
+        stats = asyncio.run(run())
+        assert stats['devices_streaming'] == 2
+        assert stats['rtsp']['mounts'] == ['synthetic-a', 'synthetic-b']
+        for device in stats['devices'].values():
+            assert device['frames'] > 5 and device['keyframes'] >= 1, f"设备没有输出: {device}"
+        assert stats['workers'][0]['pid'] != os.getpid(), "设备应在工作进程中采集"
+        
+        logger.info("✅ 多设备投屏池测试通过")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 多设备投屏池测试失败: {e}")
+        return False
+
+def test_latency_sei():
+    """测试延迟时间戳SEI"""
+    try:
+        import time
+        import numpy as np
+        from phone_mirroring.latency_sei import (build_latency_sei, insert_sei, parse_latency_sei,
+                                                 LatencyTracker, STAGE_CAPTURE, STAGE_ENCODED, STAGE_SENT)
+        from phone_mirroring.performance import PerformanceMonitor
+        from phone_mirroring.video_encoder import PyAVEncoder, EncodeConfig, HAS_AV
+        
+        # seq=1 含 00 00 00 01，需要防竞争字节
+        now = time.monotonic_ns()
+        stamps = {STAGE_CAPTURE: now - 30_000_000, STAGE_ENCODED: now - 20_000_000, STAGE_SENT: now - 10_000_000}
+        sei = build_latency_sei(1, stamps)
+        assert b'\x00\x00\x00' not in sei[4:] and b'\x00\x00\x01' not in sei[4:], "SEI未正确转义"
+        
+        access_unit = b'\x00\x00\x00\x01\x09\xf0' + b'\x00\x00\x01\x65\x88\x84'
+        stamped = insert_sei(access_unit, sei)
+        assert stamped.index(sei) == 6, "SEI应插在AUD之后、第一个slice之前"
+        stamp = parse_latency_sei(stamped)
+        assert stamp and stamp.seq == 1 and stamp.stamps == stamps
+        assert parse_latency_sei(access_unit) is None
+        
+        # 客户端统计回报给性能监控器
+        monitor = PerformanceMonitor({})
+        tracker = LatencyTracker(monitor)
+        result = tracker.record(stamp, tracker.now_ns(), tracker.now_ns())
+        assert 25 <= result['end_to_end'] * 1000 < 1000, f"端到端延迟错误: {result}"
+        assert abs(result['encode'] - 0.01) < 1e-6 and abs(result['queue'] - 0.01) < 1e-6
+        assert monitor._calculate_latency() >= 25
+        assert monitor.get_latency_stats()['end_to_end']['count'] == 1
+        
+        later = parse_latency_sei(insert_sei(access_unit, build_latency_sei(4, stamps)))
+        tracker.record(later, tracker.now_ns())
+        assert later.seq == 4 and tracker.lost == 2, "序号跳变应计为丢帧"
+        
+        if not HAS_AV:
+            logger.info("⚠️ PyAV未安装，跳过SEI解码兼容性测试")
+            logger.info("✅ 延迟时间戳SEI测试通过")
+            return True
+        
+        # 带SEI的真实码流仍能正常解码
+        import av
+        encoder = PyAVEncoder(EncodeConfig(width=160, height=120, preset='ultrafast'))
+        assert encoder.start()
+        packets = []
+        for i in range(5):
+            packets += encoder.encode(np.full((120, 160, 3), i * 40, dtype=np.uint8), pts=1.0 + i / 30)
+        encoder.stop()
+        assert packets, "编码器没有输出"
+        
+        decoder = av.CodecContext.create('h264', 'r')
+        decoded = 0
+        for seq, packet in enumerate(packets, 1):
+            data = insert_sei(bytes(packet), build_latency_sei(seq, {STAGE_SENT: time.monotonic_ns()}))
+            assert parse_latency_sei(data).seq == seq
+            decoded += len(decoder.decode(av.Packet(data)))
+        assert decoded >= len(packets) - 1, f"插入SEI后解码帧数不足: {decoded}/{len(packets)}"
+        
+        logger.info("✅ 延迟时间戳SEI测试通过")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 延迟时间戳SEI测试失败: {e}")
+        return False
+
+def test_recorder():
+    """测试录制器"""
+    try:
+        import tempfile
+        import numpy as np
+        from phone_mirroring.recorder import Recorder, RecordingConfig, HAS_AV
+        from phone_mirroring.video_encoder import PyAVEncoder, EncodeConfig
+        
+        if not HAS_AV:
+            logger.info("⚠️ PyAV未安装，跳过录制器测试")
+            return True
+        import av
+        
+        encoder = PyAVEncoder(EncodeConfig(width=160, height=120, preset='ultrafast', gop_size=10))
+        assert encoder.start()
+        units = []
+        for i in range(40):
+            frame = np.full((120, 160, 3), (i * 6) % 256, dtype=np.uint8)
+            for packet in encoder.encode(frame, pts=100.0 + i / 30):
+                units.append((bytes(packet), {'pts': 100.0 + i / 30, 'is_keyframe': packet.is_keyframe}))
+        encoder.stop()
+        
+        for fmt in ('mp4', 'mkv'):
+            with tempfile.TemporaryDirectory() as output_dir:
+                recorder = Recorder(RecordingConfig(output_dir=output_dir, format=fmt, segment_duration=0.5))
+                assert recorder.start()
+                for data, metadata in units:
+                    recorder.write(data, metadata)
+                recorder.stop()
+                
+                stats = recorder.get_stats()
+                assert stats['frames_written'] == len(units) and stats['segments'] >= 2, f"录制统计错误: {stats}"
+                decoded = 0
+                for path in recorder.segments:
+                    with av.open(path) as container:
+                        stream = container.streams.video[0]
+                        assert (stream.codec_context.width, stream.codec_context.height) == (160, 120)
+                        decoded += sum(1 for _ in container.decode(stream))
+                assert decoded == len(units), f"{fmt} 分段解码帧数不符: {decoded}/{len(units)}"
+        
+        logger.info("✅ 录制器测试通过")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 录制器测试失败: {e}")
+        return False
+
+def test_timeshift():
+    """测试时移缓冲"""
+    try:
+        import io
+        import numpy as np
+        from phone_mirroring.timeshift import TimeShiftBuffer, TimeShiftConfig
+        from phone_mirroring.video_encoder import PyAVEncoder, EncodeConfig, HAS_AV
+        
+        # 合成访问单元：每10帧一个GOP，每帧1000字节，容量可容纳约4个GOP
+        buffer = TimeShiftBuffer(TimeShiftConfig(duration=100.0, max_bytes=45000))
+        buffer.write(b'\x01' * 1000, {'pts': -1.0, 'is_keyframe': False})
+        for i in range(200):
+            payload = bytes([i % 256]) * 1000
+            buffer.write(payload, {'pts': i / 10, 'is_keyframe': i % 10 == 0})
+        stats = buffer.get_stats()
+        assert stats['frames_skipped'] == 1, "关键帧之前的帧应被跳过"
+        assert stats['bytes_used'] <= 45000 and stats['buffered_frames'] % 10 == 0, f"应按GOP淘汰: {stats}"
+        units = buffer.window()
+        assert units[0][1]['is_keyframe'] and units[-1][1]['pts'] == 19.9
+        assert all(data == bytes([round(meta['pts'] * 10) % 256]) * 1000 for data, meta in units), "环形缓冲数据错误"
+        
+        # 时间窗口起点向前对齐到关键帧
+        window = buffer.window(17.35, 18.0)
+        assert window[0][1]['pts'] == 17.0 and window[-1][1]['pts'] == 18.0
+        
+        # 按时长淘汰
+        buffer = TimeShiftBuffer(TimeShiftConfig(duration=2.0, max_bytes=1 << 20))
+        for i in range(100):
+            buffer.write(b'\x00' * 100, {'pts': i / 10, 'is_keyframe': i % 10 == 0})
+        span = buffer.time_range()
+        assert span == (7.0, 9.9), f"应保留至少2秒且从关键帧开始: {span}"
+        
+        if not HAS_AV:
+            logger.info("⚠️ PyAV未安装，跳过片段导出测试")
+            logger.info("✅ 时移缓冲测试通过")
+            return True
+        import av
+        
+        encoder = PyAVEncoder(EncodeConfig(width=160, height=120, preset='ultrafast', gop_size=10))
+        assert encoder.start()
+        buffer = TimeShiftBuffer(TimeShiftConfig(duration=1.0))
+        for i in range(60):
+            frame = np.full((120, 160, 3), (i * 4) % 256, dtype=np.uint8)
+            for packet in encoder.encode(frame, pts=50.0 + i / 30):
+                buffer.write(bytes(packet), {'pts': 50.0 + i / 30, 'is_keyframe': packet.is_keyframe})
+        encoder.stop()
+        
+        output = io.BytesIO()
+        frames = buffer.export_last(output, seconds=0.5)
+        output.seek(0)
+        with av.open(output) as container:
+            decoded = sum(1 for _ in container.decode(video=0))
+        assert frames >= 15 and decoded == frames, f"导出片段解码帧数不符: {decoded}/{frames}"
+        
+        logger.info("✅ 时移缓冲测试通过")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 时移缓冲测试失败: {e}")
+        return False
+
+def test_mse_output():
+    """测试浏览器fMP4输出"""
+    try:
+        import asyncio
+        import io
+        import numpy as np
+        from phone_mirroring.nal_parser import extract_parameter_sets, parse_sps_resolution
+        from phone_mirroring.fmp4 import FMP4Packager
+        from phone_mirroring.protocols.mse import MSEProtocol, MSEViewer
+        from phone_mirroring.video_encoder import PyAVEncoder, EncodeConfig, HAS_AV
+        
+        if not HAS_AV:
+            logger.info("⚠️ PyAV未安装，跳过浏览器输出测试")
+            return True
+        import av
+        
+        encoder = PyAVEncoder(EncodeConfig(width=160, height=120, preset='ultrafast', gop_size=10))
+        assert encoder.start()
+        units = []
+        for i in range(50):
+            frame = np.full((120, 160, 3), (i * 5) % 256, dtype=np.uint8)
+            for packet in encoder.encode(frame, pts=i / 30):
+                units.append((bytes(packet), {'pts': i / 30, 'is_keyframe': packet.is_keyframe}))
+        encoder.stop()
+        
+        sps, _ = extract_parameter_sets(units[0][0])
+        assert parse_sps_resolution(sps) == (160, 120), "SPS分辨率解析错误"
+        
+        # 封装结果可直接解码
+        packager = FMP4Packager(30)
+        output = [packager.package(data, metadata) for data, metadata in units]
+        assert output[0][0] is not None and all(init is None for init, _ in output[1:])
+        stream = output[0][0] + b''.join(fragment for _, fragment in output)
+        with av.open(io.BytesIO(stream)) as container:
+            frames = list(container.decode(video=0))
+        assert len(frames) == 50 and frames[0].width == 160, f"fMP4解码帧数不符: {len(frames)}"
+        
+        async def run():
+            mse = MSEProtocol({'host': '127.0.0.1', 'port': 18092, 'max_queue_frames': 12})
+            assert await mse.start()
+            try:
+                for data, metadata in units[:25]:
+                    await mse.send_frame(data, metadata)
+                await asyncio.sleep(0.05)
+                
+                # 新观众立即收到初始化段和当前GOP（第20~24帧）
+                reader, writer = await asyncio.open_connection('127.0.0.1', 18092)
+                writer.write(b'GET /live.mp4 HTTP/1.1\r\nHost: localhost\r\n\r\n')
+                header = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 5)
+                assert b'chunked' in header
+                chunks = []
+                for _ in range(6):
+                    size = int(await asyncio.wait_for(reader.readuntil(b'\r\n'), 5), 16)
+                    chunks.append(await reader.readexactly(size))
+                    await reader.readexactly(2)
+                with av.open(io.BytesIO(b''.join(chunks))) as container:
+                    assert sum(1 for _ in container.decode(video=0)) == 5, "GOP缓存帧数不符"
+                writer.close()
+                
+                # 发送跟不上的观众：清空队列，从下一个关键帧恢复并重发初始化段
+                slow = MSEViewer('slow', None, websocket=True)
+                mse.viewers['slow'] = slow
+                for data, metadata in units[25:]:
+                    mse.push(data, metadata)
+                await asyncio.sleep(0.05)
+                payloads = [payload for opcode, payload in slow.queue if opcode == 2]
+                assert slow.fragments_dropped > 0 and payloads[0] == mse.packager.init_segment
+                with av.open(io.BytesIO(b''.join(payloads))) as container:
+                    assert sum(1 for _ in container.decode(video=0)) == len(payloads) - 1
+            finally:
+                await mse.stop()
+        
+        asyncio.run(run())
+        
+        logger.info("✅ 浏览器输出测试通过")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 浏览器输出测试失败: {e}")
+        return False
+
+def test_server_fanout():
+    """测试服务端协议并发分发"""
+    try:
+        import asyncio
+        import time
+        from phone_mirroring.config import Config
+        from phone_mirroring.server import MirroringServer
+        from phone_mirroring.protocols.base import BaseProtocol
+        
+        class RecordingProtocol(BaseProtocol):
+            """按固定耗时发送的协议，记录收到的帧序号"""
+            
+            def __init__(self, delay: float):
+                super().__init__({})
+                self.delay = delay
+                self.received = []
+            
+            async def start(self) -> bool:
+                self.is_running = True
+                return True
+            
+            async def stop(self) -> bool:
+                self.is_running = False
+                return True
+            
+            async def send_frame(self, frame_data, metadata) -> bool:
+                metadata["touched"] = True
+                await asyncio.sleep(self.delay)
+                self.received.append(metadata["seq"])
+                return True
+            
+            async def send_audio(self, audio_data, metadata) -> bool:
+                return False
+            
+            async def handle_control(self, control_data) -> bool:
+                return False
+        
+        async def run():
+            server = MirroringServer(Config(enabled_protocols=[]), fanout_queue_frames=4, send_timeout=0.05)
+            fast, slow = RecordingProtocol(0), RecordingProtocol(0.2)
+            source = RecordingProtocol(0)
+            source.ingest_only = True
+            server.protocols = {"fast": fast, "slow": slow, "source": source}
+            assert await server.start()
+            assert set(server.lanes) == {"fast", "slow"}, "只接收媒体的协议不应创建发送通道"
+            
+            # 慢协议不拖慢 broadcast_frame，也不影响快协议
+            begin = time.perf_counter()
+            caller_metadata = []
+            for seq in range(40):
+                metadata = {"seq": seq, "is_keyframe": seq % 10 == 0}
+                caller_metadata.append(metadata)
+                assert await server.broadcast_frame(b"\x00" * 100, metadata)
+                await asyncio.sleep(0.005)
+            elapsed = time.perf_counter() - begin
+            await asyncio.sleep(0.1)
+            
+            stats = server.get_stats()
+            await server.stop()
+            assert elapsed < 1.0, f"广播被慢协议阻塞: {elapsed:.2f}s"
+            assert fast.received == list(range(40)), "快协议应收到全部帧"
+            assert not slow.received and stats["fanout"]["slow"]["timeouts"] > 0
+            assert stats["fanout"]["slow"]["dropped"] > 0 and stats["fanout"]["fast"]["dropped"] == 0
+            assert stats["fanout"]["fast"]["send_latency"]["count"] == 40
+            assert stats["total_bytes_sent"] == 4000
+            assert all(set(m) == {"seq", "is_keyframe"} for m in caller_metadata), "调用方的metadata被修改"
+        
+        asyncio.run(run())
+        
+        logger.info("✅ 服务端协议分发测试通过")
+        return True
+    
+    except Exception as e:
+        logger.error(f"❌ 服务端协议分发测试失败: {e}")
+        return False
+
+def test_media_frame():
+    """测试引用计数媒体帧"""
+    try:
+        import asyncio
+        from phone_mirroring.media_frame import MediaFramePool
+        from phone_mirroring.protocols.adb import H264Parser
+        from phone_mirroring.protocols.rtsp import H264Packetizer
+        from phone_mirroring.protocols.base import BaseProtocol
+        from phone_mirroring.config import Config
+        from phone_mirroring.server import MirroringServer
+        
+        sps = b'\x67\x42\xc0\x1e' + b'S' * 8
+        pps = b'\x68\xce\x3c\x80'
+        idr = b'\x65\x88' + bytes(range(256)) * 12
+        slice_p = b'\x41\x9a' + b'P' * 300
+        keyframe = b''.join(b'\x00\x00\x00\x01' + nal for nal in (sps, pps, idr))
+        
+        # NAL偏移索引与负载视图
+        pool = MediaFramePool()
+        frame = pool.frame_from_nals([sps, memoryview(pps), idr], pts=1.0, is_keyframe=True)
+        assert bytes(frame) == keyframe and len(frame) == len(keyframe)
+        assert [bytes(nal) for nal in frame.iter_nals()] == [sps, pps, idr]
+        assert frame.parameter_sets() == (sps, pps)
+        
+        # 零拷贝打包结果与bytes路径一致
+        packets = H264Packetizer(mtu=1000).packetize_nals(frame.iter_nals(), 90000)
+        expected = H264Packetizer(mtu=1000).packetize_access_unit(keyframe, 90000)
+        assert [bytes(p.payload) for p in packets] == [bytes(p.payload) for p in expected]
+        assert [p.marker for p in packets] == [p.marker for p in expected]
+        
+        # 最后一个引用释放后缓冲区回到池中并被复用
+        frame.retain()
+        frame.release()
+        assert pool.get_stats()['in_use'] == 1
+        frame.release()
+        assert pool.get_stats()['in_use'] == 0
+        pool.frame_from_bytes(keyframe).release()
+        stats = pool.get_stats()
+        assert stats['allocated'] == 1 and stats['reused'] == 1, f"缓冲区应被复用: {stats}"
+        
+        # ADB解析器直接输出池化的MediaFrame，参数集补在帧前
+        parser = H264Parser()
+        frames = []
+        parser.frame_callback = lambda f: frames.append((f.retain(), f.tobytes()))
+        stream = keyframe + (b'\x00\x00\x00\x01' + slice_p + b'\x00\x00\x00\x01\x09\xf0') * 3
+        parser.feed_data(stream + b'\x00\x00\x00\x01\x09\xf0')
+        assert frames and frames[0][0].is_keyframe and frames[0][1] == keyframe
+        assert all(f.refcount == 1 and bytes(f) == data for f, data in frames), "保留的帧内容被覆盖"
+        for f, _ in frames:
+            f.release()
+        assert parser.pool.get_stats()['in_use'] == 0
+        
+        # 服务端各协议的发送队列持有引用，全部发送后归还缓冲池
+        class CollectingProtocol(BaseProtocol):
+            def __init__(self):
+                super().__init__({})
+                self.received = []
+            
+            async def start(self) -> bool:
+                self.is_running = True
+                return True
+            
+            async def stop(self) -> bool:
+                self.is_running = False
+                return True
+            
+            async def send_frame(self, frame_data, metadata) -> bool:
+                await asyncio.sleep(0)
+                self.received.append(bytes(frame_data))
+                return True
+            
+            async def send_audio(self, audio_data, metadata) -> bool:
+                return False
+            
+            async def handle_control(self, control_data) -> bool:
+                return False
+        
+        async def run():
+            server = MirroringServer(Config(enabled_protocols=[]))
+            server.protocols = {"a": CollectingProtocol(), "b": CollectingProtocol()}
+            await server.start()
+            frame = pool.frame_from_nals([sps, pps, idr], is_keyframe=True)
+            await server.broadcast_frame(frame, {'is_keyframe': True})
+            frame.release()
+            assert frame.refcount == 2, "每个发送队列应持有一个引用"
+            await asyncio.sleep(0.05)
+            await server.stop()
+            assert all(p.received == [keyframe] for p in server.protocols.values())
+            assert pool.get_stats()['in_use'] == 0, "发送完成后应归还缓冲池"
+        
+        asyncio.run(run())
+        
+        logger.info("✅ 媒体帧测试通过")
+        return True
+    
+    except Exception as e:
+        logger.error(f"❌ 媒体帧测试失败: {e}")
+        return False
+
+def test_lazy_imports():
+    """测试按需导入"""
+    try:
+        import os
+        import subprocess
+        import phone_mirroring.protocols as protocols
+        from phone_mirroring.protocols import get_protocol_class, available_protocols
+        from phone_mirroring.protocols.rtsp import RTSPProtocol
+        from phone_mirroring.benchmarks.bench_import import parse_importtime, measure_import, check_budgets
+        
+        # 注册表与惰性属性
+        assert get_protocol_class("rtsp") is RTSPProtocol and protocols.RTSPProtocol is RTSPProtocol
+        assert set(available_protocols()) >= {"RTSP", "ADB", "MSE", "WebRTC"}
+        try:
+            get_protocol_class("SIP")
+            raise AssertionError("未注册的协议应抛出KeyError")
+        except KeyError:
+            pass
+        
+        sample = ("import time: self [us] | cumulative | imported package\n"
+                  "import time:       120 |        120 |   phone_mirroring.config\n"
+                  "import time:       300 |        420 | phone_mirroring\n")
+        assert parse_importtime(sample) == {'phone_mirroring.config': (120, 120), 'phone_mirroring': (300, 420)}
+        
+        # 只启用ADB时不导入RTSP模块；包级导出按需加载
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        code = ("import sys\n"
+                "import phone_mirroring\n"
+                "assert 'phone_mirroring.server' not in sys.modules\n"
+                "server = phone_mirroring.MirroringServer(phone_mirroring.Config(enabled_protocols=['ADB']))\n"
+                "assert list(server.protocols) == ['ADB']\n"
+                "assert 'phone_mirroring.protocols.rtsp' not in sys.modules\n"
+                "assert not any(m in sys.modules for m in ('cv2', 'numpy', 'av', 'aiortc'))\n")
+        result = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, timeout=60)
+        assert result.returncode == 0, result.stderr.strip().splitlines()[-1:]
+        
+        # 入口模块导入时不加载重依赖（耗时预算由 bench_import --check 检查）
+        results = [measure_import(module, runs=1) for module in
+                   ('phone_mirroring', 'phone_mirroring.protocols', 'phone_mirroring.app_main')]
+        problems = [p for p in check_budgets(results) if ' imports ' in p]
+        assert not problems, problems
+        logger.info("导入耗时: " + ", ".join(f"{r['module']}={r['cumulative_ms']:.1f}ms" for r in results))
+        
+        logger.info("✅ 按需导入测试通过")
+        return True
+    
+    except Exception as e:
+        logger.error(f"❌ 按需导入测试失败: {e}")
+        return False
+
+def test_webrtc_passthrough():
+    """测试WebRTC H.264直通"""
+    try:
+        import asyncio
+        import json
+        import numpy as np
+        from phone_mirroring.protocols.webrtc import WebRTCProtocol, H264PassthroughTrack, WEBRTC_AVAILABLE
+        from phone_mirroring.video_encoder import PyAVEncoder, EncodeConfig, HAS_AV
+        
+        if not WEBRTC_AVAILABLE or not HAS_AV:
+            logger.info("⚠️ aiortc/PyAV未安装，跳过WebRTC直通测试")
+            return True
+        import websockets
+        from aiortc import RTCPeerConnection, RTCSessionDescription
+        
+        encoder = PyAVEncoder(EncodeConfig(width=160, height=120, preset='ultrafast', gop_size=10))
+        assert encoder.start()
+        units = []
+        for i in range(60):
+            frame = np.full((120, 160, 3), (i * 5) % 256, dtype=np.uint8)
+            for packet in encoder.encode(frame, pts=i / 30):
+                units.append((bytes(packet), {'pts': i / 30, 'is_keyframe': packet.is_keyframe}))
+        encoder.stop()
+        
+        async def run():
+            # 轨道：从关键帧开始，积压溢出时丢弃并请求关键帧
+            track = H264PassthroughTrack(max_frames=4)
+            needed = []
+            track.on_keyframe_needed = lambda: needed.append(True)
+            assert not track.put_access_unit(units[1][0], 1 / 30, False), "关键帧之前的帧应丢弃"
+            for data, metadata in units[:6]:
+                track.put_access_unit(data, metadata['pts'], metadata['is_keyframe'])
+            assert needed and len(track._queue) == 0, "溢出后应等待下一个关键帧"
+            track.put_access_unit(units[10][0], units[10][1]['pts'], True)
+            packet = await track.recv()
+            assert bytes(packet) == units[10][0] and packet.pts == int(units[10][1]['pts'] * 90000)
+            track.stop()
+            
+            proto = WebRTCProtocol({'signaling_port': 18093, 'stun_servers': []})
+            requests = []
+            proto.register_callback('keyframe_requested', lambda client_id, reason: requests.append(reason))
+            assert await proto.start()
+            pc = RTCPeerConnection()
+            try:
+                pc.addTransceiver('video', direction='recvonly')
+                received = asyncio.get_running_loop().create_future()
+                pc.on('track', lambda remote_track: received.set_result(remote_track))
+                await pc.setLocalDescription(await pc.createOffer())
+                
+                async with websockets.connect('ws://127.0.0.1:18093') as ws:
+                    await ws.send(json.dumps({'type': 'offer', 'sdp': pc.localDescription.sdp}))
+                    answer = json.loads(await asyncio.wait_for(ws.recv(), 5))
+                    assert 'H264' in answer['sdp'] and 'VP8' not in answer['sdp'], "视频应只协商H.264"
+                    await pc.setRemoteDescription(RTCSessionDescription(sdp=answer['sdp'], type=answer['type']))
+                    remote_track = await asyncio.wait_for(received, 5)
+                    
+                    # 从GOP中间开始推送，编码数据原样转发，客户端解码
+                    async def feed():
+                        for data, metadata in units[3:]:
+                            await proto.send_frame(data, metadata)
+                            await asyncio.sleep(1 / 30)
+                    feeder = asyncio.create_task(feed())
+                    decoded = []
+                    while len(decoded) < 20:
+                        decoded.append(await asyncio.wait_for(remote_track.recv(), 5))
+                    await feeder
+                    assert (decoded[0].width, decoded[0].height) == (160, 120)
+                    
+                    # 观众的PLI转发给视频源
+                    sender = next(iter(proto.connections.values())).getSenders()[0]
+                    sender._send_keyframe()
+                    assert 'pli' in requests, f"PLI未转发: {requests}"
+                    stats = next(iter(proto.video_tracks.values())).stats
+                    assert stats['dropped'] >= 7 and stats['frames'] >= 20, stats
+            finally:
+                await pc.close()
+                await proto.stop()
+        
+        asyncio.run(run())
+        
+        logger.info("✅ WebRTC直通测试通过")
+        return True
+    
+    except Exception as e:
+        logger.error(f"❌ WebRTC直通测试失败: {e}")
+        return False
+
 def test_config():
     """测试配置模块"""
     try:
@@ -217,6 +1592,30 @@ def main():
         ("模块导入测试", test_imports),
         ("RTSP包测试", test_rtsp_packet),
         ("H264解析器测试", test_h264_parser),
+        ("访问单元解析器测试", test_access_unit_parser),
+        ("帧邮箱测试", test_frame_mailbox),
+        ("I420转换测试", test_i420_conversion),
+        ("PyAV编码器测试", test_pyav_encoder),
+        ("参数集更新测试", test_parameter_set_update),
+        ("关键帧请求测试", test_keyframe_requests),
+        ("编码器注册表测试", test_encoder_registry),
+        ("Simulcast档位测试", test_simulcast_renditions),
+        ("静止画面检测测试", test_change_detector),
+        ("帧缓冲池测试", test_frame_pool),
+        ("采集线程测试", test_capture_thread),
+        ("XShm捕获测试", test_xshm_capture),
+        ("帧时钟测试", test_frame_clock),
+        ("文件视频源测试", test_file_source),
+        ("流水线测试", test_pipeline),
+        ("多设备投屏池测试", test_device_pool),
+        ("延迟时间戳SEI测试", test_latency_sei),
+        ("录制器测试", test_recorder),
+        ("时移缓冲测试", test_timeshift),
+        ("浏览器输出测试", test_mse_output),
+        ("服务端协议分发测试", test_server_fanout),
+        ("媒体帧测试", test_media_frame),
+        ("按需导入测试", test_lazy_imports),
+        ("WebRTC直通测试", test_webrtc_passthrough),
         ("配置模块测试", test_config),
     ]
     
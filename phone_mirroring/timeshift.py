@@ -0,0 +1,316 @@
+"""
+时移缓冲模块
+在内存中保留最近一段编码后的访问单元（按GOP对齐），可随时把任意时间窗口
+仅重新封装（不重新编码）导出为MP4，并通过HTTP按时间点回看
+"""
+
+import asyncio
+import io
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, Tuple, Deque, NamedTuple, Union, BinaryIO
+from urllib.parse import urlparse, parse_qs
+
+from phone_mirroring.recorder import remux_access_units, HAS_AV
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class TimeShiftConfig:
+    """时移缓冲配置"""
+    duration: float = 30.0              # 至少保留的时长（秒），超出后整GOP淘汰
+    max_bytes: int = 64 << 20           # 预分配的缓冲区大小，写满时淘汰最旧的GOP
+    rendition: Optional[str] = None     # Simulcast时缓冲的档位，None表示第一个收到的档位
+    http_port: int = 0                  # 回看HTTP服务端口，0表示不启动
+
+class BufferedUnit(NamedTuple):
+    """缓冲区中的一个访问单元"""
+    offset: int
+    length: int
+    pts: float
+    dts: float
+    is_keyframe: bool
+
+class TimeShiftBuffer:
+    """GOP对齐的访问单元环形缓冲
+
+    数据拷贝进一块预分配的 bytearray（环形使用，不为每帧分配 bytes 对象），
+    索引只记录偏移和时间戳。缓冲区总是从关键帧开始：淘汰时以GOP为单位，
+    写满 max_bytes 或超过 duration 时丢弃最旧的GOP。write() 可在编码器输出线程中调用。
+    """
+
+    def __init__(self, config: Optional[TimeShiftConfig] = None):
+        self.config = config or TimeShiftConfig()
+        self.capacity = self.config.max_bytes
+        self.arena = bytearray(self.capacity)
+        self._view = memoryview(self.arena)
+
+        self.index: Deque[BufferedUnit] = deque()
+        self._keyframes: Deque[float] = deque()    # 缓冲中各GOP起始关键帧的pts
+        self._write_pos = 0
+        self._bytes_used = 0
+        self._rendition = self.config.rendition
+        self._waiting_keyframe = True
+        self._lock = threading.Lock()
+
+        self.stats = {
+            'frames': 0,
+            'gops_evicted': 0,
+            'frames_skipped': 0,    # 等待第一个关键帧、或单帧过大时跳过
+            'exports': 0
+        }
+
+    def write(self, data: bytes, metadata: Dict):
+        """追加一个访问单元"""
+        rendition = metadata.get('rendition')
+        if rendition != self._rendition:
+            if self._rendition is not None or self.index:
+                return
+            self._rendition = rendition
+
+        is_keyframe = metadata.get('is_keyframe', False)
+        length = len(data)
+        with self._lock:
+            if length > self.capacity // 4:
+                # 单帧占用过大，缓冲无法容纳完整GOP，清空后等待下一个关键帧
+                self._clear()
+                self._waiting_keyframe = True
+            if self._waiting_keyframe:
+                if not is_keyframe or length > self.capacity // 4:
+                    self.stats['frames_skipped'] += 1
+                    return
+                self._waiting_keyframe = False
+
+            position = self._write_pos
+            if position + length > self.capacity:
+                # 末尾放不下，从头开始（尾部空间在这一轮中不使用）
+                self._evict_range(position, self.capacity)
+                position = 0
+            self._evict_range(position, position + length)
+            if self._waiting_keyframe and not is_keyframe:
+                # 淘汰到了当前GOP本身（GOP超过缓冲容量），从下一个关键帧重新开始
+                self.stats['frames_skipped'] += 1
+                return
+            self._waiting_keyframe = False
+
+            self._view[position:position + length] = data
+            pts = metadata.get('pts')
+            if pts is None:
+                pts = time.monotonic()
+            self.index.append(BufferedUnit(position, length, pts, metadata.get('dts', pts), is_keyframe))
+            if is_keyframe:
+                self._keyframes.append(pts)
+            self._write_pos = position + length
+            self._bytes_used += length
+            self.stats['frames'] += 1
+
+            # 按时长淘汰：去掉最旧GOP后仍保留至少 duration 秒时才淘汰
+            while len(self._keyframes) > 1 and pts - self._keyframes[1] >= self.config.duration:
+                self._evict_gop()
+
+    def _evict_range(self, start: int, end: int):
+        """淘汰与 [start, end) 重叠的最旧数据（按GOP）"""
+        while self.index:
+            oldest = self.index[0]
+            if oldest.offset >= end or oldest.offset + oldest.length <= start:
+                return
+            self._evict_gop()
+
+    def _evict_gop(self):
+        """淘汰最旧的一个GOP"""
+        self._pop_unit()
+        while self.index and not self.index[0].is_keyframe:
+            self._pop_unit()
+        if self._keyframes:
+            self._keyframes.popleft()
+        self.stats['gops_evicted'] += 1
+        if not self.index:
+            self._waiting_keyframe = True
+
+    def _pop_unit(self):
+        unit = self.index.popleft()
+        self._bytes_used -= unit.length
+
+    def _clear(self):
+        self.index.clear()
+        self._keyframes.clear()
+        self._write_pos = 0
+        self._bytes_used = 0
+
+    def clear(self):
+        """清空缓冲"""
+        with self._lock:
+            self._clear()
+            self._waiting_keyframe = True
+
+    def time_range(self) -> Optional[Tuple[float, float]]:
+        """缓冲中最早和最新访问单元的pts，空时返回None"""
+        with self._lock:
+            if not self.index:
+                return None
+            return self.index[0].pts, self.index[-1].pts
+
+    def keyframe_times(self) -> List[float]:
+        """各GOP起始关键帧的pts（可定位的时间点）"""
+        with self._lock:
+            return list(self._keyframes)
+
+    def window(self, start: Optional[float] = None, end: Optional[float] = None) -> List[Tuple[bytes, Dict]]:
+        """拷贝出 [start, end] 时间窗口内的访问单元（pts时基），起点向前对齐到关键帧"""
+        with self._lock:
+            first = 0
+            if start is not None:
+                for i, unit in enumerate(self.index):
+                    if unit.pts > start:
+                        break
+                    if unit.is_keyframe:
+                        first = i
+
+            output = []
+            for unit in itertools.islice(self.index, first, None):
+                if end is not None and unit.pts > end:
+                    break
+                output.append((bytes(self._view[unit.offset:unit.offset + unit.length]),
+                               {'pts': unit.pts, 'dts': unit.dts, 'is_keyframe': unit.is_keyframe}))
+            return output
+
+    def export(self, output: Union[str, BinaryIO], start: Optional[float] = None,
+               end: Optional[float] = None, format: str = 'mp4') -> int:
+        """把时间窗口导出为MP4/MKV（仅重新封装）
+
+        Returns:
+            导出的帧数
+        """
+        if not HAS_AV:
+            raise RuntimeError("PyAV is required to export clips. Install with: pip install av")
+        frames = remux_access_units(self.window(start, end), output, format)
+        self.stats['exports'] += 1
+        return frames
+
+    def export_last(self, output: Union[str, BinaryIO], seconds: float = 30.0, format: str = 'mp4') -> int:
+        """导出最近 seconds 秒（"保存最后30秒"）"""
+        span = self.time_range()
+        if span is None:
+            return 0
+        return self.export(output, span[1] - seconds, None, format)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓冲统计"""
+        with self._lock:
+            duration = self.index[-1].pts - self.index[0].pts if self.index else 0.0
+            return dict(self.stats,
+                        buffered_frames=len(self.index),
+                        buffered_gops=len(self._keyframes),
+                        buffered_seconds=duration,
+                        bytes_used=self._bytes_used,
+                        capacity=self.capacity)
+
+class TimeShiftServer:
+    """时移回看HTTP服务
+
+    GET /index.json                  缓冲时长和可定位的关键帧位置（相对最早一帧的秒数）
+    GET /clip.mp4?start=S&end=E      从位置 S 秒（向前对齐到关键帧）到 E 秒的片段
+    GET /clip.mp4?last=N             最近 N 秒
+
+    片段为 fragmented MP4，浏览器可边下载边播放。
+    """
+
+    def __init__(self, buffer: TimeShiftBuffer, port: int = 8091, host: str = '0.0.0.0'):
+        self.buffer = buffer
+        self.host = host
+        self.port = port
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.requests = 0
+
+    async def start(self) -> bool:
+        """启动HTTP服务"""
+        try:
+            self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError as e:
+            logger.error(f"Failed to start time-shift server on port {self.port}: {e}")
+            return False
+        logger.info(f"Time-shift playback: http://localhost:{self.port}/clip.mp4?last=30")
+        return True
+
+    async def stop(self):
+        """停止HTTP服务"""
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=10)
+            parts = request.split(b'\r\n', 1)[0].decode('latin-1').split(' ')
+            if len(parts) < 2 or parts[0] not in ('GET', 'HEAD'):
+                await self._respond(writer, 405, 'Method Not Allowed')
+                return
+
+            self.requests += 1
+            url = urlparse(parts[1])
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            if url.path == '/index.json':
+                await self._respond(writer, 200, 'OK', json.dumps(self._index()).encode(), 'application/json')
+            elif url.path == '/clip.mp4':
+                await self._send_clip(writer, query, parts[0] == 'HEAD')
+            else:
+                await self._respond(writer, 404, 'Not Found')
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"Time-shift request error: {e}")
+        finally:
+            writer.close()
+
+    def _index(self) -> Dict[str, Any]:
+        span = self.buffer.time_range()
+        if span is None:
+            return {'duration': 0.0, 'keyframes': []}
+        origin = span[0]
+        return {
+            'duration': span[1] - origin,
+            'keyframes': [round(t - origin, 3) for t in self.buffer.keyframe_times()]
+        }
+
+    async def _send_clip(self, writer: asyncio.StreamWriter, query: Dict[str, str], head_only: bool):
+        span = self.buffer.time_range()
+        if span is None:
+            await self._respond(writer, 503, 'Service Unavailable')
+            return
+        try:
+            if 'last' in query:
+                start, end = span[1] - float(query['last']), None
+            else:
+                start = span[0] + float(query['start']) if 'start' in query else None
+                end = span[0] + float(query['end']) if 'end' in query else None
+        except ValueError:
+            await self._respond(writer, 400, 'Bad Request')
+            return
+
+        # 封装在线程池中进行，不阻塞事件循环
+        output = io.BytesIO()
+        frames = await asyncio.get_running_loop().run_in_executor(None, self.buffer.export, output, start, end)
+        if not frames:
+            await self._respond(writer, 404, 'Not Found')
+            return
+        body = output.getvalue()
+        await self._respond(writer, 200, 'OK', b'' if head_only else body, 'video/mp4', len(body))
+
+    async def _respond(self, writer: asyncio.StreamWriter, code: int, message: str, body: bytes = b'',
+                       content_type: str = 'text/plain', length: Optional[int] = None):
+        headers = (f"HTTP/1.1 {code} {message}\r\n"
+                   f"Content-Type: {content_type}\r\n"
+                   f"Content-Length: {len(body) if length is None else length}\r\n"
+                   f"Access-Control-Allow-Origin: *\r\n"
+                   f"Cache-Control: no-store\r\n"
+                   f"Connection: close\r\n\r\n")
+        writer.write(headers.encode('latin-1'))
+        if body:
+            writer.write(body)
+        await writer.drain()
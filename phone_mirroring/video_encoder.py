@@ -7,12 +7,27 @@ import cv2
 import numpy as np
 import logging
 import asyncio
-from typing import Optional, Dict, Any, Callable, Tuple
-from dataclasses import dataclass
+import threading
+from collections import deque
+from fractions import Fraction
+from typing import Optional, Dict, Any, Callable, Tuple, List, Deque
+from dataclasses import dataclass, replace
 import time
 
+from phone_mirroring.nal_parser import AccessUnit, AccessUnitParser
+from phone_mirroring.frame_mailbox import FrameMailbox
+from phone_mirroring.keyframe_limiter import KeyframeLimiter
+from phone_mirroring.frame_pool import retain_frame, release_frame
+
 logger = logging.getLogger(__name__)
 
+try:
+    import av
+    from av.video.frame import PictureType
+    HAS_AV = True
+except ImportError:
+    HAS_AV = False
+
 @dataclass
 class EncodeConfig:
     """编码配置"""
@@ -25,6 +40,62 @@ class EncodeConfig:
     gop_size: int = 30  # 关键帧间隔
     preset: str = 'fast'  # ultrafast, superfast, veryfast, faster, fast, medium, slow
     tune: str = 'zerolatency'  # film, animation, grain, stillimage, fastdecode, zerolatency
+    pixel_format: str = 'bgr24'  # 输入像素格式: bgr24 或 yuv420p（I420，管道数据量减半）
+    encoder_name: str = 'libx264'  # FFmpeg编码器: libx264, libopenh264, h264_nvenc, h264_qsv...
+    max_latency_ms: float = 50.0  # 编码延迟目标（自动选择编码器时使用）
+
+def build_ffmpeg_command(config: EncodeConfig, extra_output_args: Tuple[str, ...] = ()) -> List[str]:
+    """生成从stdin读取原始帧、向stdout输出H.264 Annex-B的FFmpeg命令"""
+    # 关闭B帧：AccessUnitParser按输出顺序（FIFO）分配PTS，输出顺序必须与输入一致
+    # （tune不是zerolatency时libx264默认也会使用B帧）
+    codec_args = ['-bf', '0']
+    if config.encoder_name == 'libx264':
+        codec_args += [
+            '-preset', config.preset,  # 编码速度预设
+            '-tune', config.tune,  # 调优选项
+        ]
+    
+    return [
+        'ffmpeg',
+        '-hide_banner',
+        '-loglevel', 'error',  # 避免stderr管道写满阻塞编码进程
+        '-y',  # 覆盖输出文件
+        '-f', 'rawvideo',  # 输入格式
+        '-vcodec', 'rawvideo',
+        '-pix_fmt', config.pixel_format,  # 像素格式
+        '-s', f'{config.width}x{config.height}',  # 分辨率
+        '-r', str(config.fps),  # 帧率
+        '-i', '-',  # 从stdin读取
+        '-c:v', config.encoder_name,  # 视频编码器
+        *codec_args,
+        '-b:v', str(config.bitrate),  # 视频码率
+        '-g', str(config.gop_size),  # GOP大小
+        *extra_output_args,
+        '-pix_fmt', 'yuv420p',  # 输出像素格式
+        '-flush_packets', '1',  # 每个包立即写出
+        '-f', 'h264',  # 输出格式
+        '-'  # 输出到stdout
+    ]
+
+def expected_frame_shape(config: EncodeConfig) -> Tuple[int, ...]:
+    """编码器输入帧应有的数组形状"""
+    if config.pixel_format == 'yuv420p':
+        return (config.height * 3 // 2, config.width)
+    return (config.height, config.width, 3)
+
+def fit_frame(frame: np.ndarray, config: EncodeConfig) -> np.ndarray:
+    """将帧调整为编码器配置的分辨率"""
+    if frame.shape == expected_frame_shape(config):
+        return frame
+    
+    size = (config.width, config.height)
+    if config.pixel_format == 'yuv420p':
+        # I420平面不能直接缩放，先转回BGR再转换（较慢，仅在分辨率不一致时发生）
+        if frame.ndim == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_I420)
+        return cv2.cvtColor(cv2.resize(frame, size), cv2.COLOR_BGR2YUV_I420)
+    
+    return cv2.resize(frame, size)
 
 class VideoEncoder:
     """H.264视频编码器"""
@@ -155,6 +226,11 @@ class VideoEncoder:
             self.release()
             self.initialize()
     
+    def request_keyframe(self) -> bool:
+        """请求关键帧（OpenCV VideoWriter不支持强制关键帧）"""
+        logger.debug("Keyframe requests are not supported by OpenCV encoder")
+        return False
+    
     def release(self):
         """释放编码器资源"""
         if self.encoder:
@@ -168,62 +244,263 @@ class VideoEncoder:
         self.release()
 
 
+def _release_item(item: Tuple[np.ndarray, float]):
+    """邮箱丢弃 (帧, PTS) 时归还池化帧"""
+    release_frame(item[0])
+
+class _FFmpegProcess:
+    """单个FFmpeg编码进程
+    
+    写入线程从邮箱取帧零拷贝写入stdin，读取线程将stdout切分为访问单元。
+    FFmpegEncoder在重新配置时会同时运行两个进程，在IDR处切换。
+    """
+    
+    # 单次读取FFmpeg输出的缓冲区大小
+    READ_BUFFER_SIZE = 1024 * 1024
+    
+    def __init__(self, config: EncodeConfig,
+                 on_access_unit: Callable[['_FFmpegProcess', AccessUnit], None],
+                 on_closed: Optional[Callable[['_FFmpegProcess'], None]] = None,
+                 warmup_frames: int = 0):
+        self.config = config
+        # 替换进程：前 warmup_frames 帧仅用于预热，下一帧强制编码为IDR作为切换点
+        self.warmup_frames = warmup_frames
+        self.on_access_unit = on_access_unit
+        self.on_closed = on_closed
+        self.process = None
+        self.is_running = False
+        self.frames_written = 0
+        # 已读到编码输出（编码器完成初始化）
+        self.output_started = False
+        # 最近输出访问单元时编码器中滞留的帧数（前瞻等设置会推迟输出），尚未输出时为None
+        self.output_delay: Optional[int] = None
+        self.started_at = 0.0
+        
+        # 访问单元解析器（编码输出按帧切分并标记PTS）
+        self.parser = AccessUnitParser()
+        self._pts_lock = threading.Lock()
+        
+        # 单槽位邮箱，编码器忙时新帧覆盖旧帧（被覆盖的池化帧归还缓冲池）
+        self.mailbox = FrameMailbox(on_discard=_release_item)
+        self._write_thread: Optional[threading.Thread] = None
+        self._read_thread: Optional[threading.Thread] = None
+    
+    def _build_command(self) -> List[str]:
+        """生成FFmpeg命令行参数"""
+        keyframe_args = (('-force_key_frames', f'expr:eq(n,{self.warmup_frames})')
+                         if self.warmup_frames else ())
+        return build_ffmpeg_command(self.config, keyframe_args)
+    
+    def start(self):
+        """启动FFmpeg进程及读写线程（失败时抛出异常）"""
+        import subprocess
+        
+        self.process = subprocess.Popen(
+            self._build_command(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0
+        )
+        
+        self.is_running = True
+        self.started_at = time.monotonic()
+        
+        # 启动读取线程
+        self._read_thread = threading.Thread(target=self._read_output)
+        self._read_thread.daemon = True
+        self._read_thread.start()
+        
+        # 启动写入线程
+        self._write_thread = threading.Thread(target=self._write_input)
+        self._write_thread.daemon = True
+        self._write_thread.start()
+    
+    def submit(self, frame: np.ndarray, pts: float) -> bool:
+        """提交一帧，返回False表示覆盖了尚未写入的上一帧"""
+        retain_frame(frame)
+        return self.mailbox.put((frame, pts))
+    
+    def exited(self) -> bool:
+        """FFmpeg进程是否已退出（或已停止）"""
+        process = self.process
+        return process is None or process.poll() is not None
+    
+    def _read_output(self):
+        """读取FFmpeg输出并切分为访问单元"""
+        buffer = bytearray(self.READ_BUFFER_SIZE)
+        view = memoryview(buffer)
+        stdout = self.process.stdout
+        
+        # 读到EOF为止，停止时也会输出FFmpeg中剩余的帧
+        while True:
+            try:
+                # 大块读取，减少系统调用次数
+                n = stdout.readinto(view)
+                if not n:
+                    break
+                self.output_started = True
+                
+                with self._pts_lock:
+                    access_units = self.parser.feed(view[:n])
+                    if access_units:
+                        self.output_delay = self.parser.pending_frames
+                for au in access_units:
+                    self.on_access_unit(self, au)
+            except Exception as e:
+                if self.is_running:
+                    logger.error(f"Error reading FFmpeg output: {e}")
+                break
+        
+        # 输出剩余的最后一帧
+        with self._pts_lock:
+            access_units = self.parser.flush()
+        for au in access_units:
+            self.on_access_unit(self, au)
+        
+        if self.on_closed:
+            self.on_closed(self)
+    
+    def _write_input(self):
+        """写入线程：从邮箱取出最新帧并零拷贝写入FFmpeg"""
+        stdin = self.process.stdin
+        
+        while self.is_running:
+            item = self.mailbox.get(timeout=0.5)
+            if item is None:
+                continue
+            
+            source, pts = item
+            try:
+                # 调整帧大小
+                frame = fit_frame(source, self.config)
+                
+                # 直接写入数组缓冲区，不经过tobytes()复制
+                view = memoryview(np.ascontiguousarray(frame)).cast('B')
+                
+                # 登记PTS，输出的访问单元按相同顺序匹配
+                with self._pts_lock:
+                    self.parser.push_pts(pts)
+                
+                while view:
+                    written = stdin.write(view)
+                    if written is None:
+                        continue
+                    view = view[written:]
+                
+                self.frames_written += 1
+            
+            except Exception as e:
+                if self.is_running:
+                    logger.error(f"Error writing frame to FFmpeg: {e}")
+                break
+            finally:
+                release_frame(source)
+    
+    def stop(self):
+        """停止写入并等待FFmpeg输出剩余帧后退出"""
+        self.is_running = False
+        self.mailbox.close()
+        
+        if self._write_thread:
+            self._write_thread.join(timeout=2.0)
+            self._write_thread = None
+        
+        if self.process:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=5)
+            except:
+                self.process.kill()
+            finally:
+                self.process = None
+
+
 class FFmpegEncoder:
-    """使用FFmpeg进行H.264编码（更专业的编码实现）"""
+    """使用FFmpeg进行H.264编码（更专业的编码实现）
+    
+    FFmpeg进程运行期间无法修改参数，reconfigure() 会按新配置启动替换进程，
+    先送入预热帧（帧数按当前进程的输出延迟估算），替换进程开始输出后把下一帧作为切换点：
+    替换进程将其编码为IDR，旧进程不再接收新帧并输出剩余帧后退出，观众无需等待下一个GOP。
+    预热帧送完后迟迟没有输出（编码器前瞻滞留了帧）时继续送帧直到输出，测得延迟后
+    按该预热帧数重新启动替换进程；超过 WARMUP_TIMEOUT 或替换进程退出时放弃替换。
+    """
+    
+    # 单个替换进程的预热期限（秒）
+    WARMUP_TIMEOUT = 5.0
+    # 预热帧送完后等待输出的时间，超过则认为编码器滞留了帧
+    WARMUP_STALL = 0.5
+    MAX_WARMUP_FRAMES = 256
     
     def __init__(self, config: Optional[EncodeConfig] = None):
         self.config = config or EncodeConfig()
-        self.process = None
         self.is_running = False
-        self.frame_count = 0
+        self.access_unit_count = 0
+        self.keyframe_count = 0
+        self.frames_dropped = 0
+        self.reconfigure_count = 0
+        self._frames_retired = 0
         
-        # 回调
-        self.on_encoded_data: Optional[Callable[[bytes], None]] = None
+        # 当前进程、预热中的替换进程、切换后等待排空的旧进程
+        self._active: Optional[_FFmpegProcess] = None
+        self._pending: Optional[_FFmpegProcess] = None
+        self._retiring: Optional[_FFmpegProcess] = None
+        # 已送入替换进程的预热帧数及最后一帧的送入时间
+        self._pending_fed = 0
+        self._pending_fed_at = 0.0
+        # 替换进程滞留预热帧时持续送帧测量其输出延迟，之后按测得的延迟重新启动
+        self._pending_probing = False
+        self._pending_retrying = False
+        self._switch_pts: Optional[float] = None
+        self._announce_keyframe = False
+        # 旧进程排空前暂存的新进程输出（保证访问单元按顺序输出）
+        self._held: List[Tuple[AccessUnit, Optional[Tuple[int, int]]]] = []
+        self._swap_lock = threading.RLock()
+        # 待输出的 (访问单元, 重新配置后的分辨率)：在_swap_lock内按顺序入队，
+        # 出队和回调只持有_emit_lock，回调阻塞时不影响encode_frame和切换
+        self._output: Deque[Tuple[AccessUnit, Optional[Tuple[int, int]]]] = deque()
+        self._emit_lock = threading.Lock()
+        
+        # 关键帧请求限流
+        self._keyframe_limiter = KeyframeLimiter()
+        
+        # 回调: (访问单元数据, 元数据)
+        self.on_encoded_data: Optional[Callable[[bytes, Dict], None]] = None
+    
+    @property
+    def frame_count(self) -> int:
+        """已写入FFmpeg的帧数"""
+        active = self._active
+        return self._frames_retired + (active.frames_written if active else 0)
+    
+    @property
+    def process(self):
+        """当前FFmpeg进程（subprocess.Popen），未运行时为None"""
+        active = self._active
+        return active.process if active else None
     
-    def start(self, output_callback: Callable[[bytes], None] = None) -> bool:
+    @property
+    def pid(self) -> Optional[int]:
+        """当前FFmpeg进程的PID（重新配置切换后会变化）"""
+        process = self.process
+        return process.pid if process else None
+    
+    def _create_process(self, config: EncodeConfig, warmup_frames: int = 0) -> _FFmpegProcess:
+        return _FFmpegProcess(config, self._on_access_unit, self._on_process_closed, warmup_frames)
+    
+    def start(self, output_callback: Callable[[bytes, Dict], None] = None) -> bool:
         """启动FFmpeg编码进程"""
         try:
-            import subprocess
-            
             if output_callback:
                 self.on_encoded_data = output_callback
             
-            # FFmpeg命令行参数
-            cmd = [
-                'ffmpeg',
-                '-y',  # 覆盖输出文件
-                '-f', 'rawvideo',  # 输入格式
-                '-vcodec', 'rawvideo',
-                '-pix_fmt', 'bgr24',  # 像素格式
-                '-s', f'{self.config.width}x{self.config.height}',  # 分辨率
-                '-r', str(self.config.fps),  # 帧率
-                '-i', '-',  # 从stdin读取
-                '-c:v', 'libx264',  # 视频编码器
-                '-preset', self.config.preset,  # 编码速度预设
-                '-tune', self.config.tune,  # 调优选项
-                '-b:v', str(self.config.bitrate),  # 视频码率
-                '-g', str(self.config.gop_size),  # GOP大小
-                '-pix_fmt', 'yuv420p',  # 输出像素格式
-                '-f', 'h264',  # 输出格式
-                '-'  # 输出到stdout
-            ]
-            
-            self.process = subprocess.Popen(
-                cmd,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                bufsize=0
-            )
+            process = self._create_process(self.config)
+            process.start()
             
+            self._active = process
+            self._switch_pts = None
             self.is_running = True
             
-            # 启动读取线程
-            import threading
-            self._read_thread = threading.Thread(target=self._read_output)
-            self._read_thread.daemon = True
-            self._read_thread.start()
-            
             logger.info(f"FFmpeg encoder started: {self.config.width}x{self.config.height}@{self.config.fps}fps")
             return True
             
@@ -231,68 +508,597 @@ class FFmpegEncoder:
             logger.error(f"Failed to start FFmpeg encoder: {e}")
             return False
     
-    def _read_output(self):
-        """读取FFmpeg输出"""
-        while self.is_running and self.process:
+    def _on_access_unit(self, process: _FFmpegProcess, au: AccessUnit):
+        """各进程读取线程的访问单元回调"""
+        with self._swap_lock:
+            resolution = None
+            if process is self._active:
+                # 丢弃替换进程的预热帧
+                if self._switch_pts is not None and au.pts is not None and au.pts < self._switch_pts:
+                    return
+                if au.is_keyframe and self._announce_keyframe:
+                    # 切换后的首个IDR，参数集（SPS/PPS）可能已变化
+                    resolution = (self.config.width, self.config.height)
+                    self._announce_keyframe = False
+                if self._retiring is not None:
+                    self._held.append((au, resolution))
+                    return
+            elif process is not self._retiring:
+                return
+            
+            self._output.append((au, resolution))
+        
+        self._drain_output()
+    
+    def _on_process_closed(self, process: _FFmpegProcess):
+        """旧进程排空后输出暂存的访问单元"""
+        with self._swap_lock:
+            if process is not self._retiring:
+                return
+            
+            self._frames_retired += process.frames_written
+            self._retiring = None
+            held, self._held = self._held, []
+            self._output.extend(held)
+        
+        self._drain_output()
+    
+    def _drain_output(self):
+        """按入队顺序输出访问单元（不持有_swap_lock）
+        
+        同一时刻只有一个线程输出；其他线程入队后直接返回，由正在输出的线程接着输出。
+        """
+        while self._output:
+            if not self._emit_lock.acquire(blocking=False):
+                return
             try:
-                # 读取编码后的数据
-                data = self.process.stdout.read(4096)
-                if data:
-                    if self.on_encoded_data:
-                        self.on_encoded_data(data)
-            except Exception as e:
-                if self.is_running:
-                    logger.error(f"Error reading FFmpeg output: {e}")
-                break
+                while self._output:
+                    self._emit_access_unit(*self._output.popleft())
+            finally:
+                self._emit_lock.release()
     
-    def encode_frame(self, frame: np.ndarray) -> bool:
-        """编码一帧"""
-        if not self.is_running or not self.process:
+    def _switch_process(self, pts: float):
+        """以当前帧为切换点切换到替换进程（调用方持有_swap_lock）"""
+        previous = self._active
+        process = self._pending
+        
+        self._active = process
+        self._pending = None
+        self._retiring = previous
+        self._switch_pts = pts
+        
+        # 预热帧不计入编码帧数
+        process.frames_written = 0
+        
+        # 在后台关闭旧进程，其读取线程会输出切换点之前的剩余帧
+        threading.Thread(target=previous.stop, daemon=True).start()
+        
+        if process.config == self.config:
+            # 仅为强制关键帧而切换
+            logger.debug("Switched FFmpeg encoder process for keyframe request")
+            return
+        
+        self.config = process.config
+        self._announce_keyframe = True
+        self.reconfigure_count += 1
+        logger.info(f"Switched to reconfigured FFmpeg encoder: "
+                    f"{self.config.width}x{self.config.height}@{self.config.fps}fps "
+                    f"{self.config.bitrate}bps")
+    
+    def _feed_pending(self, frame: np.ndarray, pts: float):
+        """推进替换进程：先送预热帧，开始输出后在下一帧切换"""
+        retry = None
+        with self._swap_lock:
+            pending = self._pending
+            if pending is None:
+                return
+            
+            now = time.monotonic()
+            exited = pending.exited()
+            if exited or (not pending.output_started and now - pending.started_at > self.WARMUP_TIMEOUT):
+                logger.warning(f"Replacement FFmpeg encoder "
+                               f"{'exited' if exited else 'produced no output in time'}, abandoning it")
+                self._pending = None
+                threading.Thread(target=pending.stop, daemon=True).start()
+                return
+            
+            if self._pending_retrying:
+                return
+            
+            if self._pending_probing and pending.output_delay is not None:
+                # 测得替换进程的输出延迟，按此预热帧数重新启动（强制IDR的帧位置已经错过）
+                warmup_frames = pending.output_delay + 1
+                if warmup_frames > self.MAX_WARMUP_FRAMES:
+                    logger.warning(f"Replacement FFmpeg encoder holds back {pending.output_delay} frames, "
+                                   f"abandoning it")
+                    self._pending = None
+                    threading.Thread(target=pending.stop, daemon=True).start()
+                    return
+                # 重试进程启动前保留当前替换进程，避免期间触发的关键帧替换覆盖重新配置
+                self._pending_retrying = True
+                retry = (pending, warmup_frames)
+            elif self._pending_fed < pending.warmup_frames or self._pending_probing:
+                pending.submit(frame, pts)
+                self._pending_fed += 1
+                self._pending_fed_at = now
+            elif pending.output_started:
+                if self._retiring is None:
+                    self._switch_process(pts)
+            elif now - self._pending_fed_at > self.WARMUP_STALL:
+                # 预热帧送完仍没有输出：编码器滞留了帧（如rc-lookahead），继续送帧直到输出以测量延迟
+                logger.debug("Replacement FFmpeg encoder holds back warm-up frames, measuring its delay")
+                self._pending_probing = True
+                pending.submit(frame, pts)
+                self._pending_fed += 1
+                self._pending_fed_at = now
+        
+        if retry:
+            pending, warmup_frames = retry
+            logger.debug(f"Restarting replacement FFmpeg encoder with {warmup_frames} warm-up frames")
+            threading.Thread(target=self._start_replacement, args=(pending.config,),
+                             kwargs={'warmup_frames': warmup_frames, 'replaces': pending}, daemon=True).start()
+    
+    def _emit_access_unit(self, au: AccessUnit, resolution: Optional[Tuple[int, int]] = None):
+        """输出一个完整的访问单元（resolution 为重新配置后首个IDR的分辨率）"""
+        self.access_unit_count += 1
+        if au.is_keyframe:
+            self.keyframe_count += 1
+            self._keyframe_limiter.note_keyframe()
+        
+        if self.on_encoded_data:
+            metadata = au.to_metadata()
+            metadata['frame_number'] = self.access_unit_count
+            metadata['timestamp'] = time.time()
+            if resolution:
+                metadata['reconfigured'] = True
+                metadata['resolution'] = resolution
+            self.on_encoded_data(au.data, metadata)
+    
+    def encode_frame(self, frame: np.ndarray, pts: Optional[float] = None) -> bool:
+        """提交一帧进行编码（非阻塞）
+        
+        帧交由写入线程处理，调用方之后不应再修改该数组。
+        编码器忙时未写入的上一帧会被新帧覆盖并计入丢帧数。
+        
+        Args:
+            frame: BGR数组 (H, W, 3)，pixel_format为yuv420p时为I420数组 (H*3/2, W)
+            pts: 采集时间戳（time.monotonic()），默认使用当前时间
+        """
+        if not self.is_running or not self._active:
             return False
         
+        if pts is None:
+            pts = time.monotonic()
+        
+        if self._pending is not None:
+            self._feed_pending(frame, pts)
+        elif self._keyframe_limiter.take():
+            # 在后台启动替换进程，避免阻塞调用方
+            threading.Thread(target=self._start_replacement, args=(self.config, True), daemon=True).start()
+        
+        if not self._active.submit(frame, pts):
+            self.frames_dropped += 1
+        return True
+    
+    async def encode_frame_async(self, frame: np.ndarray, pts: Optional[float] = None) -> bool:
+        """异步编码帧（提交本身不阻塞，无需线程池）"""
+        return self.encode_frame(frame, pts)
+    
+    def reconfigure(self, **kwargs) -> bool:
+        """在线修改编码参数（码率、帧率、分辨率、预设等）
+        
+        运行中时启动替换进程，切换前旧进程照常输出，切换点为替换进程的IDR。
+        
+        Returns:
+            是否成功开始重新配置
+        """
+        with self._swap_lock:
+            base = self._pending.config if self._pending else self.config
+        
+        changes = {key: value for key, value in kwargs.items()
+                   if hasattr(base, key) and getattr(base, key) != value}
+        if not changes:
+            return True
+        
+        new_config = replace(base, **changes)
+        if not self.is_running:
+            self.config = new_config
+            return True
+        
+        logger.info(f"Warming up replacement FFmpeg encoder: {changes}")
+        return self._start_replacement(new_config)
+    
+    def _start_replacement(self, config: EncodeConfig, keyframe_only: bool = False,
+                           warmup_frames: Optional[int] = None,
+                           replaces: Optional[_FFmpegProcess] = None) -> bool:
+        """启动替换进程，之后由encode_frame完成预热和切换
+        
+        Args:
+            config: 替换进程的配置
+            keyframe_only: 仅为强制关键帧（后台线程调用）：进程启动期间若已有重新配置的
+                替换进程或配置已切换，丢弃本进程，不能用旧配置覆盖重新配置
+            warmup_frames: 预热帧数，默认按当前进程的输出延迟估算
+            replaces: 重试时被替换的替换进程，它已不是当前替换进程时丢弃本进程
+        """
+        if warmup_frames is None:
+            active = self._active
+            warmup_frames = ((active.output_delay or 0) if active else 0) + 1
+        process = self._create_process(config, warmup_frames)
         try:
-            # 调整帧大小
-            if frame.shape[:2] != (self.config.height, self.config.width):
-                frame = cv2.resize(frame, (self.config.width, self.config.height))
+            process.start()
+        except Exception as e:
+            logger.error(f"Failed to start replacement FFmpeg encoder: {e}")
+            return False
+        
+        with self._swap_lock:
+            if replaces is not None and self._pending is not replaces:
+                logger.debug("Discarding retried FFmpeg encoder, the replacement was superseded")
+                superseded = process
+            elif keyframe_only and (self._pending is not None or config != self.config):
+                logger.debug("Discarding keyframe replacement, a reconfiguration is pending")
+                superseded = process
+            else:
+                superseded, self._pending = self._pending, process
+                self._pending_fed = 0
+                self._pending_probing = False
+                self._pending_retrying = False
+        
+        if superseded:
+            threading.Thread(target=superseded.stop, daemon=True).start()
+        return superseded is not process
+    
+    def request_keyframe(self) -> bool:
+        """请求尽快输出IDR（新观众、PLI/FIR、丢包）
+        
+        运行中的FFmpeg进程无法强制关键帧，按当前配置启动替换进程，
+        在其IDR处切换。请求经过限流，短时间内的多次请求只触发一次。
+        """
+        if not self.is_running:
+            return False
+        
+        self._keyframe_limiter.request()
+        return True
+    
+    def stop(self):
+        """停止编码器"""
+        self.is_running = False
+        
+        with self._swap_lock:
+            processes = [p for p in (self._pending, self._retiring, self._active) if p]
+            self._pending = None
+        
+        # 先停旧进程，保证暂存的新进程输出能按顺序释放
+        for process in processes:
+            process.stop()
+        
+        if self._active:
+            self._frames_retired += self._active.frames_written
+            self._active = None
+        logger.info("FFmpeg encoder stopped")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取编码统计"""
+        return {
+            'frames_encoded': self.frame_count,
+            'frames_dropped': self.frames_dropped,
+            'access_units': self.access_unit_count,
+            'keyframes': self.keyframe_count,
+            'reconfigurations': self.reconfigure_count,
+            'reconfiguring': self._pending is not None,
+            'keyframe_requests': self._keyframe_limiter.get_stats(),
+            'fps': self.config.fps,
+            'resolution': f'{self.config.width}x{self.config.height}',
+            'bitrate': self.config.bitrate
+        }
+
+
+class PyAVEncoder:
+    """进程内PyAV编码器（libx264）
+    
+    直接在进程内编码numpy帧，省去FFmpeg子进程的双向管道复制，
+    输出带PTS和关键帧标记的 av.Packet。编码期间PyAV会释放GIL，
+    编码线程与采集线程可以在不同CPU核心上并行运行。
+    """
+    
+    # 输出时间基（与RTP视频时钟一致）
+    TIME_BASE = Fraction(1, 90000)
+    
+    # 运行中修改bit_rate即可生效的编码器（libx264经PyAV修改bit_rate不会生效）
+    IN_PLACE_BITRATE_CODECS = ('h264_nvenc', 'hevc_nvenc')
+    
+    def __init__(self, config: Optional[EncodeConfig] = None, codec_name: Optional[str] = None):
+        self.config = config or EncodeConfig()
+        self.codec_name = codec_name or self.config.encoder_name
+        self.codec = None
+        self.is_running = False
+        self.frame_count = 0
+        self.frames_dropped = 0
+        self.packet_count = 0
+        self.keyframe_count = 0
+        self._encode_time = 0.0
+        self._last_pts = -1
+        
+        # 编码线程：单槽位邮箱，编码器忙时新帧覆盖旧帧（被覆盖的池化帧归还缓冲池）
+        self._mailbox = FrameMailbox(on_discard=_release_item)
+        self._encode_thread: Optional[threading.Thread] = None
+        self._codec_lock = threading.Lock()
+        
+        # 预热好的替换编码上下文，在下一帧切换
+        self._pending: Optional[Tuple[Any, EncodeConfig]] = None
+        self._announce_keyframe = False
+        self.reconfigure_count = 0
+        
+        # 关键帧请求限流
+        self._keyframe_limiter = KeyframeLimiter()
+        
+        # 回调: (访问单元数据, 元数据)
+        self.on_encoded_data: Optional[Callable[[bytes, Dict], None]] = None
+        # 回调: 原始 av.Packet
+        self.on_packet: Optional[Callable[[Any], None]] = None
+    
+    def _open_codec(self, config: Optional[EncodeConfig] = None):
+        """创建并配置编码上下文"""
+        config = config or self.config
+        codec = av.CodecContext.create(self.codec_name, 'w')
+        codec.width = config.width
+        codec.height = config.height
+        codec.pix_fmt = 'yuv420p'
+        codec.time_base = self.TIME_BASE
+        codec.framerate = Fraction(config.fps, 1)
+        codec.bit_rate = config.bitrate
+        codec.gop_size = config.gop_size
+        codec.max_b_frames = 0
+        codec.thread_count = 0
+        
+        if self.codec_name == 'libx264':
+            codec.options = {
+                'preset': config.preset,
+                'tune': config.tune,
+                'forced-idr': '1'
+            }
+        
+        codec.open()
+        return codec
+    
+    def start(self, output_callback: Callable[[bytes, Dict], None] = None) -> bool:
+        """启动编码器"""
+        if not HAS_AV:
+            logger.error("PyAV not installed. Install with: pip install av")
+            return False
+        
+        try:
+            if output_callback:
+                self.on_encoded_data = output_callback
             
-            # 写入原始帧数据
-            self.process.stdin.write(frame.tobytes())
-            self.process.stdin.flush()
+            self.codec = self._open_codec()
+            self._last_pts = -1
+            self.is_running = True
+            self._mailbox.reopen()
             
-            self.frame_count += 1
+            self._encode_thread = threading.Thread(target=self._encode_loop)
+            self._encode_thread.daemon = True
+            self._encode_thread.start()
+            
+            logger.info(f"PyAV encoder started: {self.codec_name} "
+                        f"{self.config.width}x{self.config.height}@{self.config.fps}fps")
             return True
             
         except Exception as e:
-            logger.error(f"Error encoding frame: {e}")
+            logger.error(f"Failed to start PyAV encoder: {e}")
+            self.codec = None
             return False
     
-    async def encode_frame_async(self, frame: np.ndarray) -> bool:
-        """异步编码帧"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self.encode_frame, frame)
+    def _make_frame(self, frame: np.ndarray):
+        """将numpy数组转换为 av.VideoFrame"""
+        frame = fit_frame(frame, self.config)
+        if frame.ndim == 2:
+            return av.VideoFrame.from_ndarray(frame, format='yuv420p')
+        return av.VideoFrame.from_ndarray(frame, format='bgr24').reformat(format='yuv420p')
+    
+    def encode(self, frame: np.ndarray, pts: Optional[float] = None) -> List[Any]:
+        """同步编码一帧
+        
+        Args:
+            frame: BGR数组 (H, W, 3) 或 I420数组 (H*3/2, W)
+            pts: 采集时间戳（time.monotonic()），默认使用当前时间
+            
+        Returns:
+            编码输出的 av.Packet 列表（pts为90kHz时间基，is_keyframe标记关键帧）
+        """
+        if not self.codec:
+            return []
+        
+        if pts is None:
+            pts = time.monotonic()
+        
+        # libx264 要求PTS严格递增
+        ticks = int(round(pts / self.TIME_BASE))
+        if ticks <= self._last_pts:
+            ticks = self._last_pts + 1
+        self._last_pts = ticks
+        
+        start = time.perf_counter()
+        with self._codec_lock:
+            packets = self._swap_codec() if self._pending else []
+            
+            video_frame = self._make_frame(frame)
+            video_frame.pts = ticks
+            video_frame.time_base = self.TIME_BASE
+            if self._keyframe_limiter.take():
+                # forced-idr=1，强制的I帧编码为IDR
+                video_frame.pict_type = PictureType.I
+            packets += self.codec.encode(video_frame)
+        
+        self._encode_time += time.perf_counter() - start
+        self.frame_count += 1
+        return packets
+    
+    def _swap_codec(self) -> List[Any]:
+        """切换到替换编码上下文（调用方持有_codec_lock）
+        
+        Returns:
+            旧编码上下文冲刷出的剩余包
+        """
+        codec, config = self._pending
+        self._pending = None
+        
+        packets = self.codec.encode(None)
+        self.codec = codec
+        self.config = config
+        self.reconfigure_count += 1
+        # 新编码上下文输出的第一帧为IDR，携带新的SPS/PPS
+        self._announce_keyframe = True
+        
+        logger.info(f"Switched to reconfigured PyAV encoder: "
+                    f"{config.width}x{config.height}@{config.fps}fps {config.bitrate}bps")
+        return packets
+    
+    def reconfigure(self, **kwargs) -> bool:
+        """在线修改编码参数（码率、帧率、分辨率、预设等）
+        
+        支持的编码器直接修改码率；其余情况预热新的编码上下文，
+        在下一帧切换，新上下文的第一帧即为IDR。
+        
+        Returns:
+            是否成功应用
+        """
+        with self._codec_lock:
+            base = self._pending[1] if self._pending else self.config
+        
+        changes = {key: value for key, value in kwargs.items()
+                   if hasattr(base, key) and getattr(base, key) != value}
+        if not changes:
+            return True
+        
+        new_config = replace(base, **changes)
+        if not self.codec:
+            self.config = new_config
+            return True
+        
+        if (self._pending is None and set(changes) == {'bitrate'}
+                and self.codec_name in self.IN_PLACE_BITRATE_CODECS):
+            with self._codec_lock:
+                self.codec.bit_rate = new_config.bitrate
+                self.config = new_config
+            logger.info(f"PyAV encoder bitrate changed in place: {new_config.bitrate}bps")
+            return True
+        
+        # 在调用线程中预热，编码线程只需切换引用
+        try:
+            codec = self._open_codec(new_config)
+        except Exception as e:
+            logger.error(f"Failed to open replacement PyAV encoder: {e}")
+            return False
+        
+        with self._codec_lock:
+            self._pending = (codec, new_config)
+        
+        logger.info(f"Warming up replacement PyAV encoder: {changes}")
+        return True
+    
+    def request_keyframe(self) -> bool:
+        """请求下一帧编码为IDR（经过限流）"""
+        if not self.codec:
+            return False
+        
+        self._keyframe_limiter.request()
+        return True
+    
+    def _encode_loop(self):
+        """编码线程：取出最新帧编码并分发输出"""
+        while self.is_running:
+            item = self._mailbox.get(timeout=0.5)
+            if item is None:
+                continue
+            
+            frame, pts = item
+            try:
+                for packet in self.encode(frame, pts):
+                    self._emit_packet(packet)
+            except Exception as e:
+                logger.error(f"Error encoding frame with PyAV: {e}")
+            finally:
+                release_frame(frame)
+    
+    def _emit_packet(self, packet):
+        """分发一个编码包"""
+        self.packet_count += 1
+        if packet.is_keyframe:
+            self.keyframe_count += 1
+            self._keyframe_limiter.note_keyframe()
+        
+        if self.on_packet:
+            self.on_packet(packet)
+        
+        if self.on_encoded_data:
+            metadata = {
+                'pts': float(packet.pts * self.TIME_BASE) if packet.pts is not None else None,
+                'is_keyframe': packet.is_keyframe,
+                'size': packet.size,
+                'frame_number': self.packet_count,
+                'timestamp': time.time()
+            }
+            if packet.is_keyframe and self._announce_keyframe:
+                # 切换后的首个IDR，参数集（SPS/PPS）可能已变化
+                metadata['reconfigured'] = True
+                metadata['resolution'] = (self.config.width, self.config.height)
+                self._announce_keyframe = False
+            self.on_encoded_data(bytes(packet), metadata)
+    
+    def encode_frame(self, frame: np.ndarray, pts: Optional[float] = None) -> bool:
+        """提交一帧进行编码（非阻塞）
+        
+        帧交由编码线程处理，调用方之后不应再修改该数组。
+        编码器忙时未编码的上一帧会被新帧覆盖并计入丢帧数。
+        """
+        if not self.is_running:
+            return False
+        
+        retain_frame(frame)
+        if not self._mailbox.put((frame, pts if pts is not None else time.monotonic())):
+            self.frames_dropped += 1
+        return True
+    
+    async def encode_frame_async(self, frame: np.ndarray, pts: Optional[float] = None) -> bool:
+        """异步编码帧（提交本身不阻塞）"""
+        return self.encode_frame(frame, pts)
     
     def stop(self):
-        """停止编码器"""
+        """停止编码器并输出缓存的帧"""
         self.is_running = False
+        self._mailbox.close()
         
-        if self.process:
+        if self._encode_thread:
+            self._encode_thread.join(timeout=2.0)
+            self._encode_thread = None
+        
+        if self.codec:
             try:
-                self.process.stdin.close()
-                self.process.wait(timeout=5)
-            except:
-                self.process.kill()
-            finally:
-                self.process = None
+                with self._codec_lock:
+                    packets = self.codec.encode(None)
+                for packet in packets:
+                    self._emit_packet(packet)
+            except Exception as e:
+                logger.debug(f"Error flushing PyAV encoder: {e}")
+            self.codec = None
+            self._pending = None
         
-        logger.info("FFmpeg encoder stopped")
+        logger.info("PyAV encoder stopped")
     
     def get_stats(self) -> Dict[str, Any]:
         """获取编码统计"""
         return {
             'frames_encoded': self.frame_count,
+            'frames_dropped': self.frames_dropped,
+            'access_units': self.packet_count,
+            'keyframes': self.keyframe_count,
+            'average_encode_time': self._encode_time / self.frame_count if self.frame_count else 0,
             'fps': self.config.fps,
             'resolution': f'{self.config.width}x{self.config.height}',
-            'bitrate': self.config.bitrate
+            'bitrate': self.config.bitrate,
+            'reconfigurations': self.reconfigure_count,
+            'keyframe_requests': self._keyframe_limiter.get_stats(),
+            'codec': self.codec_name
         }
 
 
@@ -306,31 +1112,16 @@ class HardwareEncoder:
         self.is_running = False
     
     def _detect_hardware_encoder(self) -> str:
-        """检测可用的硬件编码器"""
+        """检测可用的硬件编码器
+        
+        探测结果由编码器注册表按进程和磁盘缓存，构造时不再启动子进程探测。
+        """
+        from phone_mirroring.encoder_registry import get_registry
+        
         try:
-            import subprocess
-            
-            # 检查NVIDIA GPU
-            result = subprocess.run(
-                ['nvidia-smi'],
-                capture_output=True,
-                text=True
-            )
-            if result.returncode == 0:
-                return 'h264_nvenc'
-            
-            # 检查Intel QuickSync
-            result = subprocess.run(
-                ['ffmpeg', '-encoders'],
-                capture_output=True,
-                text=True
-            )
-            if 'h264_qsv' in result.stdout:
-                return 'h264_qsv'
-            
-            return 'libx264'  # 默认软件编码
-            
-        except:
+            return get_registry().hardware_encoder() or 'libx264'  # 默认软件编码
+        except Exception as e:
+            logger.debug(f"Hardware encoder detection failed: {e}")
             return 'libx264'
     
     def start(self) -> bool:
@@ -343,7 +1134,7 @@ class HardwareEncoder:
                 '-y',
                 '-f', 'rawvideo',
                 '-vcodec', 'rawvideo',
-                '-pix_fmt', 'bgr24',
+                '-pix_fmt', self.config.pixel_format,
                 '-s', f'{self.config.width}x{self.config.height}',
                 '-r', str(self.config.fps),
                 '-i', '-',
@@ -375,8 +1166,7 @@ class HardwareEncoder:
             return False
         
         try:
-            if frame.shape[:2] != (self.config.height, self.config.width):
-                frame = cv2.resize(frame, (self.config.width, self.config.height))
+            frame = fit_frame(frame, self.config)
             
             self.process.stdin.write(frame.tobytes())
             return True
@@ -385,6 +1175,11 @@ class HardwareEncoder:
             logger.error(f"Error encoding frame: {e}")
             return False
     
+    def request_keyframe(self) -> bool:
+        """请求关键帧（硬件编码进程不支持强制关键帧）"""
+        logger.debug("Keyframe requests are not supported by hardware encoder")
+        return False
+    
     def stop(self):
         """停止编码器"""
         self.is_running = False
@@ -399,7 +1194,8 @@ def create_encoder(encoder_type: str = 'ffmpeg', config: Optional[EncodeConfig]
     """创建编码器实例
     
     Args:
-        encoder_type: 编码器类型 ('opencv', 'ffmpeg', 'hardware')
+        encoder_type: 编码器类型 ('auto', 'opencv', 'ffmpeg', 'pyav', 'hardware')，
+            'auto' 根据缓存的基准测试结果选择满足帧率和延迟目标的最快后端
         config: 编码配置
         
     Returns:
@@ -407,8 +1203,26 @@ def create_encoder(encoder_type: str = 'ffmpeg', config: Optional[EncodeConfig]
     """
     config = config or EncodeConfig()
     
+    if encoder_type == 'auto':
+        from phone_mirroring.encoder_registry import get_registry
+        
+        choice = get_registry().select(config)
+        if choice is None:
+            encoder_type = 'ffmpeg'
+        else:
+            encoder_type = choice.backend
+            # 调用方的配置可能被多个编码器共用，选择结果只作用于副本
+            overrides = {'encoder_name': choice.encoder_name}
+            if choice.preset:
+                overrides['preset'] = choice.preset
+            config = replace(config, **overrides)
+            logger.info(f"Auto-selected encoder: {choice.key} "
+                        f"({choice.fps:.0f}fps, {choice.latency_ms:.1f}ms at benchmark size)")
+    
     if encoder_type == 'ffmpeg':
         return FFmpegEncoder(config)
+    elif encoder_type == 'pyav':
+        return PyAVEncoder(config)
     elif encoder_type == 'hardware':
         return HardwareEncoder(config)
     else:
@@ -0,0 +1,242 @@
+"""
+X11 MIT-SHM 屏幕捕获模块
+通过共享内存段读取X服务器的屏幕图像，每帧不经过X套接字传输像素数据（ctypes实现，无额外依赖）
+"""
+
+import ctypes
+import ctypes.util
+import logging
+from typing import Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_IPC_PRIVATE = 0
+_IPC_CREAT = 0o1000
+_IPC_RMID = 0
+_Z_PIXMAP = 2
+_ALL_PLANES = ctypes.c_ulong(-1)
+
+class _XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [
+        ('shmseg', ctypes.c_ulong),
+        ('shmid', ctypes.c_int),
+        ('shmaddr', ctypes.c_void_p),
+        ('readOnly', ctypes.c_int),
+    ]
+
+class _XImage(ctypes.Structure):
+    # 只声明用到的前若干字段（通过指针访问，不需要完整布局）
+    _fields_ = [
+        ('width', ctypes.c_int),
+        ('height', ctypes.c_int),
+        ('xoffset', ctypes.c_int),
+        ('format', ctypes.c_int),
+        ('data', ctypes.c_void_p),
+        ('byte_order', ctypes.c_int),
+        ('bitmap_unit', ctypes.c_int),
+        ('bitmap_bit_order', ctypes.c_int),
+        ('bitmap_pad', ctypes.c_int),
+        ('depth', ctypes.c_int),
+        ('bytes_per_line', ctypes.c_int),
+        ('bits_per_pixel', ctypes.c_int),
+    ]
+
+class _XErrorEvent(ctypes.Structure):
+    _fields_ = [
+        ('type', ctypes.c_int),
+        ('display', ctypes.c_void_p),
+        ('resourceid', ctypes.c_ulong),
+        ('serial', ctypes.c_ulong),
+        ('error_code', ctypes.c_ubyte),
+        ('request_code', ctypes.c_ubyte),
+        ('minor_code', ctypes.c_ubyte),
+    ]
+
+_XErrorHandler = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(_XErrorEvent))
+
+_libs = None
+
+def _load_libraries():
+    """加载并声明 libX11 / libXext / libc 中用到的函数"""
+    global _libs
+    if _libs is not None:
+        return _libs
+
+    names = {name: ctypes.util.find_library(name) for name in ('X11', 'Xext', 'c')}
+    missing = [name for name, path in names.items() if not path]
+    if missing:
+        raise OSError(f"Library not found: {', '.join(missing)}")
+
+    x11 = ctypes.CDLL(names['X11'])
+    xext = ctypes.CDLL(names['Xext'])
+    libc = ctypes.CDLL(names['c'], use_errno=True)
+
+    x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+    x11.XOpenDisplay.restype = ctypes.c_void_p
+    x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+    x11.XDefaultScreen.argtypes = [ctypes.c_void_p]
+    x11.XRootWindow.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x11.XRootWindow.restype = ctypes.c_ulong
+    x11.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x11.XDefaultVisual.restype = ctypes.c_void_p
+    x11.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x11.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x11.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x11.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x11.XSetErrorHandler.argtypes = [_XErrorHandler]
+    x11.XSetErrorHandler.restype = ctypes.c_void_p
+    # XDestroyImage是宏且会释放data；数据在共享内存中，XImage本身用XFree释放
+    x11.XFree.argtypes = [ctypes.c_void_p]
+
+    xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+    xext.XShmCreateImage.argtypes = [
+        ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p,
+        ctypes.POINTER(_XShmSegmentInfo), ctypes.c_uint, ctypes.c_uint]
+    xext.XShmCreateImage.restype = ctypes.POINTER(_XImage)
+    xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+    xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+    xext.XShmGetImage.argtypes = [
+        ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(_XImage), ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+
+    libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+    libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+    libc.shmat.restype = ctypes.c_void_p
+    libc.shmdt.argtypes = [ctypes.c_void_p]
+    libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+
+    _libs = (x11, xext, libc)
+    return _libs
+
+# X错误默认处理会直接退出进程，这里改为记录错误码，由调用处检查
+_last_error: Optional[int] = None
+
+@_XErrorHandler
+def _on_x_error(display, event):
+    global _last_error
+    _last_error = event.contents.error_code
+    return 0
+
+class XShmGrabber:
+    """MIT-SHM 屏幕捕获
+
+    初始化时创建一次共享内存段并挂到X服务器，之后每帧 XShmGetImage 由X服务器
+    直接把像素写入共享内存，返回的数组是该共享内存的视图（不复制）。
+
+    注意：返回的数组在下一次 grab() 时被覆盖，需要跨帧保留时由调用方复制。
+    Display连接不是线程安全的，应在使用它的线程中创建。
+    """
+
+    def __init__(self, display: Optional[str] = None):
+        self._x11, self._xext, self._libc = _load_libraries()
+        self._x11.XSetErrorHandler(_on_x_error)
+
+        self._display = self._x11.XOpenDisplay(display.encode() if display else None)
+        if not self._display:
+            raise RuntimeError(f"Cannot open X display {display or ''}".strip())
+
+        try:
+            if not self._xext.XShmQueryExtension(self._display):
+                raise RuntimeError("X server does not support MIT-SHM")
+
+            screen = self._x11.XDefaultScreen(self._display)
+            self._root = self._x11.XRootWindow(self._display, screen)
+            self._visual = self._x11.XDefaultVisual(self._display, screen)
+            self._depth = self._x11.XDefaultDepth(self._display, screen)
+            self.screen_size = (self._x11.XDisplayWidth(self._display, screen),
+                                self._x11.XDisplayHeight(self._display, screen))
+        except Exception:
+            self._x11.XCloseDisplay(self._display)
+            self._display = None
+            raise
+
+        self._shminfo = _XShmSegmentInfo()
+        self._image = None
+        self._size: Optional[Tuple[int, int]] = None
+        self._view: Optional[np.ndarray] = None
+
+    def _create_segment(self, width: int, height: int):
+        """按捕获区域大小创建XImage和共享内存段"""
+        global _last_error
+        self._destroy_segment()
+
+        image = self._xext.XShmCreateImage(self._display, self._visual, self._depth, _Z_PIXMAP,
+                                           None, ctypes.byref(self._shminfo), width, height)
+        if not image:
+            raise RuntimeError("XShmCreateImage failed")
+        self._image = image
+
+        header = image.contents
+        if header.bits_per_pixel != 32:
+            raise RuntimeError(f"Unsupported X image format: {header.bits_per_pixel} bits per pixel")
+
+        size = header.bytes_per_line * height
+        shmid = self._libc.shmget(_IPC_PRIVATE, size, _IPC_CREAT | 0o600)
+        if shmid < 0:
+            raise OSError(ctypes.get_errno(), "shmget failed")
+        self._shminfo.shmid = shmid
+
+        address = self._libc.shmat(shmid, None, 0)
+        if address in (None, ctypes.c_void_p(-1).value):
+            self._libc.shmctl(shmid, _IPC_RMID, None)
+            raise OSError(ctypes.get_errno(), "shmat failed")
+        self._shminfo.shmaddr = address
+        self._shminfo.readOnly = 0
+        header.data = address
+
+        _last_error = None
+        attached = self._xext.XShmAttach(self._display, ctypes.byref(self._shminfo))
+        self._x11.XSync(self._display, 0)
+
+        # 双方都挂上后即可标记删除，进程退出时共享内存段会被自动回收
+        self._libc.shmctl(shmid, _IPC_RMID, None)
+        if not attached or _last_error is not None:
+            self._libc.shmdt(ctypes.c_void_p(address))
+            self._shminfo.shmaddr = None
+            raise RuntimeError(f"XShmAttach failed (X error {_last_error}), is the X server remote?")
+
+        buffer = (ctypes.c_ubyte * size).from_address(address)
+        view = np.frombuffer(buffer, dtype=np.uint8).reshape(height, header.bytes_per_line // 4, 4)
+        self._view = view[:, :width]
+        self._size = (width, height)
+
+    def _destroy_segment(self):
+        if self._shminfo.shmaddr:
+            self._xext.XShmDetach(self._display, ctypes.byref(self._shminfo))
+            self._x11.XSync(self._display, 0)
+            self._libc.shmdt(ctypes.c_void_p(self._shminfo.shmaddr))
+            self._shminfo.shmaddr = None
+        if self._image:
+            self._x11.XFree(self._image)
+            self._image = None
+        self._view = None
+        self._size = None
+
+    def grab(self, left: int = 0, top: int = 0,
+             width: Optional[int] = None, height: Optional[int] = None) -> Optional[np.ndarray]:
+        """捕获一帧，返回共享内存上的 (H, W, 4) BGRA 视图，失败返回None"""
+        global _last_error
+        width = width or self.screen_size[0] - left
+        height = height or self.screen_size[1] - top
+        if self._size != (width, height):
+            self._create_segment(width, height)
+
+        _last_error = None
+        if not self._xext.XShmGetImage(self._display, self._root, self._image, left, top, _ALL_PLANES):
+            logger.debug(f"XShmGetImage failed (X error {_last_error})")
+            return None
+        return self._view
+
+    def close(self):
+        """释放共享内存段并关闭X连接"""
+        if self._display:
+            self._destroy_segment()
+            self._x11.XCloseDisplay(self._display)
+            self._display = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
@@ -9,6 +9,7 @@
 - Fallback 渲染模式
 - 帧缓冲管理
 - 性能监控
+- 端到端延迟统计（解析服务端插入的时间戳SEI）
 """
 
 import struct
@@ -31,6 +32,12 @@ try:
 except ImportError:
     HAS_CV2 = False
 
+try:
+    from phone_mirroring.latency_sei import parse_latency_sei, LatencyTracker
+    HAS_LATENCY_SEI = True
+except ImportError:
+    HAS_LATENCY_SEI = False
+
 logger = logging.getLogger(__name__)
 
 
@@ -79,12 +86,15 @@ class FrameBuffer:
 class VideoDecoder:
     """视频解码器 (PyAV powered)"""
     
-    def __init__(self, width: int = 720, height: int = 1280):
+    def __init__(self, width: int = 720, height: int = 1280, performance_monitor=None):
         self.width = width
         self.height = height
         self.frame_buffer = FrameBuffer(max_size=30)
         self.codec = None
         
+        # 延迟统计：码流带有时间戳SEI时计算分段/端到端延迟并回报给 PerformanceMonitor
+        self.latency_tracker = LatencyTracker(performance_monitor) if HAS_LATENCY_SEI else None
+        
         self.decode_stats = {
             'frames_decoded': 0,
             'frames_failed': 0,
@@ -113,6 +123,10 @@ class VideoDecoder:
         start_time = time.time()
         decoded_frames = []
         
+        tracker = self.latency_tracker
+        received_ns = tracker.now_ns() if tracker else 0
+        stamp = parse_latency_sei(data) if tracker else None
+        
         try:
             # PyAV handles NAL parsing. We just feed it packets.
             # If data is a raw NAL unit, PyAV can usually handle it.
@@ -132,13 +146,17 @@ class VideoDecoder:
                 self.decode_stats['last_decode_time'] = decode_time / len(decoded_frames)
                 self.decode_stats['total_decode_time'] += decode_time
                 
+                # 解码完成即计为上屏时间
+                latency = tracker.record(stamp, received_ns, tracker.now_ns()) if stamp else None
+                
                 # Return the last frame for display (or all?)
                 # Usually we process one frame at a time in this architecture
                 return {
                     'success': True,
                     'frame_info': {'frame_number': self.decode_stats['frames_decoded']},
                     'image': decoded_frames[-1], # Numpy array
-                    'decode_time': decode_time
+                    'decode_time': decode_time,
+                    'latency': latency
                 }
             else:
                 return {'success': False, 'error': 'No frames produced'}
@@ -154,8 +172,10 @@ class VideoDecoder:
             stats['avg_decode_time'] = stats['total_decode_time'] / stats['frames_decoded']
         else:
             stats['avg_decode_time'] = 0
+        if self.latency_tracker and self.latency_tracker.frames:
+            stats['latency'] = self.latency_tracker.get_stats()
         return stats
 
 
-def create_video_decoder(width: int = 720, height: int = 1280) -> VideoDecoder:
-    return VideoDecoder(width, height)
\ No newline at end of file
+def create_video_decoder(width: int = 720, height: int = 1280, performance_monitor=None) -> VideoDecoder:
+    return VideoDecoder(width, height, performance_monitor)
\ No newline at end of file